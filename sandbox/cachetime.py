@@ -0,0 +1,110 @@
+""" Compare loading the system cache as a pickle and as a cache file
+
+Usage: cachetime.py [packages]
+
+Without arguments the system cache is used, otherwise a deb cache with
+the given number of packages is made up. Each file is loaded in a new
+process, reporting the time taken and how much resident memory grew.
+"""
+
+import subprocess
+import tempfile
+import cPickle
+import random
+import time
+import sys
+import os
+
+SECTION = """\
+Package: %(name)s
+Priority: optional
+Section: admin
+Installed-Size: 100
+Maintainer: Someone <someone@example.com>
+Architecture: all
+Version: %(version)s
+Provides: %(provides)s
+Depends: %(depends)s
+Conflicts: %(conflicts)s
+Filename: pool/%(name)s_%(version)s_all.deb
+Size: 1000
+MD5sum: 00000000000000000000000000000000
+Description: Summary line of %(name)s
+ Full description.
+
+"""
+
+def getRSS():
+    for line in open("/proc/self/status"):
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1])/1024.
+
+def load(kind, path):
+    from smart import init
+    init(datadir=tempfile.mkdtemp())
+    from smart.cache import loadCacheFile
+    import smart.backends.deb.loader
+    rss = getRSS()
+    start = time.time()
+    file = open(path)
+    if kind == "pickle":
+        obj = cPickle.load(file)
+    else:
+        obj = loadCacheFile(file)
+    file.close()
+    print "%s\t%d\t%fs\t%.1fMB" % (kind, os.path.getsize(path),
+                                    time.time()-start, getRSS()-rss)
+
+def makeCache(total, datadir):
+    from smart.backends.deb.loader import DebTagFileLoader
+    from smart.cache import Cache
+    rnd = random.Random(0)
+    path = os.path.join(datadir, "Packages")
+    file = open(path, "w")
+    for i in range(total):
+        names = ["pkg%d" % rnd.randrange(total) for j in range(5)]
+        file.write(SECTION % {"name": "pkg%d" % i,
+                              "version": "%d.%d-1" % (i%7, i%13),
+                              "provides": "virtual%d" % (i%100),
+                              "depends": "%s (>= 1.0), %s, virtual%d" %
+                                         (names[0], names[1], i%100),
+                              "conflicts": "%s (<< 2.0)" % names[2]})
+    file.close()
+    cache = Cache()
+    cache.addLoader(DebTagFileLoader(path))
+    cache.load()
+    return cache
+
+if len(sys.argv) == 4 and sys.argv[1] == "--load":
+    load(sys.argv[2], sys.argv[3])
+    sys.exit(0)
+
+from smart import init, sysconf
+from smart.cache import dumpCacheFile
+
+if len(sys.argv) > 1:
+    datadir = tempfile.mkdtemp()
+    ctrl = init(datadir=datadir)
+    cache = makeCache(int(sys.argv[1]), datadir)
+    channels = {}
+else:
+    ctrl = init()
+    cache = ctrl.getCache()
+    channels = ctrl.getChannels()
+state = (ctrl.__stateversion__, channels, {})
+
+picklepath = os.path.join(sysconf.get("data-dir"), "cache.pickle")
+cachepath = os.path.join(sysconf.get("data-dir"), "cache.bench")
+
+file = open(picklepath, "w")
+cPickle.dump((cache, state), file, 2)
+file.close()
+
+file = open(cachepath, "w")
+dumpCacheFile(file, cache, state)
+file.close()
+
+print "%d packages" % len(cache.getPackages())
+for kind, path in [("pickle", picklepath), ("cachefile", cachepath)]:
+    subprocess.call([sys.executable, sys.argv[0], "--load", kind, path])
+    os.unlink(path)
@@ -0,0 +1,86 @@
+""" Count the dpkg calls committing an upgrade of a synthetic cache """
+
+from StringIO import StringIO
+import tempfile
+import time
+import sys
+
+from smart import init, sysconf
+ctrl = init(datadir=tempfile.mkdtemp())
+
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.backends.deb.pm import DebPackageManager
+from smart.transaction import Transaction, PolicyUpgrade, UPGRADE
+from smart.channel import PackageChannel
+from smart.const import INSTALL
+
+SECTION = """\
+Package: pkg%(i)d
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %(version)s
+%(depends)s: pkg%(dep)d (>= %(version)s)
+Description: Summary line
+ Full description.
+"""
+
+class FakeLoader(DebTagLoader):
+
+    def __init__(self, sections):
+        super(FakeLoader, self).__init__()
+        self.fake_sections = sections
+        self.setChannel(PackageChannel("deb-dir", "fake"))
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self.fake_sections):
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+def sections(total, version):
+    # Packages depend on the one at half their number, so that they
+    # form a tree, and every seventh one pre-depends on it.
+    result = []
+    for i in range(total):
+        result.append(SECTION % {"i": i, "dep": i/2, "version": version,
+                                 "depends": i%7 and "Depends" or
+                                            "Pre-Depends"})
+    return result
+
+total = 1000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+
+cache = ctrl.getCache()
+installed = FakeLoader(sections(total, "1.0"))
+installed.setInstalled(True)
+cache.addLoader(installed)
+cache.addLoader(FakeLoader(sections(total, "1.1")))
+cache.load()
+
+trans = Transaction(cache, PolicyUpgrade)
+for pkg in cache.getPackages():
+    if pkg.installed:
+        trans.enqueue(pkg, UPGRADE)
+trans.run()
+changeset = trans.getChangeSet()
+
+pkgpaths = {}
+for pkg in changeset:
+    if changeset[pkg] is INSTALL:
+        pkgpaths[pkg] = ["/tmp/%s.deb" % pkg]
+
+calls = []
+def dpkg(argv, output, callback=None):
+    calls.append(argv)
+    return 0
+
+sysconf.set("pm-iface-output", True)
+pm = DebPackageManager()
+pm.dpkg = dpkg
+start = time.time()
+pm.commit(changeset, pkgpaths)
+sys.stderr.write("commit\t%d changes\t%fs\t%d dpkg calls\n" %
+                 (len(changeset), time.time()-start, len(calls)))
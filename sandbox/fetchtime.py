@@ -0,0 +1,77 @@
+""" Time fetching many small files from a local HTTP server """
+
+import BaseHTTPServer
+import SocketServer
+import tempfile
+import signal
+import time
+import sys
+import os
+
+from smart import init
+ctrl = init(datadir=tempfile.mkdtemp())
+
+from smart.progress import Progress
+from smart.fetcher import Fetcher
+from smart.const import SUCCEEDED
+
+PORT = 43544
+BODY = "x"*512
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep connections alive, and send each response at once, as
+    # mirrors do.
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+total = 5000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+batch = total
+if len(sys.argv) > 2:
+    batch = int(sys.argv[2])
+
+# Serve from another process, so that only the fetcher is measured.
+httpd = HTTPServer(("127.0.0.1", PORT), Handler)
+pid = os.fork()
+if not pid:
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    httpd.serve_forever()
+httpd.server_close()
+
+try:
+    fetcher = Fetcher()
+    fetcher.setLocalPathPrefix(tempfile.mkdtemp()+"/")
+    succeeded = 0
+    start = time.time()
+    cpu = os.times()
+    for first in range(0, total, batch):
+        fetcher.reset()
+        for i in range(first, min(first+batch, total)):
+            fetcher.enqueue("http://127.0.0.1:%d/file%d" % (PORT, i))
+        fetcher.run(progress=Progress())
+        succeeded += len([x for x in fetcher.getItems()
+                          if x.getStatus() == SUCCEEDED])
+    cpu = [x-y for x, y in zip(os.times(), cpu)]
+    elapsed = time.time()-start
+    sys.stderr.write("fetch\t%d\t%fs wall\t%fs cpu\t%.0f files/s\t"
+                     "%d succeeded\n" % (total, elapsed, cpu[0]+cpu[1],
+                                         total/elapsed, succeeded))
+finally:
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
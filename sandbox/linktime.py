@@ -0,0 +1,71 @@
+""" Time Cache.linkDeps on names with many versioned provides """
+
+from StringIO import StringIO
+import tempfile
+import random
+import time
+import sys
+
+from smart import init
+init(datadir=tempfile.mkdtemp())
+
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.cache import Cache
+
+SECTION = """\
+Package: %s
+Priority: optional
+Section: admin
+Architecture: all
+Version: %s
+Depends: %s
+Description: Summary line
+ Full description.
+"""
+
+class Loader(DebTagLoader):
+
+    def __init__(self, sections):
+        DebTagLoader.__init__(self)
+        self._fakesections = sections
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self._fakesections):
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+total = 3000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+relations = ["="]
+if len(sys.argv) > 2:
+    relations = sys.argv[2].split(",")
+
+# A few hundred versions of one package, and many packages requiring
+# some version of it.
+rnd = random.Random(0)
+sections = []
+versions = []
+for i in range(total//10):
+    version = "%d.%d-%d" % (i//100, i%100, rnd.randint(1, 3))
+    sections.append(SECTION % ("lib", version, "libc6"))
+    versions.append(version)
+for i in range(total):
+    depends = "lib (%s %s)" % (rnd.choice(relations), rnd.choice(versions))
+    sections.append(SECTION % ("user%d" % i, "1.0", depends))
+
+cache = Cache()
+cache.addLoader(Loader(sections))
+cache.load()
+
+for prv in cache.getProvides():
+    prv.requiredby = ()
+for req in cache.getRequires():
+    req.providedby = ()
+
+start = time.time()
+cache.linkDeps()
+elapsed = time.time()-start
+links = sum([len(req.providedby) for req in cache.getRequires()])
+print "linkdeps\t%d\t%fs\t%d links" % (total, elapsed, links)
@@ -0,0 +1,78 @@
+""" Time searching paths in a large channel, with and without the
+    search index """
+
+import tempfile
+import random
+import time
+import sys
+import os
+
+from smart import init, sysconf
+ctrl = init(datadir=tempfile.mkdtemp())
+
+from smart.backends.slack.loader import SlackLoader
+from smart.searcher import Searcher, updateSearchIndex
+from smart.channel import PackageChannel
+from smart.cache import Cache
+
+total = 5000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+
+DIRS = ["/usr/bin", "/usr/lib/%s", "/usr/share/doc/%s",
+        "/usr/share/%s/data", "/usr/include/%s", "/etc/%s"]
+
+WORDS = ["library", "server", "client", "tool", "data", "plugin", "font",
+         "config", "python", "module", "network", "graphics", "sound",
+         "kernel", "editor", "daemon", "test", "util"]
+
+class BenchLoader(SlackLoader):
+
+    def getInfoList(self):
+        rnd = random.Random(0)
+        for i in range(total):
+            name = "pkg%d" % i
+            paths = []
+            for j in range(60):
+                dir = rnd.choice(DIRS).replace("%s", name)
+                paths.append("%s/%s%s%s.%s" %
+                             (dir, rnd.choice(WORDS), rnd.choice("-_"),
+                              rnd.choice(WORDS),
+                              rnd.choice(["so", "h", "txt"])))
+            yield {"name": name, "version": "1.0", "filelist": paths,
+                   "website": "http://example.com/%s/" % name}
+
+os.mkdir(os.path.join(sysconf.get("data-dir"), "channels"))
+
+loader = BenchLoader()
+channel = PackageChannel("slack-site", "bench")
+channel._digest = "bench"
+channel._loaders.append(loader)
+loader.setChannel(channel)
+cache = Cache()
+cache.addLoader(loader)
+cache.load()
+
+def search(pattern, cutoff):
+    searcher = Searcher()
+    searcher.addPath(pattern, cutoff)
+    start = time.time()
+    cache.search(searcher)
+    return time.time()-start, searcher.getResults()
+
+results = {}
+for name in ["scan", "index"]:
+    if name == "index":
+        start = time.time()
+        updateSearchIndex(loader)
+        sys.stderr.write("build\t%d\t%fs\n" % (total, time.time()-start))
+    for pattern, cutoff in [("/usr/bin/sound-daemon.so", 1.0),
+                            ("*/doc/pkg42/*", 1.0),
+                            ("*/pkg7/kernel_font.txt", 0.9),
+                            ("/opt/nothing", 1.0)]:
+        elapsed, found = search(pattern, cutoff)
+        if name == "index" and found != results[pattern]:
+            sys.stderr.write("%s\tresults differ\n" % pattern)
+        results[pattern] = found
+        sys.stderr.write("%s\t%s\t%fs\t%d found\n" %
+                         (name, pattern, elapsed, len(found)))
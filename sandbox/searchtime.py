@@ -0,0 +1,61 @@
+""" Time searching summaries in a large deb channel, with and without
+    the search index """
+
+import tempfile
+import random
+import time
+import sys
+import os
+
+from smart import init, sysconf
+ctrl = init(datadir=tempfile.mkdtemp())
+
+from smart.backends.deb.loader import DebTagFileLoader
+from smart.searcher import Searcher, updateSearchIndex
+from smart.channel import PackageChannel
+from smart.cache import Cache
+
+total = 20000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+
+WORDS = ["library", "server", "client", "tool", "data", "plugin", "font",
+         "documentation", "development", "files", "python", "module",
+         "network", "graphics", "sound", "kernel", "editor", "daemon"]
+
+rnd = random.Random(0)
+path = os.path.join(sysconf.get("data-dir"), "Packages")
+file = open(path, "w")
+for i in range(total):
+    file.write("Package: pkg%d\nVersion: 1.0\nArchitecture: all\n"
+               "Section: misc\nDescription: %s\n %s\n\n" %
+               (i, " ".join(rnd.sample(WORDS, 4)),
+                " ".join([rnd.choice(WORDS) for j in range(40)])))
+file.close()
+os.mkdir(os.path.join(sysconf.get("data-dir"), "channels"))
+
+loader = DebTagFileLoader(path)
+channel = PackageChannel("deb-dir", "bench")
+channel._digest = "bench"
+channel._loaders.append(loader)
+loader.setChannel(channel)
+cache = Cache()
+cache.addLoader(loader)
+cache.load()
+
+def search(pattern):
+    searcher = Searcher()
+    searcher.addSummary(pattern)
+    start = time.time()
+    cache.search(searcher)
+    return time.time()-start, len(searcher.getResults())
+
+for name in ["scan", "index"]:
+    if name == "index":
+        start = time.time()
+        updateSearchIndex(loader)
+        sys.stderr.write("build\t%d\t%fs\n" % (total, time.time()-start))
+    for pattern in ["*sound*", "*kernel daemon*", "*nothing*"]:
+        elapsed, found = search(pattern)
+        sys.stderr.write("%s\t%s\t%fs\t%d found\n" %
+                         (name, pattern, elapsed, found))
@@ -0,0 +1,43 @@
+""" Time sorting elements tied in big loops, as big changesets with
+    glibc/perl/python stacks have """
+
+import random
+import time
+import sys
+
+from smart.sorter import ElementSorter
+
+size = 2000
+if len(sys.argv) > 1:
+    size = int(sys.argv[1])
+
+def build(size, seed):
+    # A ring of requires, with shortcuts of pre-requires and extra
+    # requires going back, all tied in a single loop.
+    rnd = random.Random(seed)
+    sorter = ElementSorter()
+    for i in range(size):
+        sorter.addSuccessor(i, (i+1)%size, 1)
+        if rnd.random() < 0.1:
+            sorter.addSuccessor(i, (i+rnd.randint(2, 20))%size, 0)
+        if rnd.random() < 0.2:
+            sorter.addSuccessor(i, (i-rnd.randint(2, 20))%size, 1)
+    return sorter
+
+for seed in range(3):
+    sorter = build(size, seed)
+    start = time.time()
+    result = sorter.getSorted()
+    elapsed = time.time()-start
+    position = dict([(elem, i) for i, elem in enumerate(result)])
+    disabled = [0, 0]
+    for pred, succ in sorter._disabled:
+        disabled[sorter._priorities[(pred, succ)]] += 1
+    for (pred, succ), priority in sorter._priorities.items():
+        if ((pred, succ) not in sorter._disabled and
+            position[pred] > position[succ]):
+            sys.stderr.write("relation %r not respected\n" % ((pred, succ),))
+    sys.stderr.write("sort\t%d\t%fs\t%d relations\t"
+                     "%d/%d disabled (priority 0/1)\n" %
+                     (size, elapsed, len(sorter._priorities),
+                      disabled[0], disabled[1]))
@@ -0,0 +1,67 @@
+""" Time markAndSweep on a long chain of automatically installed packages """
+
+from StringIO import StringIO
+import tempfile
+import time
+import sys
+
+from smart import init
+ctrl = init(datadir=tempfile.mkdtemp())
+
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.transaction import ChangeSet
+from smart.const import REMOVE
+from smart import pkgconf
+
+SECTION = """\
+Package: pkg%d
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: 1.0
+Depends: pkg%d
+Description: Summary line
+ Full description.
+"""
+
+class Loader(DebTagLoader):
+
+    def __init__(self, sections):
+        DebTagLoader.__init__(self)
+        self._fakesections = sections
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self._fakesections):
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+total = 20000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+
+# Only the head of the chain was installed explicitly.
+sections = [SECTION % (i, min(i+1, total-1)) for i in range(total)]
+loader = Loader(sections)
+loader.setInstalled(True)
+cache = ctrl.getCache()
+cache.addLoader(loader)
+cache.load()
+pkgconf.setFlagTargets("auto", dict([("pkg%d" % i, [(None, None)])
+                                     for i in range(1, total)]))
+pkgconf.getFlagMatcher("auto")
+
+start = time.time()
+reachability = ctrl.getReachability()
+built = time.time()-start
+start = time.time()
+swept = len(ctrl.markAndSweep())
+elapsed = time.time()-start
+changeset = ChangeSet(cache)
+changeset[reachability.getPackages()[0]] = REMOVE
+start = time.time()
+impact = len(reachability.getRemovalImpact(changeset))
+impactelapsed = time.time()-start
+print "sweep\t%d\t%fs build\t%fs sweep\t%fs impact\t%d swept\t%d impact" % \
+      (total, built, elapsed, impactelapsed, swept, impact)
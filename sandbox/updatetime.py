@@ -0,0 +1,66 @@
+""" Time updating many channels served with some latency """
+
+import SimpleHTTPServer
+import BaseHTTPServer
+import SocketServer
+import tempfile
+import signal
+import time
+import sys
+import os
+
+from smart import init, sysconf
+ctrl = init(datadir=tempfile.mkdtemp())
+sysconf.set("check-signatures", False)
+
+from smart.const import NEVER
+
+PORT = 43545
+DATADIR = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                       "../tests/data")
+
+class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    def do_GET(self):
+        # Pretend the mirror is far away.
+        time.sleep(latency)
+        SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, format, *args):
+        pass
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+total = 15
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+latency = 0.1
+if len(sys.argv) > 2:
+    latency = float(sys.argv[2])
+
+os.chdir(DATADIR)
+httpd = HTTPServer(("127.0.0.1", PORT), Handler)
+pid = os.fork()
+if not pid:
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    httpd.serve_forever()
+httpd.server_close()
+
+try:
+    for i in range(total):
+        sysconf.set(("channels", "chan%d" % i),
+                    {"type": "apt-deb",
+                     "baseurl": "http://127.0.0.1:%d/aptdeb" % PORT,
+                     "distribution": "component-less",
+                     "components": ""})
+    for workers in (1, 4, 10):
+        sysconf.set("channel-fetch-workers", workers)
+        start = time.time()
+        result = ctrl.reloadChannels(caching=NEVER)
+        sys.stderr.write("update\t%d channels\t%d workers\t%fs\t%s\n" %
+                         (total, workers, time.time()-start, result))
+finally:
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
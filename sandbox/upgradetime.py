@@ -0,0 +1,83 @@
+""" Time an upgrade-all transaction on a synthetic cache """
+
+from StringIO import StringIO
+import tempfile
+import time
+import sys
+
+from smart import init, sysconf
+ctrl = init(datadir=tempfile.mkdtemp())
+
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.transaction import Transaction, PolicyUpgrade, UPGRADE
+from smart.channel import PackageChannel
+
+SECTION = """\
+Package: pkg%(i)d
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %(version)s
+Depends: pkg%(next)d (>= 1.0), libc6
+Provides: virtual%(mod)d
+Conflicts: old-pkg%(i)d
+Description: Summary line
+ Full description.
+"""
+
+LIBC = """\
+Package: libc6
+Status: install ok installed
+Priority: required
+Section: libs
+Architecture: all
+Version: 2.3
+Description: Summary line
+ Full description.
+"""
+
+class FakeLoader(DebTagLoader):
+
+    def __init__(self, sections):
+        super(FakeLoader, self).__init__()
+        self.fake_sections = sections
+        self.setChannel(PackageChannel("deb-dir", "fake"))
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self.fake_sections):
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+def sections(total, version):
+    result = [LIBC]
+    for i in range(total):
+        result.append(SECTION % {"i": i, "next": (i+1)%total,
+                                 "mod": i%100, "version": version})
+    return result
+
+total = 50000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+if len(sys.argv) > 2:
+    sysconf.set("solver-workers", int(sys.argv[2]))
+
+cache = ctrl.getCache()
+installed = FakeLoader(sections(total, "1.0"))
+installed.setInstalled(True)
+cache.addLoader(installed)
+cache.addLoader(FakeLoader(sections(total, "1.1")))
+
+start = time.time()
+cache.load()
+print "load\t%d\t%fs" % (total, time.time()-start)
+
+start = time.time()
+trans = Transaction(cache, PolicyUpgrade)
+for pkg in cache.getPackages():
+    if pkg.installed:
+        trans.enqueue(pkg, UPGRADE)
+trans.run()
+print "upgrade\t%d\t%fs\t%d changes" % (total, time.time()-start,
+                                       len(trans.getChangeSet()))
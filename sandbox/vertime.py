@@ -0,0 +1,29 @@
+""" Time version comparisons of the rpm and deb backends """
+
+import random
+import time
+import sys
+
+from smart.backends.rpm import rpmver
+from smart.backends.deb import debver
+
+total = 300000
+if len(sys.argv) > 1:
+    total = int(sys.argv[1])
+
+rnd = random.Random(0)
+versions = ["%d:%d.%d.%d-%d.el%d" % (rnd.randint(0, 2), rnd.randint(0, 9),
+                                     rnd.randint(0, 20), rnd.randint(0, 99),
+                                     rnd.randint(1, 30), rnd.randint(5, 7))
+            for i in range(2000)]
+pairs = [(rnd.choice(versions), rnd.choice(versions)) for i in range(total)]
+
+for name, module in [("rpm", rpmver), ("deb", debver)]:
+    checkdep = module.checkdep
+    start = time.time()
+    for v1, v2 in pairs:
+        checkdep(v1, ">=", v2)
+    print "%s\tcheckdep\t%d\t%fs" % (name, total, time.time()-start)
+    start = time.time()
+    sorted(versions*(total//len(versions)//10), module.vercmp)
+    print "%s\tsort\t%d\t%fs" % (name, total//10, time.time()-start)
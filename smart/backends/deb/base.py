@@ -120,6 +120,8 @@ class DebDepends(Depends):
 
     __slots__ = ()
 
+    matchcmp = staticmethod(vercmp)
+
     def matches(self, prv):
         if not isinstance(prv, DebProvides) and type(prv) is not Provides:
             return False
@@ -136,6 +138,8 @@ class DebOrDepends(Depends):
 
     __slots__ = ("_nrv",)
 
+    matchcmp = staticmethod(vercmp)
+
     def __init__(self, nrv):
         name = " | ".join([(x[2] and " ".join(x) or x[0]) for x in nrv])
         Depends.__init__(self, name, None, None)
@@ -147,6 +151,9 @@ class DebOrDepends(Depends):
     def getMatchNames(self):
         return [x[0] for x in self._nrv]
 
+    def getMatchRelations(self):
+        return self._nrv
+
     def matches(self, prv):
         if not isinstance(prv, DebProvides) and type(prv) is not Provides:
             return False
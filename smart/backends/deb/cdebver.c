@@ -182,6 +182,177 @@ vercmp(const char *s1, const char *s2)
     return vercmpparts(e1, v1, r1, e2, v2, r2);
 }
 
+/* Keys built by getverkey() are kept for this many version strings. */
+#define VERKEYCACHESIZE 50000
+
+static PyObject *verkeys = NULL;
+
+static int
+appendint(PyObject *lst, long value)
+{
+    PyObject *o = PyInt_FromLong(value);
+    int ret;
+    if (!o) return -1;
+    ret = PyList_Append(lst, o);
+    Py_DECREF(o);
+    return ret;
+}
+
+static int
+appendnumber(PyObject *lst, const char *start, const char *end)
+{
+    PyObject *str, *o;
+    int ret;
+    while (start != end && *start == '0') start++;
+    if (end-start < 10) {
+        long value = 0;
+        for (; start != end; start++)
+            value = value*10 + (*start-'0');
+        return appendint(lst, value);
+    }
+    str = PyString_FromStringAndSize(start, end-start);
+    if (!str) return -1;
+    o = PyLong_FromString(PyString_AS_STRING(str), NULL, 10);
+    Py_DECREF(str);
+    if (!o) return -1;
+    ret = PyList_Append(lst, o);
+    Py_DECREF(o);
+    return ret;
+}
+
+/* See verkey() in debver.py. */
+static PyObject *
+buildpartkey(const char *a)
+{
+    PyObject *lst, *ret;
+    if (!a || !*a)
+        return Py_BuildValue("(i)", 1);
+    lst = PyList_New(0);
+    if (!lst) return NULL;
+    if (appendint(lst, *a == '~' ? 0 : 2) == -1)
+        goto error;
+    while (*a) {
+        const char *start;
+        for (; *a && !isdigit(*a); a++)
+            if (appendint(lst, ORDER[(unsigned char)*a]) == -1)
+                goto error;
+        if (appendint(lst, 0) == -1)
+            goto error;
+        start = a;
+        while (*a && isdigit(*a)) a++;
+        if (appendnumber(lst, start, a) == -1)
+            goto error;
+    }
+    if (appendint(lst, 0) == -1)
+        goto error;
+    ret = PyList_AsTuple(lst);
+    Py_DECREF(lst);
+    return ret;
+
+error:
+    Py_DECREF(lst);
+    return NULL;
+}
+
+static PyObject *
+buildverkey(const char *s)
+{
+    char *e, *v, *r;
+    char b[64];
+    PyObject *ekey, *vkey, *rkey, *ret;
+    strncpy(b, s, sizeof(b)-1);
+    b[sizeof(b)-1] = '\0';
+    splitversion(b, &e, &v, &r);
+    ekey = buildpartkey(e);
+    vkey = buildpartkey(v);
+    rkey = buildpartkey(r);
+    if (!ekey || !vkey || !rkey) {
+        Py_XDECREF(ekey);
+        Py_XDECREF(vkey);
+        Py_XDECREF(rkey);
+        return NULL;
+    }
+    ret = PyTuple_New(3);
+    if (!ret) {
+        Py_DECREF(ekey);
+        Py_DECREF(vkey);
+        Py_DECREF(rkey);
+        return NULL;
+    }
+    PyTuple_SET_ITEM(ret, 0, ekey);
+    PyTuple_SET_ITEM(ret, 1, vkey);
+    PyTuple_SET_ITEM(ret, 2, rkey);
+    return ret;
+}
+
+static PyObject *
+getverkey(PyObject *version)
+{
+    PyObject *key = PyDict_GetItem(verkeys, version);
+    if (key) {
+        Py_INCREF(key);
+        return key;
+    }
+    key = buildverkey(PyString_AS_STRING(version));
+    if (!key) return NULL;
+    if (PyDict_Size(verkeys) >= VERKEYCACHESIZE)
+        PyDict_Clear(verkeys);
+    if (PyDict_SetItem(verkeys, version, key) == -1) {
+        Py_DECREF(key);
+        return NULL;
+    }
+    return key;
+}
+
+/* Compare keys as tuple comparison would, without going through
+   the generic machinery for the ints and strings they're made of. */
+static int
+comparekeys(PyObject *k1, PyObject *k2, int *rc)
+{
+    Py_ssize_t i, n1, n2;
+    if (k1 == k2) {
+        *rc = 0;
+        return 0;
+    }
+    if (!PyTuple_CheckExact(k1) || !PyTuple_CheckExact(k2))
+        return PyObject_Cmp(k1, k2, rc);
+    n1 = PyTuple_GET_SIZE(k1);
+    n2 = PyTuple_GET_SIZE(k2);
+    for (i = 0; i != n1 && i != n2; i++) {
+        PyObject *o1 = PyTuple_GET_ITEM(k1, i);
+        PyObject *o2 = PyTuple_GET_ITEM(k2, i);
+        if (PyInt_CheckExact(o1) && PyInt_CheckExact(o2)) {
+            long l1 = PyInt_AS_LONG(o1);
+            long l2 = PyInt_AS_LONG(o2);
+            *rc = (l1 > l2) - (l1 < l2);
+        } else if (comparekeys(o1, o2, rc) == -1) {
+            return -1;
+        }
+        if (*rc) return 0;
+    }
+    *rc = (n1 > n2) - (n1 < n2);
+    return 0;
+}
+
+/* Compare two version strings through their keys. */
+static int
+vercmpobjects(PyObject *v1, PyObject *v2, int *rc)
+{
+    PyObject *k1, *k2;
+    int ret;
+    k1 = getverkey(v1);
+    if (!k1) return -1;
+    k2 = getverkey(v2);
+    if (!k2) {
+        Py_DECREF(k1);
+        return -1;
+    }
+    ret = comparekeys(k1, k2, rc);
+    Py_DECREF(k1);
+    Py_DECREF(k2);
+    return ret;
+}
+
 static void
 parserelation(char *buf, char **n, char **r, char **v)
 {
@@ -418,11 +589,19 @@ static PyObject *
 cdebver_checkdep(PyObject *self, PyObject *args)
 {
     const char *v1, *rel, *v2;
+    PyObject *o1, *o2;
     PyObject *ret;
     int rc;
-    if (!PyArg_ParseTuple(args, "sss", &v1, &rel, &v2))
+    if (!PyArg_ParseTuple(args, "OsO", &o1, &rel, &o2))
         return NULL;
-    rc = vercmp(v1, v2);
+    if (PyString_Check(o1) && PyString_Check(o2)) {
+        if (vercmpobjects(o1, o2, &rc) == -1)
+            return NULL;
+    } else {
+        if (!PyArg_ParseTuple(args, "sss", &v1, &rel, &v2))
+            return NULL;
+        rc = vercmp(v1, v2);
+    }
     if (rc == 0)
         ret = (strchr(rel, '=') != NULL) ? Py_True : Py_False;
     else if (rc < 0)
@@ -437,11 +616,30 @@ static PyObject *
 cdebver_vercmp(PyObject *self, PyObject *args)
 {
     const char *v1, *v2;
+    PyObject *o1, *o2;
+    int rc;
+    if (!PyArg_ParseTuple(args, "OO", &o1, &o2))
+        return NULL;
+    if (PyString_Check(o1) && PyString_Check(o2)) {
+        if (vercmpobjects(o1, o2, &rc) == -1)
+            return NULL;
+        return PyInt_FromLong(rc);
+    }
     if (!PyArg_ParseTuple(args, "ss", &v1, &v2))
         return NULL;
     return PyInt_FromLong(vercmp(v1, v2));
 }
 
+static PyObject *
+cdebver_verkey(PyObject *self, PyObject *version)
+{
+    if (!PyString_Check(version)) {
+        PyErr_SetString(PyExc_TypeError, "version string expected");
+        return NULL;
+    }
+    return getverkey(version);
+}
+
 static PyObject *
 cdebver_vercmpparts(PyObject *self, PyObject *args)
 {
@@ -468,6 +666,7 @@ static PyMethodDef cdebver_methods[] = {
     {"vercmp", (PyCFunction)cdebver_vercmp, METH_VARARGS, NULL},
     {"vercmpparts", (PyCFunction)cdebver_vercmpparts, METH_VARARGS, NULL},
     {"vercmppart", (PyCFunction)cdebver_vercmppart, METH_VARARGS, NULL},
+    {"verkey", (PyCFunction)cdebver_verkey, METH_O, NULL},
     {NULL, NULL}
 };
 
@@ -479,6 +678,7 @@ initcdebver(void)
     if (m == NULL)
         return;
     _buildORDER();
+    verkeys = PyDict_New();
 }
 
 /* vim:ts=4:sw=4:et
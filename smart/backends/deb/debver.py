@@ -28,6 +28,13 @@ CM = {"=": "=", "<<": "<", ">>": ">", "<=": "<=",
 
 SPLITRE = re.compile(" *([<>=]+) *")
 
+PARTRE = re.compile("([^0-9]*)([0-9]*)")
+
+# Keys built by verkey() are kept for this many version strings.
+VERKEYCACHESIZE = 50000
+
+_verkeys = {}
+
 def parserelation(str, cm=CM):
     open = str.find("(")
     if open != -1:
@@ -67,7 +74,39 @@ def checkdep(s1, rel, s2):
         return '>' in rel
 
 def vercmp(s1, s2):
-    return vercmpparts(*(VERRE.match(s1).groups()+VERRE.match(s2).groups()))
+    return cmp(verkey(s1), verkey(s2))
+
+# The key of a version is an (epoch, version, release) tuple, ordered
+# with plain tuple comparison as vercmpparts() orders the version. Each
+# part is a flat tuple, starting with 1 for an empty part, and 0 or 2
+# for parts starting with a tilde or not. Then come the ORDER of each
+# character in a non-digit run and a 0 to end it, followed by the
+# value of the next digit run, for as many runs as there are, and a
+# last 0 standing for the end of the string.
+def verkey(s):
+    key = _verkeys.get(s)
+    if key is None:
+        if len(_verkeys) >= VERKEYCACHESIZE:
+            _verkeys.clear()
+        e, v, r = VERRE.match(s).groups()
+        key = _verkeys[s] = (buildpartkey(e), buildpartkey(v),
+                             buildpartkey(r))
+    return key
+
+def buildpartkey(a):
+    if not a:
+        return (1,)
+    if a[0] == "~":
+        key = [0]
+    else:
+        key = [2]
+    for nondigits, digits in PARTRE.findall(a):
+        if nondigits or digits:
+            key.extend([ORDER[c] for c in nondigits])
+            key.append(0)
+            key.append(digits and int(digits) or 0)
+    key.append(0)
+    return tuple(key)
 
 # compare alpha and numeric segments of two versions
 # return 1: first is newer than second
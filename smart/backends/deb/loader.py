@@ -250,12 +250,37 @@ class DebTagLoader(Loader):
             pkg.loaders[self] = offset
             self._sections[pkg] = intern(section.get("section", ""))
 
-    def search(self, searcher):
+    def getSearchTexts(self):
         offsets = {}
         for pkg in self._packages:
             offsets[pkg.loaders[self]] = pkg
-
         for section, offset in self.getSections(Progress()):
+            pkg = offsets.get(offset)
+            if pkg:
+                toks = section.get("description", "").split("\n", 1)
+                if len(toks) == 2:
+                    summary, description = toks
+                else:
+                    summary, description = toks[0], ""
+                # search() doesn't look at reference URLs and paths,
+                # so they're left unindexed.
+                yield (pkg, (self._sections[pkg], summary, description),
+                       None, None)
+
+    def search(self, searcher):
+        offsets = {}
+        for pkg in searcher.getCandidates(self):
+            offsets[pkg.loaders[self]] = pkg
+
+        if len(offsets)*2 < len(self._packages):
+            # Reading sections one by one is slower than reading them
+            # in sequence, so it's only worth it for few candidates.
+            sections = [(self.getDict(offsets[x]), x)
+                        for x in sorted(offsets)]
+        else:
+            sections = self.getSections(Progress())
+
+        for section, offset in sections:
             pkg = offsets.get(offset)
             if not pkg:
                 continue
@@ -175,6 +175,40 @@ class DebSorter(ElementSorter):
                         self.addSuccessor((cnfpkg, REMOVE), unpack, HIGH)
 
 
+def joinLayers(layers):
+    """
+    Join layers of (pkg, op) elements, as returned by the sorter, into
+    a single list. The elements of each layer are grouped by operation,
+    starting with the operation the previous layer ended with, and
+    ending with one the next layer has, so that dpkg may be called for
+    as many packages at once as possible.
+    """
+    result = []
+    for i, layer in enumerate(layers):
+        groups = {}
+        ops = []
+        for elem in layer:
+            op = elem[1]
+            if op not in groups:
+                groups[op] = []
+                ops.append(op)
+            groups[op].append(elem)
+        first = 0
+        if result and result[-1][1] in groups:
+            ops.remove(result[-1][1])
+            ops.insert(0, result[-1][1])
+            first = 1
+        if i+1 < len(layers):
+            nextops = dict.fromkeys([op for pkg, op in layers[i+1]])
+            for op in ops[first:]:
+                if op in nextops:
+                    ops.remove(op)
+                    ops.append(op)
+                    break
+        for op in ops:
+            result.extend(groups[op])
+    return result
+
 class DebPackageManager(PackageManager):
 
     MAXPKGSPEROP = 50
@@ -211,7 +245,16 @@ class DebPackageManager(PackageManager):
 
         sorter = DebSorter(changeset)
 
-        sorted = sorter.getSorted()
+        layers = sorter.getLayers()
+
+        if sysconf.get("deb-purge"):
+            for layer in layers:
+                for i in range(len(layer)):
+                    pkg, op = layer[i]
+                    if op is REMOVE and not upgraded.get(pkg):
+                        layer[i] = pkg, PURGE
+
+        sorted = joinLayers(layers)
 
         prog.set(0, len(sorted))
 
@@ -230,12 +273,6 @@ class DebPackageManager(PackageManager):
         if opt:
             baseargs.append("--simulate")
 
-        if sysconf.get("deb-purge"):
-            for i in range(len(sorted)):
-                pkg, op = sorted[i]
-                if op is REMOVE and not upgraded.get(pkg):
-                    sorted[i] = pkg, PURGE
-
         if sysconf.get("deb-non-interactive"):
             old_debian_frontend = os.environ.get(DEBIAN_FRONTEND)
             old_apt_lc_frontend = os.environ.get(APT_LISTCHANGES_FRONTEND)
@@ -24,7 +24,7 @@
 # being linked with rpm. :-(
 import zlib
 
-from rpmver import checkdep, checkver, vercmp, splitarch, splitrelease
+from rpmver import checkdep, checkver, vercmp, verkey, splitarch, splitrelease
 from smart.util.strtools import isGlob
 from smart.cache import *
 from smart import *
@@ -305,10 +305,25 @@ class RPMPackage(Package):
 class RPMProvides(Provides):         __slots__ = ()
 class RPMNameProvides(RPMProvides):  __slots__ = ()
 
+def matchvercmp(v1, v2):
+    # Releases are left out, since a missing one compares as
+    # equal to any other.
+    return vercmp(splitrelease(splitarch(v1)[0])[0],
+                  splitrelease(splitarch(v2)[0])[0])
+
+def matchversortable(v):
+    # Versions ending in a separator, or without alphanumeric
+    # segments, don't compare transitively with the others, and
+    # are the ones without a key.
+    return verkey(splitrelease(splitarch(v)[0])[0]) is not None
+
 class RPMDepends(Depends):
 
     __slots__ = ()
 
+    matchcmp = staticmethod(matchvercmp)
+    matchsortable = staticmethod(matchversortable)
+
     def matches(self, prv):
         if not isinstance(prv, RPMProvides) and type(prv) is not Provides:
             return False
@@ -326,6 +341,9 @@ class RPMConflicts(RPMDepends,Conflicts):     __slots__ = ()
 class RPMObsoletes(Depends):
     __slots__ = ()
 
+    matchcmp = staticmethod(matchvercmp)
+    matchsortable = staticmethod(matchversortable)
+
     def matches(self, prv):
         if not isinstance(prv, RPMNameProvides) and type(prv) is not Provides:
             return False
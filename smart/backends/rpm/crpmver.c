@@ -175,6 +175,203 @@ vercmp(const char *s1, const char *s2)
     return vercmpparts(e1, v1, r1, d1, e2, v2, r2, d2);
 }
 
+/* Keys built by getverkey() are kept for this many version strings. */
+#define VERKEYCACHESIZE 50000
+
+static PyObject *verkeys = NULL;
+
+static PyObject *
+buildnumber(const char *start, const char *end)
+{
+    PyObject *str, *ret;
+    while (start != end && *start == '0') start++;
+    if (end-start < 10) {
+        long value = 0;
+        for (; start != end; start++)
+            value = value*10 + (*start-'0');
+        return PyInt_FromLong(value);
+    }
+    str = PyString_FromStringAndSize(start, end-start);
+    if (!str) return NULL;
+    ret = PyLong_FromString(PyString_AS_STRING(str), NULL, 10);
+    Py_DECREF(str);
+    return ret;
+}
+
+static PyObject *
+buildpartkey(const char *a)
+{
+    PyObject *lst, *ret;
+    lst = PyList_New(0);
+    if (!lst) return NULL;
+    for (;;) {
+        const char *start;
+        PyObject *flag, *value;
+        while (*a && !isalnum(*a)) a++;
+        if (!*a) break;
+        start = a;
+        if (isdigit(*a)) {
+            while (*a && isdigit(*a)) a++;
+            flag = PyInt_FromLong(1);
+            value = buildnumber(start, a);
+        } else {
+            while (*a && isalpha(*a)) a++;
+            flag = PyInt_FromLong(0);
+            value = PyString_FromStringAndSize(start, a-start);
+        }
+        if (!flag || !value ||
+            PyList_Append(lst, flag) == -1 ||
+            PyList_Append(lst, value) == -1) {
+            Py_XDECREF(flag);
+            Py_XDECREF(value);
+            Py_DECREF(lst);
+            return NULL;
+        }
+        Py_DECREF(flag);
+        Py_DECREF(value);
+    }
+    ret = PyList_AsTuple(lst);
+    Py_DECREF(lst);
+    return ret;
+}
+
+static int
+endsinseparator(const char *a)
+{
+    size_t len = strlen(a);
+    return len && !isalnum(a[len-1]);
+}
+
+/* See verkey() in rpmver.py. */
+static PyObject *
+buildverkey(const char *s)
+{
+    char *e, *v, *r, *d;
+    char b[64];
+    PyObject *epoch, *vkey, *rkey, *ret;
+    strncpy(b, s, sizeof(b)-1);
+    b[sizeof(b)-1] = '\0';
+    splitversion(b, &e, &v, &r, &d);
+    if (endsinseparator(v) || (r && endsinseparator(r))) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    epoch = PyInt_FromLong(atoi(e));
+    vkey = buildpartkey(v);
+    if (r) {
+        rkey = buildpartkey(r);
+    } else {
+        Py_INCREF(Py_None);
+        rkey = Py_None;
+    }
+    if (!epoch || !vkey || !rkey) {
+        Py_XDECREF(epoch);
+        Py_XDECREF(vkey);
+        Py_XDECREF(rkey);
+        return NULL;
+    }
+    ret = PyTuple_New(3);
+    if (!ret) {
+        Py_DECREF(epoch);
+        Py_DECREF(vkey);
+        Py_DECREF(rkey);
+        return NULL;
+    }
+    PyTuple_SET_ITEM(ret, 0, epoch);
+    PyTuple_SET_ITEM(ret, 1, vkey);
+    PyTuple_SET_ITEM(ret, 2, rkey);
+    return ret;
+}
+
+static PyObject *
+getverkey(PyObject *version)
+{
+    PyObject *key = PyDict_GetItem(verkeys, version);
+    if (key) {
+        Py_INCREF(key);
+        return key;
+    }
+    key = buildverkey(PyString_AS_STRING(version));
+    if (!key) return NULL;
+    if (PyDict_Size(verkeys) >= VERKEYCACHESIZE)
+        PyDict_Clear(verkeys);
+    if (PyDict_SetItem(verkeys, version, key) == -1) {
+        Py_DECREF(key);
+        return NULL;
+    }
+    return key;
+}
+
+/* Compare keys as tuple comparison would, without going through
+   the generic machinery for the ints and strings they're made of. */
+static int
+comparekeys(PyObject *k1, PyObject *k2, int *rc)
+{
+    Py_ssize_t i, n1, n2;
+    if (k1 == k2) {
+        *rc = 0;
+        return 0;
+    }
+    if (!PyTuple_CheckExact(k1) || !PyTuple_CheckExact(k2))
+        return PyObject_Cmp(k1, k2, rc);
+    n1 = PyTuple_GET_SIZE(k1);
+    n2 = PyTuple_GET_SIZE(k2);
+    for (i = 0; i != n1 && i != n2; i++) {
+        PyObject *o1 = PyTuple_GET_ITEM(k1, i);
+        PyObject *o2 = PyTuple_GET_ITEM(k2, i);
+        if (PyInt_CheckExact(o1) && PyInt_CheckExact(o2)) {
+            long l1 = PyInt_AS_LONG(o1);
+            long l2 = PyInt_AS_LONG(o2);
+            *rc = (l1 > l2) - (l1 < l2);
+        } else if (comparekeys(o1, o2, rc) == -1) {
+            return -1;
+        }
+        if (*rc) return 0;
+    }
+    *rc = (n1 > n2) - (n1 < n2);
+    return 0;
+}
+
+static int
+vercmpkeys(PyObject *k1, PyObject *k2, int *rc)
+{
+    PyObject *r1, *r2;
+    if (comparekeys(PyTuple_GET_ITEM(k1, 0), PyTuple_GET_ITEM(k2, 0),
+                    rc) == -1)
+        return -1;
+    if (*rc) return 0;
+    if (comparekeys(PyTuple_GET_ITEM(k1, 1), PyTuple_GET_ITEM(k2, 1),
+                    rc) == -1)
+        return -1;
+    r1 = PyTuple_GET_ITEM(k1, 2);
+    r2 = PyTuple_GET_ITEM(k2, 2);
+    if (*rc || r1 == Py_None || r2 == Py_None)
+        return 0;
+    return comparekeys(r1, r2, rc);
+}
+
+/* Compare two version strings through their keys. */
+static int
+vercmpobjects(PyObject *v1, PyObject *v2, int *rc)
+{
+    PyObject *k1, *k2;
+    int ret = 0;
+    k1 = getverkey(v1);
+    if (!k1) return -1;
+    k2 = getverkey(v2);
+    if (!k2) {
+        Py_DECREF(k1);
+        return -1;
+    }
+    if (k1 == Py_None || k2 == Py_None)
+        *rc = vercmp(PyString_AS_STRING(v1), PyString_AS_STRING(v2));
+    else
+        ret = vercmpkeys(k1, k2, rc);
+    Py_DECREF(k1);
+    Py_DECREF(k2);
+    return ret;
+}
+
 static PyObject *
 crpmver_splitarch(PyObject *self, PyObject *version)
 {
@@ -256,7 +453,6 @@ static PyObject *
 crpmver_checkver(PyObject *self, PyObject *args)
 {
     PyObject *v1, *v2;
-    const char *s1, *s2;
     PyObject *ret;
     int rc;
     if (!PyArg_ParseTuple(args, "OO", &v1, &v2))
@@ -271,9 +467,8 @@ crpmver_checkver(PyObject *self, PyObject *args)
         Py_INCREF(ret);
         return ret;
     }
-    s1 = PyString_AS_STRING(v1);
-    s2 = PyString_AS_STRING(v2);
-    rc = vercmp(s1, s2);
+    if (vercmpobjects(v1, v2, &rc) == -1)
+        return NULL;
     ret = (rc == 0) ? Py_True : Py_False;
     Py_INCREF(ret);
     return ret;
@@ -283,11 +478,19 @@ static PyObject *
 crpmver_checkdep(PyObject *self, PyObject *args)
 {
     const char *v1, *rel, *v2;
+    PyObject *o1, *o2;
     PyObject *ret;
     int rc;
-    if (!PyArg_ParseTuple(args, "sss", &v1, &rel, &v2))
+    if (!PyArg_ParseTuple(args, "OsO", &o1, &rel, &o2))
         return NULL;
-    rc = vercmp(v1, v2);
+    if (PyString_Check(o1) && PyString_Check(o2)) {
+        if (vercmpobjects(o1, o2, &rc) == -1)
+            return NULL;
+    } else {
+        if (!PyArg_ParseTuple(args, "sss", &v1, &rel, &v2))
+            return NULL;
+        rc = vercmp(v1, v2);
+    }
     if (rc == 0)
         ret = (strchr(rel, '=') != NULL) ? Py_True : Py_False;
     else if (rc < 0)
@@ -302,11 +505,47 @@ static PyObject *
 crpmver_vercmp(PyObject *self, PyObject *args)
 {
     const char *v1, *v2;
+    PyObject *o1, *o2;
+    int rc;
+    if (!PyArg_ParseTuple(args, "OO", &o1, &o2))
+        return NULL;
+    if (PyString_Check(o1) && PyString_Check(o2)) {
+        if (vercmpobjects(o1, o2, &rc) == -1)
+            return NULL;
+        return PyInt_FromLong(rc);
+    }
     if (!PyArg_ParseTuple(args, "ss", &v1, &v2))
         return NULL;
     return PyInt_FromLong(vercmp(v1, v2));
 }
 
+static PyObject *
+crpmver_verkey(PyObject *self, PyObject *version)
+{
+    if (!PyString_Check(version)) {
+        PyErr_SetString(PyExc_TypeError, "version string expected");
+        return NULL;
+    }
+    return getverkey(version);
+}
+
+static PyObject *
+crpmver_vercmpkeys(PyObject *self, PyObject *args)
+{
+    PyObject *k1, *k2;
+    int rc;
+    if (!PyArg_ParseTuple(args, "O!O!", &PyTuple_Type, &k1,
+                          &PyTuple_Type, &k2))
+        return NULL;
+    if (PyTuple_GET_SIZE(k1) != 3 || PyTuple_GET_SIZE(k2) != 3) {
+        PyErr_SetString(PyExc_ValueError, "version key expected");
+        return NULL;
+    }
+    if (vercmpkeys(k1, k2, &rc) == -1)
+        return NULL;
+    return PyInt_FromLong(rc);
+}
+
 static PyObject *
 crpmver_vercmpparts(PyObject *self, PyObject *args)
 {
@@ -333,6 +572,8 @@ static PyMethodDef crpmver_methods[] = {
     {"vercmp", (PyCFunction)crpmver_vercmp, METH_VARARGS, NULL},
     {"vercmpparts", (PyCFunction)crpmver_vercmpparts, METH_VARARGS, NULL},
     {"vercmppart", (PyCFunction)crpmver_vercmppart, METH_VARARGS, NULL},
+    {"verkey", (PyCFunction)crpmver_verkey, METH_O, NULL},
+    {"vercmpkeys", (PyCFunction)crpmver_vercmpkeys, METH_VARARGS, NULL},
     {NULL, NULL}
 };
 
@@ -343,6 +584,7 @@ initcrpmver(void)
     m = Py_InitModule3("crpmver", crpmver_methods, "");
     if (m == NULL)
         return;
+    verkeys = PyDict_New();
 }
 
 /* vim:ts=4:sw=4:et
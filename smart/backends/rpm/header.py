@@ -408,9 +408,25 @@ class RPMHeaderLoader(Loader):
             self._offsets[offset] = pkg
             self._groups[pkg] = intern(h[rpm.RPMTAG_GROUP])
 
+    def getSearchTexts(self):
+        for h, offset in self.getHeaders(Progress()):
+            pkg = self._offsets.get(offset)
+            if pkg:
+                url = h[rpm.RPMTAG_URL]
+                yield (pkg, (self._groups[pkg], h[rpm.RPMTAG_SUMMARY],
+                             h[rpm.RPMTAG_DESCRIPTION]),
+                       url and [url] or [], get_header_filenames(h) or [])
+
     def search(self, searcher):
         ic = searcher.ignorecase
-        for h, offset in self.getHeaders(Progress()):
+        pkgs = searcher.getCandidates(self)
+        if len(pkgs)*2 < len(self._packages):
+            # Reading headers one by one is slower than reading them
+            # in sequence, so it's only worth it for few candidates.
+            headers = [(self.getHeader(x), x.loaders[self]) for x in pkgs]
+        else:
+            headers = self.getHeaders(Progress())
+        for h, offset in headers:
             pkg = self._offsets.get(offset)
             if not pkg:
                 continue
@@ -21,6 +21,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 from smart.backends.rpm.rpmver import checkver
+from smart.util.pathindex import PathIndex, writePathIndex
 from smart.cache import PackageInfo, Loader
 from smart.backends.rpm.base import *
 
@@ -32,6 +33,11 @@ except ImportError:
     except ImportError:     
         from smart.util import cElementTree
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 from smart import *
 import posixpath
 import locale
@@ -43,6 +49,8 @@ NS_FILELISTS = "http://linux.duke.edu/metadata/filelists"
 
 BYTESPERPKG = 3000
 
+COMPMAP = { "EQ":"=", "LT":"<", "LE":"<=", "GT":">", "GE":">="}
+
 def nstag(ns, tag):
     return "{%s}%s" % (ns, tag)
 
@@ -101,7 +109,7 @@ class RPMMetaDataPackageInfo(PackageInfo):
 
 class RPMMetaDataLoader(Loader):
 
-    __stateversion__ = Loader.__stateversion__+3
+    __stateversion__ = Loader.__stateversion__+4
  
     def __init__(self, filename, filelistsname, baseurl):
         Loader.__init__(self)
@@ -111,6 +119,13 @@ class RPMMetaDataLoader(Loader):
         self._fileprovides = {}
         self._parsedflist = False
         self._pkgids = {}
+        self._fileindex = None
+        self._fileindexdigest = None
+
+    def setFileIndex(self, filename, digest):
+        """Use the filelists index built by updateFileListsIndex()."""
+        self._fileindex = filename
+        self._fileindexdigest = digest
 
     def reset(self):
         Loader.reset(self)
@@ -151,8 +166,6 @@ class RPMMetaDataLoader(Loader):
         DISTTAG     = nstag(NS_RPM, "disttag")
         DISTEPOCH   = nstag(NS_RPM, "distepoch")
 
-        COMPMAP = { "EQ":"=", "LT":"<", "LE":"<=", "GT":">", "GE":">="}
-
         # Prepare progress reporting.
         lastoffset = 0
         mod = 0
@@ -419,10 +432,37 @@ class RPMMetaDataLoader(Loader):
                     bfp(pkg, (RPMProvides, fn, None))
 
 
+    def searchFileIndex(self, fndict):
+        try:
+            index = PathIndex(self._fileindex)
+        except (IOError, OSError, Error):
+            return False
+        try:
+            if index.getDigest() != self._fileindexdigest:
+                return False
+            pkgids = self._pkgids
+            fileprovides = self._fileprovides
+            for fn in fndict:
+                if fn in fileprovides:
+                    continue
+                if type(fn) is unicode:
+                    pkgidlist = index.get(fn.encode("utf-8"))
+                else:
+                    pkgidlist = index.get(fn)
+                pkgs = [pkgids[x] for x in pkgidlist if x in pkgids]
+                if pkgs:
+                    fileprovides[fn] = pkgs
+        finally:
+            index.close()
+        return True
+
     def parseFilesList(self, fndict):
         FILE    = nstag(NS_FILELISTS, "file")
         PACKAGE = nstag(NS_FILELISTS, "package")
 
+        if self._fileindex and self.searchFileIndex(fndict):
+            return
+
         pkgids = self._pkgids
         fileprovides = self._fileprovides
 
@@ -451,10 +491,285 @@ class RPMMetaDataLoader(Loader):
                 elem.clear()
         file.close()
 
+def updateFileListsIndex(filelistsname, indexname, digest):
+    """
+    Index the files in filelistsname by the ids of the packages
+    providing them, unless indexname already has an index built from
+    the filelists with the given digest. Return whether the index may
+    be used.
+    """
+    try:
+        index = PathIndex(indexname)
+    except (IOError, OSError, Error):
+        pass
+    else:
+        uptodate = index.getDigest() == digest
+        index.close()
+        if uptodate:
+            return True
+
+    FILE    = nstag(NS_FILELISTS, "file")
+    PACKAGE = nstag(NS_FILELISTS, "package")
+
+    paths = {}
+    pkgid = None
+    try:
+        file = open(filelistsname)
+        try:
+            for event, elem in cElementTree.iterparse(file,
+                                                      ("start", "end")):
+                if event == "start":
+                    if elem.tag == PACKAGE:
+                        if elem.get("arch") == "src":
+                            pkgid = None
+                        else:
+                            pkgid = elem.get("pkgid")
+                elif event == "end":
+                    if pkgid and elem.tag == FILE and elem.text:
+                        path = elem.text
+                        if type(path) is unicode:
+                            path = path.encode("utf-8")
+                        lst = paths.get(path)
+                        if lst is None:
+                            paths[path] = [pkgid]
+                        else:
+                            lst.append(pkgid)
+                    elem.clear()
+        finally:
+            file.close()
+        writePathIndex(indexname, digest, paths)
+    except (IOError, OSError, SyntaxError), e:
+        iface.debug(_("Couldn't index %s: %s") % (filelistsname, e))
+        return False
+    return True
+
+def decodeText(text):
+    # Return the same kind of strings ElementTree does.
+    try:
+        text.decode("ascii")
+    except UnicodeDecodeError:
+        return text.decode("utf-8")
+    return text
+
+class RPMMetaDataDBLoader(RPMMetaDataLoader):
+    """
+    Load the primary_db and filelists_db SQLite databases, building
+    the same packages the XML metadata would.
+    """
+
+    def connect(self, filename, text_factory=decodeText):
+        db = sqlite3.connect(filename)
+        db.text_factory = text_factory
+        return db
+
+    def getLoadSteps(self):
+        db = self.connect(self._filename)
+        try:
+            return db.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+        finally:
+            db.close()
+
+    def getRelations(self, db, table, pre=False):
+        tables = [row[0] for row in
+                  db.execute("SELECT name FROM sqlite_master "
+                             "WHERE type = 'table'")]
+        relations = {}
+        if table not in tables:
+            return relations
+        query = "SELECT pkgKey, name, flags, epoch, version, release"
+        if pre:
+            query += ", pre"
+        for row in db.execute(query+" FROM "+table):
+            ename = row[1]
+            if not ename or ename[:7] in ("rpmlib(", "config("):
+                continue
+            v = row[4]
+            if v is not None:
+                e = row[3]
+                r = row[5]
+                eversion = v
+                if e and e != "0":
+                    eversion = "%s:%s" % (e, eversion)
+                if r:
+                    eversion = "%s-%s" % (eversion, r)
+                erelation = COMPMAP.get(row[2])
+            else:
+                eversion = None
+                erelation = None
+            entry = (ename, erelation, eversion)
+            if pre:
+                entry += (row[6] in (1, "TRUE"),)
+            lst = relations.get(row[0])
+            if lst is None:
+                relations[row[0]] = [entry]
+            else:
+                lst.append(entry)
+        return relations
+
+    def load(self):
+        progress = iface.getProgress(self._cache)
+
+        db = self.connect(self._filename)
+        try:
+            requires = self.getRelations(db, "requires", pre=True)
+            recommends = self.getRelations(db, "recommends")
+            provides = self.getRelations(db, "provides")
+            conflicts = self.getRelations(db, "conflicts")
+            obsoletes = self.getRelations(db, "obsoletes")
+            files = {}
+            for pkgkey, filename in db.execute("SELECT pkgKey, name "
+                                               "FROM files"):
+                lst = files.get(pkgkey)
+                if lst is None:
+                    files[pkgkey] = [filename]
+                else:
+                    lst.append(filename)
+            rows = db.execute("SELECT pkgKey, pkgId, name, arch, epoch, "
+                              "version, release, summary, description, "
+                              "url, time_file, time_build, size_package, "
+                              "size_installed, checksum_type, "
+                              "location_href, rpm_sourcerpm, rpm_group, "
+                              "rpm_license FROM packages "
+                              "ORDER BY pkgKey").fetchall()
+        finally:
+            db.close()
+
+        for (pkgkey, pkgid, name, arch, e, v, r, summary, description,
+             url, time, build_time, size, installed_size, checksum_type,
+             location, sourcerpm, group, license) in rows:
+
+            progress.add(1)
+            progress.show()
+
+            if getArchScore(arch) == 0:
+                continue
+
+            if e and e != "0":
+                version = "%s:%s-%s" % (e, v, r)
+            else:
+                version = "%s-%s" % (v, r)
+
+            info = {}
+            if summary:
+                info["summary"] = summary
+            if description:
+                info["description"] = description
+            if url:
+                info["url"] = url
+            info["time"] = int(time)
+            info["build_time"] = int(build_time)
+            info["size"] = int(size)
+            if installed_size is not None:
+                info["installed_size"] = int(installed_size)
+            info[checksum_type] = pkgid
+            info["location"] = location
+            if sourcerpm:
+                info["sourcerpm"] = sourcerpm
+            if group:
+                info["group"] = group
+            if license:
+                info["license"] = license
+
+            filedict = dict.fromkeys(files.get(pkgkey, ()), True)
+
+            prvdict = {}
+            for ename, erelation, eversion in provides.get(pkgkey, ()):
+                if ename[0] == "/":
+                    filedict[ename] = True
+                else:
+                    if ename == name and checkver(eversion, version):
+                        eversion = "%s@%s" % (eversion, arch)
+                        Prv = RPMNameProvides
+                    else:
+                        Prv = RPMProvides
+                    prvdict[(Prv, ename.encode('utf-8'), eversion)] = True
+
+            reqdict = {}
+            for ename, erelation, eversion, epre in requires.get(pkgkey, ()):
+                if epre:
+                    Req = RPMPreRequires
+                else:
+                    Req = RPMRequires
+                reqdict[(Req, ename, erelation, eversion)] = True
+
+            recdict = {}
+            for ename, erelation, eversion in recommends.get(pkgkey, ()):
+                recdict[(RPMRequires, ename, erelation, eversion)] = True
+
+            versionarch = "%s@%s" % (version, arch)
+
+            upgdict = {}
+            cnfdict = {}
+            for ename, erelation, eversion in obsoletes.get(pkgkey, ()):
+                tup = (RPMObsoletes, ename, erelation, eversion)
+                upgdict[tup] = True
+                cnfdict[tup] = True
+            for ename, erelation, eversion in conflicts.get(pkgkey, ()):
+                cnfdict[(RPMConflicts, ename, erelation, eversion)] = True
+            upgdict[(RPMObsoletes, name, '<', versionarch)] = True
+
+            reqargs = [x for x in reqdict
+                       if not ((x[2] is None or "=" in x[2]) and
+                               (RPMProvides, x[1], x[3]) in prvdict or
+                               system_provides.match(x[1], x[2], x[3]))]
+            reqargs = collapse_libc_requires(reqargs)
+
+            recargs = [x for x in recdict
+                       if not ((x[2] is None or "=" in x[2]) and
+                               (RPMProvides, x[1], x[3]) in prvdict or
+                               system_provides.match(x[1], x[2], x[3]))]
+
+            pkg = self.buildPackage((RPMPackage, name, versionarch),
+                                    prvdict.keys(), reqargs,
+                                    upgdict.keys(), cnfdict.keys(), recargs)
+            pkg.loaders[self] = info
+
+            # Store the provided files for future usage.
+            for filename in filedict:
+                lst = self._fileprovides.get(filename)
+                if not lst:
+                    self._fileprovides[filename] = [pkg]
+                else:
+                    lst.append(pkg)
+
+            self._pkgids[pkgid] = pkg
+
+    def loadFileProvides(self, fndict):
+        bfp = self.buildFileProvides
+        fileprovides = self._fileprovides
+        pkgids = self._pkgids
+        db = None
+        try:
+            for fn in fndict:
+                pkgs = fileprovides.get(fn)
+                if pkgs is None:
+                    if db is None:
+                        # File names are compared as the byte strings
+                        # they're given in.
+                        db = self.connect(self._filelistsname, str)
+                    pkgs = []
+                    dirname, basename = posixpath.split(fn)
+                    for pkgid, filenames in db.execute(
+                            "SELECT packages.pkgId, filelist.filenames "
+                            "FROM filelist JOIN packages USING (pkgKey) "
+                            "WHERE filelist.dirname = ?", (dirname,)):
+                        pkg = pkgids.get(pkgid)
+                        if (pkg and pkg not in pkgs and
+                            basename in filenames.split("/")):
+                            pkgs.append(pkg)
+                    fileprovides[fn] = pkgs or ()
+                for pkg in pkgs:
+                    bfp(pkg, (RPMProvides, fn, None))
+        finally:
+            if db is not None:
+                db.close()
+
 def enablePsyco(psyco):
     psyco.bind(RPMMetaDataLoader.load)
     psyco.bind(RPMMetaDataLoader.loadFileProvides)
     psyco.bind(RPMMetaDataLoader.parseFilesList)
+    psyco.bind(RPMMetaDataDBLoader.load)
+    psyco.bind(RPMMetaDataDBLoader.loadFileProvides)
 
 hooks.register("enable-psyco", enablePsyco)
 
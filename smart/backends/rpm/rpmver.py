@@ -23,6 +23,13 @@ import re
 
 VERRE = re.compile("(?:([0-9]+):)?([^:-]+)(?:-([^:-]+))?(?::([^:-]+))?")
 
+SEGMENTRE = re.compile("[0-9]+|[a-zA-Z]+")
+
+# Keys built by verkey() are kept for this many version strings.
+VERKEYCACHESIZE = 50000
+
+_verkeys = {}
+
 def splitarch(v):
     at = v.rfind("@")
     slash = v.rfind("-")
@@ -55,7 +62,55 @@ def checkdep(s1, rel, s2):
         return '>' in rel
 
 def vercmp(s1, s2):
-    return vercmpparts(*(VERRE.match(s1).groups()+VERRE.match(s2).groups()))
+    k1 = verkey(s1)
+    k2 = verkey(s2)
+    if k1 is None or k2 is None:
+        return vercmpparts(*(VERRE.match(s1).groups()+
+                             VERRE.match(s2).groups()))
+    return vercmpkeys(k1, k2)
+
+# The key of a version is an (epoch, version, release) tuple, where
+# version and release are flat tuples with a (1, number) or a
+# (0, string) pair for each segment, so that plain tuple comparison
+# orders them as vercmppart() does. The release is None when missing,
+# since it then matches any other release. Versions ending in a
+# separator get None instead of a key, as vercmppart() doesn't order
+# them consistently.
+def verkey(s):
+    key = _verkeys.get(s, False)
+    if key is False:
+        if len(_verkeys) >= VERKEYCACHESIZE:
+            _verkeys.clear()
+        key = _verkeys[s] = buildverkey(s)
+    return key
+
+def buildverkey(s):
+    m = VERRE.match(s)
+    if not m:
+        return None
+    e, v, r, d = m.groups()
+    if not v[-1].isalnum() or r and not r[-1].isalnum():
+        return None
+    if r:
+        r = buildpartkey(r)
+    return (e and int(e) or 0, buildpartkey(v), r)
+
+def buildpartkey(a):
+    key = []
+    for segment in SEGMENTRE.findall(a):
+        if segment[0].isdigit():
+            key.append(1)
+            key.append(int(segment))
+        else:
+            key.append(0)
+            key.append(segment)
+    return tuple(key)
+
+def vercmpkeys(k1, k2):
+    rc = cmp(k1[0], k2[0]) or cmp(k1[1], k2[1])
+    if rc or k1[2] is None or k2[2] is None:
+        return rc
+    return cmp(k1[2], k2[2])
 
 # compare alpha and numeric segments of two versions
 # return 1: first is newer than second
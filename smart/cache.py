@@ -22,6 +22,12 @@
 from smart.util.strtools import globdistance
 from smart.const import BLOCKSIZE
 from smart import *
+from cStringIO import StringIO
+import cPickle
+import struct
+import array
+import mmap
+import sys
 import os
 
 class StateVersionError(Error): pass
@@ -319,6 +325,18 @@ class Provides(object):
         return (self.__class__, (self.name, self.version))
 
 class Depends(object):
+
+    # Function comparing versions as matches() does, except that any
+    # part which may make versions compare as equal when missing (as
+    # a release) is ignored. When set, linkDeps() doesn't ask about
+    # provides out of the range given by getMatchRelations().
+    matchcmp = None
+
+    # Function telling if matchcmp() orders a version consistently
+    # with all others. Provides with versions it rejects are always
+    # asked about. When unset, every version is taken as sortable.
+    matchsortable = None
+
     def __init__(self, name, relation, version):
         self.name = name
         self.relation = relation
@@ -332,6 +350,9 @@ class Depends(object):
     def getMatchNames(self):
         return (self.name,)
 
+    def getMatchRelations(self):
+        return [(self.name, self.relation, self.version)]
+
     def matches(self, prv):
         return False
 
@@ -484,6 +505,8 @@ class Loader(object):
             for pkgs in relpkgs:
                 pkgs.append(pkg)
 
+        cache._nameindex.clear()
+
         pkg.installed |= self._installed
         self._packages.append(pkg)
 
@@ -496,6 +519,7 @@ class Loader(object):
             prv = prvargs[0](*prvargs[1:])
             cache._objmap[prvargs] = prv
             cache._provides.append(prv)
+            cache._nameindex.clear()
         elif prv in pkg.provides:
             return
 
@@ -508,13 +532,14 @@ class Loader(object):
                 req.packages.remove(pkg)
                 if not req.packages:
                     cache._requires.remove(req)
+                    cache._nameindex.clear()
 
     def search(self, searcher):
         # Loaders are responsible for searching on PackageInfo. They
         # should use the fastest possible method. The one here is
         # generic, and should be replaced if possible.
         ic = searcher.ignorecase
-        for pkg in self._packages:
+        for pkg in searcher.getCandidates(self):
             info = self.getInfo(pkg)
             ratio = 0
             if searcher.url:
@@ -569,6 +594,16 @@ class Loader(object):
             if ratio:
                 searcher.addResult(pkg, ratio)
 
+    def getSearchTexts(self):
+        # Return (pkg, (group, summary, description), urls, paths)
+        # tuples for the search index. Loaders should replace it if
+        # they can read them faster than through PackageInfo.
+        for pkg in self._packages:
+            info = self.getInfo(pkg)
+            yield (pkg, (info.getGroup(), info.getSummary(),
+                         info.getDescription()),
+                   info.getReferenceURLs(), info.getPathList())
+
     __stateversion__ = 1
     
     def __getstate__(self):
@@ -582,6 +617,138 @@ class Loader(object):
         self.__dict__.update(state)
         del self.__stateversion__
 
+# Names with fewer provides than this have them all asked about by
+# linkDeps(), since sorting them wouldn't pay off.
+MINIMUMINDEXED = 8
+
+class ProvidesIndex(object):
+    """
+    Provides by name, for finding the ones a dependency may match.
+
+    The versioned provides of names with many of them are sorted with
+    the matchcmp function of the dependency class, so that the ones
+    in the range of a versioned dependency are found by binary search.
+    Candidates are returned in the order of the given provides list.
+    """
+
+    def __init__(self, provides):
+        self._provides = provides
+        self._names = {}
+        self._sorted = {}
+        self._positions = None
+        for prv in provides:
+            lst = self._names.get(prv.name)
+            if lst:
+                lst.append(prv)
+            else:
+                self._names[prv.name] = [prv]
+
+    def getNames(self):
+        return self._names
+
+    def getCandidates(self, dep):
+        names = dep.getMatchNames()
+        if len(names) == 1:
+            return self._getCandidates(dep, names[0])
+        lists = []
+        for name in names:
+            lst = self._getCandidates(dep, name)
+            if lst:
+                lists.append(lst)
+        if not lists:
+            return []
+        if len(lists) == 1:
+            return lists[0]
+        positions = self._positions
+        if positions is None:
+            positions = self._positions = {}
+            for i, prv in enumerate(self._provides):
+                positions[id(prv)] = i
+        candidates = []
+        for lst in lists:
+            for prv in lst:
+                candidates.append((positions[id(prv)], len(candidates), prv))
+        candidates.sort()
+        return [x[2] for x in candidates]
+
+    def _getCandidates(self, dep, name):
+        lst = self._names.get(name)
+        if not lst or len(lst) < MINIMUMINDEXED:
+            return lst or []
+        matchcmp = dep.matchcmp
+        if matchcmp is None:
+            return lst
+        sortable = dep.matchsortable
+        ranges = []
+        for rname, relation, version in dep.getMatchRelations():
+            if rname == name:
+                if (not relation or not version or
+                    sortable and not sortable(version)):
+                    return lst
+                ranges.append((relation, version))
+        if not ranges:
+            return lst
+        entry = self._getSorted(name, matchcmp, sortable)
+        if entry is None:
+            return lst
+        versioned, unversioned = entry
+        selected = {}
+        try:
+            for relation, version in ranges:
+                if "<" in relation:
+                    start = 0
+                else:
+                    start = self._bisect(versioned, version, matchcmp, False)
+                if ">" in relation:
+                    end = len(versioned)
+                else:
+                    end = self._bisect(versioned, version, matchcmp, True)
+                for item in versioned[start:end]:
+                    selected[item[0]] = item
+        except:
+            return lst
+        if not selected:
+            return [prv for i, prv in unversioned]
+        selected = selected.values()
+        selected.extend(unversioned)
+        selected.sort()
+        return [prv for i, prv in selected]
+
+    def _getSorted(self, name, matchcmp, sortable):
+        key = (name, matchcmp, sortable)
+        if key in self._sorted:
+            return self._sorted[key]
+        versioned = []
+        unversioned = []
+        for i, prv in enumerate(self._names[name]):
+            if prv.version and (not sortable or sortable(prv.version)):
+                versioned.append((i, prv))
+            else:
+                unversioned.append((i, prv))
+        try:
+            versioned.sort(lambda x, y: matchcmp(x[1].version, y[1].version))
+        except:
+            # Versions the function can't handle are left for matches().
+            entry = None
+        else:
+            entry = (versioned, unversioned)
+        self._sorted[key] = entry
+        return entry
+
+    def _bisect(self, versioned, version, matchcmp, after):
+        # First position with a version above the given one, if after
+        # is true, or not below it otherwise.
+        lo = 0
+        hi = len(versioned)
+        while lo < hi:
+            mid = (lo+hi)//2
+            rc = matchcmp(versioned[mid][1].version, version)
+            if rc < 0 or after and rc == 0:
+                lo = mid+1
+            else:
+                hi = mid
+        return lo
+
 class Cache(object):
 
     def __init__(self):
@@ -593,6 +760,7 @@ class Cache(object):
         self._upgrades = []
         self._conflicts = []
         self._objmap = {}
+        self._nameindex = {}
 
     def reset(self):
         for prv in self._provides:
@@ -628,12 +796,14 @@ class Cache(object):
         del self._upgrades[:]
         del self._conflicts[:]
         self._objmap.clear()
+        self._nameindex.clear()
 
     def addLoader(self, loader):
         if loader:
             if loader not in self._loaders:
                 self._loaders.append(loader)
                 loader.setCache(self)
+                self._nameindex.clear()
 
     def removeLoader(self, loader):
         if loader:
@@ -641,6 +811,10 @@ class Cache(object):
                 self._loaders.remove(loader)
                 loader.setCache(None)
                 loader.unload()
+                self._nameindex.clear()
+
+    def getLoaders(self):
+        return self._loaders[:]
 
     def _reload(self):
         packages = {}
@@ -693,6 +867,7 @@ class Cache(object):
         self._recommends[:] = recommends.keys()
         self._upgrades[:] = upgrades.keys()
         self._conflicts[:] = conflicts.keys()
+        self._nameindex.clear()
 
     def load(self):
         self._reload()
@@ -734,123 +909,74 @@ class Cache(object):
             loader.loadFileProvides(fndict)
 
     def linkDeps(self):
-        reqnames = {}
-        for req in self._requires:
-            for name in req.getMatchNames():
-                lst = reqnames.get(name)
-                if lst:
-                    lst.append(req)
-                else:
-                    reqnames[name] = [req]
-        recnames = {}
-        for rec in self._recommends:
-            for name in rec.getMatchNames():
-                lst = recnames.get(name)
-                if lst:
-                    lst.append(rec)
-                else:
-                    recnames[name] = [rec]
-        upgnames = {}
-        for upg in self._upgrades:
-            for name in upg.getMatchNames():
-                lst = upgnames.get(name)
-                if lst:
-                    lst.append(upg)
-                else:
-                    upgnames[name] = [upg]
-        cnfnames = {}
-        for cnf in self._conflicts:
-            for name in cnf.getMatchNames():
-                lst = cnfnames.get(name)
-                if lst:
-                    lst.append(cnf)
-                else:
-                    cnfnames[name] = [cnf]
-        for prv in self._provides:
-            lst = reqnames.get(prv.name)
-            if lst:
-                for req in lst:
-                    if req.matches(prv):
-                        if req.providedby:
-                            req.providedby.append(prv)
-                        else:
-                            req.providedby = [prv]
-                        if prv.requiredby:
-                            prv.requiredby.append(req)
-                        else:
-                            prv.requiredby = [req]
-            lst = recnames.get(prv.name)
-            if lst:
-                for rec in lst:
-                    if rec.matches(prv):
-                        if rec.providedby:
-                            rec.providedby.append(prv)
-                        else:
-                            rec.providedby = [prv]
-                        if prv.recommendedby:
-                            prv.recommendedby.append(rec)
-                        else:
-                            prv.recommendedby = [rec]
-            lst = upgnames.get(prv.name)
-            if lst:
-                for upg in lst:
-                    if upg.matches(prv):
-                        if upg.providedby:
-                            upg.providedby.append(prv)
-                        else:
-                            upg.providedby = [prv]
-                        if prv.upgradedby:
-                            prv.upgradedby.append(upg)
-                        else:
-                            prv.upgradedby = [upg]
-            lst = cnfnames.get(prv.name)
-            if lst:
-                for cnf in lst:
-                    if cnf.matches(prv):
-                        if cnf.providedby:
-                            cnf.providedby.append(prv)
+        index = ProvidesIndex(self._provides)
+        for deps, attr in [(self._requires, "requiredby"),
+                           (self._recommends, "recommendedby"),
+                           (self._upgrades, "upgradedby"),
+                           (self._conflicts, "conflictedby")]:
+            for dep in deps:
+                for prv in index.getCandidates(dep):
+                    if dep.matches(prv):
+                        if dep.providedby:
+                            dep.providedby.append(prv)
                         else:
-                            cnf.providedby = [prv]
-                        if prv.conflictedby:
-                            prv.conflictedby.append(cnf)
+                            dep.providedby = [prv]
+                        lst = getattr(prv, attr)
+                        if lst:
+                            lst.append(dep)
                         else:
-                            prv.conflictedby = [cnf]
+                            setattr(prv, attr, [dep])
+
+    def _getByName(self, key, objects, name):
+        index = self._nameindex.get(key)
+        if index is None:
+            index = self._nameindex[key] = {}
+            for obj in objects:
+                lst = index.get(obj.name)
+                if lst:
+                    lst.append(obj)
+                else:
+                    index[obj.name] = [obj]
+        lst = index.get(name)
+        if lst:
+            return lst[:]
+        return []
 
     def getPackages(self, name=None):
         if not name:
             return self._packages
         else:
-            return [x for x in self._packages if x.name == name]
+            return self._getByName("_packages", self._packages, name)
 
     def getProvides(self, name=None):
         if not name:
             return self._provides
         else:
-            return [x for x in self._provides if x.name == name]
+            return self._getByName("_provides", self._provides, name)
 
     def getRequires(self, name=None):
         if not name:
             return self._requires
         else:
-            return [x for x in self._requires if x.name == name]
+            return self._getByName("_requires", self._requires, name)
 
     def getRecommends(self, name=None):
         if not name:
             return self._recommends
         else:
-            return [x for x in self._recommends if x.name == name]
+            return self._getByName("_recommends", self._recommends, name)
 
     def getUpgrades(self, name=None):
         if not name:
             return self._upgrades
         else:
-            return [x for x in self._upgrades if x.name == name]
+            return self._getByName("_upgrades", self._upgrades, name)
 
     def getConflicts(self, name=None):
         if not name:
             return self._conflicts
         else:
-            return [x for x in self._conflicts if x.name == name]
+            return self._getByName("_conflicts", self._conflicts, name)
 
     def search(self, searcher):
         if searcher.nameversion:
@@ -928,6 +1054,433 @@ class Cache(object):
         self._upgrades = upgrades.keys()
         self._conflicts = conflicts.keys()
         self._objmap = {}
+        self._nameindex = {}
+
+# Binary cache file format. The file starts with a fixed header made
+# of the magic string, the format version, a flags word, and an
+# (offset, count) pair for each of the sections listed below, in that
+# order. Integers are little-endian, and records have a fixed width,
+# so that the file may be mapped in memory and objects built only
+# when they're needed.
+#
+#   STRINGS   - count+1 uint32 offsets of each string into STRDATA
+#   STRDATA   - raw string data (count is its size in bytes)
+#   CLASSES   - uint32 string index of each "module.Class" name
+#   RELATIONS - relation records (class, argc, kinds, 3 arguments)
+#   PACKAGES  - package records (class, flags, name, version, priority,
+#               (start, count) in LINKS for provides, requires,
+#               recommends, upgrades and conflicts, and (start, count)
+#               in INFOS for the loader information)
+#   LINKS     - uint32 relation indexes referenced by packages
+#   INFOS     - loader information records (loader, kind, value)
+#   LISTS     - (start, count) in PKGINDEX of saved package lists
+#   PKGINDEX  - uint32 package indexes referenced by LISTS
+#   BLOB      - pickled data, referencing the above with persistent ids
+#
+CACHEFILEMAGIC = "SMARTCF\0"
+CACHEFILEVERSION = 1
+
+CF_STRINGS   = 0
+CF_STRDATA   = 1
+CF_CLASSES   = 2
+CF_RELATIONS = 3
+CF_PACKAGES  = 4
+CF_LINKS     = 5
+CF_INFOS     = 6
+CF_LISTS     = 7
+CF_PKGINDEX  = 8
+CF_BLOB      = 9
+CF_SECTIONS  = 10
+
+CF_NOINDEX = 0xffffffffL
+
+CF_HEADER = "<8sII"+"II"*CF_SECTIONS
+CF_RELATION = "<HBBIII"
+CF_PACKAGE = "<HHIIi"+"II"*6
+CF_INFO = "<IIq"
+CF_LIST = "<II"
+
+CF_HEADERSIZE = struct.calcsize(CF_HEADER)
+CF_RELATIONSIZE = struct.calcsize(CF_RELATION)
+CF_PACKAGESIZE = struct.calcsize(CF_PACKAGE)
+CF_INFOSIZE = struct.calcsize(CF_INFO)
+CF_LISTSIZE = struct.calcsize(CF_LIST)
+
+# Relation argc value when arguments are pickled in the first one.
+CF_ARGSPICKLED = 0xff
+
+# Package flags. Bits from CF_PKGLIST on tell which of the five
+# relation attributes are lists, rather than tuples.
+CF_PKGINSTALLED = 1
+CF_PKGESSENTIAL = 2
+CF_PKGLIST      = 4
+
+CF_INFONONE    = 0
+CF_INFOINT     = 1
+CF_INFOSTRING  = 2
+CF_INFOPICKLED = 3
+
+def _packArray(lst):
+    data = array.array("I", lst)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tostring()
+
+def _unpackArray(data):
+    lst = array.array("I")
+    lst.fromstring(data)
+    if sys.byteorder == "big":
+        lst.byteswap()
+    return lst
+
+class CacheFileWriter(object):
+
+    def __init__(self, cache):
+        self._strings = {}
+        self._stroffsets = [0]
+        self._strdata = []
+        self._classes = {}
+        self._classlist = []
+        self._relations = {}
+        self._relrecs = []
+        self._packages = {}
+        self._pkgrecs = []
+        self._links = []
+        self._infos = []
+        self._lists = []
+        self._pkgindex = []
+        self._objects = []
+        self._loaders = {}
+        for i, loader in enumerate(cache._loaders):
+            self._loaders[loader] = i
+        for pkg in cache._packages:
+            self.addPackage(pkg)
+
+    def _addString(self, s):
+        index = self._strings.get(s)
+        if index is None:
+            index = self._strings[s] = len(self._stroffsets)-1
+            self._strdata.append(s)
+            self._stroffsets.append(self._stroffsets[-1]+len(s))
+        return index
+
+    def _addClass(self, cls):
+        index = self._classes.get(cls)
+        if index is None:
+            name = self._addString("%s.%s" % (cls.__module__, cls.__name__))
+            index = self._classes[cls] = len(self._classlist)
+            self._classlist.append(name)
+        return index
+
+    def _addRelation(self, rel, kind):
+        index = self._relations.get(id(rel))
+        if index is not None:
+            self._relrecs[index][2] |= kind
+            return index
+        args = rel.getInitArgs()
+        cls = self._addClass(args[0])
+        args = args[1:]
+        for arg in args:
+            if arg is not None and type(arg) is not str:
+                break
+        else:
+            if len(args) <= 3:
+                rec = [cls, len(args), kind, CF_NOINDEX,
+                       CF_NOINDEX, CF_NOINDEX]
+                for i, arg in enumerate(args):
+                    if arg is not None:
+                        rec[3+i] = self._addString(arg)
+                args = None
+        if args is not None:
+            rec = [cls, CF_ARGSPICKLED, kind,
+                   self._addString(cPickle.dumps(args, 2)),
+                   CF_NOINDEX, CF_NOINDEX]
+        index = self._relations[id(rel)] = len(self._relrecs)
+        self._relrecs.append(rec)
+        self._objects.append(rel)
+        return index
+
+    def addPackage(self, pkg):
+        index = self._packages.get(id(pkg))
+        if index is not None:
+            return index
+        index = self._packages[id(pkg)] = len(self._pkgrecs)
+        self._pkgrecs.append(None)
+        self._objects.append(pkg)
+        flags = 0
+        if pkg.installed:
+            flags |= CF_PKGINSTALLED
+        if pkg.essential:
+            flags |= CF_PKGESSENTIAL
+        rec = [self._addClass(pkg.__class__), 0,
+               self._addString(pkg.name), self._addString(pkg.version),
+               pkg.priority]
+        links = self._links
+        for i, lst in enumerate((pkg.provides, pkg.requires,
+                                 pkg.recommends, pkg.upgrades,
+                                 pkg.conflicts)):
+            if type(lst) is list:
+                flags |= CF_PKGLIST << i
+            rec.append(len(links))
+            rec.append(len(lst))
+            kind = 1 << i
+            for rel in lst:
+                links.append(self._addRelation(rel, kind))
+        rec[1] = flags
+        infos = self._infos
+        rec.append(len(infos))
+        for loader, info in pkg.loaders.items():
+            loaderindex = self._loaders.get(loader)
+            if loaderindex is None:
+                continue
+            if info is None:
+                kind, value = CF_INFONONE, 0
+            elif type(info) is int:
+                kind, value = CF_INFOINT, info
+            elif type(info) is str:
+                kind, value = CF_INFOSTRING, self._addString(info)
+            else:
+                kind, value = (CF_INFOPICKLED,
+                               self._addString(cPickle.dumps(info, 2)))
+            infos.append(struct.pack(CF_INFO, loaderindex, kind, value))
+        rec.append(len(infos)-rec[-1])
+        self._pkgrecs[index] = struct.pack(CF_PACKAGE, *rec)
+        return index
+
+    def addPackageList(self, lst):
+        index = len(self._lists)
+        self._lists.append(struct.pack(CF_LIST, len(self._pkgindex),
+                                       len(lst)))
+        for pkg in lst:
+            self._pkgindex.append(self.addPackage(pkg))
+        return index
+
+    def dump(self, blob):
+        sections = [(_packArray(self._stroffsets),
+                     len(self._stroffsets)-1),
+                    ("".join(self._strdata), self._stroffsets[-1]),
+                    (_packArray(self._classlist), len(self._classlist)),
+                    ("".join([struct.pack(CF_RELATION, *x)
+                              for x in self._relrecs]), len(self._relrecs)),
+                    ("".join(self._pkgrecs), len(self._pkgrecs)),
+                    (_packArray(self._links), len(self._links)),
+                    ("".join(self._infos), len(self._infos)),
+                    ("".join(self._lists), len(self._lists)),
+                    (_packArray(self._pkgindex), len(self._pkgindex)),
+                    (blob, len(blob))]
+        header = [CACHEFILEMAGIC, CACHEFILEVERSION, 0]
+        offset = CF_HEADERSIZE
+        for data, count in sections:
+            header.append(offset)
+            header.append(count)
+            offset += len(data)
+        return struct.pack(CF_HEADER, *header) + \
+               "".join([data for data, count in sections])
+
+class CacheFileReader(object):
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        if len(buffer) < CF_HEADERSIZE:
+            raise Error, _("Invalid cache file")
+        header = struct.unpack_from(CF_HEADER, buffer)
+        if (header[0] != CACHEFILEMAGIC or
+            header[1] != CACHEFILEVERSION):
+            raise StateVersionError
+        self._offsets = header[3::2]
+        self._counts = header[4::2]
+        sizes = [4, 1, 4, CF_RELATIONSIZE, CF_PACKAGESIZE,
+                 4, CF_INFOSIZE, CF_LISTSIZE, 4, 1]
+        for i in range(CF_SECTIONS):
+            size = sizes[i]*(self._counts[i]+(i == CF_STRINGS))
+            if self._offsets[i]+size > len(buffer):
+                raise Error, _("Invalid cache file")
+        self._stroffsets = self._getArray(CF_STRINGS, 0,
+                                          self._counts[CF_STRINGS]+1)
+        self._strings = [None]*self._counts[CF_STRINGS]
+        self._relations = [None]*self._counts[CF_RELATIONS]
+        self._packages = [None]*self._counts[CF_PACKAGES]
+        self._filled = [False]*self._counts[CF_PACKAGES]
+        self._classes = None
+        self._loaders = None
+
+    def _getArray(self, section, start, count):
+        if start+count > self._counts[section]+(section == CF_STRINGS):
+            raise Error, _("Invalid cache file")
+        offset = self._offsets[section]+start*4
+        return _unpackArray(self._buffer[offset:offset+count*4])
+
+    def _getString(self, index):
+        s = self._strings[index]
+        if s is None:
+            start = self._stroffsets[index]
+            end = self._stroffsets[index+1]
+            if start > end or end > self._counts[CF_STRDATA]:
+                raise Error, _("Invalid cache file")
+            offset = self._offsets[CF_STRDATA]
+            s = self._strings[index] = self._buffer[offset+start:offset+end]
+        return s
+
+    def getClassNames(self):
+        return [self._getString(x) for x in
+                self._getArray(CF_CLASSES, 0, self._counts[CF_CLASSES])]
+
+    def setClasses(self, classes):
+        self._classes = classes
+
+    def setLoaders(self, loaders):
+        self._loaders = loaders
+
+    def getBlob(self):
+        offset = self._offsets[CF_BLOB]
+        return self._buffer[offset:offset+self._counts[CF_BLOB]]
+
+    def getRelation(self, index):
+        rel = self._relations[index]
+        if rel is None:
+            cls, argc, kinds, a0, a1, a2 = \
+                struct.unpack_from(CF_RELATION, self._buffer,
+                                   self._offsets[CF_RELATIONS]+
+                                   index*CF_RELATIONSIZE)
+            if argc == CF_ARGSPICKLED:
+                args = cPickle.loads(self._getString(a0))
+            elif argc > 3:
+                raise Error, _("Invalid cache file")
+            else:
+                args = []
+                for arg in (a0, a1, a2)[:argc]:
+                    if arg == CF_NOINDEX:
+                        args.append(None)
+                    else:
+                        args.append(self._getString(arg))
+            rel = self._relations[index] = self._classes[cls](*args)
+        return rel
+
+    def getPackage(self, index):
+        pkg = self._packages[index]
+        if pkg is None:
+            rec = struct.unpack_from(CF_PACKAGE, self._buffer,
+                                     self._offsets[CF_PACKAGES]+
+                                     index*CF_PACKAGESIZE)
+            cls = self._classes[rec[0]]
+            pkg = self._packages[index] = cls.__new__(cls)
+        if not self._filled[index] and self._loaders is not None:
+            self._fillPackage(index, pkg)
+        return pkg
+
+    def _fillPackage(self, index, pkg):
+        rec = struct.unpack_from(CF_PACKAGE, self._buffer,
+                                 self._offsets[CF_PACKAGES]+
+                                 index*CF_PACKAGESIZE)
+        flags = rec[1]
+        getRelation = self.getRelation
+        lists = []
+        for i in range(5):
+            lst = [getRelation(x) for x in
+                   self._getArray(CF_LINKS, rec[5+i*2], rec[6+i*2])]
+            if not flags&(CF_PKGLIST << i):
+                lst = tuple(lst)
+            lists.append(lst)
+        loaders = {}
+        start, count = rec[15:17]
+        if start+count > self._counts[CF_INFOS]:
+            raise Error, _("Invalid cache file")
+        offset = self._offsets[CF_INFOS]+start*CF_INFOSIZE
+        for i in range(count):
+            loader, kind, value = struct.unpack_from(CF_INFO, self._buffer,
+                                                     offset+i*CF_INFOSIZE)
+            if kind == CF_INFONONE:
+                value = None
+            elif kind == CF_INFOSTRING:
+                value = self._getString(value)
+            elif kind == CF_INFOPICKLED:
+                value = cPickle.loads(self._getString(value))
+            elif kind != CF_INFOINT:
+                raise Error, _("Invalid cache file")
+            loaders[self._loaders[loader]] = value
+        pkg.__setstate__((self._getString(rec[2]),
+                          self._getString(rec[3]),
+                          lists[0], lists[1], lists[2], lists[3], lists[4],
+                          bool(flags&CF_PKGINSTALLED),
+                          bool(flags&CF_PKGESSENTIAL),
+                          rec[4], loaders))
+        self._filled[index] = True
+        for lst in lists:
+            for rel in lst:
+                rel.packages.append(pkg)
+
+    def getPackageList(self, index):
+        if index >= self._counts[CF_LISTS]:
+            raise Error, _("Invalid cache file")
+        start, count = struct.unpack_from(CF_LIST, self._buffer,
+                                          self._offsets[CF_LISTS]+
+                                          index*CF_LISTSIZE)
+        return [self.getPackage(x) for x in
+                self._getArray(CF_PKGINDEX, start, count)]
+
+    def restoreCache(self, cache):
+        if self._loaders is None:
+            raise Error, _("Loaders must be set before restoring the cache")
+        packages = [self.getPackage(i)
+                    for i in range(self._counts[CF_PACKAGES])]
+        relations = ([], [], [], [], [])
+        offset = self._offsets[CF_RELATIONS]
+        for i, rel in enumerate(self._relations):
+            if rel is not None:
+                kinds = ord(self._buffer[offset+i*CF_RELATIONSIZE+3])
+                for j in range(5):
+                    if kinds&(1 << j):
+                        relations[j].append(rel)
+        cache._loaders = self._loaders
+        cache._packages = packages
+        (cache._provides, cache._requires, cache._recommends,
+         cache._upgrades, cache._conflicts) = relations
+        cache._objmap = {}
+        cache._nameindex = {}
+
+def _getCacheFileClass(name):
+    module, name = name.rsplit(".", 1)
+    return getattr(__import__(module, {}, {}, [name]), name)
+
+def dumpCacheFile(file, cache, state):
+    writer = CacheFileWriter(cache)
+    lists = {}
+    for loader in cache._loaders:
+        lists[id(loader._packages)] = loader._packages
+    def persistent_id(obj):
+        if obj is cache:
+            return "C"
+        if isinstance(obj, Package):
+            return "P%d" % writer.addPackage(obj)
+        if id(obj) in lists and lists[id(obj)] is obj:
+            return "L%d" % writer.addPackageList(obj)
+        return None
+    blob = StringIO()
+    pickler = cPickle.Pickler(blob, 2)
+    pickler.persistent_id = persistent_id
+    pickler.dump((cache._loaders, state))
+    file.write(writer.dump(blob.getvalue()))
+
+def loadCacheFile(file):
+    buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    reader = CacheFileReader(buffer)
+    reader.setClasses([_getCacheFileClass(x)
+                       for x in reader.getClassNames()])
+    cache = Cache()
+    def persistent_load(pid):
+        if pid == "C":
+            return cache
+        if pid[0] == "P":
+            return reader.getPackage(int(pid[1:]))
+        if pid[0] == "L":
+            return reader.getPackageList(int(pid[1:]))
+        raise cPickle.UnpicklingError, "Unknown persistent id: %s" % pid
+    unpickler = cPickle.Unpickler(StringIO(reader.getBlob()))
+    unpickler.persistent_load = persistent_load
+    loaders, state = unpickler.load()
+    reader.setLoaders(loaders)
+    reader.restoreCache(cache)
+    return cache, state
 
 from ccache import *
 
@@ -129,6 +129,7 @@ typedef struct {
     PyObject *_upgrades;
     PyObject *_conflicts;
     PyObject *_objmap;
+    PyObject *_nameindex;
 } CacheObject;
 
 static PyObject *
@@ -187,6 +188,38 @@ getGlobDistance(void)
     return globdistance;
 }
 
+static PyObject *
+getProvidesIndex(void)
+{
+    static PyObject *index = NULL;
+    if (index == NULL) {
+        PyObject *module = PyImport_ImportModule("smart.cache");
+        if (module) {
+            index = PyObject_GetAttrString(module, "ProvidesIndex");
+            Py_DECREF(module);
+        }
+    }
+    return index;
+}
+
+static long
+getMinimumIndexed(void)
+{
+    static long minimum = -1;
+    if (minimum == -1) {
+        PyObject *module = PyImport_ImportModule("smart.cache");
+        if (module) {
+            PyObject *o = PyObject_GetAttrString(module, "MINIMUMINDEXED");
+            if (o) {
+                minimum = PyInt_AsLong(o);
+                Py_DECREF(o);
+            }
+            Py_DECREF(module);
+        }
+    }
+    return minimum;
+}
+
 static PyObject *
 _(const char *str)
 {
@@ -1133,6 +1166,26 @@ Depends_getMatchNames(DependsObject *self)
     return tup;
 }
 
+static PyObject *
+Depends_getMatchRelations(DependsObject *self)
+{
+    PyObject *lst = PyList_New(1);
+    PyObject *tup = PyTuple_New(3);
+    if (!lst || !tup) {
+        Py_XDECREF(lst);
+        Py_XDECREF(tup);
+        return NULL;
+    }
+    Py_INCREF(self->name);
+    Py_INCREF(self->relation);
+    Py_INCREF(self->version);
+    PyTuple_SET_ITEM(tup, 0, self->name);
+    PyTuple_SET_ITEM(tup, 1, self->relation);
+    PyTuple_SET_ITEM(tup, 2, self->version);
+    PyList_SET_ITEM(lst, 0, tup);
+    return lst;
+}
+
 static PyObject *
 Depends_matches(DependsObject *self, PyObject *prv)
 {
@@ -1210,6 +1263,8 @@ Depends__reduce__(DependsObject *self, PyObject *_)
 static PyMethodDef Depends_methods[] = {
     {"getInitArgs", (PyCFunction)Depends_getInitArgs, METH_NOARGS, NULL},
     {"getMatchNames", (PyCFunction)Depends_getMatchNames, METH_NOARGS, NULL},
+    {"getMatchRelations", (PyCFunction)Depends_getMatchRelations,
+     METH_NOARGS, NULL},
     {"matches", (PyCFunction)Depends_matches, METH_O, NULL},
     {"__reduce__", (PyCFunction)Depends__reduce__, METH_NOARGS, NULL},
     {NULL, NULL}
@@ -1981,6 +2036,9 @@ Loader_buildPackage(LoaderObject *self, PyObject *args)
      * returns are serious bugs, so let's KISS here. */
     Py_DECREF(relpkgs);
 
+    /* cache._nameindex.clear() */
+    PyDict_Clear(cache->_nameindex);
+
     /* pkg.installed |= self._installed */
     if (self->_installed == Py_True) {
         Py_DECREF(pkgobj->installed);
@@ -2057,6 +2115,7 @@ Loader_buildFileProvides(LoaderObject *self, PyObject *args)
 
         /* cache._provides.append(prv) */
         PyList_Append(cache->_provides, prv);
+        PyDict_Clear(cache->_nameindex);
     /*
        elif prv in pkg.provides:
            return
@@ -2099,6 +2158,7 @@ Loader_buildFileProvides(LoaderObject *self, PyObject *args)
                     if (PyList_GET_ITEM(cache->_requires, j) == req)
                         PyList_SetSlice(cache->_requires, j, j+1, NULL);
                 }
+                PyDict_Clear(cache->_nameindex);
             }
         }
     }
@@ -2113,7 +2173,7 @@ Loader_search(LoaderObject *self, PyObject *searcher)
     PyObject *globdistance = getGlobDistance();
     PyObject *ratio = NULL;
     PyObject *ignorecase;
-    PyObject *pkg, *info;
+    PyObject *pkgs, *pkg, *info;
     int i, j, k;
 
     if (globdistance == NULL)
@@ -2123,8 +2183,16 @@ Loader_search(LoaderObject *self, PyObject *searcher)
     if (ignorecase == NULL)
         return NULL;
 
-    for (i = 0; i != PyList_GET_SIZE(self->_packages); i++) {
-        pkg = PyList_GET_ITEM(self->_packages, i);
+    pkgs = PyObject_CallMethod(searcher, "getCandidates", "O", self);
+    if (pkgs == NULL)
+        return NULL;
+    if (!PyList_Check(pkgs)) {
+        PyErr_SetString(PyExc_TypeError, "Invalid candidates list");
+        return NULL;
+    }
+
+    for (i = 0; i != PyList_GET_SIZE(pkgs); i++) {
+        pkg = PyList_GET_ITEM(pkgs, i);
         info = PyObject_CallMethod((PyObject *)self, "getInfo", "O", pkg);
         if (info == NULL)
             return NULL;
@@ -2317,12 +2385,61 @@ Loader_search(LoaderObject *self, PyObject *searcher)
 
         Py_DECREF(info);
     }
+    Py_DECREF(pkgs);
     Py_DECREF(ignorecase);
 
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+static PyObject *
+Loader_getSearchTexts(LoaderObject *self, PyObject *args)
+{
+    static const char *methods[] = {"getGroup", "getSummary",
+                                    "getDescription"};
+    PyObject *lst, *pkg, *info, *texts, *text, *urls, *paths;
+    int i, j;
+
+    lst = PyList_New(0);
+    if (lst == NULL)
+        return NULL;
+    for (i = 0; i != PyList_GET_SIZE(self->_packages); i++) {
+        pkg = PyList_GET_ITEM(self->_packages, i);
+        info = PyObject_CallMethod((PyObject *)self, "getInfo", "O", pkg);
+        if (info == NULL) {
+            Py_DECREF(lst);
+            return NULL;
+        }
+        texts = PyTuple_New(3);
+        for (j = 0; j != 3; j++) {
+            text = PyObject_CallMethod(info, (char *)methods[j], NULL);
+            if (text == NULL) {
+                Py_DECREF(texts);
+                Py_DECREF(info);
+                Py_DECREF(lst);
+                return NULL;
+            }
+            PyTuple_SET_ITEM(texts, j, text);
+        }
+        urls = PyObject_CallMethod(info, "getReferenceURLs", NULL);
+        paths = urls ? PyObject_CallMethod(info, "getPathList", NULL) : NULL;
+        Py_DECREF(info);
+        if (paths == NULL) {
+            Py_XDECREF(urls);
+            Py_DECREF(texts);
+            Py_DECREF(lst);
+            return NULL;
+        }
+        text = PyTuple_Pack(4, pkg, texts, urls, paths);
+        Py_DECREF(paths);
+        Py_DECREF(urls);
+        Py_DECREF(texts);
+        PyList_Append(lst, text);
+        Py_DECREF(text);
+    }
+    return lst;
+}
+
 #define Loader__stateversion__ 1
 
 static PyObject *
@@ -2435,6 +2552,7 @@ static PyMethodDef Loader_methods[] = {
     {"buildPackage", (PyCFunction)Loader_buildPackage, METH_VARARGS, NULL},
     {"buildFileProvides", (PyCFunction)Loader_buildFileProvides, METH_VARARGS, NULL},
     {"search", (PyCFunction)Loader_search, METH_O, NULL},
+    {"getSearchTexts", (PyCFunction)Loader_getSearchTexts, METH_NOARGS, NULL},
     {"__getstate__", (PyCFunction)Loader__getstate__, METH_NOARGS, NULL},
     {"__setstate__", (PyCFunction)Loader__setstate__, METH_O, NULL},
     {NULL, NULL}
@@ -2507,6 +2625,7 @@ Cache_init(CacheObject *self, PyObject *args)
     self->_upgrades = PyList_New(0);
     self->_conflicts = PyList_New(0);
     self->_objmap = PyDict_New();
+    self->_nameindex = PyDict_New();
     return 0;
 }
 
@@ -2521,6 +2640,7 @@ Cache_traverse(CacheObject *self, visitproc visit, void *arg)
     Py_VISIT(self->_upgrades);
     Py_VISIT(self->_conflicts);
     Py_VISIT(self->_objmap);
+    Py_VISIT(self->_nameindex);
     return 0;
 }
 
@@ -2535,6 +2655,7 @@ Cache_clear(CacheObject *self)
     Py_CLEAR(self->_upgrades);
     Py_CLEAR(self->_conflicts);
     Py_CLEAR(self->_objmap);
+    Py_CLEAR(self->_nameindex);
     return 0;
 }
 
@@ -2549,6 +2670,7 @@ Cache_dealloc(CacheObject *self)
     Py_XDECREF(self->_upgrades);
     Py_XDECREF(self->_conflicts);
     Py_XDECREF(self->_objmap);
+    Py_XDECREF(self->_nameindex);
     self->ob_type->tp_free((PyObject *)self);
 }
 
@@ -2619,6 +2741,7 @@ Cache_reset(CacheObject *self, PyObject *args)
     LIST_CLEAR(self->_upgrades);
     LIST_CLEAR(self->_conflicts);
     PyDict_Clear(self->_objmap);
+    PyDict_Clear(self->_nameindex);
     Py_RETURN_NONE;
 }
 
@@ -2634,6 +2757,7 @@ Cache_addLoader(CacheObject *self, PyObject *loader)
         if (i == len) {
             PyList_Append(self->_loaders, loader);
             CALLMETHOD(loader, "setCache", "O", self);
+            PyDict_Clear(self->_nameindex);
         }
     }
     Py_RETURN_NONE;
@@ -2651,11 +2775,19 @@ Cache_removeLoader(CacheObject *self, PyObject *loader)
         if (i >= 0) {
             CALLMETHOD(loader, "setCache", "O", Py_None);
             CALLMETHOD(loader, "unload", NULL);
+            PyDict_Clear(self->_nameindex);
         }
     }
     Py_RETURN_NONE;
 }
 
+PyObject *
+Cache_getLoaders(CacheObject *self, PyObject *args)
+{
+    return PyList_GetSlice(self->_loaders, 0,
+                           PyList_GET_SIZE(self->_loaders));
+}
+
 PyObject *
 Cache__reload(CacheObject *self, PyObject *args)
 {
@@ -2917,6 +3049,8 @@ Cache__reload(CacheObject *self, PyObject *args)
     self->_conflicts = PyDict_Keys(conflicts);
     Py_DECREF(conflicts);
 
+    PyDict_Clear(self->_nameindex);
+
     Py_INCREF(Py_None);
     return Py_None;
 }
@@ -3008,531 +3142,253 @@ Cache_loadFileProvides(CacheObject *self, PyObject *args)
     Py_RETURN_NONE;
 }
 
-PyObject *
-Cache_linkDeps(CacheObject *self, PyObject *args)
+static int
+Cache_linkDependsList(PyObject *deps, PyObject *index, PyObject *names,
+                      long minimum, size_t prvoffset)
 {
     int i, j, len;
-    PyObject *reqnames, *recnames, *upgnames, *cnfnames;
-    PyObject *lst;
 
-    /* reqnames = {} */
-    reqnames = PyDict_New();
-    /* for req in self._requires: */
-    len = PyList_GET_SIZE(self->_requires);
+    /* for dep in deps: */
+    len = PyList_GET_SIZE(deps);
     for (i = 0; i != len; i++) {
-        PyObject *req = PyList_GET_ITEM(self->_requires, i);
-
-        /* for name in req.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(req, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = reqnames.get(name) */
-            lst = PyDict_GetItem(reqnames, name);
-
-            /* 
-               if lst:
-                   lst.append(req)
-               else:
-                   reqnames[name] = [req]
-            */
-            if (lst) {
-                PyList_Append(lst, req);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(req);
-                PyList_SET_ITEM(lst, 0, req);
-                PyDict_SetItem(reqnames, name, lst);
-                Py_DECREF(lst);
+        DependsObject *dep = (DependsObject *)PyList_GET_ITEM(deps, i);
+        PyObject *candidates = NULL;
+        PyObject *matchnames, *seq;
+        int candlen;
+
+        /* Names with few provides are handled here, as
+           index.getCandidates() would only return all of them. */
+        matchnames = PyObject_CallMethod((PyObject *)dep, "getMatchNames",
+                                         NULL);
+        if (!matchnames) return -1;
+        seq = PySequence_Fast(matchnames, "getMatchNames() returned "
+                                          "non-sequence object");
+        Py_DECREF(matchnames);
+        if (!seq) return -1;
+        if (PySequence_Fast_GET_SIZE(seq) == 1) {
+            PyObject *lst = PyDict_GetItem(names,
+                                           PySequence_Fast_GET_ITEM(seq, 0));
+            if (!lst) {
+                Py_DECREF(seq);
+                continue;
+            }
+            if (PyList_GET_SIZE(lst) < minimum) {
+                Py_INCREF(lst);
+                candidates = lst;
             }
         }
-
-        Py_DECREF(names);
         Py_DECREF(seq);
-    }
 
-    /* recnames = {} */
-    recnames = PyDict_New();
-    /* for rec in self._recommends: */
-    len = PyList_GET_SIZE(self->_recommends);
-    for (i = 0; i != len; i++) {
-        PyObject *rec = PyList_GET_ITEM(self->_recommends, i);
-
-        /* for name in rec.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(rec, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = recnames.get(name) */
-            lst = PyDict_GetItem(recnames, name);
+        /* for prv in index.getCandidates(dep): */
+        if (!candidates) {
+            PyObject *ret = PyObject_CallMethod(index, "getCandidates",
+                                                "O", (PyObject *)dep);
+            if (!ret) return -1;
+            candidates = PySequence_Fast(ret, "getCandidates() returned "
+                                              "non-sequence object");
+            Py_DECREF(ret);
+            if (!candidates) return -1;
+        }
+        candlen = PySequence_Fast_GET_SIZE(candidates);
+        for (j = 0; j != candlen; j++) {
+            PyObject *prv = PySequence_Fast_GET_ITEM(candidates, j);
+            PyObject **prvlst = (PyObject **)((char *)prv + prvoffset);
+
+            /* if dep.matches(prv): */
+            PyObject *ret = PyObject_CallMethod((PyObject *)dep, "matches",
+                                                "O", prv);
+            if (!ret) {
+                Py_DECREF(candidates);
+                return -1;
+            }
+            if (PyObject_IsTrue(ret)) {
+                /*
+                   if dep.providedby:
+                       dep.providedby.append(prv)
+                   else:
+                       dep.providedby = [prv]
+                */
+                if (PyList_Check(dep->providedby)) {
+                    PyList_Append(dep->providedby, prv);
+                } else {
+                    PyObject *_lst = PyList_New(1);
+                    Py_INCREF(prv);
+                    PyList_SET_ITEM(_lst, 0, prv);
+                    Py_DECREF(dep->providedby);
+                    dep->providedby = _lst;
+                }
 
-            /* 
-               if lst:
-                   lst.append(rec)
-               else:
-                   recnames[name] = [rec]
-            */
-            if (lst) {
-                PyList_Append(lst, rec);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(rec);
-                PyList_SET_ITEM(lst, 0, rec);
-                PyDict_SetItem(recnames, name, lst);
-                Py_DECREF(lst);
+                /*
+                   if prv.<attr>:
+                       prv.<attr>.append(dep)
+                   else:
+                       prv.<attr> = [dep]
+                */
+                if (PyList_Check(*prvlst)) {
+                    PyList_Append(*prvlst, (PyObject *)dep);
+                } else {
+                    PyObject *_lst = PyList_New(1);
+                    Py_INCREF(dep);
+                    PyList_SET_ITEM(_lst, 0, (PyObject *)dep);
+                    Py_DECREF(*prvlst);
+                    *prvlst = _lst;
+                }
             }
+            Py_DECREF(ret);
         }
-
-        Py_DECREF(names);
-        Py_DECREF(seq);
+        Py_DECREF(candidates);
     }
+    return 0;
+}
 
-    /* upgnames = {} */
-    upgnames = PyDict_New();
-    /* for upg in self._upgrades: */
-    len = PyList_GET_SIZE(self->_upgrades);
-    for (i = 0; i != len; i++) {
-        PyObject *upg = PyList_GET_ITEM(self->_upgrades, i);
-
-        /* for name in upg.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(upg, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = upgnames.get(name) */
-            lst = PyDict_GetItem(upgnames, name);
+PyObject *
+Cache_linkDeps(CacheObject *self, PyObject *args)
+{
+    PyObject *index, *names, *cls;
+    long minimum;
+    int rc;
 
-            /* 
-               if lst:
-                   lst.append(upg)
-               else:
-                   upgnames[name] = [upg]
-            */
-            if (lst) {
-                PyList_Append(lst, upg);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(upg);
-                PyList_SET_ITEM(lst, 0, upg);
-                PyDict_SetItem(upgnames, name, lst);
-                Py_DECREF(lst);
-            }
+    minimum = getMinimumIndexed();
+    if (minimum == -1 && PyErr_Occurred())
+        return NULL;
+    cls = getProvidesIndex();
+    if (!cls) return NULL;
+
+    /* index = ProvidesIndex(self._provides) */
+    index = PyObject_CallFunction(cls, "O", self->_provides);
+    if (!index) return NULL;
+    names = PyObject_CallMethod(index, "getNames", NULL);
+    if (!names || !PyDict_Check(names)) {
+        if (names) {
+            PyErr_SetString(PyExc_TypeError, "getNames() returned "
+                                             "non-dict object");
+            Py_DECREF(names);
         }
-
-        Py_DECREF(names);
-        Py_DECREF(seq);
+        Py_DECREF(index);
+        return NULL;
     }
 
-    /* cnfnames = {} */
-    cnfnames = PyDict_New();
-    /* for cnf in self._conflicts: */
-    len = PyList_GET_SIZE(self->_conflicts);
-    for (i = 0; i != len; i++) {
-        PyObject *cnf = PyList_GET_ITEM(self->_conflicts, i);
-
-        /* for name in cnf.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(cnf, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = cnfnames.get(name) */
-            lst = PyDict_GetItem(cnfnames, name);
+#define PRVOFF(x) offsetof(ProvidesObject, x)
+    rc = (Cache_linkDependsList(self->_requires, index, names, minimum,
+                                PRVOFF(requiredby)) ||
+          Cache_linkDependsList(self->_recommends, index, names, minimum,
+                                PRVOFF(recommendedby)) ||
+          Cache_linkDependsList(self->_upgrades, index, names, minimum,
+                                PRVOFF(upgradedby)) ||
+          Cache_linkDependsList(self->_conflicts, index, names, minimum,
+                                PRVOFF(conflictedby)));
+#undef PRVOFF
+
+    Py_DECREF(names);
+    Py_DECREF(index);
+
+    if (rc) return NULL;
+    Py_RETURN_NONE;
+}
+
+#define OBJNAME(obj) \
+    (PyObject_TypeCheck(obj, &Package_Type) ? \
+     ((PackageObject *)(obj))->name : \
+     PyObject_TypeCheck(obj, &Provides_Type) ? \
+     ((ProvidesObject *)(obj))->name : \
+     ((DependsObject *)(obj))->name)
 
-            /* 
+static PyObject *
+Cache__getByName(CacheObject *self, const char *key, PyObject *objects,
+                 PyObject *args)
+{
+    PyObject *name = NULL;
+    PyObject *index, *lst;
+    if (!PyArg_ParseTuple(args, "|O", &name))
+        return NULL;
+    if (!name || !PyObject_IsTrue(name)) {
+        Py_INCREF(objects);
+        return objects;
+    }
+    /*
+       index = self._nameindex.get(key)
+       if index is None:
+           index = self._nameindex[key] = {}
+           for obj in objects:
+               lst = index.get(obj.name)
                if lst:
-                   lst.append(cnf)
+                   lst.append(obj)
                else:
-                   cnfnames[name] = [cnf]
-            */
+                   index[obj.name] = [obj]
+    */
+    index = PyDict_GetItemString(self->_nameindex, key);
+    if (!index) {
+        int i, len;
+        index = PyDict_New();
+        if (!index) return NULL;
+        PyDict_SetItemString(self->_nameindex, key, index);
+        Py_DECREF(index);
+        len = PyList_GET_SIZE(objects);
+        for (i = 0; i != len; i++) {
+            PyObject *obj = PyList_GET_ITEM(objects, i);
+            PyObject *objname = OBJNAME(obj);
+            lst = PyDict_GetItem(index, objname);
             if (lst) {
-                PyList_Append(lst, cnf);
+                PyList_Append(lst, obj);
             } else {
                 lst = PyList_New(1);
-                Py_INCREF(cnf);
-                PyList_SET_ITEM(lst, 0, cnf);
-                PyDict_SetItem(cnfnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
-
-        Py_DECREF(names);
-        Py_DECREF(seq);
-    }
-
-    /* for prv in self._provides: */
-    len = PyList_GET_SIZE(self->_provides);
-    for (i = 0; i != len; i++) {
-        ProvidesObject *prv;
-
-        prv = (ProvidesObject *)PyList_GET_ITEM(self->_provides, i);
-
-        /* lst = reqnames.get(prv.name) */
-        lst = PyDict_GetItem(reqnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-            /* for req in lst: */
-            int reqlen = PyList_GET_SIZE(lst);
-            for (j = 0; j != reqlen; j++) {
-                DependsObject *req = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if req.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)req, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if req.providedby:
-                           req.providedby.append(prv)
-                       else:
-                           req.providedby = [prv]
-                    */
-                    if (PyList_Check(req->providedby)) {
-                        PyList_Append(req->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(req->providedby);
-                        req->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.requiredby:
-                           prv.requiredby.append(prv)
-                       else:
-                           prv.requiredby = [prv]
-                    */
-                    if (PyList_Check(prv->requiredby)) {
-                        PyList_Append(prv->requiredby, (PyObject *)req);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(req);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)req);
-                        Py_DECREF(prv->requiredby);
-                        prv->requiredby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
-        }
-
-        /* lst = recnames.get(prv.name) */
-        lst = PyDict_GetItem(recnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-            /* for rec in lst: */
-            int reclen = PyList_GET_SIZE(lst);
-            for (j = 0; j != reclen; j++) {
-                DependsObject *rec = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if rec.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)rec, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if rec.providedby:
-                           rec.providedby.append(prv)
-                       else:
-                           rec.providedby = [prv]
-                    */
-                    if (PyList_Check(rec->providedby)) {
-                        PyList_Append(rec->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(rec->providedby);
-                        rec->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.recommendedby:
-                           prv.recommendedby.append(prv)
-                       else:
-                           prv.recommendedby = [prv]
-                    */
-                    if (PyList_Check(prv->recommendedby)) {
-                        PyList_Append(prv->recommendedby, (PyObject *)rec);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(rec);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)rec);
-                        Py_DECREF(prv->recommendedby);
-                        prv->recommendedby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
-        }
-
-        /* lst = upgnames.get(prv.name) */
-        lst = PyDict_GetItem(upgnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-
-            /* for upg in lst: */
-            int upglen = PyList_GET_SIZE(lst);
-            for (j = 0; j != upglen; j++) {
-                DependsObject *upg = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if upg.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)upg, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if upg.providedby:
-                           upg.providedby.append(prv)
-                       else:
-                           upg.providedby = [prv]
-                    */
-                    if (PyList_Check(upg->providedby)) {
-                        PyList_Append(upg->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(upg->providedby);
-                        upg->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.upgradedby:
-                           prv.upgradedby.append(prv)
-                       else:
-                           prv.upgradedby = [prv]
-                    */
-                    if (PyList_Check(prv->upgradedby)) {
-                        PyList_Append(prv->upgradedby, (PyObject *)upg);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(upg);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)upg);
-                        Py_DECREF(prv->upgradedby);
-                        prv->upgradedby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
-        }
-
-        /* lst = cnfnames.get(prv.name) */
-        lst = PyDict_GetItem(cnfnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-
-            /* for cnf in lst: */
-            int cnflen = PyList_GET_SIZE(lst);
-            for (j = 0; j != cnflen; j++) {
-                DependsObject *cnf = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if cnf.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)cnf, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if cnf.providedby:
-                           cnf.providedby.append(prv)
-                       else:
-                           cnf.providedby = [prv]
-                    */
-                    if (PyList_Check(cnf->providedby)) {
-                        PyList_Append(cnf->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(cnf->providedby);
-                        cnf->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.conflictedby:
-                           prv.conflictedby.append(prv)
-                       else:
-                           prv.conflictedby = [prv]
-                    */
-                    if (PyList_Check(prv->conflictedby)) {
-                        PyList_Append(prv->conflictedby, (PyObject *)cnf);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(cnf);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)cnf);
-                        Py_DECREF(prv->conflictedby);
-                        prv->conflictedby = _lst;
-                    }
+                if (!lst) {
+                    PyDict_Clear(self->_nameindex);
+                    return NULL;
                 }
-                Py_DECREF(ret);
+                Py_INCREF(obj);
+                PyList_SET_ITEM(lst, 0, obj);
+                PyDict_SetItem(index, objname, lst);
+                Py_DECREF(lst);
             }
         }
     }
-
-    Py_DECREF(reqnames);
-    Py_DECREF(recnames);
-    Py_DECREF(upgnames);
-    Py_DECREF(cnfnames);
-
-    Py_RETURN_NONE;
+    /*
+       lst = index.get(name)
+       if lst:
+           return lst[:]
+       return []
+    */
+    lst = PyDict_GetItem(index, name);
+    if (lst)
+        return PyList_GetSlice(lst, 0, PyList_GET_SIZE(lst));
+    return PyList_New(0);
 }
 
 PyObject *
 Cache_getPackages(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_packages);
-        return self->_packages;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_packages);
-    for (i = 0; i != len; i++) {
-        PackageObject *pkg =
-            (PackageObject*)PyList_GET_ITEM(self->_packages, i);
-        if (strcmp(STR(pkg->name), name) == 0)
-            PyList_Append(lst, (PyObject *)pkg);
-    }
-    return lst;
+    return Cache__getByName(self, "_packages", self->_packages, args);
 }
 
 PyObject *
 Cache_getProvides(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_provides);
-        return self->_provides;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_provides);
-    for (i = 0; i != len; i++) {
-        ProvidesObject *prv =
-            (ProvidesObject*)PyList_GET_ITEM(self->_provides, i);
-        if (strcmp(STR(prv->name), name) == 0)
-            PyList_Append(lst, (PyObject *)prv);
-    }
-    return lst;
+    return Cache__getByName(self, "_provides", self->_provides, args);
 }
 
 PyObject *
 Cache_getRequires(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_requires);
-        return self->_requires;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_requires);
-    for (i = 0; i != len; i++) {
-        DependsObject *req =
-            (DependsObject*)PyList_GET_ITEM(self->_requires, i);
-        if (strcmp(STR(req->name), name) == 0)
-            PyList_Append(lst, (PyObject *)req);
-    }
-    return lst;
+    return Cache__getByName(self, "_requires", self->_requires, args);
 }
 
 PyObject *
 Cache_getRecommends(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_recommends);
-        return self->_recommends;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_recommends);
-    for (i = 0; i != len; i++) {
-        DependsObject *rec =
-            (DependsObject*)PyList_GET_ITEM(self->_recommends, i);
-        if (strcmp(STR(rec->name), name) == 0)
-            PyList_Append(lst, (PyObject *)rec);
-    }
-    return lst;
+    return Cache__getByName(self, "_recommends", self->_recommends, args);
 }
 
 PyObject *
 Cache_getUpgrades(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_upgrades);
-        return self->_upgrades;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_upgrades);
-    for (i = 0; i != len; i++) {
-        DependsObject *upg =
-            (DependsObject*)PyList_GET_ITEM(self->_upgrades, i);
-        if (strcmp(STR(upg->name), name) == 0)
-            PyList_Append(lst, (PyObject *)upg);
-    }
-    return lst;
+    return Cache__getByName(self, "_upgrades", self->_upgrades, args);
 }
 
 PyObject *
 Cache_getConflicts(CacheObject *self, PyObject *args)
 {
-    const char *name = NULL;
-    PyObject *lst;
-    int i, len;
-    if (!PyArg_ParseTuple(args, "|s", &name))
-        return NULL;
-    if (!name) {
-        Py_INCREF(self->_conflicts);
-        return self->_conflicts;
-    }
-    lst = PyList_New(0);
-    len = PyList_GET_SIZE(self->_conflicts);
-    for (i = 0; i != len; i++) {
-        DependsObject *cnf =
-            (DependsObject*)PyList_GET_ITEM(self->_conflicts, i);
-        if (strcmp(STR(cnf->name), name) == 0)
-            PyList_Append(lst, (PyObject *)cnf);
-    }
-    return lst;
+    return Cache__getByName(self, "_conflicts", self->_conflicts, args);
 }
 
 PyObject *
@@ -3874,6 +3730,9 @@ Cache__setstate__(CacheObject *self, PyObject *state)
 
     /* self._objmap = {} */
     self->_objmap = PyDict_New();
+
+    /* self._nameindex = {} */
+    self->_nameindex = PyDict_New();
     
     Py_INCREF(Py_None);
     return Py_None;
@@ -3883,6 +3742,7 @@ static PyMethodDef Cache_methods[] = {
     {"reset", (PyCFunction)Cache_reset, METH_VARARGS, NULL},
     {"addLoader", (PyCFunction)Cache_addLoader, METH_O, NULL},
     {"removeLoader", (PyCFunction)Cache_removeLoader, METH_O, NULL},
+    {"getLoaders", (PyCFunction)Cache_getLoaders, METH_NOARGS, NULL},
     {"_reload", (PyCFunction)Cache__reload, METH_NOARGS, NULL},
     {"load", (PyCFunction)Cache_load, METH_NOARGS, NULL},
     {"unload", (PyCFunction)Cache_unload, METH_NOARGS, NULL},
@@ -3910,6 +3770,7 @@ static PyMemberDef Cache_members[] = {
     {"_upgrades", T_OBJECT, OFF(_upgrades), RO, 0},
     {"_conflicts", T_OBJECT, OFF(_conflicts), RO, 0},
     {"_objmap", T_OBJECT, OFF(_objmap), RO, 0},
+    {"_nameindex", T_OBJECT, OFF(_nameindex), RO, 0},
     {NULL}
 };
 #undef OFF
@@ -3959,22 +3820,1299 @@ statichere PyTypeObject Cache_Type = {
 };
 
 
-static PyMethodDef ccache_methods[] = {
-    {NULL, NULL}
-};
+/* Binary cache file. See the format description in cache.py. */
 
-DL_EXPORT(void)
-initccache(void)
+#define CF_MAGIC "SMARTCF\0"
+#define CF_MAGICSIZE 8
+#define CF_VERSION 1
+
+#define CF_STRINGS   0
+#define CF_STRDATA   1
+#define CF_CLASSES   2
+#define CF_RELATIONS 3
+#define CF_PACKAGES  4
+#define CF_LINKS     5
+#define CF_INFOS     6
+#define CF_LISTS     7
+#define CF_PKGINDEX  8
+#define CF_BLOB      9
+#define CF_SECTIONS  10
+
+#define CF_NOINDEX 0xffffffffUL
+
+#define CF_HEADERSIZE   (CF_MAGICSIZE+8+CF_SECTIONS*8)
+#define CF_RELATIONSIZE 16
+#define CF_PACKAGESIZE  64
+#define CF_INFOSIZE     16
+#define CF_LISTSIZE     8
+
+#define CF_ARGSPICKLED 0xff
+
+#define CF_PKGINSTALLED 1
+#define CF_PKGESSENTIAL 2
+#define CF_PKGLIST      4
+
+#define CF_INFONONE    0
+#define CF_INFOINT     1
+#define CF_INFOSTRING  2
+#define CF_INFOPICKLED 3
+
+static const unsigned long cf_itemsize[CF_SECTIONS] =
+    {4, 1, 4, CF_RELATIONSIZE, CF_PACKAGESIZE,
+     4, CF_INFOSIZE, CF_LISTSIZE, 4, 1};
+
+static unsigned long
+cf_get16(const unsigned char *p)
 {
-    PyObject *m, *o;
-    Package_Type.ob_type = &PyType_Type;
-    Provides_Type.ob_type = &PyType_Type;
-    Depends_Type.ob_type = &PyType_Type;
-    Loader_Type.ob_type = &PyType_Type;
-    Cache_Type.ob_type = &PyType_Type;
+    return (unsigned long)p[0] | ((unsigned long)p[1] << 8);
+}
 
-    PyType_Ready(&Loader_Type);
-    o = PyInt_FromLong(Loader__stateversion__);
+static unsigned long
+cf_get32(const unsigned char *p)
+{
+    return ((unsigned long)p[0] | ((unsigned long)p[1] << 8) |
+            ((unsigned long)p[2] << 16) | ((unsigned long)p[3] << 24));
+}
+
+static PY_LONG_LONG
+cf_get64(const unsigned char *p)
+{
+    return (PY_LONG_LONG)((unsigned PY_LONG_LONG)cf_get32(p) |
+                          ((unsigned PY_LONG_LONG)cf_get32(p+4) << 32));
+}
+
+static void
+cf_put16(unsigned char *p, unsigned long v)
+{
+    p[0] = v & 0xff;
+    p[1] = (v >> 8) & 0xff;
+}
+
+static void
+cf_put32(unsigned char *p, unsigned long v)
+{
+    p[0] = v & 0xff;
+    p[1] = (v >> 8) & 0xff;
+    p[2] = (v >> 16) & 0xff;
+    p[3] = (v >> 24) & 0xff;
+}
+
+static void
+cf_put64(unsigned char *p, PY_LONG_LONG v)
+{
+    cf_put32(p, (unsigned long)((unsigned PY_LONG_LONG)v & 0xffffffffUL));
+    cf_put32(p+4, (unsigned long)((unsigned PY_LONG_LONG)v >> 32));
+}
+
+static PyObject *
+getPickleFunction(const char *name)
+{
+    static PyObject *module = NULL;
+    if (module == NULL) {
+        module = PyImport_ImportModule("cPickle");
+        if (module == NULL)
+            return NULL;
+    }
+    return PyObject_GetAttrString(module, (char *)name);
+}
+
+static PyObject *
+cf_dumps(PyObject *obj)
+{
+    static PyObject *dumps = NULL;
+    if (dumps == NULL) {
+        dumps = getPickleFunction("dumps");
+        if (dumps == NULL)
+            return NULL;
+    }
+    return PyObject_CallFunction(dumps, "Oi", obj, 2);
+}
+
+static PyObject *
+cf_loads(PyObject *str)
+{
+    static PyObject *loads = NULL;
+    if (loads == NULL) {
+        loads = getPickleFunction("loads");
+        if (loads == NULL)
+            return NULL;
+    }
+    return PyObject_CallFunctionObjArgs(loads, str, NULL);
+}
+
+static PyObject *
+cf_error(const char *str)
+{
+    PyObject *module = PyImport_ImportModule("smart");
+    if (module) {
+        PyObject *error = PyObject_GetAttrString(module, "Error");
+        if (error) {
+            PyObject *msg = _(str);
+            if (msg) {
+                PyErr_SetObject(error, msg);
+                Py_DECREF(msg);
+            }
+            Py_DECREF(error);
+        }
+        Py_DECREF(module);
+    }
+    return NULL;
+}
+
+#define cf_invalid() cf_error("Invalid cache file")
+
+typedef struct {
+    unsigned char *data;
+    size_t len;
+    size_t alloc;
+} CFBuffer;
+
+static unsigned char *
+CFBuffer_extend(CFBuffer *buf, size_t size)
+{
+    unsigned char *p;
+    if (buf->len+size > buf->alloc) {
+        size_t alloc = buf->alloc ? buf->alloc : 1024;
+        while (alloc < buf->len+size)
+            alloc *= 2;
+        p = (unsigned char *)realloc(buf->data, alloc);
+        if (!p) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        buf->data = p;
+        buf->alloc = alloc;
+    }
+    p = buf->data+buf->len;
+    buf->len += size;
+    return p;
+}
+
+static int
+CFBuffer_append32(CFBuffer *buf, unsigned long v)
+{
+    unsigned char *p = CFBuffer_extend(buf, 4);
+    if (!p) return -1;
+    cf_put32(p, v);
+    return 0;
+}
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *_strings;   /* string -> index */
+    PyObject *_classes;   /* class -> index */
+    PyObject *_relations; /* id(relation) -> index */
+    PyObject *_packages;  /* id(package) -> index */
+    PyObject *_loaders;   /* loader -> index */
+    PyObject *_objects;   /* keeps indexed objects alive */
+    CFBuffer sections[CF_SECTIONS];
+    unsigned long counts[CF_SECTIONS];
+} CacheFileWriterObject;
+
+staticforward PyTypeObject CacheFileWriter_Type;
+
+static long CacheFileWriter__addPackage(CacheFileWriterObject *self,
+                                        PyObject *pkg);
+
+static int
+CacheFileWriter_init(CacheFileWriterObject *self, PyObject *args)
+{
+    CacheObject *cache;
+    int i, len;
+    if (!PyArg_ParseTuple(args, "O!", &Cache_Type, &cache))
+        return -1;
+    self->_strings = PyDict_New();
+    self->_classes = PyDict_New();
+    self->_relations = PyDict_New();
+    self->_packages = PyDict_New();
+    self->_loaders = PyDict_New();
+    self->_objects = PyList_New(0);
+    if (!self->_strings || !self->_classes || !self->_relations ||
+        !self->_packages || !self->_loaders || !self->_objects)
+        return -1;
+    if (CFBuffer_append32(&self->sections[CF_STRINGS], 0) == -1)
+        return -1;
+    len = PyList_GET_SIZE(cache->_loaders);
+    for (i = 0; i != len; i++) {
+        PyObject *index = PyInt_FromLong(i);
+        if (!index) return -1;
+        PyDict_SetItem(self->_loaders,
+                       PyList_GET_ITEM(cache->_loaders, i), index);
+        Py_DECREF(index);
+    }
+    len = PyList_GET_SIZE(cache->_packages);
+    for (i = 0; i != len; i++) {
+        if (CacheFileWriter__addPackage(self,
+                PyList_GET_ITEM(cache->_packages, i)) == -1)
+            return -1;
+    }
+    return 0;
+}
+
+static void
+CacheFileWriter_dealloc(CacheFileWriterObject *self)
+{
+    int i;
+    Py_XDECREF(self->_strings);
+    Py_XDECREF(self->_classes);
+    Py_XDECREF(self->_relations);
+    Py_XDECREF(self->_packages);
+    Py_XDECREF(self->_loaders);
+    Py_XDECREF(self->_objects);
+    for (i = 0; i != CF_SECTIONS; i++)
+        free(self->sections[i].data);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
+static long
+CacheFileWriter__addString(CacheFileWriterObject *self, PyObject *str)
+{
+    PyObject *index = PyDict_GetItem(self->_strings, str);
+    unsigned char *p;
+    long i;
+    int len;
+    if (index)
+        return PyInt_AS_LONG(index);
+    if (!PyString_Check(str)) {
+        PyErr_SetString(PyExc_TypeError, "String expected");
+        return -1;
+    }
+    i = self->counts[CF_STRINGS];
+    len = PyString_GET_SIZE(str);
+    p = CFBuffer_extend(&self->sections[CF_STRDATA], len);
+    if (!p) return -1;
+    memcpy(p, STR(str), len);
+    self->counts[CF_STRDATA] += len;
+    if (CFBuffer_append32(&self->sections[CF_STRINGS],
+                          self->counts[CF_STRDATA]) == -1)
+        return -1;
+    self->counts[CF_STRINGS] += 1;
+    index = PyInt_FromLong(i);
+    if (!index) return -1;
+    PyDict_SetItem(self->_strings, str, index);
+    Py_DECREF(index);
+    return i;
+}
+
+static long
+CacheFileWriter__addPickled(CacheFileWriterObject *self, PyObject *obj)
+{
+    PyObject *str = cf_dumps(obj);
+    long i;
+    if (!str) return -1;
+    i = CacheFileWriter__addString(self, str);
+    Py_DECREF(str);
+    return i;
+}
+
+static long
+CacheFileWriter__addClass(CacheFileWriterObject *self, PyObject *cls)
+{
+    PyObject *index = PyDict_GetItem(self->_classes, cls);
+    PyObject *module, *name, *fullname;
+    long i, stri;
+    if (index)
+        return PyInt_AS_LONG(index);
+    module = PyObject_GetAttrString(cls, "__module__");
+    if (!module) return -1;
+    name = PyObject_GetAttrString(cls, "__name__");
+    if (!name) {
+        Py_DECREF(module);
+        return -1;
+    }
+    if (!PyString_Check(module) || !PyString_Check(name)) {
+        PyErr_SetString(PyExc_TypeError, "Invalid class name");
+        Py_DECREF(module);
+        Py_DECREF(name);
+        return -1;
+    }
+    fullname = PyString_FromFormat("%s.%s", STR(module), STR(name));
+    Py_DECREF(module);
+    Py_DECREF(name);
+    if (!fullname) return -1;
+    stri = CacheFileWriter__addString(self, fullname);
+    Py_DECREF(fullname);
+    if (stri == -1) return -1;
+    i = self->counts[CF_CLASSES];
+    if (CFBuffer_append32(&self->sections[CF_CLASSES], stri) == -1)
+        return -1;
+    self->counts[CF_CLASSES] += 1;
+    index = PyInt_FromLong(i);
+    if (!index) return -1;
+    PyDict_SetItem(self->_classes, cls, index);
+    Py_DECREF(index);
+    return i;
+}
+
+static long
+CacheFileWriter__addRelation(CacheFileWriterObject *self, PyObject *rel,
+                             int kind)
+{
+    PyObject *key = PyLong_FromVoidPtr(rel);
+    PyObject *index, *initargs;
+    unsigned long argv[3] = {CF_NOINDEX, CF_NOINDEX, CF_NOINDEX};
+    unsigned char *p;
+    int argc, j, jlen;
+    long i, cls;
+    if (!key) return -1;
+    index = PyDict_GetItem(self->_relations, key);
+    if (index) {
+        Py_DECREF(key);
+        i = PyInt_AS_LONG(index);
+        self->sections[CF_RELATIONS].data[i*CF_RELATIONSIZE+3] |= kind;
+        return i;
+    }
+    initargs = PyObject_CallMethod(rel, "getInitArgs", NULL);
+    if (!initargs) goto error;
+    if (!PyTuple_Check(initargs) || PyTuple_GET_SIZE(initargs) < 1) {
+        PyErr_SetString(PyExc_TypeError, "Invalid getInitArgs() result");
+        goto error;
+    }
+    cls = CacheFileWriter__addClass(self, PyTuple_GET_ITEM(initargs, 0));
+    if (cls == -1) goto error;
+    jlen = PyTuple_GET_SIZE(initargs);
+    argc = jlen-1;
+    for (j = 1; j != jlen; j++) {
+        PyObject *arg = PyTuple_GET_ITEM(initargs, j);
+        if (arg != Py_None && !PyString_CheckExact(arg))
+            break;
+    }
+    if (j == jlen && argc <= 3) {
+        for (j = 1; j != jlen; j++) {
+            PyObject *arg = PyTuple_GET_ITEM(initargs, j);
+            if (arg != Py_None) {
+                long stri = CacheFileWriter__addString(self, arg);
+                if (stri == -1) goto error;
+                argv[j-1] = stri;
+            }
+        }
+    } else {
+        PyObject *args = PyTuple_GetSlice(initargs, 1, jlen);
+        long stri;
+        if (!args) goto error;
+        stri = CacheFileWriter__addPickled(self, args);
+        Py_DECREF(args);
+        if (stri == -1) goto error;
+        argc = CF_ARGSPICKLED;
+        argv[0] = stri;
+    }
+    Py_CLEAR(initargs);
+    i = self->counts[CF_RELATIONS];
+    p = CFBuffer_extend(&self->sections[CF_RELATIONS], CF_RELATIONSIZE);
+    if (!p) goto error;
+    cf_put16(p, cls);
+    p[2] = argc;
+    p[3] = kind;
+    cf_put32(p+4, argv[0]);
+    cf_put32(p+8, argv[1]);
+    cf_put32(p+12, argv[2]);
+    self->counts[CF_RELATIONS] += 1;
+    index = PyInt_FromLong(i);
+    if (!index) goto error;
+    PyDict_SetItem(self->_relations, key, index);
+    Py_DECREF(index);
+    Py_DECREF(key);
+    PyList_Append(self->_objects, rel);
+    return i;
+
+error:
+    Py_XDECREF(initargs);
+    Py_DECREF(key);
+    return -1;
+}
+
+static long
+CacheFileWriter__addPackage(CacheFileWriterObject *self, PyObject *pkg)
+{
+    PackageObject *pkgobj = (PackageObject *)pkg;
+    PyObject *key, *index, *lists[5];
+    PyObject *loader, *info;
+    unsigned char rec[CF_PACKAGESIZE];
+    unsigned long flags = 0;
+    long i, cls, name, version, priority, infostart;
+    Py_ssize_t pos;
+    int j, k, klen;
+
+    if (!PyObject_TypeCheck(pkg, &Package_Type)) {
+        PyErr_SetString(PyExc_TypeError, "Package instance expected");
+        return -1;
+    }
+    key = PyLong_FromVoidPtr(pkg);
+    if (!key) return -1;
+    index = PyDict_GetItem(self->_packages, key);
+    if (index) {
+        Py_DECREF(key);
+        return PyInt_AS_LONG(index);
+    }
+    i = self->counts[CF_PACKAGES];
+    self->counts[CF_PACKAGES] += 1;
+    if (!CFBuffer_extend(&self->sections[CF_PACKAGES], CF_PACKAGESIZE))
+        goto error;
+    index = PyInt_FromLong(i);
+    if (!index) goto error;
+    PyDict_SetItem(self->_packages, key, index);
+    Py_DECREF(index);
+    Py_CLEAR(key);
+    PyList_Append(self->_objects, pkg);
+
+    if (PyObject_IsTrue(pkgobj->installed))
+        flags |= CF_PKGINSTALLED;
+    if (PyObject_IsTrue(pkgobj->essential))
+        flags |= CF_PKGESSENTIAL;
+    cls = CacheFileWriter__addClass(self, (PyObject *)pkg->ob_type);
+    if (cls == -1) goto error;
+    if (!PyString_CheckExact(pkgobj->name) ||
+        !PyString_CheckExact(pkgobj->version)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "Package name or version is not string");
+        goto error;
+    }
+    name = CacheFileWriter__addString(self, pkgobj->name);
+    if (name == -1) goto error;
+    version = CacheFileWriter__addString(self, pkgobj->version);
+    if (version == -1) goto error;
+    priority = PyInt_AsLong(pkgobj->priority);
+    if (priority == -1 && PyErr_Occurred()) goto error;
+
+    lists[0] = pkgobj->provides;
+    lists[1] = pkgobj->requires;
+    lists[2] = pkgobj->recommends;
+    lists[3] = pkgobj->upgrades;
+    lists[4] = pkgobj->conflicts;
+    for (k = 0; k != 5; k++) {
+        PyObject *seq = lists[k];
+        if (PyList_CheckExact(seq))
+            flags |= CF_PKGLIST << k;
+        else if (!PyTuple_CheckExact(seq)) {
+            PyErr_SetString(PyExc_TypeError,
+                            "Package relations must be lists or tuples");
+            goto error;
+        }
+        klen = PySequence_Fast_GET_SIZE(seq);
+        cf_put32(rec+16+k*8, self->counts[CF_LINKS]);
+        cf_put32(rec+20+k*8, klen);
+        for (j = 0; j != klen; j++) {
+            long reli = CacheFileWriter__addRelation(self,
+                            PySequence_Fast_GET_ITEM(seq, j), 1 << k);
+            if (reli == -1) goto error;
+            if (CFBuffer_append32(&self->sections[CF_LINKS], reli) == -1)
+                goto error;
+            self->counts[CF_LINKS] += 1;
+        }
+    }
+
+    infostart = self->counts[CF_INFOS];
+    pos = 0;
+    while (PyDict_Next(pkgobj->loaders, &pos, &loader, &info)) {
+        PyObject *loaderindex = PyDict_GetItem(self->_loaders, loader);
+        PY_LONG_LONG value;
+        unsigned char *p;
+        int kind;
+        if (!loaderindex)
+            continue;
+        if (info == Py_None) {
+            kind = CF_INFONONE;
+            value = 0;
+        } else if (PyInt_CheckExact(info)) {
+            kind = CF_INFOINT;
+            value = PyInt_AS_LONG(info);
+        } else if (PyString_CheckExact(info)) {
+            kind = CF_INFOSTRING;
+            value = CacheFileWriter__addString(self, info);
+            if (value == -1) goto error;
+        } else {
+            kind = CF_INFOPICKLED;
+            value = CacheFileWriter__addPickled(self, info);
+            if (value == -1) goto error;
+        }
+        p = CFBuffer_extend(&self->sections[CF_INFOS], CF_INFOSIZE);
+        if (!p) goto error;
+        cf_put32(p, PyInt_AS_LONG(loaderindex));
+        cf_put32(p+4, kind);
+        cf_put64(p+8, value);
+        self->counts[CF_INFOS] += 1;
+    }
+
+    cf_put16(rec, cls);
+    cf_put16(rec+2, flags);
+    cf_put32(rec+4, name);
+    cf_put32(rec+8, version);
+    cf_put32(rec+12, (unsigned long)priority);
+    cf_put32(rec+56, infostart);
+    cf_put32(rec+60, self->counts[CF_INFOS]-infostart);
+    memcpy(self->sections[CF_PACKAGES].data+i*CF_PACKAGESIZE,
+           rec, CF_PACKAGESIZE);
+    return i;
+
+error:
+    Py_XDECREF(key);
+    return -1;
+}
+
+static PyObject *
+CacheFileWriter_addPackage(CacheFileWriterObject *self, PyObject *pkg)
+{
+    long i = CacheFileWriter__addPackage(self, pkg);
+    if (i == -1) return NULL;
+    return PyInt_FromLong(i);
+}
+
+static PyObject *
+CacheFileWriter_addPackageList(CacheFileWriterObject *self, PyObject *lst)
+{
+    unsigned char *p;
+    long i = self->counts[CF_LISTS];
+    int j, len;
+    if (!PyList_Check(lst)) {
+        PyErr_SetString(PyExc_TypeError, "List expected");
+        return NULL;
+    }
+    len = PyList_GET_SIZE(lst);
+    p = CFBuffer_extend(&self->sections[CF_LISTS], CF_LISTSIZE);
+    if (!p) return NULL;
+    cf_put32(p, self->counts[CF_PKGINDEX]);
+    cf_put32(p+4, len);
+    self->counts[CF_LISTS] += 1;
+    for (j = 0; j != len; j++) {
+        long pkgi = CacheFileWriter__addPackage(self,
+                                                PyList_GET_ITEM(lst, j));
+        if (pkgi == -1) return NULL;
+        if (CFBuffer_append32(&self->sections[CF_PKGINDEX], pkgi) == -1)
+            return NULL;
+        self->counts[CF_PKGINDEX] += 1;
+    }
+    return PyInt_FromLong(i);
+}
+
+static PyObject *
+CacheFileWriter_dump(CacheFileWriterObject *self, PyObject *blob)
+{
+    PyObject *ret;
+    unsigned char *p;
+    unsigned long offset;
+    size_t size;
+    int i;
+    if (!PyString_Check(blob)) {
+        PyErr_SetString(PyExc_TypeError, "String expected");
+        return NULL;
+    }
+    size = CF_HEADERSIZE+PyString_GET_SIZE(blob);
+    for (i = 0; i != CF_BLOB; i++)
+        size += self->sections[i].len;
+    ret = PyString_FromStringAndSize(NULL, size);
+    if (!ret) return NULL;
+    p = (unsigned char *)STR(ret);
+    memcpy(p, CF_MAGIC, CF_MAGICSIZE);
+    cf_put32(p+CF_MAGICSIZE, CF_VERSION);
+    cf_put32(p+CF_MAGICSIZE+4, 0);
+    offset = CF_HEADERSIZE;
+    for (i = 0; i != CF_SECTIONS; i++) {
+        unsigned char *data;
+        size_t len;
+        unsigned long count;
+        if (i == CF_BLOB) {
+            data = (unsigned char *)STR(blob);
+            len = count = PyString_GET_SIZE(blob);
+        } else {
+            data = self->sections[i].data;
+            len = self->sections[i].len;
+            count = self->counts[i];
+        }
+        cf_put32(p+CF_MAGICSIZE+8+i*8, offset);
+        cf_put32(p+CF_MAGICSIZE+12+i*8, count);
+        if (len)
+            memcpy(p+offset, data, len);
+        offset += len;
+    }
+    return ret;
+}
+
+static PyMethodDef CacheFileWriter_methods[] = {
+    {"addPackage", (PyCFunction)CacheFileWriter_addPackage, METH_O, NULL},
+    {"addPackageList", (PyCFunction)CacheFileWriter_addPackageList,
+     METH_O, NULL},
+    {"dump", (PyCFunction)CacheFileWriter_dump, METH_O, NULL},
+    {NULL, NULL}
+};
+
+statichere PyTypeObject CacheFileWriter_Type = {
+	PyObject_HEAD_INIT(NULL)
+	0,			/*ob_size*/
+	"smart.cache.CacheFileWriter",	/*tp_name*/
+	sizeof(CacheFileWriterObject), /*tp_basicsize*/
+	0,			/*tp_itemsize*/
+	(destructor)CacheFileWriter_dealloc, /*tp_dealloc*/
+	0,			/*tp_print*/
+	0,			/*tp_getattr*/
+	0,			/*tp_setattr*/
+	0,			/*tp_compare*/
+	0,			/*tp_repr*/
+	0,			/*tp_as_number*/
+	0,			/*tp_as_sequence*/
+	0,			/*tp_as_mapping*/
+	0,			/*tp_hash*/
+    0,                      /*tp_call*/
+    0,                      /*tp_str*/
+    PyObject_GenericGetAttr,/*tp_getattro*/
+    PyObject_GenericSetAttr,/*tp_setattro*/
+    0,                      /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,     /*tp_flags*/
+    0,                      /*tp_doc*/
+    0,                      /*tp_traverse*/
+    0,                      /*tp_clear*/
+    0,                      /*tp_richcompare*/
+    0,                      /*tp_weaklistoffset*/
+    0,                      /*tp_iter*/
+    0,                      /*tp_iternext*/
+    CacheFileWriter_methods, /*tp_methods*/
+    0,                      /*tp_members*/
+    0,                      /*tp_getset*/
+    0,                      /*tp_base*/
+    0,                      /*tp_dict*/
+    0,                      /*tp_descr_get*/
+    0,                      /*tp_descr_set*/
+    0,                      /*tp_dictoffset*/
+    (initproc)CacheFileWriter_init, /*tp_init*/
+    PyType_GenericAlloc,    /*tp_alloc*/
+    PyType_GenericNew,      /*tp_new*/
+    PyObject_Del,           /*tp_free*/
+    0,                      /*tp_is_gc*/
+};
+
+typedef struct {
+    PyObject_HEAD
+    PyObject *_buffer;
+    const unsigned char *data;
+    Py_ssize_t size;
+    unsigned long offsets[CF_SECTIONS];
+    unsigned long counts[CF_SECTIONS];
+    PyObject **strings;
+    PyObject **relations;
+    PyObject **packages;
+    char *filled;
+    PyObject *_classes;
+    PyObject *_loaders;
+} CacheFileReaderObject;
+
+static int
+CacheFileReader_init(CacheFileReaderObject *self, PyObject *args)
+{
+    PyObject *buffer;
+    const void *data;
+    Py_ssize_t size;
+    int i;
+    if (!PyArg_ParseTuple(args, "O", &buffer))
+        return -1;
+    if (PyObject_AsReadBuffer(buffer, &data, &size) == -1)
+        return -1;
+    Py_INCREF(buffer);
+    self->_buffer = buffer;
+    self->data = (const unsigned char *)data;
+    self->size = size;
+    if (size < CF_HEADERSIZE) {
+        cf_invalid();
+        return -1;
+    }
+    if (memcmp(self->data, CF_MAGIC, CF_MAGICSIZE) != 0 ||
+        cf_get32(self->data+CF_MAGICSIZE) != CF_VERSION) {
+        PyErr_SetString(StateVersionError, "");
+        return -1;
+    }
+    for (i = 0; i != CF_SECTIONS; i++) {
+        unsigned PY_LONG_LONG end;
+        self->offsets[i] = cf_get32(self->data+CF_MAGICSIZE+8+i*8);
+        self->counts[i] = cf_get32(self->data+CF_MAGICSIZE+12+i*8);
+        end = (unsigned PY_LONG_LONG)self->offsets[i] +
+              (unsigned PY_LONG_LONG)cf_itemsize[i] *
+              (self->counts[i]+(i == CF_STRINGS));
+        if (end > (unsigned PY_LONG_LONG)size) {
+            cf_invalid();
+            return -1;
+        }
+    }
+    self->strings = (PyObject **)calloc(self->counts[CF_STRINGS]+1,
+                                        sizeof(PyObject *));
+    self->relations = (PyObject **)calloc(self->counts[CF_RELATIONS]+1,
+                                          sizeof(PyObject *));
+    self->packages = (PyObject **)calloc(self->counts[CF_PACKAGES]+1,
+                                         sizeof(PyObject *));
+    self->filled = (char *)calloc(self->counts[CF_PACKAGES]+1, 1);
+    if (!self->strings || !self->relations ||
+        !self->packages || !self->filled) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    return 0;
+}
+
+static void
+CacheFileReader_dealloc(CacheFileReaderObject *self)
+{
+    unsigned long i;
+    if (self->strings) {
+        for (i = 0; i != self->counts[CF_STRINGS]; i++)
+            Py_XDECREF(self->strings[i]);
+        free(self->strings);
+    }
+    if (self->relations) {
+        for (i = 0; i != self->counts[CF_RELATIONS]; i++)
+            Py_XDECREF(self->relations[i]);
+        free(self->relations);
+    }
+    if (self->packages) {
+        for (i = 0; i != self->counts[CF_PACKAGES]; i++)
+            Py_XDECREF(self->packages[i]);
+        free(self->packages);
+    }
+    free(self->filled);
+    Py_XDECREF(self->_classes);
+    Py_XDECREF(self->_loaders);
+    Py_XDECREF(self->_buffer);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
+static const unsigned char *
+CacheFileReader__item(CacheFileReaderObject *self, int section,
+                      unsigned long index)
+{
+    if (index >= self->counts[section]) {
+        cf_invalid();
+        return NULL;
+    }
+    return self->data+self->offsets[section]+index*cf_itemsize[section];
+}
+
+static const unsigned char *
+CacheFileReader__range(CacheFileReaderObject *self, int section,
+                       unsigned long start, unsigned long count)
+{
+    if (start > self->counts[section] ||
+        count > self->counts[section]-start) {
+        cf_invalid();
+        return NULL;
+    }
+    return self->data+self->offsets[section]+start*cf_itemsize[section];
+}
+
+/* Returns a borrowed reference. */
+static PyObject *
+CacheFileReader__getString(CacheFileReaderObject *self, unsigned long index)
+{
+    const unsigned char *p;
+    unsigned long start, end;
+    if (index >= self->counts[CF_STRINGS]) {
+        cf_invalid();
+        return NULL;
+    }
+    if (self->strings[index])
+        return self->strings[index];
+    p = self->data+self->offsets[CF_STRINGS]+index*4;
+    start = cf_get32(p);
+    end = cf_get32(p+4);
+    if (start > end || end > self->counts[CF_STRDATA]) {
+        cf_invalid();
+        return NULL;
+    }
+    self->strings[index] = PyString_FromStringAndSize(
+        (const char *)self->data+self->offsets[CF_STRDATA]+start, end-start);
+    return self->strings[index];
+}
+
+/* Returns a borrowed reference. */
+static PyObject *
+CacheFileReader__getClass(CacheFileReaderObject *self, unsigned long index)
+{
+    if (!self->_classes) {
+        PyErr_SetString(PyExc_TypeError, "Classes not set");
+        return NULL;
+    }
+    if (index >= (unsigned long)PyList_GET_SIZE(self->_classes)) {
+        cf_invalid();
+        return NULL;
+    }
+    return PyList_GET_ITEM(self->_classes, index);
+}
+
+/* Returns a borrowed reference. */
+static PyObject *
+CacheFileReader__getRelation(CacheFileReaderObject *self,
+                             unsigned long index)
+{
+    const unsigned char *p;
+    PyObject *cls, *args, *rel;
+    int argc, i;
+    if (index >= self->counts[CF_RELATIONS]) {
+        cf_invalid();
+        return NULL;
+    }
+    if (self->relations[index])
+        return self->relations[index];
+    p = CacheFileReader__item(self, CF_RELATIONS, index);
+    cls = CacheFileReader__getClass(self, cf_get16(p));
+    if (!cls) return NULL;
+    argc = p[2];
+    if (argc == CF_ARGSPICKLED) {
+        PyObject *str = CacheFileReader__getString(self, cf_get32(p+4));
+        PyObject *obj;
+        if (!str) return NULL;
+        obj = cf_loads(str);
+        if (!obj) return NULL;
+        args = PySequence_Tuple(obj);
+        Py_DECREF(obj);
+        if (!args) return NULL;
+    } else if (argc > 3) {
+        return cf_invalid();
+    } else {
+        args = PyTuple_New(argc);
+        if (!args) return NULL;
+        for (i = 0; i != argc; i++) {
+            unsigned long stri = cf_get32(p+4+i*4);
+            PyObject *arg;
+            if (stri == CF_NOINDEX) {
+                arg = Py_None;
+            } else {
+                arg = CacheFileReader__getString(self, stri);
+                if (!arg) {
+                    Py_DECREF(args);
+                    return NULL;
+                }
+            }
+            Py_INCREF(arg);
+            PyTuple_SET_ITEM(args, i, arg);
+        }
+    }
+    rel = PyObject_CallObject(cls, args);
+    Py_DECREF(args);
+    if (!rel) return NULL;
+    self->relations[index] = rel;
+    return rel;
+}
+
+static int
+CacheFileReader__fillPackage(CacheFileReaderObject *self,
+                             unsigned long index, PyObject *pkg)
+{
+    const unsigned char *p, *q;
+    PyObject *lists[5] = {NULL, NULL, NULL, NULL, NULL};
+    PyObject *loaders = NULL, *state = NULL, *res;
+    PyObject *name, *version;
+    unsigned long flags, start, count, j;
+    int k;
+
+    p = CacheFileReader__item(self, CF_PACKAGES, index);
+    if (!p) return -1;
+    flags = cf_get16(p+2);
+    name = CacheFileReader__getString(self, cf_get32(p+4));
+    if (!name) return -1;
+    version = CacheFileReader__getString(self, cf_get32(p+8));
+    if (!version) return -1;
+
+    for (k = 0; k != 5; k++) {
+        start = cf_get32(p+16+k*8);
+        count = cf_get32(p+20+k*8);
+        q = CacheFileReader__range(self, CF_LINKS, start, count);
+        if (!q) goto error;
+        if (flags & (CF_PKGLIST << k))
+            lists[k] = PyList_New(count);
+        else
+            lists[k] = PyTuple_New(count);
+        if (!lists[k]) goto error;
+        for (j = 0; j != count; j++) {
+            PyObject *rel = CacheFileReader__getRelation(self,
+                                                         cf_get32(q+j*4));
+            if (!rel) goto error;
+            if (!PyObject_TypeCheck(rel, k == 0 ? &Provides_Type
+                                                : &Depends_Type)) {
+                PyErr_SetString(PyExc_TypeError,
+                                "Unexpected relation type");
+                goto error;
+            }
+            Py_INCREF(rel);
+            if (flags & (CF_PKGLIST << k))
+                PyList_SET_ITEM(lists[k], j, rel);
+            else
+                PyTuple_SET_ITEM(lists[k], j, rel);
+        }
+    }
+
+    loaders = PyDict_New();
+    if (!loaders) goto error;
+    start = cf_get32(p+56);
+    count = cf_get32(p+60);
+    q = CacheFileReader__range(self, CF_INFOS, start, count);
+    if (!q) goto error;
+    for (j = 0; j != count; j++, q += CF_INFOSIZE) {
+        unsigned long loaderi = cf_get32(q);
+        PY_LONG_LONG value = cf_get64(q+8);
+        PyObject *info;
+        if (loaderi >= (unsigned long)PyList_GET_SIZE(self->_loaders)) {
+            cf_invalid();
+            goto error;
+        }
+        switch (cf_get32(q+4)) {
+            case CF_INFONONE:
+                Py_INCREF(Py_None);
+                info = Py_None;
+                break;
+            case CF_INFOINT:
+                if (value >= LONG_MIN && value <= LONG_MAX)
+                    info = PyInt_FromLong((long)value);
+                else
+                    info = PyLong_FromLongLong(value);
+                break;
+            case CF_INFOSTRING:
+                info = CacheFileReader__getString(self,
+                                                  (unsigned long)value);
+                Py_XINCREF(info);
+                break;
+            case CF_INFOPICKLED:
+                info = CacheFileReader__getString(self,
+                                                  (unsigned long)value);
+                if (info)
+                    info = cf_loads(info);
+                break;
+            default:
+                info = cf_invalid();
+                break;
+        }
+        if (!info) goto error;
+        PyDict_SetItem(loaders, PyList_GET_ITEM(self->_loaders, loaderi),
+                       info);
+        Py_DECREF(info);
+    }
+
+    state = Py_BuildValue("(OOOOOOOOOlO)", name, version,
+                          lists[0], lists[1], lists[2], lists[3], lists[4],
+                          (flags & CF_PKGINSTALLED) ? Py_True : Py_False,
+                          (flags & CF_PKGESSENTIAL) ? Py_True : Py_False,
+                          (long)(int)cf_get32(p+12), loaders);
+    if (!state) goto error;
+    res = PyObject_CallMethod(pkg, "__setstate__", "(O)", state);
+    if (!res) goto error;
+    Py_DECREF(res);
+    self->filled[index] = 1;
+
+    /*
+       for lst in lists:
+           for rel in lst:
+               rel.packages.append(pkg)
+    */
+    for (k = 0; k != 5; k++) {
+        PyObject *seq = lists[k];
+        int len = PySequence_Fast_GET_SIZE(seq);
+        int m;
+        for (m = 0; m != len; m++) {
+            PyObject *rel = PySequence_Fast_GET_ITEM(seq, m);
+            if (k == 0)
+                PyList_Append(((ProvidesObject *)rel)->packages, pkg);
+            else
+                PyList_Append(((DependsObject *)rel)->packages, pkg);
+        }
+    }
+
+    for (k = 0; k != 5; k++)
+        Py_DECREF(lists[k]);
+    Py_DECREF(loaders);
+    Py_DECREF(state);
+    return 0;
+
+error:
+    for (k = 0; k != 5; k++)
+        Py_XDECREF(lists[k]);
+    Py_XDECREF(loaders);
+    Py_XDECREF(state);
+    return -1;
+}
+
+/* Returns a borrowed reference. */
+static PyObject *
+CacheFileReader__getPackage(CacheFileReaderObject *self,
+                            unsigned long index)
+{
+    PyObject *pkg;
+    if (index >= self->counts[CF_PACKAGES]) {
+        cf_invalid();
+        return NULL;
+    }
+    pkg = self->packages[index];
+    if (!pkg) {
+        const unsigned char *p;
+        PyObject *cls, *args;
+        p = CacheFileReader__item(self, CF_PACKAGES, index);
+        cls = CacheFileReader__getClass(self, cf_get16(p));
+        if (!cls) return NULL;
+        if (!PyType_Check(cls) ||
+            !PyType_IsSubtype((PyTypeObject *)cls, &Package_Type)) {
+            PyErr_SetString(PyExc_TypeError, "Package class expected");
+            return NULL;
+        }
+        args = PyTuple_New(0);
+        if (!args) return NULL;
+        pkg = ((PyTypeObject *)cls)->tp_new((PyTypeObject *)cls, args, NULL);
+        Py_DECREF(args);
+        if (!pkg) return NULL;
+        self->packages[index] = pkg;
+    }
+    if (!self->filled[index] && self->_loaders) {
+        if (CacheFileReader__fillPackage(self, index, pkg) == -1)
+            return NULL;
+    }
+    return pkg;
+}
+
+static PyObject *
+CacheFileReader_getClassNames(CacheFileReaderObject *self, PyObject *args)
+{
+    PyObject *ret = PyList_New(self->counts[CF_CLASSES]);
+    unsigned long i;
+    if (!ret) return NULL;
+    for (i = 0; i != self->counts[CF_CLASSES]; i++) {
+        const unsigned char *p = CacheFileReader__item(self, CF_CLASSES, i);
+        PyObject *name = CacheFileReader__getString(self, cf_get32(p));
+        if (!name) {
+            Py_DECREF(ret);
+            return NULL;
+        }
+        Py_INCREF(name);
+        PyList_SET_ITEM(ret, i, name);
+    }
+    return ret;
+}
+
+static PyObject *
+CacheFileReader_setClasses(CacheFileReaderObject *self, PyObject *classes)
+{
+    if (!PyList_Check(classes)) {
+        PyErr_SetString(PyExc_TypeError, "List expected");
+        return NULL;
+    }
+    Py_INCREF(classes);
+    Py_XDECREF(self->_classes);
+    self->_classes = classes;
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+CacheFileReader_setLoaders(CacheFileReaderObject *self, PyObject *loaders)
+{
+    if (!PyList_Check(loaders)) {
+        PyErr_SetString(PyExc_TypeError, "List expected");
+        return NULL;
+    }
+    Py_INCREF(loaders);
+    Py_XDECREF(self->_loaders);
+    self->_loaders = loaders;
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+CacheFileReader_getBlob(CacheFileReaderObject *self, PyObject *args)
+{
+    return PyString_FromStringAndSize(
+        (const char *)self->data+self->offsets[CF_BLOB],
+        self->counts[CF_BLOB]);
+}
+
+static PyObject *
+CacheFileReader_getRelation(CacheFileReaderObject *self, PyObject *args)
+{
+    PyObject *rel;
+    unsigned long index;
+    if (!PyArg_ParseTuple(args, "k", &index))
+        return NULL;
+    rel = CacheFileReader__getRelation(self, index);
+    Py_XINCREF(rel);
+    return rel;
+}
+
+static PyObject *
+CacheFileReader_getPackage(CacheFileReaderObject *self, PyObject *args)
+{
+    PyObject *pkg;
+    unsigned long index;
+    if (!PyArg_ParseTuple(args, "k", &index))
+        return NULL;
+    pkg = CacheFileReader__getPackage(self, index);
+    Py_XINCREF(pkg);
+    return pkg;
+}
+
+static PyObject *
+CacheFileReader_getPackageList(CacheFileReaderObject *self, PyObject *args)
+{
+    const unsigned char *p;
+    PyObject *ret;
+    unsigned long index, start, count, j;
+    if (!PyArg_ParseTuple(args, "k", &index))
+        return NULL;
+    p = CacheFileReader__item(self, CF_LISTS, index);
+    if (!p) return NULL;
+    start = cf_get32(p);
+    count = cf_get32(p+4);
+    p = CacheFileReader__range(self, CF_PKGINDEX, start, count);
+    if (!p) return NULL;
+    ret = PyList_New(count);
+    if (!ret) return NULL;
+    for (j = 0; j != count; j++) {
+        PyObject *pkg = CacheFileReader__getPackage(self, cf_get32(p+j*4));
+        if (!pkg) {
+            Py_DECREF(ret);
+            return NULL;
+        }
+        Py_INCREF(pkg);
+        PyList_SET_ITEM(ret, j, pkg);
+    }
+    return ret;
+}
+
+static PyObject *
+CacheFileReader_restoreCache(CacheFileReaderObject *self, PyObject *cache)
+{
+    CacheObject *cacheobj = (CacheObject *)cache;
+    PyObject *packages, *relations[5] = {NULL, NULL, NULL, NULL, NULL};
+    PyObject *objmap;
+    unsigned long i;
+    int k;
+    if (!PyObject_TypeCheck(cache, &Cache_Type)) {
+        PyErr_SetString(PyExc_TypeError, "Cache instance expected");
+        return NULL;
+    }
+    if (!self->_loaders) {
+        return cf_error("Loaders must be set before restoring the cache");
+    }
+    packages = PyList_New(self->counts[CF_PACKAGES]);
+    if (!packages) return NULL;
+    for (i = 0; i != self->counts[CF_PACKAGES]; i++) {
+        PyObject *pkg = CacheFileReader__getPackage(self, i);
+        if (!pkg) goto error;
+        Py_INCREF(pkg);
+        PyList_SET_ITEM(packages, i, pkg);
+    }
+    for (k = 0; k != 5; k++) {
+        relations[k] = PyList_New(0);
+        if (!relations[k]) goto error;
+    }
+    for (i = 0; i != self->counts[CF_RELATIONS]; i++) {
+        PyObject *rel = self->relations[i];
+        if (rel) {
+            const unsigned char *p =
+                CacheFileReader__item(self, CF_RELATIONS, i);
+            for (k = 0; k != 5; k++) {
+                if (p[3] & (1 << k))
+                    PyList_Append(relations[k], rel);
+            }
+        }
+    }
+    objmap = PyDict_New();
+    if (!objmap) goto error;
+
+    Py_INCREF(self->_loaders);
+    Py_XDECREF(cacheobj->_loaders);
+    cacheobj->_loaders = self->_loaders;
+    Py_XDECREF(cacheobj->_packages);
+    cacheobj->_packages = packages;
+    Py_XDECREF(cacheobj->_provides);
+    cacheobj->_provides = relations[0];
+    Py_XDECREF(cacheobj->_requires);
+    cacheobj->_requires = relations[1];
+    Py_XDECREF(cacheobj->_recommends);
+    cacheobj->_recommends = relations[2];
+    Py_XDECREF(cacheobj->_upgrades);
+    cacheobj->_upgrades = relations[3];
+    Py_XDECREF(cacheobj->_conflicts);
+    cacheobj->_conflicts = relations[4];
+    Py_XDECREF(cacheobj->_objmap);
+    cacheobj->_objmap = objmap;
+    PyDict_Clear(cacheobj->_nameindex);
+
+    Py_RETURN_NONE;
+
+error:
+    Py_DECREF(packages);
+    for (k = 0; k != 5; k++)
+        Py_XDECREF(relations[k]);
+    return NULL;
+}
+
+static PyMethodDef CacheFileReader_methods[] = {
+    {"getClassNames", (PyCFunction)CacheFileReader_getClassNames,
+     METH_NOARGS, NULL},
+    {"setClasses", (PyCFunction)CacheFileReader_setClasses, METH_O, NULL},
+    {"setLoaders", (PyCFunction)CacheFileReader_setLoaders, METH_O, NULL},
+    {"getBlob", (PyCFunction)CacheFileReader_getBlob, METH_NOARGS, NULL},
+    {"getRelation", (PyCFunction)CacheFileReader_getRelation,
+     METH_VARARGS, NULL},
+    {"getPackage", (PyCFunction)CacheFileReader_getPackage,
+     METH_VARARGS, NULL},
+    {"getPackageList", (PyCFunction)CacheFileReader_getPackageList,
+     METH_VARARGS, NULL},
+    {"restoreCache", (PyCFunction)CacheFileReader_restoreCache,
+     METH_O, NULL},
+    {NULL, NULL}
+};
+
+statichere PyTypeObject CacheFileReader_Type = {
+	PyObject_HEAD_INIT(NULL)
+	0,			/*ob_size*/
+	"smart.cache.CacheFileReader",	/*tp_name*/
+	sizeof(CacheFileReaderObject), /*tp_basicsize*/
+	0,			/*tp_itemsize*/
+	(destructor)CacheFileReader_dealloc, /*tp_dealloc*/
+	0,			/*tp_print*/
+	0,			/*tp_getattr*/
+	0,			/*tp_setattr*/
+	0,			/*tp_compare*/
+	0,			/*tp_repr*/
+	0,			/*tp_as_number*/
+	0,			/*tp_as_sequence*/
+	0,			/*tp_as_mapping*/
+	0,			/*tp_hash*/
+    0,                      /*tp_call*/
+    0,                      /*tp_str*/
+    PyObject_GenericGetAttr,/*tp_getattro*/
+    PyObject_GenericSetAttr,/*tp_setattro*/
+    0,                      /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT,     /*tp_flags*/
+    0,                      /*tp_doc*/
+    0,                      /*tp_traverse*/
+    0,                      /*tp_clear*/
+    0,                      /*tp_richcompare*/
+    0,                      /*tp_weaklistoffset*/
+    0,                      /*tp_iter*/
+    0,                      /*tp_iternext*/
+    CacheFileReader_methods, /*tp_methods*/
+    0,                      /*tp_members*/
+    0,                      /*tp_getset*/
+    0,                      /*tp_base*/
+    0,                      /*tp_dict*/
+    0,                      /*tp_descr_get*/
+    0,                      /*tp_descr_set*/
+    0,                      /*tp_dictoffset*/
+    (initproc)CacheFileReader_init, /*tp_init*/
+    PyType_GenericAlloc,    /*tp_alloc*/
+    PyType_GenericNew,      /*tp_new*/
+    PyObject_Del,           /*tp_free*/
+    0,                      /*tp_is_gc*/
+};
+
+static PyMethodDef ccache_methods[] = {
+    {NULL, NULL}
+};
+
+DL_EXPORT(void)
+initccache(void)
+{
+    PyObject *m, *o;
+    Package_Type.ob_type = &PyType_Type;
+    Provides_Type.ob_type = &PyType_Type;
+    Depends_Type.ob_type = &PyType_Type;
+    Loader_Type.ob_type = &PyType_Type;
+    Cache_Type.ob_type = &PyType_Type;
+    CacheFileWriter_Type.ob_type = &PyType_Type;
+    CacheFileReader_Type.ob_type = &PyType_Type;
+
+    PyType_Ready(&Loader_Type);
+    o = PyInt_FromLong(Loader__stateversion__);
     PyDict_SetItemString(Loader_Type.tp_dict, "__stateversion__", o);
     Py_DECREF(o);
     PyType_Ready(&Cache_Type);
@@ -3982,6 +5120,13 @@ initccache(void)
     PyDict_SetItemString(Cache_Type.tp_dict, "__stateversion__", o);
     Py_DECREF(o);
 
+    PyType_Ready(&CacheFileWriter_Type);
+    PyType_Ready(&CacheFileReader_Type);
+
+    PyType_Ready(&Depends_Type);
+    PyDict_SetItemString(Depends_Type.tp_dict, "matchcmp", Py_None);
+    PyDict_SetItemString(Depends_Type.tp_dict, "matchsortable", Py_None);
+
     PyType_Ready(&PreRequires_Type);
     PyType_Ready(&Requires_Type);
     PyType_Ready(&Upgrades_Type);
@@ -4005,6 +5150,8 @@ initccache(void)
     REGISTER_TYPE(Conflicts);
     REGISTER_TYPE(Loader);
     REGISTER_TYPE(Cache);
+    REGISTER_TYPE(CacheFileWriter);
+    REGISTER_TYPE(CacheFileReader);
 
     StateVersionError = PyErr_NewException("ccache.StateVersionError",
                                            NULL, NULL);
@@ -25,6 +25,8 @@ import os
 
 from smart.backends.deb.loader import DebTagFileLoader
 from smart.util.filetools import getFileDigest
+from smart.util.edpatch import applyEdPatch
+from smart.fetcher import DigestSet, getFileDigest as getHexFileDigest
 from smart.backends.deb.base import getArchitecture
 from smart.channel import PackageChannel
 from smart.const import SUCCEEDED, NEVER
@@ -193,6 +195,168 @@ class APTDEBChannel(PackageChannel):
                     checksum[path]["size"] = int(size)
         return checksum
 
+    def _parseDiffIndex(self, path):
+        fields = {}
+        values = None
+        for line in open(path):
+            if line[:1] in (" ", "\t"):
+                if values is not None:
+                    values.append(line.split())
+            elif ":" in line:
+                field, value = line.split(":", 1)
+                values = fields[field.strip()] = []
+                if value.strip():
+                    values.append(value.split())
+        return fields
+
+    def _getPatchInfo(self, fetcher, index, localpath, size, downloadsize):
+        """
+        Return a list of (name, info) pairs for the patches which bring
+        localpath up to date, in the order they must be applied, or
+        None if localpath can't be patched, or if it's cheaper to
+        download the whole file again.
+        """
+        for prefix, kind in (("SHA256", "sha256"), ("SHA1", "sha")):
+            current = index.get(prefix+"-Current")
+            history = index.get(prefix+"-History")
+            patches = index.get(prefix+"-Patches")
+            if current and history and patches:
+                break
+        else:
+            return None
+        digest = fetcher.getFileMetadata(localpath).get("digests", {})
+        digest = digest.get(kind) or getHexFileDigest(localpath, kind)
+        if digest == current[0][0]:
+            return []
+        for i in range(len(history)):
+            if history[i][0] == digest:
+                break
+        else:
+            return None
+        if index.get("X-Patch-Precedence") == [["merged"]]:
+            # Each patch brings its history entry up to date at once.
+            names = [history[i][2]]
+        else:
+            names = [entry[2] for entry in history[i:]]
+        patches = dict([(entry[2], entry) for entry in patches])
+        downloads = dict([(entry[2], entry) for entry in
+                          index.get(prefix+"-Download", ())])
+        result = []
+        total = 0
+        downloadtotal = 0
+        for name in names:
+            if name not in patches:
+                return None
+            info = {"uncomp": True,
+                    "uncomp_"+kind: patches[name][0],
+                    "uncomp_size": int(patches[name][1])}
+            download = downloads.get(name+".gz")
+            if download:
+                info[kind] = download[0]
+                info["size"] = int(download[1])
+                downloadtotal += info["size"]
+            else:
+                downloadtotal = None
+            total += info["uncomp_size"]
+            result.append((name, info))
+        if downloadtotal is not None:
+            if downloadtotal >= downloadsize:
+                return None
+        elif total >= size:
+            return None
+        return result
+
+    def _applyPatches(self, fetcher, localpath, patchpaths, checksum):
+        lines = open(localpath).readlines()
+        for path in patchpaths:
+            applyEdPatch(lines, open(path))
+        kinds = [kind for kind, key in (("md5", "md5"), ("sha", "sha1"),
+                                        ("sha256", "sha256"))
+                 if checksum.get(key)]
+        digests = DigestSet(kinds)
+        file = open(localpath+".new", "w")
+        try:
+            for line in lines:
+                file.write(line)
+                digests.update(line)
+        finally:
+            file.close()
+        hexdigests = digests.getHexDigests()
+        if (digests.size != checksum["size"] or
+            [kind for kind, key in (("md5", "md5"), ("sha", "sha1"),
+                                    ("sha256", "sha256"))
+             if kind in hexdigests and hexdigests[kind] != checksum[key]]):
+            os.unlink(localpath+".new")
+            raise Error, _("Patched file doesn't match Release file")
+        os.rename(localpath+".new", localpath)
+        fetcher.setFileMetadata(localpath, digests=hexdigests)
+
+    def _fetchPatches(self, fetcher, progress, checksum):
+        """
+        Bring the Packages files kept from the last fetch up to date
+        with the Packages.diff patches of the mirror, and return a
+        dictionary mapping the components updated to their files.
+        """
+        fetcher.reset()
+        indexes = {}
+        for component in self._comps or [None]:
+            subpath = self._getURL("Packages", component, subpath=True)
+            indexpath = subpath+".diff/Index"
+            localpath = fetcher.getLocalPath(self._getURL("Packages",
+                                                          component))
+            if (subpath in checksum and indexpath in checksum and
+                os.path.isfile(localpath)):
+                info = checksum[indexpath]
+                url = self._getURL("Packages.diff/Index", component)
+                item = fetcher.enqueue(url, md5=info.get("md5"),
+                                       sha=info.get("sha1"),
+                                       sha256=info.get("sha256"),
+                                       size=info["size"])
+                indexes[component] = (item, localpath)
+        if not indexes:
+            return {}
+        progress.addTotal(len(indexes))
+        fetcher.run(progress=progress)
+
+        fetcher.reset()
+        patched = {}
+        patches = {}
+        for component, (item, localpath) in indexes.items():
+            if item.getStatus() != SUCCEEDED:
+                continue
+            subpath = self._getURL("Packages", component, subpath=True)
+            size = checksum[subpath]["size"]
+            downloadsize = min([checksum[subpath+ext]["size"]
+                                for ext in ("", ".gz", ".bz2", ".lzma")
+                                if subpath+ext in checksum])
+            index = self._parseDiffIndex(item.getTargetPath())
+            patchinfo = self._getPatchInfo(fetcher, index, localpath,
+                                           size, downloadsize)
+            if patchinfo is None:
+                continue
+            items = []
+            for name, info in patchinfo:
+                url = self._getURL("Packages.diff/%s.gz" % name, component)
+                items.append(fetcher.enqueue(url, **info))
+            patches[component] = (localpath, items)
+        if patches:
+            progress.addTotal(sum([len(x[1]) for x in patches.values()]))
+            fetcher.run(progress=progress)
+
+        for component, (localpath, items) in patches.items():
+            if [x for x in items if x.getStatus() != SUCCEEDED]:
+                continue
+            subpath = self._getURL("Packages", component, subpath=True)
+            try:
+                self._applyPatches(fetcher, localpath,
+                                   [x.getTargetPath() for x in items],
+                                   checksum[subpath])
+            except (Error, IOError, OSError), e:
+                iface.debug(_("Failed patching %s: %s") % (localpath, e))
+                continue
+            patched[component] = localpath
+        return patched
+
     def _enqueuePackages(self, fetcher, checksum=None, component=None):
         info = {}
         url = self._getURL("Packages", component)
@@ -264,13 +428,26 @@ class APTDEBChannel(PackageChannel):
             digest = None
             checksum = None
 
+        # Patch the files we already have when possible, and fetch the
+        # other ones in full.
+        if checksum is not None and sysconf.get("apt-deb-pdiff", True):
+            patched = self._fetchPatches(fetcher, progress, checksum)
+        else:
+            patched = {}
+
         fetcher.reset()
 
         if not self._comps:
-            packages_items = [self._enqueuePackages(fetcher, checksum)]
+            if None in patched:
+                packages_items = [patched[None]]
+            else:
+                packages_items = [self._enqueuePackages(fetcher, checksum)]
         else:
             packages_items = []
             for component in self._comps:
+                if component in patched:
+                    packages_items.append(patched[component])
+                    continue
                 item = self._enqueuePackages(fetcher, checksum, component)
                 if item:
                     packages_items.append(item)
@@ -282,14 +459,20 @@ class APTDEBChannel(PackageChannel):
 
         errorlines = []
         for item in packages_items:
-            if item.getStatus() == SUCCEEDED:
+            if type(item) is str:
+                # Patched by _fetchPatches().
+                progress.add(1)
+                progress.show()
+                localpath = item
+            elif item.getStatus() == SUCCEEDED:
                 localpath = item.getTargetPath()
-                loader = DebTagFileLoader(localpath, self._baseurl)
-                loader.setChannel(self)
-                self._loaders.append(loader)
             else:
                 errorlines.append(u"%s: %s" % (item.getURL(),
                                                item.getFailedReason()))
+                continue
+            loader = DebTagFileLoader(localpath, self._baseurl)
+            loader.setChannel(self)
+            self._loaders.append(loader)
 
         if errorlines:
             if fetcher.getCaching() is NEVER:
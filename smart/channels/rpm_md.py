@@ -19,7 +19,8 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
-from smart.backends.rpm.metadata import RPMMetaDataLoader
+from smart.backends.rpm.metadata import RPMMetaDataLoader, RPMMetaDataDBLoader
+from smart.backends.rpm.metadata import updateFileListsIndex
 from smart.backends.rpm.updateinfo import RPMUpdateInfo
 from smart.util.filetools import getFileDigest
 
@@ -31,6 +32,11 @@ except ImportError:
     except ImportError:
         from smart.util.elementtree import ElementTree
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 from smart.const import SUCCEEDED, FAILED, NEVER, ALWAYS
 from smart.channel import PackageChannel, MirrorsChannel
 from smart import *
@@ -166,6 +172,20 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
         item = FetchItem(fetcher, url, mirror)
         return fetcher.getLocalPath(item)
 
+    def indexFileLists(self, loader, filelists, filelistspath):
+        # Index the filelists once per digest, so that file provides
+        # may be found without parsing them on every cache rebuild.
+        for type in ["uncomp_sha256", "uncomp_sha", "uncomp_md5",
+                     "sha256", "sha", "md5"]:
+            digest = filelists.get(type)
+            if digest:
+                break
+        else:
+            digest = getFileDigest(filelistspath)
+        indexpath = filelistspath+".idx"
+        if updateFileListsIndex(filelistspath, indexpath, digest):
+            loader.setFileIndex(indexpath, digest)
+
     def fetch(self, fetcher, progress):
         
         fetcher.reset()
@@ -247,18 +267,26 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
 
         info = self.loadMetadata(item.getTargetPath())
 
-        if "primary" not in info and "primary_lzma" not in info:
+        usedb = ("primary_db" in info and "filelists_db" in info and
+                 sqlite3 is not None and sysconf.get("rpm-md-sqlite", True))
+
+        if ("primary" not in info and "primary_lzma" not in info and
+            not usedb):
             raise Error, _("Primary information not found in repository "
                            "metadata for '%s'") % self
 
-        if "primary_lzma" in info:
-            primary = info["primary_lzma"]
-        else:
-            primary = info["primary"]
-        if "filelists_lzma" in info:
-            filelists = info["filelists_lzma"]
+        if usedb:
+            primary = info["primary_db"]
+            filelists = info["filelists_db"]
         else:
-            filelists = info["filelists"]
+            if "primary_lzma" in info:
+                primary = info["primary_lzma"]
+            else:
+                primary = info["primary"]
+            if "filelists_lzma" in info:
+                filelists = info["filelists_lzma"]
+            else:
+                filelists = info["filelists"]
 
         fetcher.reset()
         item = fetcher.enqueue(primary["url"],
@@ -289,8 +317,13 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
         if item.getStatus() == SUCCEEDED and flitem.getStatus() == SUCCEEDED:
             localpath = item.getTargetPath()
             filelistspath = flitem.getTargetPath()
-            loader = RPMMetaDataLoader(localpath, filelistspath,
-                                       self._baseurl)
+            if usedb:
+                loadercls = RPMMetaDataDBLoader
+            else:
+                loadercls = RPMMetaDataLoader
+            loader = loadercls(localpath, filelistspath, self._baseurl)
+            if not usedb:
+                self.indexFileLists(loader, filelists, filelistspath)
             loader.setChannel(self)
             self._loaders.append(loader)
             if "updateinfo" in info:
@@ -327,10 +360,11 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
 
         # delete any old files, if the new ones have new names
         for type in ["primary", "filelists", "other", 
-                     "primary_lzma", "filelists_lzma", "other_lzma"]:
+                     "primary_lzma", "filelists_lzma", "other_lzma",
+                     "primary_db", "filelists_db", "other_db"]:
             if type in oldinfo:
                 url = oldinfo[type]["url"]
-                if url and info[type]["url"] != oldinfo[type]["url"]:
+                if url and info.get(type, {}).get("url") != url:
                     path = self.getLocalPath(fetcher, url)
                     if os.path.exists(path):
                        os.unlink(path)
@@ -338,6 +372,8 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
                     path = handler.getTargetPath(path)
                     if os.path.exists(path):
                        os.unlink(path)
+                    if os.path.exists(path+".idx"):
+                       os.unlink(path+".idx")
 
         self._digest = digest
 
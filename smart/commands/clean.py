@@ -29,7 +29,9 @@ USAGE=_("smart clean [options]")
 DESCRIPTION=_("""
 This command cleans the package cache. You can use it to
 delete old unused files that were left behind because of
-an incomplete transaction.
+an incomplete transaction. When the package store is
+enabled, the least recently used packages in it are also
+removed until it fits in package-store-size.
 """)
 
 def option_parser():
@@ -78,4 +80,7 @@ def main(ctrl, opts):
                 iface.error(_("Can't remove cached package %s: %s") \
                             % (cached_pkg, str(e)))
 
+    for path in ctrl.evictPackageStore():
+        iface.debug(_("Removed %s") % path)
+
 # vim:ts=4:sw=4:et
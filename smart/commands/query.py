@@ -203,17 +203,8 @@ def main(ctrl, opts, reloadchannels=True):
                 dupes.append(pkg)
         packages = dupes
     if opts.leaves:
-        leaves = []
-        for pkg in packages:
-            leaf = True
-            for prv in pkg.provides:
-                for req in prv.requiredby:
-                    for reqpkg in req.packages:
-                        if reqpkg.installed:
-                            leaf = False
-            if leaf:
-                leaves.append(pkg)
-        packages = leaves
+        reachability = ctrl.getReachability()
+        packages = [pkg for pkg in packages if reachability.isLeaf(pkg)]
     if opts.orphans:
         orphans = []
         for pkg in packages:
@@ -341,6 +332,7 @@ def main(ctrl, opts, reloadchannels=True):
     hasflag = []
     for token in opts.flag:
         hasflag.append(token)
+    flagmatchers = [pkgconf.getFlagMatcher(x) for x in hasflag]
     hassummary = []
     for token in opts.summary:
         hassummary.append(sh2re(token))
@@ -387,12 +379,12 @@ def main(ctrl, opts, reloadchannels=True):
                             if pattern.match(url):
                                 newpackages[pkg] = True
             if hasflag and not (hasname or needsinfo):
-                for flag in hasflag:
-                    if pkgconf.testFlag(flag, pkg):
+                for matcher in flagmatchers:
+                    if matcher.matches(pkg):
                         newpackages[pkg] = True
             elif hasflag and pkg in newpackages:
-                for flag in hasflag:
-                    if not pkgconf.testFlag(flag, pkg):
+                for matcher in flagmatchers:
+                    if not matcher.matches(pkg):
                         del newpackages[pkg]
                         break
         
@@ -410,8 +402,8 @@ def main(ctrl, opts, reloadchannels=True):
     if hasflag:
         newpackages = {}
         for pkg in packages:
-            for flag in hasflag:
-                if pkgconf.testFlag(flag, pkg):
+            for matcher in flagmatchers:
+                if matcher.matches(pkg):
                     newpackages[pkg] = True
         packages = newpackages.keys()
 
@@ -19,12 +19,12 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
-import cPickle
 import sys, os
 import copy
 import time
 import tempfile
 import tarfile
+import threading
 
 from smart.transaction import ChangeSet, ChangeSetSplitter, INSTALL, REMOVE
 from smart.util.filetools import compareFiles, setCloseOnExecAll
@@ -32,7 +32,11 @@ from smart.util.objdigest import getObjectDigest
 from smart.util.pathlocks import PathLocks
 from smart.util.strtools import strToBool
 from smart.util.metalink import Metalink, Metafile
-from smart.searcher import Searcher
+from smart.util.workerpool import WorkerPool
+from smart.util.filemeta import METAFILE
+from smart.util.contentstore import ContentStore
+from smart.searcher import Searcher, updateSearchIndex
+from smart.reachability import Reachability
 from smart.media import MediaSet
 from smart.progress import Progress
 from smart.fetcher import Fetcher
@@ -46,6 +50,11 @@ from smart import *
 if sys.version_info < (2, 4):
     from sets import Set as set
 
+CHANNELFETCHWORKERS = 4
+
+# Default bound for the package store, in megabytes.
+PACKAGESTORESIZE = 1024
+
 
 class Control(object):
 
@@ -56,6 +65,7 @@ class Control(object):
         self._dynamicchannels = {} # alias -> Channel()
         self._pathlocks = PathLocks(forcelocks)
         self._cache = Cache()
+        self._reachability = None
 
         self.loadSysConf(confpath)
 
@@ -154,10 +164,26 @@ class Control(object):
     def getMediaSet(self):
         return self._mediaset
 
+    def getPackageStore(self):
+        """Return the ContentStore for packages, if it's enabled."""
+        if not sysconf.get("package-store", False):
+            return None
+        return ContentStore(os.path.join(sysconf.get("data-dir"),
+                                         "package-store/"))
+
+    def evictPackageStore(self, store=None):
+        """Trim the package store down to its size bound."""
+        if store is None:
+            store = self.getPackageStore()
+        if store is None:
+            return []
+        maxsize = sysconf.get("package-store-size", PACKAGESTORESIZE)
+        return store.evict(maxsize*1024*1024)
+
     def restoreMediaState(self):
         self._mediaset.restoreState()
 
-    __stateversion__ = 2
+    __stateversion__ = 3
 
     def loadSysConf(self, confpath=None):
         datadir = sysconf.get("data-dir")
@@ -202,10 +228,9 @@ class Control(object):
                     iface.showStatus(_("Saving cache..."))
                     cachefile = open(cachepath+".new", "w")
                     state = (self.__stateversion__,
-                             self._cache,
                              self._channels,
                              self._sysconfchannels)
-                    cPickle.dump(state, cachefile, 2)
+                    dumpCacheFile(cachefile, self._cache, state)
                     cachefile.close()
                     os.rename(cachepath+".new", cachepath)
                     iface.hideStatus()
@@ -220,6 +245,105 @@ class Control(object):
 
         sysconf.save(confpath)
 
+    def _fetchChannel(self, fetcher, channel, progress, manual, caching):
+        if not manual and channel.hasManualUpdate():
+            fetcher.setCaching(ALWAYS)
+        else:
+            fetcher.setCaching(caching)
+        fetcher.setForceCopy(channel.isRemovable())
+        fetcher.setLocalPathPrefix(channel.getAlias()+"%%")
+        try:
+            return channel.fetch(fetcher, progress), None
+        except Error, e:
+            return False, unicode(e)
+
+    def _fetchChannels(self, channels, progress, manual, caching, workers):
+        """
+        Fetch the given channels concurrently, and return the result
+        of _fetchChannel() for each of them, in the same order.
+        """
+        cond = threading.Condition()
+        results = [None]*len(channels)
+        fetching = []
+        excinfo = []
+        topic = []
+        messages = []
+        chanprogress = ChannelProgress(progress)
+        chaniface = ChannelInterface(iface.object, cond, messages)
+
+        # Interfaces may only be used from the main thread, so the
+        # workers queue their topics and messages, and they're shown
+        # from here while waiting.
+        def showTopic():
+            names = ["'%s'" % (x.getName() or x.getAlias())
+                     for x in fetching if x.getFetchSteps() > 0]
+            if names:
+                topic[:] = [_("Fetching information for %s...") %
+                            ", ".join(names)]
+
+        def showQueued():
+            while messages:
+                name, args = messages.pop(0)
+                getattr(iface, name)(*args)
+            if topic:
+                progress.setTopic(topic.pop())
+            progress.show()
+
+        def fetch(i, channel, fetcher):
+            # Channels still waiting for a worker are skipped once
+            # cancelled. The running ones report the cancellation.
+            if fetcher.wasCancelled():
+                cond.acquire()
+                results[i] = False, None
+                cond.notify()
+                cond.release()
+                return
+            cond.acquire()
+            fetching.append(channel)
+            showTopic()
+            cond.notify()
+            cond.release()
+            try:
+                try:
+                    result = self._fetchChannel(fetcher, channel,
+                                                chanprogress,
+                                                manual, caching)
+                except:
+                    excinfo.append(sys.exc_info())
+                    result = False, None
+            finally:
+                cond.acquire()
+                fetching.remove(channel)
+                showTopic()
+                results[i] = result
+                cond.notify()
+                cond.release()
+
+        pool = WorkerPool(workers)
+        iface.object = chaniface
+        cond.acquire()
+        try:
+            try:
+                for i, channel in enumerate(channels):
+                    fetcher = self._fetcher.fork()
+                    fetcher.setSubProgress(chanprogress)
+                    pool.submit(fetch, i, channel, fetcher)
+                # Wait with a timeout, so that we may still be interrupted.
+                while None in results:
+                    cond.wait(0.5)
+                    showQueued()
+            except:
+                self._fetcher.cancel()
+                raise
+        finally:
+            cond.release()
+            pool.stop()
+            iface.object = chaniface.getInterface()
+            showQueued()
+        if excinfo:
+            raise excinfo[0][0], excinfo[0][1], excinfo[0][2]
+        return results
+
     def reloadMirrors(self):
         mirrors = sysconf.get("mirrors", {})
         for channel in self._channels.values():
@@ -254,7 +378,7 @@ class Control(object):
                 iface.showStatus(_("Loading cache..."))
                 cachefile = open(cachepath)
                 try:
-                    state = cPickle.load(cachefile)
+                    cache, state = loadCacheFile(cachefile)
                     if state[0] != self.__stateversion__:
                         raise StateVersionError
                 except:
@@ -264,8 +388,8 @@ class Control(object):
                     if os.access(os.path.dirname(cachepath), os.W_OK):
                         os.unlink(cachepath)
                 else:
+                    self._cache = cache
                     (__stateversion__,
-                     self._cache,
                      self._channels,
                      self._sysconfchannels) = state
                     for alias in self._channels.keys():
@@ -370,28 +494,36 @@ class Control(object):
 
         self._cache.reset()
 
-        # Do the real work.
+        # Do the real work. Channels on removable media may ask for
+        # the media to be inserted, so they're fetched one at a time.
+        # The others are fetched together, each in its own fork of
+        # the fetcher.
         result = True
+        digests = [channel.getDigest() for channel in channels]
+        together = [x for x in channels if not x.isRemovable()]
+        workers = sysconf.get("channel-fetch-workers", CHANNELFETCHWORKERS)
+        if workers > 1 and len(together) > 1:
+            fetched = self._fetchChannels(together, progress,
+                                          manual, caching, workers)
+        else:
+            together = []
         for channel in channels:
-            digest = channel.getDigest()
-            if not manual and channel.hasManualUpdate():
-                self._fetcher.setCaching(ALWAYS)
+            if channel in together:
+                ok, error = fetched[together.index(channel)]
             else:
-                self._fetcher.setCaching(caching)
-                if channel.getFetchSteps() > 0:
+                if (channel.getFetchSteps() > 0 and
+                    (manual or not channel.hasManualUpdate())):
                     progress.setTopic(_("Fetching information for '%s'...") %
                                   (channel.getName() or channel.getAlias()))
                     progress.show()
-            self._fetcher.setForceCopy(channel.isRemovable())
-            self._fetcher.setLocalPathPrefix(channel.getAlias()+"%%")
-            try:
-                if not channel.fetch(self._fetcher, progress):
-                    iface.debug(_("Failed fetching channel '%s'") % channel)
-                    result = False
-            except Error, e:
-                iface.error(unicode(e))
+                ok, error = self._fetchChannel(self._fetcher, channel,
+                                               progress, manual, caching)
+            if error:
+                iface.error(error)
+            if not ok:
                 iface.debug(_("Failed fetching channel '%s'") % channel)
                 result = False
+        for channel, digest in zip(channels, digests):
             if (channel.getDigest() != digest and
                 isinstance(channel, PackageChannel)):
                 channel.addLoaders(self._cache)
@@ -411,13 +543,23 @@ class Control(object):
         # Build cache with the new information.
         self._cache.load()
 
+        # Index the package texts of channels which changed, so that
+        # searching doesn't have to read them all.
+        for loader in self._cache.getLoaders():
+            updateSearchIndex(loader)
+
         # Compare new packages with what we had available, and mark
         # new packages.
         if caching is not ALWAYS:
-            pkgconf.clearFlag("new")
+            targets = {}
             for pkg in self._cache.getPackages():
                 if (pkg.name, pkg.version) not in oldpkgs:
-                    pkgconf.setFlag("new", pkg.name, "=", pkg.version)
+                    lst = targets.setdefault(pkg.name, [])
+                    if ("=", pkg.version) not in lst:
+                        lst.append(("=", pkg.version))
+            pkgconf.clearFlag("new")
+            if targets:
+                pkgconf.setFlagTargets("new", targets)
 
         # Remove unused files from channels directory.
         for dir in (channelsdir, userchannelsdir):
@@ -425,6 +567,8 @@ class Control(object):
                 aliases = self._channels.copy()
                 aliases.update(dict.fromkeys(sysconf.get("channels", ())))
                 for entry in os.listdir(dir):
+                    if entry == METAFILE:
+                        continue
                     sep = entry.find("%%")
                     if sep == -1 or entry[:sep] not in aliases:
                         os.unlink(os.path.join(dir, entry))
@@ -433,33 +577,18 @@ class Control(object):
         self._pathlocks.lock(channelsdir)
         return result
 
+    def getReachability(self):
+        reachability = self._reachability
+        if reachability is None or not reachability.isCurrent(self._cache):
+            reachability = self._reachability = Reachability(self._cache)
+        return reachability
+
     def markAndSweep(self, changeset=None):
-        if changeset==None:
-            changeset={}
-        # Mark ...
-        all = self._cache.getPackages()
-        auto = pkgconf.filterByFlag("auto", all)
-        marked = {}
-        for pkg in all:
-            if (pkg.installed and pkg not in auto and
-                changeset.get(pkg) != REMOVE):
-                marked[pkg] = True
-        queue = marked.keys()
-        while queue:
-            pkg = queue.pop(0)
-            for req in pkg.requires + pkg.recommends:
-                for prv in req.providedby:
-                    for prvpkg in prv.packages:
-                        if (prvpkg.installed and
-                            prvpkg not in marked and
-                            prvpkg not in changeset):
-                            marked[prvpkg] = True
-                            queue.append(prvpkg)
-        # see what is not marked
+        # Mark what the packages which weren't installed automatically
+        # need, and sweep the rest.
         suggestions = ChangeSet(self._cache)
-        for pkg in all:
-            if pkg.installed and pkg not in marked:
-                suggestions[pkg] = REMOVE
+        for pkg in self.getReachability().sweep(changeset):
+            suggestions[pkg] = REMOVE
         # FIXME: we should probably check here is those suggestions
         #        would break the relations in the cache and bail out
         #        if that happens 
@@ -684,6 +813,9 @@ class Control(object):
         if sysconf.get("commit-stepped", False):
             return self.commitChangeSetStepped(changeset, caching, confirm)
 
+        if sysconf.get("commit-pipelined", False):
+            return self.commitChangeSetPipelined(changeset, caching, confirm)
+
         if confirm and not iface.confirmChangeSet(changeset):
             return False
 
@@ -693,19 +825,15 @@ class Control(object):
         if sysconf.get("dry-run"):
             return True
 
+        return self._commitChangeSet(changeset, caching)
+
+    def _commitChangeSet(self, changeset, caching):
         setCloseOnExecAll()
 
-        pmpkgs = {}
-        for pkg in changeset:
-            pmclass = pkg.packagemanager
-            if pmclass not in pmpkgs:
-                pmpkgs[pmclass] = [pkg]
-            else:
-                pmpkgs[pmclass].append(pkg)
+        pmpkgs = self._getPackageManagerPackages(changeset)
 
         channels = getChannelsWithPackages([x for x in changeset
                                             if changeset[x] is INSTALL])
-        datadir = sysconf.get("data-dir")
         splitter = ChangeSetSplitter(changeset)
         donecs = ChangeSet(self._cache)
         copypkgpaths = {}
@@ -735,28 +863,7 @@ class Control(object):
                         pkgpaths[pkg] = copypkgpaths[pkg]
                         del copypkgpaths[pkg]
 
-                hooks.call("pre-commit")
-                
-                for pmclass in pmpkgs:
-                    pmcs = ChangeSet(self._cache)
-                    for pkg in pmpkgs[pmclass]:
-                        if pkg in cs:
-                            pmcs[pkg] = cs[pkg]
-                            pmcs.setRequested(pkg, cs.getRequested(pkg))
-                    if sysconf.get("commit", True):
-                        pmcs.markPackagesAutoInstalled()
-                        self.writeCommitLog(pmcs)
-                        pmclass().commit(pmcs, pkgpaths)
-                        self.setPackageOrigins(pmcs, pkgchannels)
-
-                hooks.call("post-commit")
-                
-                if sysconf.get("remove-packages", True):
-                    for pkg in pkgpaths:
-                        for path in pkgpaths[pkg]:
-                            if path.startswith(os.path.join(datadir,
-                                                            "packages")):
-                                os.unlink(path)
+                self._commitFetched(cs, pmpkgs, pkgpaths, pkgchannels)
 
             if donecs == changeset:
                 break
@@ -781,6 +888,40 @@ class Control(object):
 
         return True
 
+    def _getPackageManagerPackages(self, changeset):
+        pmpkgs = {}
+        for pkg in changeset:
+            pmclass = pkg.packagemanager
+            if pmclass not in pmpkgs:
+                pmpkgs[pmclass] = [pkg]
+            else:
+                pmpkgs[pmclass].append(pkg)
+        return pmpkgs
+
+    def _commitFetched(self, cs, pmpkgs, pkgpaths, pkgchannels):
+        hooks.call("pre-commit")
+        
+        for pmclass in pmpkgs:
+            pmcs = ChangeSet(self._cache)
+            for pkg in pmpkgs[pmclass]:
+                if pkg in cs:
+                    pmcs[pkg] = cs[pkg]
+                    pmcs.setRequested(pkg, cs.getRequested(pkg))
+            if sysconf.get("commit", True):
+                pmcs.markPackagesAutoInstalled()
+                self.writeCommitLog(pmcs)
+                pmclass().commit(pmcs, pkgpaths)
+                self.setPackageOrigins(pmcs, pkgchannels)
+
+        hooks.call("post-commit")
+        
+        if sysconf.get("remove-packages", True):
+            datadir = sysconf.get("data-dir")
+            for pkg in pkgpaths:
+                for path in pkgpaths[pkg]:
+                    if path.startswith(os.path.join(datadir, "packages")):
+                        os.unlink(path)
+
     def commitTransactionStepped(self, trans, caching=OPTIONAL, confirm=True):
         return self.commitChangeSetStepped(trans.getChangeSet(),
                                            caching, confirm)
@@ -790,6 +931,17 @@ class Control(object):
         if confirm and not iface.confirmChangeSet(changeset):
             return False
 
+        for cs in self.splitChangeSet(changeset):
+            self.commitChangeSet(cs, confirm=confirm)
+
+        return True
+
+    def splitChangeSet(self, changeset):
+        """
+        Split changeset in steps which may be committed one after the
+        other, with the requirements of each step satisfied once the
+        steps before it are committed.
+        """
         # Order by number of required packages inside the transaction.
         pkglst = []
         for pkg in changeset:
@@ -803,6 +955,7 @@ class Control(object):
 
         pkglst.sort()
 
+        steps = []
         splitter = ChangeSetSplitter(changeset)
         unioncs = ChangeSet(self._cache)
         for n, pkg in pkglst:
@@ -810,13 +963,103 @@ class Control(object):
                 continue
             cs = ChangeSet(self._cache, unioncs)
             splitter.include(unioncs, pkg)
-            cs = unioncs.difference(cs)
-            self.commitChangeSet(cs, confirm=confirm)
+            steps.append(unioncs.difference(cs))
+
+        return steps
+
+    def commitTransactionPipelined(self, trans, caching=OPTIONAL,
+                                   confirm=True):
+        return self.commitChangeSetPipelined(trans.getChangeSet(),
+                                             caching, confirm)
+
+    def commitChangeSetPipelined(self, changeset, caching=OPTIONAL,
+                                 confirm=True):
+        """
+        Commit changeset in the steps given by splitChangeSet(),
+        downloading the packages of each step while the one before
+        it is being committed.
+        """
+        if confirm and not iface.confirmChangeSet(changeset):
+            return False
+
+        if not confirm:
+            iface.showChangeSet(changeset)
+
+        if sysconf.get("dry-run"):
+            return True
+
+        channels = getChannelsWithPackages([x for x in changeset
+                                            if changeset[x] is INSTALL])
+        for channel in channels:
+            if channel.isRemovable():
+                # Media may have to be changed between steps, and
+                # that can't happen while the next one downloads.
+                return self._commitChangeSet(changeset, caching)
+
+        setCloseOnExecAll()
+
+        pmpkgs = self._getPackageManagerPackages(changeset)
+
+        self._achanset.setChannels(channels)
+
+        steps = self.splitChangeSet(changeset)
+        installs = [[pkg for pkg in cs if cs[pkg] is INSTALL]
+                    for cs in steps]
+
+        def fetch(fetcher, progress, packages, result):
+            try:
+                result.append((True, self.fetchPackages(packages, caching,
+                                                        channels=True,
+                                                        fetcher=fetcher,
+                                                        progress=progress)))
+            except:
+                result.append((False, sys.exc_info()))
+
+        if steps:
+            pkgpaths, pkgchannels = self.fetchPackages(installs[0], caching,
+                                                       channels=True)
+        for i, cs in enumerate(steps):
+            thread = None
+            if i+1 < len(steps):
+                # The next step is downloaded quietly, so that the
+                # progress of the package manager is left alone.
+                progress = Progress()
+                fetcher = self._fetcher.fork()
+                fetcher.setSubProgress(progress)
+                result = []
+                thread = threading.Thread(target=fetch,
+                                          args=(fetcher, progress,
+                                                installs[i+1], result))
+                thread.setDaemon(True)
+                thread.start()
+            try:
+                self._commitFetched(cs, pmpkgs, pkgpaths, pkgchannels)
+                if thread:
+                    if thread.isAlive():
+                        iface.showStatus(_("Waiting for packages to be "
+                                           "downloaded..."))
+                        # Wait with a timeout, so that we may still
+                        # be interrupted.
+                        while thread.isAlive():
+                            thread.join(0.5)
+                        iface.hideStatus()
+                    ok, value = result[0]
+                    if not ok:
+                        raise value[0], value[1], value[2]
+                    pkgpaths, pkgchannels = value
+            except:
+                if thread:
+                    fetcher.cancel()
+                raise
+
+        self._mediaset.restoreState()
 
         return True
 
-    def fetchPackages(self, packages, caching=OPTIONAL, targetdir=None, channels=False):
-        fetcher = self._fetcher
+    def fetchPackages(self, packages, caching=OPTIONAL, targetdir=None,
+                      channels=False, fetcher=None, progress=None):
+        if fetcher is None:
+            fetcher = self._fetcher
         fetcher.reset()
         fetcher.setCaching(caching)
         self.reloadMirrors()
@@ -827,6 +1070,31 @@ class Control(object):
             fetcher.setLocalDir(localdir, mangle=False)
         else:
             fetcher.setLocalDir(targetdir, mangle=False)
+        store = self.getPackageStore()
+        fetcher.setStore(store)
+        try:
+            pkgitems, pkgchannels = self._enqueuePackages(fetcher, packages)
+            if targetdir:
+                fetcher.setForceCopy(True)
+            fetcher.run(what=_("packages"), progress=progress)
+            fetcher.setForceCopy(False)
+        finally:
+            fetcher.setStore(None)
+        if store:
+            self.evictPackageStore(store)
+        failed = fetcher.getFailedSet()
+        if failed:
+            raise Error, _("Failed to download packages:\n") + \
+                         "\n".join([u"    %s: %s" % (url, failed[url])
+                                    for url in failed])
+        pkgpaths = {}
+        for pkg in packages:
+            pkgpaths[pkg] = [item.getTargetPath() for item in pkgitems[pkg]]
+        if not channels:
+            return pkgpaths
+        return pkgpaths, pkgchannels
+
+    def _enqueuePackages(self, fetcher, packages):
         pkgitems = {}
         pkgchannels = {}
         for pkg in packages:
@@ -850,21 +1118,7 @@ class Control(object):
                                                      sha256=info.getSHA256(url),
                                                      size=info.getSize(url),
                                                      validate=info.validate))
-        if targetdir:
-            fetcher.setForceCopy(True)
-        fetcher.run(what=_("packages"))
-        fetcher.setForceCopy(False)
-        failed = fetcher.getFailedSet()
-        if failed:
-            raise Error, _("Failed to download packages:\n") + \
-                         "\n".join([u"    %s: %s" % (url, failed[url])
-                                    for url in failed])
-        pkgpaths = {}
-        for pkg in packages:
-            pkgpaths[pkg] = [item.getTargetPath() for item in pkgitems[pkg]]
-        if not channels:
-            return pkgpaths
-        return pkgpaths, pkgchannels
+        return pkgitems, pkgchannels
 
     def search(self, s, cutoff=1.00, suggestioncutoff=0.70,
                globcutoff=1.00, globsuggestioncutoff=0.95,
@@ -1029,6 +1283,69 @@ class ChannelSorter(object):
                 rc *= -1
         return rc
 
+class ChannelProgress(object):
+    """
+    Progress shared by channels being fetched together. Only the
+    topic set by the control is shown, since each channel would
+    otherwise replace the topic of the others.
+    """
+
+    def __init__(self, progress):
+        self._progress = progress
+
+    def setTopic(self, topic):
+        pass
+
+    def show(self):
+        # Shown by the control from the main thread.
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._progress, name)
+
+class ChannelInterface(object):
+    """
+    Interface used while channels are fetched together. Messages
+    from other threads are queued, so that the control may show
+    them from the main thread.
+    """
+
+    def __init__(self, iface, cond, messages):
+        self._iface = iface
+        self._cond = cond
+        self._messages = messages
+        self._thread = threading.currentThread()
+
+    def getInterface(self):
+        return self._iface
+
+    def _queue(self, name, *args):
+        if threading.currentThread() is self._thread:
+            getattr(self._iface, name)(*args)
+        else:
+            self._cond.acquire()
+            self._messages.append((name, args))
+            self._cond.notify()
+            self._cond.release()
+
+    def error(self, msg):
+        self._queue("error", msg)
+
+    def warning(self, msg):
+        self._queue("warning", msg)
+
+    def info(self, msg):
+        self._queue("info", msg)
+
+    def debug(self, msg):
+        self._queue("debug", msg)
+
+    def message(self, level, msg):
+        self._queue("message", level, msg)
+
+    def __getattr__(self, name):
+        return getattr(self._iface, name)
+
 def getChannelsWithPackages(packages):
     channels = {}
     for pkg in packages:
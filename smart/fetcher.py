@@ -24,23 +24,33 @@ from smart.util.strtools import sizeToStr, speedToStr, secondsToStr
 from smart.media import MediaSet, DeviceMedia
 from smart.uncompress import Uncompressor
 from smart.mirror import MirrorSystem
+from smart.util.workerpool import WorkerPool
+from smart.util.filemeta import getFileMetadata, saveFileMetadata
 from smart.const import *
 from smart import *
+from cStringIO import StringIO
 import tempfile
+import httplib
 import socket
+import select
+import urlparse
 import urllib
+import base64
 import string
 import thread
+import errno
 import time
 import os
 import re
 import signal
 import threading
+import weakref
 
 MAXRETRIES = 30
 SPEEDDELAY = 1
 CANCELDELAY = 2
 MAXACTIVEDOWNLOADS = 10
+UNCOMPRESSTHREADS = 2
 SOCKETTIMEOUT = 600
 
 class FetcherCancelled(Error): pass
@@ -65,18 +75,66 @@ class Fetcher(object):
         self._localpathprefix = None
         self._cancel = False
         self._speedupdated = 0
-        self._activedownloads = 0
-        self._activedownloadslock = thread.allocate_lock()
+        self._slots = DownloadSlots()
         self._maxactivedownloads = 0
         self.time = 0
         self._eta = 0
+        self._pool = None
+        self._eventlock = thread.allocate_lock()
+        self._eventpipe = None
+        self._eventpending = False
+        self._running = {}
+        self._finished = []
+        self._subprogress = None
+        self._store = None
+        self._forks = {}
 
     def reset(self):
         self._items.clear()
         self._uncompressing = 0
 
+    def fork(self):
+        """
+        Return a new fetcher with the same settings, which shares the
+        mirror system, media set and download slots with this one.
+        Forked fetchers may run at the same time in different threads.
+        """
+        fetcher = Fetcher()
+        fetcher._mediaset = self._mediaset
+        fetcher._mirrorsystem = self._mirrorsystem
+        fetcher._slots = self._slots
+        fetcher._localdir = self._localdir
+        fetcher._mangle = self._mangle
+        fetcher._caching = self._caching
+        fetcher._forcecopy = self._forcecopy
+        fetcher._forcemountedcopy = self._forcemountedcopy
+        fetcher._localpathprefix = self._localpathprefix
+        fetcher._store = self._store
+        forks = self._forks
+        key = id(fetcher)
+        forks[key] = weakref.ref(fetcher, lambda ref: forks.pop(key, None))
+        return fetcher
+
     def cancel(self):
         self._cancel = True
+        # Cancelling is asked from the interface, which only knows
+        # about this fetcher, so the forks doing the work go as well.
+        for ref in self._forks.values():
+            fetcher = ref()
+            if fetcher is not None:
+                fetcher.cancel()
+
+    def wasCancelled(self):
+        return self._cancel
+
+    def getSubProgress(self):
+        if self._subprogress is not None:
+            return self._subprogress
+        return iface.getSubProgress(self)
+
+    def setSubProgress(self, progress):
+        """Show the progress of each item in progress, not the iface."""
+        self._subprogress = progress
 
     def getItem(self, url):
         return self._items.get(url)
@@ -127,8 +185,11 @@ class Fetcher(object):
         return self._localpathprefix
 
     def getLocalPath(self, item):
-        assert isinstance(item, FetchItem)
-        url = item.getOriginalURL()
+        """Return where item, or the file at the given URL, is saved."""
+        if isinstance(item, FetchItem):
+            url = item.getOriginalURL()
+        else:
+            url = item
         if self._mangle:
             filename = url.replace("/", "_")
         else:
@@ -149,6 +210,55 @@ class Fetcher(object):
             filename = filename[-name_max:]
         return os.path.join(self._localdir, filename)
 
+    def getFileMetadata(self, path):
+        """
+        Return the metadata recorded for path while it's unchanged, or
+        an empty dictionary. Only files in the local directory have it.
+        """
+        if os.path.dirname(path) == os.path.normpath(self._localdir):
+            entry = getFileMetadata(self._localdir).get(path)
+            if entry:
+                return entry
+        return {}
+
+    def setFileMetadata(self, path, **data):
+        """Record metadata about path, if it's in the local directory."""
+        if os.path.dirname(path) == os.path.normpath(self._localdir):
+            getFileMetadata(self._localdir).update(path, **data)
+
+    def setStore(self, store):
+        """
+        Satisfy items from the given ContentStore when it has their
+        contents, and add the ones fetched to it.
+        """
+        self._store = store
+
+    def getStore(self):
+        return self._store
+
+    def getStoreKey(self, item):
+        if (item.getInfo("uncomp") or
+            item.getURL().scheme in self._localschemes):
+            return None
+        for kind in ("sha256", "sha", "md5"):
+            digest = item.getInfo(kind)
+            if digest:
+                return self._store.getKey(kind, digest)
+        return None
+
+    def _addToStore(self):
+        for item in self._items.values():
+            if item.getStatus() == SUCCEEDED:
+                key = self.getStoreKey(item)
+                if key:
+                    # Linking changes the file times, which the
+                    # metadata recorded for it depends on.
+                    path = item.getTargetPath()
+                    digests = self.getFileMetadata(path).get("digests")
+                    self._store.add(key, path)
+                    if digests:
+                        self.setFileMetadata(path, digests=digests)
+
     def setForceCopy(self, value):
         self._forcecopy = value
 
@@ -162,16 +272,10 @@ class Fetcher(object):
         return self._forcemountedcopy
 
     def changeActiveDownloads(self, value):
-        result = False
-        self._activedownloadslock.acquire()
-        if self._activedownloads+value <= self._maxactivedownloads:
-            self._activedownloads += value
-            result = True
-        self._activedownloadslock.release()
-        return result
+        return self._slots.change(value)
 
     def getActiveDownloads(self):
-        return self._activedownloads
+        return self._slots.getActive()
 
     def enqueue(self, url, **info):
         if url in self._items:
@@ -181,6 +285,13 @@ class Fetcher(object):
         self._items[url] = item
         if info:
             item.setInfo(**info)
+        if self._store and self._caching is not NEVER:
+            key = self.getStoreKey(item)
+            if key:
+                localpath = self.getLocalPath(item)
+                if not os.path.exists(localpath):
+                    # Validation of the cached file takes it from here.
+                    self._store.get(key, localpath)
         handler = self.getHandlerInstance(item)
         handler.enqueue(item)
         return item
@@ -189,6 +300,69 @@ class Fetcher(object):
         for handler in self._handlers.values():
             handler.runLocal()
 
+    def startTask(self, func, *args):
+        """
+        Run func(*args) in the worker pool. The fetcher is woken up
+        when it returns, so handlers should use this instead of
+        starting threads by themselves.
+        """
+        if not self._pool:
+            self._pool = WorkerPool(self._maxactivedownloads+
+                                    UNCOMPRESSTHREADS, self.wakeUp)
+        self._pool.submit(func, *args)
+
+    def wakeUp(self):
+        """Make the fetcher look at its handlers and items again."""
+        self._eventlock.acquire()
+        try:
+            if not self._eventpending and self._eventpipe:
+                self._eventpending = True
+                os.write(self._eventpipe[1], "x")
+        finally:
+            self._eventlock.release()
+
+    def _waitEvent(self, timeout):
+        r = self._eventpipe[0]
+        try:
+            select.select([r], [], [], max(timeout, 0))
+        except select.error, e:
+            if e[0] != errno.EINTR:
+                raise
+        self._eventlock.acquire()
+        try:
+            if self._eventpending:
+                self._eventpending = False
+                os.read(r, 1)
+        finally:
+            self._eventlock.release()
+
+    def itemStarted(self, item):
+        self._eventlock.acquire()
+        self._running[item] = True
+        self._eventlock.release()
+
+    def itemFinished(self, item):
+        self._eventlock.acquire()
+        try:
+            if item in self._running:
+                del self._running[item]
+            self._finished.append(item)
+        finally:
+            self._eventlock.release()
+        # Plain successful downloads need nothing else from run(), so
+        # they may wait until it wakes up for other reasons.
+        if item.getStatus() is not SUCCEEDED or item.getInfo("uncomp"):
+            self.wakeUp()
+
+    def _takeFinished(self):
+        self._eventlock.acquire()
+        try:
+            finished = self._finished
+            self._finished = []
+            return finished
+        finally:
+            self._eventlock.release()
+
     def run(self, what=None, progress=None):
         socket.setdefaulttimeout(sysconf.get("socket-timeout", SOCKETTIMEOUT))
         self._cancel = False
@@ -199,7 +373,6 @@ class Fetcher(object):
                 sys.exit(0)
             old_quit_handler = signal.signal(signal.SIGQUIT, quitIntHandler)
             old_int_handler  = signal.signal(signal.SIGINT, quitIntHandler)
-        self._activedownloads = 0
         self._maxactivedownloads = sysconf.get("max-active-downloads",
                                                MAXACTIVEDOWNLOADS)
         self._maxdownloadrate = sysconf.get("max-download-rate", 0)
@@ -210,6 +383,9 @@ class Fetcher(object):
         local = len([x for x in self._items.values()
                      if x.getStatus() == SUCCEEDED])
         if local == total or self._caching is ALWAYS:
+            if self._store:
+                self._addToStore()
+            saveFileMetadata()
             if progress:
                 progress.add(total)
             return
@@ -229,6 +405,17 @@ class Fetcher(object):
                 topic = _("Fetching information...")
             prog.setTopic(topic)
             prog.show()
+        # The loop below is driven by events: items finishing, tasks
+        # in the worker pool returning, and download slots being freed
+        # all wake it up. Otherwise it only wakes up to update speeds.
+        self._eventpipe = os.pipe()
+        self._eventpending = False
+        self._eventlock.acquire()
+        self._running.clear()
+        self._finished = [x for x in self._items.values()
+                          if x.getStatus() in (SUCCEEDED, FAILED)]
+        self._eventlock.release()
+        self._slots.join(self, self._maxactivedownloads)
         for handler in handlers:
             handler.start()
         active = handlers[:]
@@ -236,71 +423,98 @@ class Fetcher(object):
         uncompchecked = {}
         self._speedupdated = self.time
         cancelledtime = None
-        while active or self._uncompressing:
-            self.time = time.time()
-            if self._cancel:
-                if not cancelledtime:
-                    cancelledtime = self.time
+        try:
+            while active or self._uncompressing:
+                self.time = time.time()
+                if self._cancel:
+                    if not cancelledtime:
+                        cancelledtime = self.time
+                    for handler in active[:]:
+                        if not handler.wasCancelled():
+                            handler.cancel()
+                        if not handler.tick():
+                            active.remove(handler)
+                    # We won't wait for handlers which are not being nice.
+                    if time.time() > cancelledtime+CANCELDELAY:
+                        for item in self._items.values():
+                            if item.getStatus() != SUCCEEDED:
+                                item.setCancelled()
+                        # Remove handlers, since we don't know their state.
+                        self._handlers.clear()
+                        prog.show()
+                        break
+                    prog.show()
+                    self._waitEvent(0.1)
+                    continue
                 for handler in active[:]:
-                    if not handler.wasCancelled():
-                        handler.cancel()
                     if not handler.tick():
                         active.remove(handler)
-                # We won't wait for handlers which are not being nice.
-                if time.time() > cancelledtime+CANCELDELAY:
-                    for item in self._items.values():
-                        if item.getStatus() != SUCCEEDED:
-                            item.setCancelled()
-                    # Remove handlers, since we don't know their state.
-                    self._handlers.clear()
-                    prog.show()
-                    break
-                prog.show()
-                continue
-            for handler in active[:]:
-                if not handler.tick():
-                    active.remove(handler)
-            if self._speedupdated+SPEEDDELAY < self.time:
-                self._speedupdated = self.time
-                updatespeed = True
-            else:
-                updatespeed = False
-            for url in self._items:
-                item = self._items[url]
-                if item.getStatus() == FAILED:
-                    if (item.getRetries() < MAXRETRIES and
-                        item.setNextURL()):
-                        item.reset()
-                        handler = self.getHandlerInstance(item)
-                        handler.enqueue(item)
-                        if handler not in active:
-                            active.append(handler)
-                    continue
-                elif (item.getStatus() != SUCCEEDED or
-                      not item.getInfo("uncomp")):
-                    if updatespeed:
+                if self._speedupdated+SPEEDDELAY < self.time:
+                    self._speedupdated = self.time
+                    self._eventlock.acquire()
+                    running = self._running.keys()
+                    self._eventlock.release()
+                    for item in running:
                         item.updateSpeed()
                         item.updateETA()
-                    continue
-                localpath = item.getTargetPath()
-                if localpath in uncompchecked:
-                    continue
-                uncompchecked[localpath] = True
-                uncomphandler = uncomp.getHandler(localpath)
-                if not uncomphandler:
-                    continue
-                uncomppath = uncomphandler.getTargetPath(localpath)
-                if (not self.hasStrongValidate(item, uncomp=True) or
-                    not self.validate(item, uncomppath, uncomp=True)):
-                    self._uncompressing += 1
-                    thread.start_new_thread(self._uncompress,
-                                            (item, localpath, uncomphandler))
-                else:
-                    item.setSucceeded(uncomppath)
-            prog.show()
-            time.sleep(0.1)
+                requeued = False
+                for item in self._takeFinished():
+                    if item.getStatus() == FAILED:
+                        if (item.getRetries() < MAXRETRIES and
+                            item.setNextURL()):
+                            item.reset()
+                            handler = self.getHandlerInstance(item)
+                            handler.enqueue(item)
+                            if handler not in active:
+                                active.append(handler)
+                            requeued = True
+                        continue
+                    elif (item.getStatus() != SUCCEEDED or
+                          not item.getInfo("uncomp")):
+                        continue
+                    localpath = item.getTargetPath()
+                    if localpath in uncompchecked:
+                        continue
+                    uncompchecked[localpath] = True
+                    uncomphandler = uncomp.getHandler(localpath)
+                    if not uncomphandler:
+                        continue
+                    uncomppath = uncomphandler.getTargetPath(localpath)
+                    if item.getUncompressedPath() == uncomppath:
+                        # The handler uncompressed it while downloading.
+                        valid, reason = self.validate(item, uncomppath,
+                                                      withreason=True,
+                                                      uncomp=True)
+                        if valid:
+                            item.setSucceeded(uncomppath)
+                        else:
+                            item.setFailed(reason)
+                    elif (not self.hasStrongValidate(item, uncomp=True) or
+                          not self.validate(item, uncomppath, uncomp=True)):
+                        self._uncompressing += 1
+                        self.startTask(self._uncompress,
+                                       item, localpath, uncomphandler)
+                    else:
+                        item.setSucceeded(uncomppath)
+                prog.show()
+                if not requeued and (active or self._uncompressing):
+                    self._waitEvent(self._speedupdated+SPEEDDELAY-
+                                    time.time())
+        finally:
+            self._slots.leave(self)
+            if self._pool:
+                self._pool.stop()
+                self._pool = None
+            self._eventlock.acquire()
+            for fd in self._eventpipe:
+                os.close(fd)
+            self._eventpipe = None
+            self._eventlock.release()
         for handler in handlers:
             handler.stop()
+        if self._store and not self._cancel:
+            self._addToStore()
+        saveFileMetadata()
         if not progress:
             prog.stop()
         if thread_name == "MainThread":
@@ -310,19 +524,23 @@ class Fetcher(object):
             raise FetcherCancelled, _("Cancelled")
 
     def _uncompress(self, item, localpath, uncomphandler):
+        digests = item.newDigests(uncomp=True)
         try:
-            uncomphandler.uncompress(localpath)
+            uncomphandler.uncompress(localpath, digests=digests)
         except Error, e:
             item.setFailed(unicode(e))
         else:
             uncomppath = uncomphandler.getTargetPath(localpath)
+            item.setDigests(uncomppath, digests, uncomp=True)
             valid, reason = self.validate(item, uncomppath,
                                           withreason=True, uncomp=True)
             if not valid:
                 item.setFailed(reason)
             else:
                 item.setSucceeded(uncomppath)
+        self._eventlock.acquire()
         self._uncompressing -= 1
+        self._eventlock.release()
 
     def getLocalSchemes(self):
         return self._localschemes
@@ -391,56 +609,41 @@ class Fetcher(object):
                     raise Error, _("Unexpected size (expected %d, got %d)") % \
                                  (size, lsize)
 
+            # Digests computed while the file was written, or verified
+            # before and recorded while it's unchanged, spare reading it.
+            digests = (item.getDigests(localpath, uncomp) or
+                       self.getFileMetadata(localpath).get("digests") or {})
+            verified = {}
+
             filemd5 = item.getInfo(uncompprefix+"md5")
             if filemd5:
-                try:
-                    from hashlib import md5
-                except ImportError:
-                    from md5 import md5
-                digest = md5()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilemd5 = digest.hexdigest()
+                lfilemd5 = (digests.get("md5") or
+                            getFileDigest(localpath, "md5"))
                 if lfilemd5 != filemd5:
                     raise Error, _("Invalid MD5 (expected %s, got %s)") % \
                                  (filemd5, lfilemd5)
+                verified["md5"] = lfilemd5
 
             filesha256 = item.getInfo(uncompprefix+"sha256")
             if filesha256:
-                try:
-                    from hashlib import sha256
-                except ImportError:
-                    from smart.util.sha256 import sha256
-                digest = sha256()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilesha256 = digest.hexdigest()
+                lfilesha256 = (digests.get("sha256") or
+                               getFileDigest(localpath, "sha256"))
                 if lfilesha256 != filesha256:
                    raise Error, _("Invalid SHA256 (expected %s, got %s)") % \
                                  (filesha256, lfilesha256)
+                verified["sha256"] = lfilesha256
             else:
                 filesha = item.getInfo(uncompprefix+"sha")
                 if filesha:
-                    try:
-                        from hashlib import sha1 as sha
-                    except ImportError:
-                        from sha import sha
-                    digest = sha()
-                    file = open(localpath)
-                    data = file.read(BLOCKSIZE)
-                    while data:
-                        digest.update(data)
-                        data = file.read(BLOCKSIZE)
-                    lfilesha = digest.hexdigest()
+                    lfilesha = (digests.get("sha") or
+                                getFileDigest(localpath, "sha"))
                     if lfilesha != filesha:
                         raise Error, _("Invalid SHA (expected %s, got %s)") % \
                                      (filesha, lfilesha)
+                    verified["sha"] = lfilesha
+
+            if verified:
+                self.setFileMetadata(localpath, digests=verified)
         except Error, reason:
             if withreason:
                 return False, reason
@@ -450,6 +653,172 @@ class Fetcher(object):
                 return True, None
             return True
 
+class DownloadSlots(object):
+    """Download slots shared by fetchers running at the same time."""
+
+    def __init__(self):
+        self._lock = thread.allocate_lock()
+        self._active = 0
+        self._maximum = 0
+        self._fetchers = []
+
+    def join(self, fetcher, maximum):
+        self._lock.acquire()
+        try:
+            if not self._fetchers:
+                self._active = 0
+                self._maximum = maximum
+            self._fetchers.append(fetcher)
+        finally:
+            self._lock.release()
+
+    def leave(self, fetcher):
+        self._lock.acquire()
+        try:
+            self._fetchers.remove(fetcher)
+        finally:
+            self._lock.release()
+
+    def getActive(self):
+        return self._active
+
+    def change(self, value):
+        self._lock.acquire()
+        try:
+            result = self._active+value <= self._maximum
+            if result:
+                self._active += value
+            fetchers = self._fetchers[:]
+        finally:
+            self._lock.release()
+        if value < 0:
+            # Handlers may start another download now.
+            for fetcher in fetchers:
+                fetcher.wakeUp()
+        return result
+
+def newDigest(kind):
+    """Return a new hash object for the md5, sha or sha256 kinds."""
+    if kind == "md5":
+        try:
+            from hashlib import md5
+        except ImportError:
+            from md5 import md5
+        return md5()
+    elif kind == "sha256":
+        try:
+            from hashlib import sha256
+        except ImportError:
+            from smart.util.sha256 import sha256
+        return sha256()
+    elif kind == "sha":
+        try:
+            from hashlib import sha1 as sha
+        except ImportError:
+            from sha import sha
+        return sha()
+    raise Error, _("Unknown digest: %s") % kind
+
+def getFileDigest(path, kind):
+    digest = newDigest(kind)
+    file = open(path)
+    data = file.read(BLOCKSIZE)
+    while data:
+        digest.update(data)
+        data = file.read(BLOCKSIZE)
+    file.close()
+    return digest.hexdigest()
+
+class DigestSet(object):
+    """Digests of data being written, fed as it goes."""
+
+    def __init__(self, kinds):
+        self._digests = [(kind, newDigest(kind)) for kind in kinds]
+        self.size = 0
+
+    def update(self, data):
+        for kind, digest in self._digests:
+            digest.update(data)
+        self.size += len(data)
+
+    def getHexDigests(self):
+        return dict([(kind, digest.hexdigest())
+                     for kind, digest in self._digests])
+
+class DigestFile(object):
+    """Write-only file which feeds a DigestSet with what is written."""
+
+    def __init__(self, file, digests):
+        self._file = file
+        self._digests = digests
+
+    def getDigests(self):
+        return self._digests
+
+    def write(self, data):
+        self._file.write(data)
+        if self._digests:
+            self._digests.update(data)
+
+    def close(self):
+        self._file.close()
+
+    def finish(self, item, localpath):
+        # The file was closed and moved to localpath.
+        item.setDigests(localpath, self._digests)
+
+class UncompressFile(DigestFile):
+    """
+    DigestFile which also uncompresses what is written into uncomppath.
+    If that fails, the uncompressed file is dropped, and the fetcher
+    uncompresses the downloaded file as usual.
+    """
+
+    def __init__(self, file, digests, decompressor, uncomppath,
+                 uncompdigests):
+        DigestFile.__init__(self, file, digests)
+        self._decompressor = decompressor
+        self._uncomppath = uncomppath
+        self._uncompdigests = uncompdigests
+        self._uncomp = open(uncomppath+".part", "w")
+
+    def _write(self, data):
+        if data:
+            self._uncomp.write(data)
+            if self._uncompdigests:
+                self._uncompdigests.update(data)
+
+    def _drop(self):
+        self._decompressor = None
+        self._uncomp.close()
+        if os.path.isfile(self._uncomppath+".part"):
+            os.unlink(self._uncomppath+".part")
+
+    def write(self, data):
+        DigestFile.write(self, data)
+        if self._decompressor:
+            try:
+                self._write(self._decompressor.decompress(data))
+            except (Error, IOError, OSError):
+                self._drop()
+
+    def close(self):
+        DigestFile.close(self)
+        if self._decompressor:
+            try:
+                self._write(self._decompressor.flush())
+                self._uncomp.close()
+            except (Error, IOError, OSError):
+                self._drop()
+
+    def finish(self, item, localpath):
+        DigestFile.finish(self, item, localpath)
+        if self._decompressor:
+            os.rename(self._uncomppath+".part", self._uncomppath)
+            item.setDigests(self._uncomppath, self._uncompdigests,
+                            uncomp=True)
+            item.setUncompressedPath(self._uncomppath)
+
 class FetchItem(object):
 
     def __init__(self, fetcher, url, mirror):
@@ -459,6 +828,8 @@ class FetchItem(object):
         self._urlobj = URL(mirror.getNext())
         self._retries = 0
         self._starttime = None
+        self._digests = {}
+        self._uncompressedpath = None
         self._current = 0
         self._total = 0
         self._speed = 0
@@ -472,12 +843,14 @@ class FetchItem(object):
         self._failedreason = None
         self._targetpath = None
 
-        self._progress = iface.getSubProgress(fetcher)
+        self._progress = fetcher.getSubProgress()
 
     def reset(self):
         self._status = WAITING
         self._failedreason = None
         self._targetpath = None
+        self._digests.clear()
+        self._uncompressedpath = None
         self._starttime = None
         self._current = 0
         self._total = 0
@@ -544,10 +917,52 @@ class FetchItem(object):
                 info[kind] = value.lower()
         self._info.update(info)
 
+    def newDigests(self, uncomp=False):
+        """
+        Return a DigestSet for the digests this item is validated with,
+        to be fed while writing the file, or None if there are none.
+        """
+        prefix = uncomp and "uncomp_" or ""
+        if self._info.get(prefix+"validate"):
+            return None
+        kinds = [kind for kind in ("md5", "sha256", "sha")
+                 if self._info.get(prefix+kind)]
+        if "sha256" in kinds and "sha" in kinds:
+            kinds.remove("sha")
+        if not kinds:
+            return None
+        return DigestSet(kinds)
+
+    def setDigests(self, localpath, digests, uncomp=False):
+        """Remember the digests computed while writing localpath."""
+        if digests:
+            self._digests[uncomp] = (localpath, digests.size,
+                                     digests.getHexDigests())
+
+    def getDigests(self, localpath, uncomp=False):
+        """
+        Return the digests set for localpath as a dictionary, or None
+        if there are none, or if the file has another size than what
+        was fed, as happens when a download is resumed.
+        """
+        entry = self._digests.get(uncomp)
+        if (entry and entry[0] == localpath and
+            entry[1] == os.path.getsize(localpath)):
+            return entry[2]
+        return None
+
+    def setUncompressedPath(self, path):
+        """Tell that path was uncompressed while downloading."""
+        self._uncompressedpath = path
+
+    def getUncompressedPath(self):
+        return self._uncompressedpath
+
     def start(self):
         if self._status is WAITING:
             self._status = RUNNING
             self._starttime = self._fetcher.time
+            self._fetcher.itemStarted(self)
             prog = self._progress
             url = self._urlobj.original
             prog.setSubTopic(url, url)
@@ -607,6 +1022,7 @@ class FetchItem(object):
                     self._speed = fetchedsize/timedelta
                 self._progress.setSubDone(self._urlobj.original)
                 self._progress.show()
+            self._fetcher.itemFinished(self)
 
     def setFailed(self, reason):
         self._status = FAILED
@@ -615,6 +1031,7 @@ class FetchItem(object):
             self._mirror.addInfo(failed=1)
             self._progress.setSubStopped(self._urlobj.original)
             self._progress.show()
+        self._fetcher.itemFinished(self)
 
     def setCancelled(self):
         self.setFailed(_("Cancelled"))
@@ -739,6 +1156,32 @@ class FetcherHandler(object):
     def getLocalPath(self, item):
         return self._fetcher.getLocalPath(item)
 
+    def openLocal(self, item, path, mode="w"):
+        """
+        Open path for writing what is fetched for item. The returned
+        file computes the item digests on the way, and, when the
+        stream-uncompress option is set, also uncompresses the data.
+        Its finish() method must be called once the file is closed
+        and moved to its final place.
+        """
+        file = open(path, mode)
+        digests = item.newDigests()
+        if (mode == "w" and item.getInfo("uncomp") and
+            sysconf.get("stream-uncompress", False)):
+            localpath = self.getLocalPath(item)
+            uncompressor = self._fetcher.getUncompressor()
+            uncomphandler = uncompressor.getHandler(localpath)
+            decompressor = uncomphandler and uncomphandler.getDecompressor()
+            if decompressor:
+                uncomppath = uncomphandler.getTargetPath(localpath)
+                try:
+                    return UncompressFile(file, digests, decompressor,
+                                          uncomppath,
+                                          item.newDigests(uncomp=True))
+                except (IOError, OSError):
+                    pass
+        return DigestFile(file, digests)
+
     def runLocal(self, caching=None):
         # That's part of the caching magic.
         fetcher = self._fetcher
@@ -756,7 +1199,9 @@ class FetcherHandler(object):
                                                      withreason=True,
                                                      uncomp=True)
                     if not valid and fetcher.validate(item, localpath):
-                        uncomphandler.uncompress(localpath)
+                        digests = item.newDigests(uncomp=True)
+                        uncomphandler.uncompress(localpath, digests=digests)
+                        item.setDigests(uncomppath, digests, uncomp=True)
                         valid, reason = fetcher.validate(item, uncomppath,
                                                          withreason=True,
                                                          uncomp=True)
@@ -840,7 +1285,10 @@ class FileHandler(FetcherHandler):
                                 os.unlink(linkpath)
                             os.symlink(localpath, linkpath)
                             uncomppath = uncomphandler.getTargetPath(linkpath)
-                            uncomphandler.uncompress(linkpath)
+                            digests = item.newDigests(uncomp=True)
+                            uncomphandler.uncompress(linkpath,
+                                                     digests=digests)
+                            item.setDigests(uncomppath, digests, uncomp=True)
                             valid, reason = fetcher.validate(item, uncomppath,
                                                              withreason=True,
                                                              uncomp=True)
@@ -860,7 +1308,7 @@ class FileHandler(FetcherHandler):
     def tick(self):
         if self._queue and not self._active:
             self._active = True
-            thread.start_new_thread(self.copy, ())
+            self._fetcher.startTask(self.copy)
         return self._active
 
     def copy(self):
@@ -874,16 +1322,18 @@ class FileHandler(FetcherHandler):
             while retries < self.RETRIES:
                 try:
                     input = open(filepath)
-                    output = open(localpath, "w")
+                    output = self.openLocal(item, localpath)
                     while True:
                         data = input.read(BLOCKSIZE)
                         if not data:
                             break
                         output.write(data)
+                    output.close()
                 except (IOError, OSError), e:
                     error = unicode(e)
                     retries += 1
                 else:
+                    output.finish(item, localpath)
                     item.setSucceeded(localpath)
                     break
             else:
@@ -963,7 +1413,7 @@ class FTPHandler(FetcherHandler):
                             if self._inactive[ftp] == userhost:
                                 del self._inactive[ftp]
                                 self._active[ftp] = url.host
-                                thread.start_new_thread(self.fetch, (ftp, item))
+                                self._fetcher.startTask(self.fetch, ftp, item)
                                 break
                         else:
                             if len(self._inactive) > self.MAXINACTIVE:
@@ -971,10 +1421,13 @@ class FTPHandler(FetcherHandler):
                             ftp = ftplib.FTP()
                             ftp.lasttime = self._fetcher.time
                             self._active[ftp] = url.host
-                            thread.start_new_thread(self.connect,
-                                                    (ftp, item, len(hostactive)))
+                            self._fetcher.startTask(self.connect, ftp, item,
+                                                    len(hostactive))
+        # Must be checked with the lock held, since threads pop items
+        # from the queue.
+        active = bool(self._queue or self._active)
         self._lock.release()
-        return bool(self._queue or self._active)
+        return active
 
     def connect(self, ftp, item, active):
         item.start()
@@ -1067,7 +1520,7 @@ class FTPHandler(FetcherHandler):
                     item.current = 0
 
                 try:
-                    local = open(localpathpart, openmode)
+                    local = self.openLocal(item, localpathpart, openmode)
                 except (IOError, OSError), e:
                     raise Error, "%s: %s" % (localpathpart, e)
 
@@ -1092,6 +1545,7 @@ class FTPHandler(FetcherHandler):
                     os.utime(localpathpart, (mtime, mtime))
 
                 os.rename(localpathpart, localpath)
+                local.finish(item, localpath)
 
                 valid, reason = fetcher.validate(item, localpath,
                                                  withreason=True)
@@ -1139,6 +1593,156 @@ class FTPHandler(FetcherHandler):
 
 Fetcher.setHandler("ftp", FTPHandler)
 
+class HTTPConnectionPool(object):
+    """
+    Persistent HTTP and HTTPS connections, shared by the threads of
+    a handler.
+
+    Connections are kept per server (or proxy), and reused for the
+    following requests while the server keeps them open, so that
+    fetching many small files doesn't set up a connection for each.
+    A pool holds at most one connection per concurrent request, and
+    responses are returned like the ones from urllib openers.
+    """
+
+    MAXREDIRECTS = 5
+
+    # Errors meaning that the server closed a connection it had kept
+    # alive. The request is then retried in a new connection.
+    CLOSEDERRORS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+    def __init__(self):
+        self._idle = {} # (scheme, host, tunnel) -> [connection]
+        self._lock = thread.allocate_lock()
+
+    def open(self, url, headers=()):
+        for i in range(self.MAXREDIRECTS+1):
+            key, conn, response = self._request(url, headers)
+            if response.status not in (301, 302, 303, 307):
+                break
+            location = response.getheader("location")
+            if not location:
+                break
+            response.read()
+            self._release(key, conn, response)
+            url = urlparse.urljoin(url, location)
+        if response.status in (200, 206):
+            fp = PooledResponseFile(self, key, conn, response)
+        else:
+            # Error bodies are small, so the connection may be
+            # released right away.
+            fp = StringIO(response.read())
+            self._release(key, conn, response)
+        info = urllib.addinfourl(fp, response.msg, url)
+        if response.status != 200:
+            info.errcode = response.status
+            info.errmsg = response.reason
+        return info
+
+    def close(self):
+        self._lock.acquire()
+        idle = self._idle
+        self._idle = {}
+        self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request(self, url, headers):
+        scheme, rest = urllib.splittype(url)
+        host, selector = urllib.splithost(rest)
+        userpasswd, host = urllib.splituser(host)
+        headers = dict(headers)
+        headers["Host"] = host
+        if userpasswd:
+            headers["Authorization"] = "Basic %s" % \
+                base64.b64encode(urllib.unquote(userpasswd))
+        proxy = urllib.getproxies().get(scheme)
+        if proxy and urllib.proxy_bypass(urllib.splitport(host)[0]):
+            proxy = None
+        tunnel = None
+        if proxy:
+            proxyhost = urllib.splithost(urllib.splittype(proxy)[1])[0]
+            proxypasswd, proxyhost = urllib.splituser(proxyhost)
+            proxyheaders = {}
+            if proxypasswd:
+                proxyheaders["Proxy-Authorization"] = "Basic %s" % \
+                    base64.b64encode(urllib.unquote(proxypasswd))
+            if scheme == "https":
+                tunnel = (host, proxyheaders)
+            else:
+                selector = "%s://%s%s" % (scheme, host, selector)
+                headers.update(proxyheaders)
+            key = (scheme, proxyhost, host)
+        else:
+            proxyhost = host
+            key = (scheme, host, None)
+        while True:
+            conn = None
+            self._lock.acquire()
+            conns = self._idle.get(key)
+            if conns:
+                conn = conns.pop()
+            self._lock.release()
+            reused = conn is not None
+            if not reused:
+                if scheme == "https":
+                    conn = httplib.HTTPSConnection(proxyhost)
+                    if tunnel:
+                        conn.set_tunnel(*tunnel)
+                else:
+                    conn = httplib.HTTPConnection(proxyhost)
+            try:
+                conn.request("GET", selector or "/", headers=headers)
+                return key, conn, conn.getresponse()
+            except (socket.error, httplib.BadStatusLine), e:
+                conn.close()
+                if (not reused or isinstance(e, socket.error) and
+                    e.errno not in self.CLOSEDERRORS):
+                    raise
+
+    def _release(self, key, conn, response):
+        # Connections with unread data can't be used anymore. When
+        # the server asked for the connection to be closed, it will
+        # just be reopened by the next request.
+        if response.isclosed():
+            self._lock.acquire()
+            self._idle.setdefault(key, []).append(conn)
+            self._lock.release()
+        else:
+            response.close()
+            conn.close()
+
+class PooledResponseFile(object):
+    """File for a response body read from a pooled connection."""
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def read(self, size=-1):
+        if not self._response:
+            return ""
+        if size < 0:
+            return self._response.read()
+        return self._response.read(size)
+
+    def readline(self):
+        line = []
+        while True:
+            char = self.read(1)
+            line.append(char)
+            if not char or char == "\n":
+                return "".join(line)
+
+    def close(self):
+        response = self._response
+        if response:
+            self._response = None
+            self._pool._release(self._key, self._conn, response)
+
 class URLLIBHandler(FetcherHandler):
 
     MAXACTIVE = 5
@@ -1147,6 +1751,16 @@ class URLLIBHandler(FetcherHandler):
         FetcherHandler.__init__(self, *args)
         self._active = 0
         self._lock = thread.allocate_lock()
+        self._connections = HTTPConnectionPool()
+
+    def stop(self):
+        self._connections.close()
+
+    def open(self, opener, url, headers):
+        if url.scheme in ("http", "https"):
+            return self._connections.open(url.original, headers)
+        opener.addheaders[:] = headers
+        return opener.open(url.original)
 
     def tick(self):
         self._lock.acquire()
@@ -1154,9 +1768,10 @@ class URLLIBHandler(FetcherHandler):
             while (self._active < self.MAXACTIVE and
                    self.changeActiveDownloads(+1)):
                 self._active += 1
-                thread.start_new_thread(self.fetch, ())
+                self._fetcher.startTask(self.fetch)
+        active = bool(self._queue or self._active)
         self._lock.release()
-        return bool(self._queue or self._active)
+        return active
 
     def fetch(self):
         import urllib, rfc822, calendar
@@ -1211,31 +1826,33 @@ class URLLIBHandler(FetcherHandler):
 
                 size = item.getInfo("size")
 
-                del opener.addheaders[:]
-
-                opener.addheader("User-Agent", "smart/" + VERSION)
+                headers = [("User-Agent", "smart/" + VERSION)]
 
                 if (os.path.isfile(localpath) and
                     fetcher.validate(item, localpath)):
-                    mtime = os.path.getmtime(localpath)
-                    opener.addheader("if-modified-since",
-                                     rfc822.formatdate(mtime))
+                    metadata = fetcher.getFileMetadata(localpath)
+                    if metadata.get("etag"):
+                        headers.append(("if-none-match", metadata["etag"]))
+                    mtimes = metadata.get("lastmodified")
+                    if not mtimes:
+                        mtime = os.path.getmtime(localpath)
+                        mtimes = rfc822.formatdate(mtime)
+                    headers.append(("if-modified-since", mtimes))
 
                 localpathpart = localpath+".part"
                 if os.path.isfile(localpathpart):
                     partsize = os.path.getsize(localpathpart)
                     if not size or partsize < size:
-                        opener.addheader("range", "bytes=%d-" % partsize)
+                        headers.append(("range", "bytes=%d-" % partsize))
                 else:
                     partsize = 0
 
-                remote = opener.open(url.original)
+                remote = self.open(opener, url, headers)
 
                 if hasattr(remote, "errcode") and remote.errcode == 416:
                     # Range not satisfiable, try again without it.
-                    opener.addheaders = [x for x in opener.addheaders
-                                         if x[0] != "range"]
-                    remote = opener.open(url.original)
+                    headers = [x for x in headers if x[0] != "range"]
+                    remote = self.open(opener, url, headers)
 
                 if hasattr(remote, "errcode") and remote.errcode != 206:
                     # 206 = Partial Content
@@ -1261,7 +1878,7 @@ class URLLIBHandler(FetcherHandler):
                     raise Error, _("Server reports unexpected size")
 
                 try:
-                    local = open(localpathpart, openmode)
+                    local = self.openLocal(item, localpathpart, openmode)
                 except (IOError, OSError), e:
                     raise IOError, "%s: %s" % (localpathpart, e)
 
@@ -1292,6 +1909,14 @@ class URLLIBHandler(FetcherHandler):
                     remote.close()
 
                 os.rename(localpathpart, localpath)
+                local.finish(item, localpath)
+
+                mtimes = info.get("last-modified")
+                if mtimes:
+                    mtimet = rfc822.parsedate(mtimes)
+                    if mtimet:
+                        mtime = calendar.timegm(mtimet)
+                        os.utime(localpath, (mtime, mtime))
 
                 valid, reason = fetcher.validate(item, localpath,
                                                  withreason=True)
@@ -1311,15 +1936,11 @@ class URLLIBHandler(FetcherHandler):
                         fetchedsize = os.path.getsize(localpath)
                     else:
                         fetchedsize = None
+                    fetcher.setFileMetadata(localpath,
+                                            etag=info.get("etag"),
+                                            lastmodified=mtimes)
                     item.setSucceeded(localpath, fetchedsize)
 
-                    if "last-modified" in info:
-                        mtimes = info["last-modified"]
-                        mtimet = rfc822.parsedate(mtimes)
-                        if mtimet:
-                            mtime = calendar.timegm(mtimet)
-                            os.utime(localpath, (mtime, mtime))
-
             except urllib.addinfourl, remote:
                 if remote.errcode == 304: # Not modified
                     item.setSucceeded(localpath)
@@ -1329,7 +1950,8 @@ class URLLIBHandler(FetcherHandler):
                 else:
                     item.setFailed(remote.errmsg)
 
-            except (IOError, OSError, Error, socket.error), e:
+            except (IOError, OSError, Error, socket.error,
+                    httplib.HTTPException), e:
                 try:
                     errmsg = unicode(e[1])
                 except IndexError:
@@ -1339,12 +1961,14 @@ class URLLIBHandler(FetcherHandler):
             except FetcherCancelled:
                 item.setCancelled()
 
+        # Release the slot while still counted as active, so that the
+        # fetcher can't finish and reset the counters before it's done.
+        self.changeActiveDownloads(-1)
+
         self._lock.acquire()
         self._active -= 1
         self._lock.release()
 
-        self.changeActiveDownloads(-1)
-
 #Fetcher.setHandler("ftp", URLLIBHandler)
 Fetcher.setHandler("http", URLLIBHandler)
 Fetcher.setHandler("https", URLLIBHandler)
@@ -1382,7 +2006,7 @@ class URLLIB2Handler(FetcherHandler):
             while (self._active < self.MAXACTIVE and
                    self.changeActiveDownloads(+1)):
                 self._active += 1
-                thread.start_new_thread(self.fetch, ())
+                self._fetcher.startTask(self.fetch)
         self._lock.release()
         return bool(self._queue or self._active)
 
@@ -1540,7 +2164,7 @@ class PyCurlHandler(FetcherHandler):
 
         if not self._running and (self._queue or self._active):
             self._running = True
-            thread.start_new_thread(self.perform, ())
+            self._fetcher.startTask(self.perform)
 
         fetcher = self._fetcher
         multi = self._multi
@@ -1589,6 +2213,7 @@ class PyCurlHandler(FetcherHandler):
                     if os.path.isfile(localpath):
                         os.unlink(localpath)
                     os.rename(localpath+".part", localpath)
+                    local.finish(item, localpath)
                     mtime = handle.getinfo(pycurl.INFO_FILETIME)
                     if mtime != -1:
                         os.utime(localpath, (mtime, mtime))
@@ -1604,6 +2229,8 @@ class PyCurlHandler(FetcherHandler):
                                                      withreason=True)
                     if valid:
                         fetchedsize = handle.getinfo(pycurl.SIZE_DOWNLOAD)
+                        if fetchedsize:
+                            self.setFileMetadata(handle, localpath)
                         item.setSucceeded(localpath, fetchedsize)
                     elif handle.partsize:
                         self._queue.append(item)
@@ -1692,7 +2319,8 @@ class PyCurlHandler(FetcherHandler):
                             handle.setopt(pycurl.RESUME_FROM_LARGE, 0L)
 
                         try:
-                            local = open(localpathpart, openmode)
+                            local = self.openLocal(item, localpathpart,
+                                                   openmode)
                         except (IOError, OSError), e:
                             item.setFailed("%s: %s" % (localpathpart, e))
                             del self._active[handle]
@@ -1722,14 +2350,17 @@ class PyCurlHandler(FetcherHandler):
                         handle.setopt(pycurl.LOW_SPEED_TIME, SOCKETTIMEOUT)
                         handle.setopt(pycurl.NOPROGRESS, 0)
                         handle.setopt(pycurl.PROGRESSFUNCTION, progress)
-                        handle.setopt(pycurl.WRITEDATA, local)
+                        handle.setopt(pycurl.WRITEFUNCTION, local.write)
                         handle.setopt(pycurl.FOLLOWLOCATION, 1)
                         handle.setopt(pycurl.MAXREDIRS, 5)
-                        handle.setopt(pycurl.HTTPHEADER, ["Pragma:"])
                         handle.setopt(pycurl.USERAGENT, "smart/" + VERSION)
                         handle.setopt(pycurl.FAILONERROR, 1)
+                        handle.headers = []
+                        handle.setopt(pycurl.HEADERFUNCTION,
+                                      handle.headers.append)
 
                         # check if we have a valid local file and use I-M-S
+                        httpheader = ["Pragma:"]
                         if fetcher.validate(item, localpath):
                             handle.setopt(pycurl.TIMECONDITION,
                                           pycurl.TIMECONDITION_IFMODSINCE)
@@ -1737,10 +2368,15 @@ class PyCurlHandler(FetcherHandler):
                             if url.scheme == "ftp":
                                 mtime += 1 # libcurl handles ftp mtime wrongly
                             handle.setopt(pycurl.TIMEVALUE, int(mtime))
+                            metadata = fetcher.getFileMetadata(localpath)
+                            etag = metadata.get("etag")
+                            if etag:
+                                httpheader.append("If-None-Match: "+etag)
                         else:
                             # reset the I-M-S option 
                             handle.setopt(pycurl.TIMECONDITION,
                                           pycurl.TIMECONDITION_NONE)
+                        handle.setopt(pycurl.HTTPHEADER, httpheader)
                                           
                         rate_limit = self._fetcher._maxdownloadrate
                         if rate_limit:
@@ -1754,16 +2390,38 @@ class PyCurlHandler(FetcherHandler):
 
         return bool(self._queue or self._active)
 
+    def setFileMetadata(self, handle, localpath):
+        # Only the headers of the last response matter, since the
+        # ones before it were redirections.
+        etag = lastmodified = None
+        for line in handle.headers:
+            if line.startswith("HTTP/"):
+                etag = lastmodified = None
+            elif ":" in line:
+                name, value = line.split(":", 1)
+                name = name.strip().lower()
+                if name == "etag":
+                    etag = value.strip()
+                elif name == "last-modified":
+                    lastmodified = value.strip()
+        self._fetcher.setFileMetadata(localpath, etag=etag,
+                                      lastmodified=lastmodified)
+
     def perform(self):
         import pycurl
         multi = self._multi
         mp = pycurl.E_CALL_MULTI_PERFORM
+        running = 0
         while self._queue or self._active:
             self._lock.acquire()
             res = mp
             while res == mp:
                 res, num = multi.perform()
             self._lock.release()
+            if num < running:
+                # Transfers are collected by tick(), so ask for one.
+                self._fetcher.wakeUp()
+            running = num
             multi.select(1.0)
         # Keep in mind that even though the while above has exited due to
         # self._active being False, it may actually be true *here* due to
@@ -1810,8 +2468,8 @@ class SCPHandler(FetcherHandler):
                         self._active.append(item)
                         item.total = None
                         item.localpath = None
-                        thread.start_new_thread(self.fetch, (item,))
-        prog = iface.getSubProgress(self._fetcher)
+                        self._fetcher.startTask(self.fetch, item)
+        prog = self._fetcher.getSubProgress()
         for item in self._active:
             if item.total and item.localpath:
                 try:
@@ -1820,14 +2478,15 @@ class SCPHandler(FetcherHandler):
                     pass
                 else:
                     item.progress(size, item.total)
+        active = bool(self._queue or self._active)
         self._lock.release()
-        return bool(self._queue or self._active)
+        return active
 
     def fetch(self, item):
         from smart.util.ssh import SSH
 
         fetcher = self._fetcher
-        prog = iface.getSubProgress(self._fetcher)
+        prog = self._fetcher.getSubProgress()
 
         item.start()
 
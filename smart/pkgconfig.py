@@ -20,10 +20,47 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
+class FlagMatcher(object):
+    """
+    Test packages against the targets of a flag, as given to the
+    constructor. Names with an unversioned target match any version
+    without asking the package.
+    """
+
+    def __init__(self, targets):
+        self._names = {}
+        for name, items in targets.iteritems():
+            for relation, version in items:
+                if not relation:
+                    self._names[name] = None
+                    break
+            else:
+                if items:
+                    self._names[name] = tuple(items)
+
+    def getNames(self):
+        return self._names.keys()
+
+    def matches(self, pkg):
+        items = self._names.get(pkg.name, ())
+        if items is None:
+            return True
+        for relation, version in items:
+            if pkg.matches(relation, version):
+                return True
+        return False
+
+    def filter(self, pkgs):
+        names = self._names
+        matches = self.matches
+        return [pkg for pkg in pkgs if pkg.name in names and matches(pkg)]
+
 class PkgConfig(object):
     
     def __init__(self, config):
         self._config = config
+        self._matchers = {}
+        self._generation = None
 
     def getFlagNames(self):
         return self._config.keys("package-flags", ())
@@ -46,6 +83,9 @@ class PkgConfig(object):
                    config.get(("package-flags", oldname)))
         config.remove(("package-flags", oldname))
 
+    def setFlagTargets(self, flag, targets):
+        self._config.set(("package-flags", flag), targets)
+
     def setFlag(self, flag, name, relation=None, version=None):
         self._config.add(("package-flags", flag, name),
                          (relation, version), unique=True)
@@ -61,24 +101,33 @@ class PkgConfig(object):
         else:
             return self._config.remove(("package-flags", flag))
 
+    def getFlagMatcher(self, flag):
+        """
+        Return a FlagMatcher for the flag. It's shared until the
+        configuration changes, so hot loops should fetch it once
+        rather than keeping it around.
+        """
+        generation = self._config.getGeneration()
+        if generation != self._generation:
+            self._matchers.clear()
+            self._generation = generation
+        matcher = self._matchers.get(flag)
+        if matcher is None:
+            # Names are looked up in the soft, hard and weak maps, in
+            # that order, as get() would for each of them.
+            targets = {}
+            path = ("package-flags", flag)
+            targets.update(self._config.getSnapshot(path, {}, weak=True))
+            targets.update(self._config.getSnapshot(path, {}, hard=True))
+            targets.update(self._config.getSnapshot(path, {}, soft=True))
+            matcher = self._matchers[flag] = FlagMatcher(targets)
+        return matcher
+
     def testFlag(self, flag, pkg):
-        for item in self._config.get(("package-flags", flag, pkg.name), ()):
-            if pkg.matches(*item):
-                return True
-        return False
+        return self.getFlagMatcher(flag).matches(pkg)
 
     def filterByFlag(self, flag, pkgs):
-        fpkgs = []
-        names = self._config.get(("package-flags", flag))
-        if names:
-            for pkg in pkgs:
-                lst = names.get(pkg.name)
-                if lst:
-                    for item in lst:
-                        if pkg.matches(*item):
-                            fpkgs.append(pkg)
-                            break
-        return fpkgs
+        return self.getFlagMatcher(flag).filter(pkgs)
 
     def testAllFlags(self, pkg):
         result = []
@@ -89,7 +138,8 @@ class PkgConfig(object):
 
     def getPriority(self, pkg):
         priority = None
-        priorities = self._config.get(("package-priorities", pkg.name))
+        priorities = self._config.getSnapshot(("package-priorities",
+                                                pkg.name))
         if priorities:
             priority = None
             for loader in pkg.loaders:
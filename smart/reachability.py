@@ -0,0 +1,160 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.const import REMOVE
+from smart import *
+
+# Bumped on every cache load, so that graphs built before it are
+# known to be stale.
+_loads = 0
+
+
+class Reachability(object):
+    """
+    Dependency graph among the installed packages of a cache.
+
+    Forward and reverse edges are computed once, and each query then
+    walks them in time linear in the size of the graph. Edges follow
+    requires and recommends, as markAndSweep() always did.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._loads = _loads
+        self._packages = packages = [x for x in cache.getPackages()
+                                     if x.installed]
+        self._index = index = {}
+        for i in range(len(packages)):
+            index[packages[i]] = i
+        self._requires = [[] for pkg in packages]
+        self._recommends = [[] for pkg in packages]
+        self._requiredby = [[] for pkg in packages]
+        self._recommendedby = [[] for pkg in packages]
+        for i in range(len(packages)):
+            pkg = packages[i]
+            self._link(i, pkg.requires, self._requires, self._requiredby)
+            self._link(i, pkg.recommends,
+                       self._recommends, self._recommendedby)
+        self._automatcher = None
+        self._orphans = None
+
+    def _link(self, i, deps, forward, reverse):
+        index = self._index
+        seen = {}
+        for dep in deps:
+            for prv in dep.providedby:
+                for prvpkg in prv.packages:
+                    j = index.get(prvpkg)
+                    if j is not None and j not in seen:
+                        seen[j] = True
+                        forward[i].append(j)
+                        reverse[j].append(i)
+
+    def isCurrent(self, cache):
+        return cache is self._cache and self._loads == _loads
+
+    def getPackages(self):
+        return self._packages
+
+    def getRequiredBy(self, pkg):
+        packages = self._packages
+        return [packages[i] for i in self._requiredby[self._index[pkg]]]
+
+    def isLeaf(self, pkg):
+        i = self._index.get(pkg)
+        return i is None or not self._requiredby[i]
+
+    def getLeaves(self):
+        """Return installed packages no installed package requires."""
+        requiredby = self._requiredby
+        packages = self._packages
+        return [packages[i] for i in range(len(packages))
+                if not requiredby[i]]
+
+    def _mark(self, roots, skip):
+        requires = self._requires
+        recommends = self._recommends
+        marked = [False]*len(self._packages)
+        queue = []
+        for i in roots:
+            if not marked[i]:
+                marked[i] = True
+                queue.append(i)
+        pos = 0
+        while pos < len(queue):
+            i = queue[pos]
+            pos += 1
+            for deps in (requires[i], recommends[i]):
+                for j in deps:
+                    if not marked[j] and not skip[j]:
+                        marked[j] = True
+                        queue.append(j)
+        return marked
+
+    def sweep(self, changeset=None, automatcher=None):
+        """
+        Return installed packages which nothing that was explicitly
+        installed needs anymore, once the given changeset is applied.
+        Packages in the changeset are never reached through others,
+        and the ones being removed are never kept on their own.
+        """
+        if changeset is None:
+            changeset = {}
+        if automatcher is None:
+            automatcher = pkgconf.getFlagMatcher("auto")
+        index = self._index
+        packages = self._packages
+        skip = [False]*len(packages)
+        for pkg in changeset:
+            i = index.get(pkg)
+            if i is not None:
+                skip[i] = True
+        roots = [i for i in range(len(packages))
+                 if (not automatcher.matches(packages[i]) and
+                     changeset.get(packages[i]) != REMOVE)]
+        marked = self._mark(roots, skip)
+        return [packages[i] for i in range(len(packages)) if not marked[i]]
+
+    def getOrphans(self):
+        """Return automatically installed packages nothing needs."""
+        automatcher = pkgconf.getFlagMatcher("auto")
+        if self._orphans is None or automatcher is not self._automatcher:
+            self._orphans = self.sweep(automatcher=automatcher)
+            self._automatcher = automatcher
+        return self._orphans
+
+    def getRemovalImpact(self, pkgs):
+        """
+        Return packages which would become orphans if the given ones
+        were removed, not counting those which are orphans already.
+        """
+        changeset = {}
+        for pkg in pkgs:
+            if pkg in self._index:
+                changeset[pkg] = REMOVE
+        orphans = dict.fromkeys(self.getOrphans())
+        return [pkg for pkg in self.sweep(changeset)
+                if pkg not in changeset and pkg not in orphans]
+
+
+def cacheLoaded(cache):
+    global _loads
+    _loads += 1
+
+hooks.register("cache-loaded", cacheLoaded)
+
+# vim:ts=4:sw=4:et
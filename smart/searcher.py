@@ -19,10 +19,14 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
+from smart.util.tokenindex import TokenIndex, TrigramIndex, getGlobWords
+from smart.util.tokenindex import readTokenIndex, writeTokenIndex
+from smart.util.tokenindex import getTokenIndexDigest
 from smart.util.strtools import globdistance
 from smart.cache import Provides
 from smart import *
 import fnmatch
+import os
 import re
 
 def _stripeol(pattern):
@@ -55,6 +59,12 @@ class Searcher(object):
       that Loaders are able to speedup the searching process, since
       many times it's necessary to access huge sequential files for
       looking up information.
+
+    - when group, summary, description, path, and url are looked
+      for, getCandidates() uses the search index of the loader, if
+      any, so that only packages with the words in the patterns, or
+      with the trigrams of the path and url patterns, have to be
+      checked.
     """
 
     def __init__(self):
@@ -71,9 +81,11 @@ class Searcher(object):
         self.summary = []
         self.description = []
         self.ignorecase = True
+        self._words = {}
 
     def reset(self):
         self._results.clear()
+        self._words.clear()
         del self.nameversion[:]
         del self.provides[:]
         del self.requires[:]
@@ -111,6 +123,35 @@ class Searcher(object):
             lst = [x for x in lst if x[0] == best]
         return lst
 
+    def getCandidates(self, loader):
+        """
+        Return the packages from loader which may match the url,
+        path, group, summary, and description patterns.
+        """
+        packages = loader.getPackages()
+        if not (self.url or self.path or self.group or
+                self.summary or self.description):
+            return packages
+        index = getSearchIndex(loader)
+        if index is None:
+            return packages
+        tokens, trigrams = index
+        keys = {}
+        for field, patterns in enumerate([self.url, self.path]):
+            for pattern, cutoff in patterns:
+                found = trigrams.search(pattern, cutoff, field)
+                if found is None:
+                    return packages
+                keys.update(dict.fromkeys(found))
+        for field, patterns in enumerate([self.group, self.summary,
+                                          self.description]):
+            for pattern in patterns:
+                words = self._words.get(pattern)
+                if not words:
+                    return packages
+                keys.update(dict.fromkeys(tokens.search(words, field)))
+        return [pkg for pkg in packages if (pkg.name, pkg.version) in keys]
+
     def searchCache(self, cache):
         for loader in cache.getLoaders():
             loader.search(self)
@@ -207,16 +248,85 @@ class Searcher(object):
         self.url.append((s, cutoff))
 
     def addGroup(self, s):
+        words = getGlobWords(s)
         s = _stripeol(fnmatch.translate(s)).replace("\ ", " ")
         p = re.compile("\s+".join(s.split()), self.ignorecase and re.I or 0)
         self.group.append(p)
+        self._words[p] = words
 
     def addSummary(self, s):
+        words = getGlobWords(s)
         s = _stripeol(fnmatch.translate(s)).replace("\ ", " ")
         p = re.compile("\s+".join(s.split()), self.ignorecase and re.I or 0)
         self.summary.append(p)
+        self._words[p] = words
 
     def addDescription(self, s):
+        words = getGlobWords(s)
         s = _stripeol(fnmatch.translate(s)).replace("\ ", " ")
         p = re.compile("\s+".join(s.split()), self.ignorecase and re.I or 0)
         self.description.append(p)
+        self._words[p] = words
+
+_indexes = {}
+
+def getSearchIndexPath(loader):
+    """
+    Return the path and the digest of the search index for loader,
+    or (None, None) if it can't have one.
+    """
+    channel = loader.getChannel()
+    if channel is None or not sysconf.get("search-index", True):
+        return None, None
+    digest = channel.getDigest()
+    if type(digest) not in (str, unicode, int, long, float):
+        return None, None
+    loaders = channel.getLoaders()
+    if loader not in loaders:
+        return None, None
+    path = os.path.join(sysconf.get("data-dir"), "channels",
+                        "%s%%%%search%d" % (channel.getAlias(),
+                                            loaders.index(loader)))
+    return path, digest
+
+def getSearchIndex(loader):
+    """
+    Return the (TokenIndex, TrigramIndex) pair built for loader,
+    or None.
+    """
+    path, digest = getSearchIndexPath(loader)
+    if not path:
+        return None
+    cached = _indexes.get(path)
+    if cached and cached[0] == digest:
+        return cached[1]
+    index = readTokenIndex(path, digest)
+    if index is not None:
+        _indexes[path] = (digest, index)
+    return index
+
+def updateSearchIndex(loader):
+    """
+    Index the group, summary, description, reference URLs, and paths
+    of the packages in loader, unless the index for its channel digest
+    is there already.
+    """
+    path, digest = getSearchIndexPath(loader)
+    if (not path or sysconf.getReadOnly() or
+        not os.access(os.path.dirname(path), os.W_OK) or
+        getTokenIndexDigest(path) == digest):
+        return
+    tokens = TokenIndex()
+    trigrams = TrigramIndex()
+    for pkg, texts, urls, paths in loader.getSearchTexts():
+        key = (pkg.name, pkg.version)
+        tokens.add(key, *texts)
+        trigrams.add(key, urls, paths)
+    index = (tokens, trigrams)
+    try:
+        writeTokenIndex(path, index, digest)
+    except (IOError, OSError):
+        return
+    _indexes[path] = (digest, index)
+
+# vim:ts=4:sw=4:et
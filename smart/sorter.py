@@ -19,6 +19,7 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
+import heapq
 import os, sys
 
 from smart.const import INSTALL, REMOVE
@@ -41,6 +42,12 @@ if sys.version_info < (2, 4):
     __builtins__['sorted'] = sorted
 
 
+# Loops with up to this many relations have the order in which their
+# relations are reenabled scored by how much of the loop would be left
+# without each of them, which costs a search of the loop per relation.
+MAXIMUM_SCORED_RELATIONS = 100
+
+
 class DisableError(Error):
     """Raised on a request to break a non-existent or unbreakable relation."""
 
@@ -134,54 +141,180 @@ class ElementSorter(object):
                 path.pop()
         return (elements, relations)
 
+    def _getFollowed(self, elem, follow_relations, maximum_priority):
+        followed = []
+        for succ in self._successors.get(elem, ()):
+            relation = (elem, succ)
+            if ((relation not in self._disabled) and
+                (follow_relations is None or
+                 relation in follow_relations) and
+                (maximum_priority is None or
+                 self._priorities[relation] <= maximum_priority)):
+                followed.append(succ)
+        return followed
+
+    def _getLoops(self, elements,
+                  follow_relations=None, maximum_priority=None):
+        """Return the loops reachable from C{elements}.
+
+        Loops are the strongly connected components of the graph, found
+        with Tarjan's algorithm in a single pass over the relations.
+        """
+        def follow(elem):
+            return self._getFollowed(elem, follow_relations, maximum_priority)
+        index = {}
+        lowlink = {}
+        stack = []
+        onstack = set()
+        loops = []
+        for root in elements:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            onstack.add(root)
+            path = [(root, iter(follow(root)))]
+            while path:
+                elem, followed = path[-1]
+                for succ in followed:
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = len(index)
+                        stack.append(succ)
+                        onstack.add(succ)
+                        path.append((succ, iter(follow(succ))))
+                        break
+                    if succ in onstack and index[succ] < lowlink[elem]:
+                        lowlink[elem] = index[succ]
+                else:
+                    path.pop()
+                    if path:
+                        pred = path[-1][0]
+                        if lowlink[elem] < lowlink[pred]:
+                            lowlink[pred] = lowlink[elem]
+                    if lowlink[elem] == index[elem]:
+                        loop_elements = set()
+                        while True:
+                            member = stack.pop()
+                            onstack.remove(member)
+                            loop_elements.add(member)
+                            if member == elem:
+                                break
+                        loop_relations = set()
+                        for pred in loop_elements:
+                            for succ in follow(pred):
+                                if succ in loop_elements:
+                                    loop_relations.add((pred, succ))
+                        if loop_relations:
+                            loops.append((loop_elements, loop_relations))
+        return loops
+
     def getLoops(self):
         """Return all elements and relations participating in loops.
 
         The result is the same as for L{getPathData()}, except that only
         elements and relations involved in loops will be returned.
         """
-        all_loop_elements = set()
-        loops = []
-        for elem in self._successors:
-            if elem not in all_loop_elements:
-                loop_elements, loop_relations = self.getPathData(elem, elem)
-                if loop_elements:
-                    done = set([elem])
-                    todo = loop_elements - done
-                    while todo:
-                        loop_elem = todo.pop()
-                        more_elements, more_relations = \
-                            self.getPathData(loop_elem, loop_elem)
-                        loop_elements.update(more_elements)
-                        loop_relations.update(more_relations)
-                        done.add(loop_elem)
-                        more_elements.difference_update(done)
-                        todo.update(more_elements)
-                    loops.append((loop_elements, loop_relations))
-                    all_loop_elements.update(loop_elements)
-        return loops
+        return self._getLoops(self._successors)
 
     def hasLoop(self, elements, relations):
-        for elem in elements:
-            data = self.getPathData(elem, elem, follow_relations=relations)
-            if data[0]:
-                return True
-        return False
+        return bool(self._getLoops(elements, follow_relations=relations))
 
     def countRelationsInLoop(self, elements, relations, maximum_priority=None):
         loop_relations = 0
-        loop_elements = set()
-        for elem in elements:
-            if elem not in loop_elements:
-                data = self.getPathData(elem, elem,
-                                        follow_relations=relations,
-                                        maximum_priority=maximum_priority)
-                if data[0]:
-                    loop_elements.update(data[0])
-                    loop_relations += len(data[1])
+        for data in self._getLoops(elements, follow_relations=relations,
+                                   maximum_priority=maximum_priority):
+            loop_relations += len(data[1])
         return loop_relations
 
-    def _getReenableOrder(self, elements, relations):
+    def _orderLoop(self, elements, relations):
+        """Order the elements of a loop so that few relations lead back.
+
+        This is the greedy heuristic of Eades, Lin, and Smyth: elements
+        which are only left with successors go to the front, ones only
+        left with predecessors go to the back, and otherwise the one
+        with most successors over predecessors goes to the front.  The
+        result is a tuple where the first item is the list of ordered
+        elements, and the second item is the set of relations which
+        lead back in it.
+        """
+        successors = {}
+        predecessors = {}
+        for elem in elements:
+            successors[elem] = []
+            predecessors[elem] = []
+        for pred, succ in relations:
+            if pred != succ:
+                successors[pred].append(succ)
+                predecessors[succ].append(pred)
+        outdegree = {}
+        indegree = {}
+        heap = []
+        serial = 0
+        for elem in elements:
+            outdegree[elem] = len(successors[elem])
+            indegree[elem] = len(predecessors[elem])
+            heap.append((indegree[elem]-outdegree[elem], serial, elem))
+            serial += 1
+        heapq.heapify(heap)
+        left = set(elements)
+        front = []
+        back = []
+        ends = [elem for elem in elements
+                if not outdegree[elem] or not indegree[elem]]
+        while left:
+            if ends:
+                elem = ends.pop()
+                if elem not in left:
+                    continue
+                if not outdegree[elem]:
+                    back.append(elem)
+                else:
+                    front.append(elem)
+            else:
+                delta, _, elem = heapq.heappop(heap)
+                if (elem not in left or
+                    delta != indegree[elem]-outdegree[elem]):
+                    continue
+                front.append(elem)
+            left.remove(elem)
+            for pred in predecessors[elem]:
+                if pred in left:
+                    outdegree[pred] -= 1
+                    if not outdegree[pred]:
+                        ends.append(pred)
+                    else:
+                        heapq.heappush(heap, (indegree[pred]-outdegree[pred],
+                                              serial, pred))
+                        serial += 1
+            for succ in successors[elem]:
+                if succ in left:
+                    indegree[succ] -= 1
+                    if not indegree[succ]:
+                        ends.append(succ)
+                    else:
+                        heapq.heappush(heap, (indegree[succ]-outdegree[succ],
+                                              serial, succ))
+                        serial += 1
+        back.reverse()
+        order = front+back
+        rank = {}
+        for i, elem in enumerate(order):
+            rank[elem] = i
+        back_relations = set([(pred, succ) for pred, succ in relations
+                              if rank[pred] >= rank[succ]])
+        return order, back_relations
+
+    def _getReenableOrder(self, elements, relations, back_relations):
+        if len(relations) > MAXIMUM_SCORED_RELATIONS:
+            # Scoring would run a search of the whole loop for each of
+            # its relations. Prefer relations which don't lead back in
+            # the loop order instead, after their priority.
+            priorities = self._priorities
+            sort_key = {}
+            for relation in relations:
+                sort_key[relation] = (priorities[relation],
+                                      relation in back_relations)
+            return sorted(relations, key=sort_key.get)
         follow_relations = set(relations)
         sort_key = {}
         for relation in relations:
@@ -203,6 +336,51 @@ class ElementSorter(object):
             follow_relations.add(relation)
         return sorted(relations, key=sort_key.get)
 
+    def _reenableRelation(self, relation, rank, successors, predecessors):
+        """Reenable C{relation} unless it recreates a loop.
+
+        C{rank} must order the elements so that enabled relations always
+        go from a lower to a higher rank, and is kept that way as in the
+        dynamic topological sort of Pearce and Kelly, so that only the
+        elements ranked between the two ends of the relation are looked
+        at.
+        """
+        pred, succ = relation
+        lower = rank[succ]
+        upper = rank[pred]
+        if lower > upper:
+            forward = backward = ()
+        else:
+            forward = [succ]
+            seen = set(forward)
+            for elem in forward:
+                for next in successors.get(elem, ()):
+                    if next == pred:
+                        return False
+                    if next not in seen and rank[next] < upper:
+                        seen.add(next)
+                        forward.append(next)
+            if succ == pred:
+                return False
+            backward = [pred]
+            seen = set(backward)
+            for elem in backward:
+                for next in predecessors.get(elem, ()):
+                    if next not in seen and rank[next] > lower:
+                        seen.add(next)
+                        backward.append(next)
+        # Move what leads to pred before what succ leads to, reusing
+        # their ranks.
+        moved = (sorted(backward, key=rank.get) +
+                 sorted(forward, key=rank.get))
+        ranks = sorted([rank[elem] for elem in moved])
+        for elem, elem_rank in zip(moved, ranks):
+            rank[elem] = elem_rank
+        successors.setdefault(pred, []).append(succ)
+        predecessors.setdefault(succ, []).append(pred)
+        self.enableRelation(relation)
+        return True
+
     def breakLoops(self):
         # Reenable all relations so that we identify all potential
         # loops correctly, and retrieve data for all loops.  Note that
@@ -215,8 +393,11 @@ class ElementSorter(object):
         for loop_elements, loop_relations in loops:
             # Get our best guess of a good ordering to try reenabling
             # relations which are part of this loop later.
-            reenable_order = self._getReenableOrder(loop_elements,
+            order, back_relations = self._orderLoop(loop_elements,
                                                     loop_relations)
+            reenable_order = self._getReenableOrder(loop_elements,
+                                                    loop_relations,
+                                                    back_relations)
 
             for relation in loop_relations:
                 # Disable all relations participating in this loop.
@@ -227,14 +408,14 @@ class ElementSorter(object):
             # order which gives precedence for relations with higher
             # priority, and for relations that are unlikely to
             # recreate big loops.
+            rank = {}
+            for i, elem in enumerate(order):
+                rank[elem] = i
+            successors = {}
+            predecessors = {}
             for relation in reenable_order:
-                if relation in self._disabled:
-                    pred, succ = relation
-                    elements, relations = \
-                        self.getPathData(succ, pred,
-                                         follow_relations=loop_relations)
-                    if not elements:
-                        self.enableRelation(relation)
+                self._reenableRelation(relation, rank,
+                                       successors, predecessors)
 
     def addElement(self, elem):
         if elem not in self._successors:
@@ -290,6 +471,44 @@ class ElementSorter(object):
 
         return result
 
+    def getLayers(self):
+        """Return the sorted elements as a list of layers.
+
+        Each layer is a list of elements with no ordering between them,
+        which only have to come after the elements of previous layers.
+        """
+        successors = self._successors
+        predcount = self._predcount.copy()
+
+        self.breakLoops()
+
+        for pred, succ in self._disabled:
+            predcount[succ] -= 1
+
+        layer = [x for x in successors if not predcount.get(x)]
+        layers = []
+        total = 0
+        while layer:
+            layers.append(layer)
+            total += len(layer)
+            next = []
+            for elem in layer:
+                for succ in successors.get(elem, ()):
+                    if (elem, succ) not in self._disabled:
+                        left = predcount.get(succ)
+                        if left is not None:
+                            if left-1 == 0:
+                                del predcount[succ]
+                                next.append(succ)
+                            else:
+                                predcount[succ] -= 1
+            layer = next
+
+        if total != len(successors):
+            raise RuntimeError("There are remaining loops")
+
+        return layers
+
 
 class ChangeSetSorter(ElementSorter):
 
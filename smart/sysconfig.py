@@ -48,6 +48,8 @@ class SysConfig(object):
         self._readonly = False
         self._modified = False
         self._config = self
+        self._generation = 0
+        self._snapshots = {}
 
     def getReadOnly(self):
         return self._readonly
@@ -61,6 +63,14 @@ class SysConfig(object):
     def resetModified(self):
         self._modified = False
 
+    def getGeneration(self):
+        """Return a counter which is increased on every change."""
+        return self._generation
+
+    def _changed(self):
+        self._generation += 1
+        self._snapshots.clear()
+
     def assertWritable(self):
         if self._readonly:
             raise Error, _("Configuration is in readonly mode.")
@@ -73,6 +83,7 @@ class SysConfig(object):
             return
         file = open(filepath)
         self._hardmap.clear()
+        self._changed()
         try:
             self._hardmap.update(pickle.load(file))
         except:
@@ -214,6 +225,27 @@ class SysConfig(object):
             return copy.deepcopy(value)
         return value
 
+    def getSnapshot(self, path, default=None,
+                    soft=False, hard=False, weak=False):
+        """
+        Like get(), but return a read-only copy of the value, which
+        is shared by every caller until the configuration changes.
+        Dictionaries are returned as FrozenDict, and lists as tuples.
+        Changes made to values passed to set() or add() after the
+        fact aren't noticed.
+        """
+        if type(path) is str:
+            path = pathStringToTuple(path)
+        key = (path, soft, hard, weak)
+        try:
+            value = self._snapshots[key]
+        except KeyError:
+            value = freeze(self._getvalue(path, soft, hard, weak))
+            self._snapshots[key] = value
+        if value is NOTHING:
+            return default
+        return value
+
     def set(self, path, value, soft=False, weak=False):
         assert path
         if type(path) is str:
@@ -226,6 +258,7 @@ class SysConfig(object):
             self.assertWritable()
             self._modified = True
             map = self._hardmap
+        self._changed()
         self._traverse(map, path, setvalue=value)
 
     def add(self, path, value, unique=False, soft=False, weak=False):
@@ -240,6 +273,7 @@ class SysConfig(object):
             self.assertWritable()
             self._modified = True
             map = self._hardmap
+        self._changed()
         if unique:
             current = self._traverse(map, path)
             if type(current) is list and value in current:
@@ -259,6 +293,7 @@ class SysConfig(object):
             self.assertWritable()
             self._modified = True
             map = self._hardmap
+        self._changed()
         marker = NOTHING
         while path:
             if value is marker:
@@ -311,6 +346,32 @@ class SysConfig(object):
         return result
 
 
+class FrozenDict(dict):
+    """Dictionary which can't be changed, as given by getSnapshot()."""
+
+    def _readonly(self, *args, **kwargs):
+        raise Error, "Configuration snapshots are read-only"
+
+    __setitem__ = __delitem__ = _readonly
+    clear = update = pop = popitem = setdefault = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def copy(self):
+        return dict(self)
+
+def freeze(value):
+    if type(value) is dict:
+        frozen = FrozenDict()
+        for key, item in value.iteritems():
+            dict.__setitem__(frozen, key, freeze(item))
+        return frozen
+    elif type(value) in (list, tuple):
+        return tuple([freeze(item) for item in value])
+    return value
+
+
 SPLITPATH = re.compile(r"(\[-?\d+\])|(?<!\\)\.").split
 
 def pathStringToTuple(path):
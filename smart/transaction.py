@@ -21,7 +21,14 @@
 #
 from smart.const import INSTALL, REMOVE, UPGRADE, FIX, REINSTALL, KEEP, LOCKED_EXCLUDE, LOCKED_INSTALL, LOCKED_CONFLICT, LOCKED_CONFLICT_BY, LOCKED_NO_COEXIST, LOCKED_SYSCONF, LOCKED_REMOVE
 from smart.cache import PreRequires, Package
+from smart.util.layereddict import LayeredDict, DictLayer
 from smart import *
+import traceback
+import cPickle
+import errno
+import sys
+import os
+import gc
 
 def lock_reason(pkg, lockvalue):
     try:
@@ -46,7 +53,10 @@ def lock_reason(pkg, lockvalue):
     else:
         return _("%s is locked (unknown reason)") % pkg
 
-class ChangeSet(dict):
+class ChangeSet(LayeredDict):
+
+    _weightpolicy = None
+    _weight = 0
 
     def __init__(self, cache, state=None, requested=None):
         self._cache = cache
@@ -56,28 +66,82 @@ class ChangeSet(dict):
         if requested:
             self._requested.update(requested)
 
+    def __setitem__(self, pkg, op):
+        policy = self._weightpolicy
+        if policy is None:
+            super(ChangeSet, self).__setitem__(pkg, op)
+        else:
+            terms = policy.getWeightTerms(pkg)
+            weight = self._weight
+            for func, arg in terms:
+                weight -= func(arg, self)
+            super(ChangeSet, self).__setitem__(pkg, op)
+            for func, arg in terms:
+                weight += func(arg, self)
+            self._weight = weight
+
+    def __delitem__(self, pkg):
+        policy = self._weightpolicy
+        if policy is None:
+            super(ChangeSet, self).__delitem__(pkg)
+        else:
+            terms = policy.getWeightTerms(pkg)
+            weight = self._weight
+            for func, arg in terms:
+                weight -= func(arg, self)
+            super(ChangeSet, self).__delitem__(pkg)
+            for func, arg in terms:
+                weight += func(arg, self)
+            self._weight = weight
+
+    def _isPlain(self):
+        return (self._weightpolicy is None and
+                super(ChangeSet, self)._isPlain())
+
     def clear(self):
-        dict.clear(self)
+        if self._weightpolicy is None:
+            super(ChangeSet, self).clear()
+        else:
+            for pkg in self.keys():
+                del self[pkg]
         self._requested.clear()
 
     def update(self, other):
-        dict.update(self, other)
-        if type(other) is ChangeSet:
+        super(ChangeSet, self).update(other)
+        if isinstance(other, ChangeSet):
             self._requested.update(other._requested)
 
-    def copy(self):
-        return ChangeSet(self._cache, self, self._requested)
+    def _copy(self, cls):
+        cs = super(ChangeSet, self)._copy(cls)
+        cs._cache = self._cache
+        cs._requested = self._requested.copy()
+        cs._weightpolicy = self._weightpolicy
+        cs._weight = self._weight
+        return cs
+
+    def trackWeight(self, policy):
+        """
+        Keep the weight given by policy up to date while the changeset
+        is modified, so that policy.getWeight() doesn't have to compute
+        it again. Copies are tracked as well. Pass None to stop.
+        """
+        self._weightpolicy = None
+        if policy is not None:
+            self._weight = policy.computeWeight(self)
+            self._weightpolicy = policy
 
     def getCache(self):
         return self._cache
 
     def getState(self):
-        return (self.copy(), self._requested.copy())
+        return (ChangeSet(self._cache, self), self._requested.copy())
 
     def setState(self, state):
         if state is not self:
-            self.clear()
-            self.update(state)
+            self.assign(state)
+            self._requested.clear()
+            if isinstance(state, ChangeSet):
+                self._requested.update(state._requested)
 
     def getPersistentState(self):
         state = {}
@@ -196,6 +260,92 @@ class ChangeSet(dict):
             l.append("%s %s\n" % (self[pkg] is INSTALL and "I" or "R", pkg))
         return "".join(l)
 
+class ChangeSetLayer(ChangeSet, DictLayer):
+    pass
+
+ChangeSet._layerclass = ChangeSetLayer
+
+class _TrialChangeSet(ChangeSetLayer):
+    """
+    Changeset used by solver workers. It records the packages looked
+    up through it or its copies, and logs the changes made to itself,
+    so that the trial may be checked and replayed by the parent.
+    """
+
+    _reads = None
+    _log = None
+
+    def _copy(self, cls):
+        cs = ChangeSetLayer._copy(self, cls)
+        cs._reads = self._reads
+        return cs
+
+    def get(self, pkg, default=None):
+        self._reads[pkg] = True
+        return ChangeSetLayer.get(self, pkg, default)
+
+    def _setFlat(self, flat):
+        # Don't let lookups bypass get(), or they wouldn't be recorded.
+        self._flat = flat
+
+    def _view(self):
+        # Everything is read. None can't be a package.
+        self._reads[None] = True
+        return ChangeSetLayer._view(self)
+
+    def __setitem__(self, pkg, op):
+        ChangeSetLayer.__setitem__(self, pkg, op)
+        if self._log is not None:
+            self._log.append((pkg, op))
+
+    def __delitem__(self, pkg):
+        ChangeSetLayer.__delitem__(self, pkg)
+        if self._log is not None:
+            self._log.append((pkg, None))
+
+_TrialChangeSet._layerclass = _TrialChangeSet
+
+class _Trial(object):
+    """Result of installing a package in a solver worker."""
+
+    def __init__(self, reads, error=None, log=None, requested=None,
+                 lockeddelta=None):
+        self._reads = reads
+        self._error = error
+        self._log = log
+        self._requested = requested
+        self._lockeddelta = lockeddelta
+
+    def isValid(self, changed):
+        """Check if the trial holds after the given packages changed."""
+        if changed:
+            for pkg in self._reads:
+                if pkg is None or pkg in changed:
+                    return False
+        return True
+
+    def replay(self, changeset, locked):
+        if self._error is not None:
+            raise self._error
+        cs = changeset.copy()
+        for pkg, op in self._log:
+            if op is None:
+                del cs[pkg]
+            else:
+                cs[pkg] = op
+        added, removed = self._requested
+        for pkg in removed:
+            if pkg in cs._requested:
+                del cs._requested[pkg]
+        cs._requested.update(added)
+        lk = locked.copy()
+        lkchanged, lkremoved = self._lockeddelta
+        for pkg in lkremoved:
+            if pkg in lk:
+                del lk[pkg]
+        lk.update(lkchanged)
+        return cs, lk
+
 class Policy(object):
 
     def __init__(self, trans):
@@ -203,9 +353,13 @@ class Policy(object):
         self._locked = {}
         self._sysconflocked = []
         self._priorities = {}
+        self._weightterms = {}
+        self._checkweight = False
 
     def runStarting(self):
         self._priorities.clear()
+        self._weightterms.clear()
+        self._checkweight = sysconf.get("check-policy-weights", False)
         cache = self._trans.getCache()
         for pkg in pkgconf.filterByFlag("lock", cache.getPackages()):
             if pkg not in self._locked:
@@ -218,6 +372,7 @@ class Policy(object):
 
     def runFinished(self):
         self._priorities.clear()
+        self._weightterms.clear()
         for pkg in self._sysconflocked:
             del self._locked[pkg]
         del self._sysconflocked[:]
@@ -236,8 +391,37 @@ class Policy(object):
         return self._locked
 
     def getWeight(self, changeset):
+        if changeset._weightpolicy is not self:
+            return self.computeWeight(changeset)
+        weight = changeset._weight
+        if self._checkweight:
+            computed = self.computeWeight(changeset)
+            if abs(weight-computed) > 1e-6:
+                raise Error, _("Tracked weight %s doesn't match "
+                               "computed weight %s") % (weight, computed)
+        return weight
+
+    def computeWeight(self, changeset):
+        """Compute the weight of changeset from scratch."""
         return 0
 
+    def getWeightTerms(self, pkg):
+        terms = self._weightterms.get(pkg)
+        if terms is None:
+            terms = dict.fromkeys(self.computeWeightTerms(pkg)).keys()
+            self._weightterms[pkg] = terms
+        return terms
+
+    def computeWeightTerms(self, pkg):
+        """
+        Return (function, argument) pairs for all terms of the weight
+        which may change when the operation on pkg changes. Calling
+        function(argument, changeset) returns the value of the term,
+        and the weight computed by computeWeight() must be the sum
+        of all terms. This allows changesets to track their weight.
+        """
+        return ()
+
     def getPriority(self, pkg):
         priority = self._priorities.get(pkg)
         if priority is None:
@@ -264,6 +448,7 @@ class PolicyInstall(Policy):
         self._upgrading = upgrading = {}
         self._upgraded = upgraded = {}
         self._downgraded = downgraded = {}
+        self._weightdeps = weightdeps = {}
         for pkg in self._trans.getCache().getPackages():
             # Precompute upgrade relations.
             for upg in pkg.upgrades:
@@ -282,6 +467,7 @@ class PolicyInstall(Policy):
                                     downgraded[prvpkg].append(pkg)
                                 else:
                                     downgraded[prvpkg] = [pkg]
+                            weightdeps.setdefault(pkg, {})[prvpkg] = True
             # Downgrades are upgrades if they have a higher priority.
             for prv in pkg.provides:
                 for upg in prv.upgradedby:
@@ -299,20 +485,22 @@ class PolicyInstall(Policy):
                                     downgraded[upgpkg].append(pkg)
                                 else:
                                     downgraded[upgpkg] = [pkg]
+                            weightdeps.setdefault(pkg, {})[upgpkg] = True
 
     def runFinished(self):
         Policy.runFinished(self)
         del self._upgrading
         del self._upgraded
         del self._downgraded
+        del self._weightdeps
 
-    def getWeight(self, changeset):
+    def computeWeight(self, changeset):
         weight = 0
         upgrading = self._upgrading
         upgraded = self._upgraded
         downgraded = self._downgraded
-        for pkg in changeset:
-            if changeset[pkg] is REMOVE:
+        for pkg, op in changeset.iteritems():
+            if op is REMOVE:
                 # Upgrading a package that will be removed
                 # is better than upgrading a package that will
                 # stay in the system.
@@ -334,18 +522,54 @@ class PolicyInstall(Policy):
                     weight += 3
         return weight
 
+    def computeWeightTerms(self, pkg):
+        # The weight of a removed package depends on the packages
+        # upgrading or downgrading it.
+        getpkgweight = self._getPackageWeight
+        terms = [(getpkgweight, pkg)]
+        for instpkg in self._weightdeps.get(pkg, ()):
+            terms.append((getpkgweight, instpkg))
+        return terms
+
+    def _getPackageWeight(self, pkg, changeset):
+        op = changeset.get(pkg)
+        if op is None:
+            return 0
+        if op is REMOVE:
+            for upgpkg in self._upgraded.get(pkg, ()):
+                if changeset.get(upgpkg) is INSTALL:
+                    return -1
+            for dwnpkg in self._downgraded.get(pkg, ()):
+                if changeset.get(dwnpkg) is INSTALL:
+                    return 15
+            return 20
+        if pkg in self._upgrading:
+            return 2
+        return 3
+
 class PolicyRemove(Policy):
     """Give precedence to the choice with less changes."""
 
-    def getWeight(self, changeset):
+    def computeWeight(self, changeset):
         weight = 0
-        for pkg in changeset:
-            if changeset[pkg] is REMOVE:
+        for pkg, op in changeset.iteritems():
+            if op is REMOVE:
                 weight += 1
             else:
                 weight += 5
         return weight
 
+    def computeWeightTerms(self, pkg):
+        return [(self._getPackageWeight, pkg)]
+
+    def _getPackageWeight(self, pkg, changeset):
+        op = changeset.get(pkg)
+        if op is None:
+            return 0
+        if op is REMOVE:
+            return 1
+        return 5
+
 class PolicyUpgrade(Policy):
     """Give precedence to the choice with more upgrades and smaller impact."""
 
@@ -450,7 +674,7 @@ class PolicyUpgrade(Policy):
         del self._upgrading
         del self._upgraded
 
-    def getWeight(self, changeset):
+    def computeWeight(self, changeset):
         weight = 0
         upgrading = self._upgrading
         upgraded = self._upgraded
@@ -459,8 +683,8 @@ class PolicyUpgrade(Policy):
 
         installedcount = 0
         upgradedmap = {}
-        for pkg in changeset:
-            if changeset[pkg] is REMOVE:
+        for pkg, op in changeset.iteritems():
+            if op is REMOVE:
                 # Upgrading a package that will be removed
                 # is better than upgrading a package that will
                 # stay in the system.
@@ -493,6 +717,50 @@ class PolicyUpgrade(Policy):
         weight += -30*upgradedcount+(installedcount-upgradedcount)
         return weight
 
+    def computeWeightTerms(self, pkg):
+        # Changing a package affects the weight of the packages it
+        # upgrades as well. Stable bonus dependencies upgrade the
+        # package receiving the bonus, so they're covered too.
+        getpkgweight = self._getPackageWeight
+        getupgweight = self._getUpgradedWeight
+        terms = [(getpkgweight, pkg)]
+        for upgpkg in self._upgrading.get(pkg, ()):
+            terms.append((getpkgweight, upgpkg))
+            terms.append((getupgweight, upgpkg))
+        return terms
+
+    def _getPackageWeight(self, pkg, changeset):
+        op = changeset.get(pkg)
+        if op is None:
+            return 0
+        if op is REMOVE:
+            for lstpkg in self._upgraded.get(pkg, ()):
+                if changeset.get(lstpkg) is INSTALL:
+                    return -1
+            return 3
+        if self._upgrading.get(pkg):
+            return 1+self._sortbonus.get(pkg, 0)
+        return 1
+
+    def _getUpgradedWeight(self, pkg, changeset):
+        # Weight of pkg being upgraded by some package in the changeset.
+        for upgpkg in self._upgraded.get(pkg, ()):
+            if changeset.get(upgpkg) is INSTALL:
+                break
+        else:
+            return 0
+        weight = -31
+        sb = self._stablebonus.get(pkg)
+        if sb:
+            for bonusvalue, bonusdeps in sb:
+                for deppkg in bonusdeps:
+                    if deppkg in changeset:
+                        break
+                else:
+                    weight += bonusvalue
+                    break
+        return weight
+
 class Failed(Error): pass
 
 PENDING_REMOVE   = 1
@@ -600,6 +868,7 @@ class Transaction(object):
                 self._remove(namepkg, changeset, locked, pending, depth)
 
         # Install packages required by this one.
+        ignorerecommends = pkgconf.getFlagMatcher("ignore-recommends")
         for req in pkg.requires + pkg.recommends:
 
             reqrequired = req in pkg.requires
@@ -613,7 +882,7 @@ class Transaction(object):
                     if not reqrequired:
                         if sysconf.get("ignore-all-recommends", 0) == 1:
                             continue
-                        elif pkgconf.testFlag("ignore-recommends", prvpkg):
+                        elif ignorerecommends.matches(prvpkg):
                             continue
                     if isinst(prvpkg):
                         found = True
@@ -1000,15 +1269,29 @@ class Transaction(object):
 
         origchangeset = changeset.copy()
 
+        # Trials are run in order against the result of the previous
+        # ones, so workers run them speculatively against the current
+        # changeset, and their results are only used if nothing they
+        # looked at has been changed in the meantime.
+        trials = {}
+        changed = {}
+        workers = sysconf.get("solver-workers", 1)
+        if workers > 1 and len(pkgs) > 1 and hasattr(os, "fork"):
+            trials = self._runTrials(pkgs, changeset, locked, depth, workers)
+
         weight = getweight(changeset)
         for pkg in pkgs:
             if pkg in locked and not isinst(pkg):
                 continue
 
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(pkg, cs, lk, None, depth)
+                trial = trials.get(pkg)
+                if trial and trial.isValid(changed):
+                    cs, lk = trial.replay(changeset, locked)
+                else:
+                    cs = changeset.copy()
+                    lk = locked.copy()
+                    self._install(pkg, cs, lk, None, depth)
             except Failed, e:
                 pass
             else:
@@ -1016,6 +1299,9 @@ class Transaction(object):
                 csweight = getweight(cs)
                 if csweight < weight:
                     weight = csweight
+                    if trials:
+                        for delta in cs.getDelta(changeset):
+                            changed.update(delta)
                     changeset.setState(cs)
 
         lockedstates = {}
@@ -1023,7 +1309,7 @@ class Transaction(object):
             if changeset.get(pkg) is INSTALL:
                 state = lockedstate.get(pkg)
                 if state:
-                    lockedstates.update(state)
+                    lockedstates.update(state.iteritems())
 
         for pkg in changeset.keys():
 
@@ -1047,6 +1333,136 @@ class Transaction(object):
                         weight = csweight
                         changeset.setState(cs)
                 
+    def _runTrials(self, pkgs, changeset, locked, depth, workers):
+        """
+        Fork workers sharing the loaded cache to try installing each
+        package against the given changeset, and return a dictionary
+        mapping packages to their _Trial.
+        """
+        packages = self._cache.getPackages()
+        pkgindex = {}
+        for i, pkg in enumerate(packages):
+            pkgindex[pkg] = i
+        def persistent_id(obj):
+            if isinstance(obj, Package):
+                return pkgindex[obj]
+            return None
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Packages whose trials are missing are simply tried by the
+        # parent, so failures are only worth a debug message.
+        children = []
+        trials = {}
+        try:
+            for i in range(workers):
+                try:
+                    r, w = os.pipe()
+                except OSError, e:
+                    iface.debug(_("Can't start solver worker: %s") % e)
+                    break
+                try:
+                    pid = os.fork()
+                except OSError, e:
+                    os.close(r)
+                    os.close(w)
+                    iface.debug(_("Can't start solver worker: %s") % e)
+                    break
+                if not pid:
+                    os.close(r)
+                    self._runWorker(w, pkgs[i::workers], changeset,
+                                    locked, depth, persistent_id)
+                os.close(w)
+                children.append((pid, os.fdopen(r)))
+
+            for pid, file in children:
+                try:
+                    unpickler = cPickle.Unpickler(file)
+                    unpickler.persistent_load = packages.__getitem__
+                    result = unpickler.load()
+                except (EOFError, cPickle.UnpicklingError, IndexError), e:
+                    iface.debug(_("Can't read solver worker results: %s")
+                                % e)
+                    continue
+                if isinstance(result, dict):
+                    trials.update(result)
+                else:
+                    iface.debug(_("Solver worker failed:\n%s") % result)
+        finally:
+            for pid, file in children:
+                file.close()
+                while True:
+                    try:
+                        status = os.waitpid(pid, 0)[1]
+                    except OSError, e:
+                        if e.errno == errno.EINTR:
+                            continue
+                        raise
+                    break
+                if os.WIFSIGNALED(status):
+                    iface.debug(_("Solver worker killed by signal %d")
+                                % os.WTERMSIG(status))
+                elif os.WEXITSTATUS(status) == 2:
+                    iface.debug(_("Solver worker couldn't send its "
+                                  "results"))
+        return trials
+
+    def _runWorker(self, w, pkgs, changeset, locked, depth, persistent_id):
+        # Collecting would touch, and thus copy, the whole heap.
+        gc.disable()
+        status = 2
+        try:
+            try:
+                file = os.fdopen(w, "w")
+                try:
+                    result = self._makeTrials(pkgs, changeset, locked, depth)
+                    status = 0
+                except:
+                    # Sent instead of the trials, for the parent to
+                    # report.
+                    result = traceback.format_exc()
+                    status = 1
+                pickler = cPickle.Pickler(file, 2)
+                pickler.persistent_id = persistent_id
+                pickler.dump(result)
+                file.close()
+            except:
+                status = 2
+        finally:
+            os._exit(status)
+
+    def _makeTrials(self, pkgs, changeset, locked, depth):
+        isinst = changeset.installed
+        trials = {}
+        for pkg in pkgs:
+            if pkg in locked and not isinst(pkg):
+                continue
+            reads = {}
+            cs = changeset._copy(_TrialChangeSet)
+            cs._reads = reads
+            cs._log = log = []
+            lk = locked.copy()
+            try:
+                self._install(pkg, cs, lk, None, depth)
+            except Failed, e:
+                trials[pkg] = _Trial(reads, e)
+            else:
+                lockeddelta = lk.getDelta(locked)
+                if lockeddelta:
+                    # Like the log, only changes to the requested flags
+                    # are replayed, since earlier trials may have
+                    # changed them in the meantime.
+                    added = {}
+                    for reqpkg in cs._requested:
+                        if reqpkg not in changeset._requested:
+                            added[reqpkg] = True
+                    removed = [x for x in changeset._requested
+                               if x not in cs._requested]
+                    trials[pkg] = _Trial(reads, log=log,
+                                         requested=(added, removed),
+                                         lockeddelta=lockeddelta)
+        return trials
+
     def _fix(self, pkgs, changeset, locked, pending, depth=0):
         #print "[%03d] _fix()" % depth
         #depth += 1
@@ -1178,9 +1594,10 @@ class Transaction(object):
         self._policy.runStarting()
 
         try:
-            changeset = self._changeset.copy()
+            changeset = ChangeSet(self._cache, self._changeset)
+            changeset.trackWeight(self._policy)
             isinst = changeset.installed
-            locked = self._policy.getLockedSet().copy()
+            locked = LayeredDict(self._policy.getLockedSet())
             pending = []
 
             for pkg in self._queue:
@@ -1896,9 +2313,9 @@ def checkPackages(cache, checkset, relateset, report=False):
     return not problems
 
 def enablePsyco(psyco):
-    psyco.bind(PolicyInstall.getWeight)
-    psyco.bind(PolicyRemove.getWeight)
-    psyco.bind(PolicyUpgrade.getWeight)
+    psyco.bind(PolicyInstall.computeWeight)
+    psyco.bind(PolicyRemove.computeWeight)
+    psyco.bind(PolicyUpgrade.computeWeight)
     psyco.bind(Transaction._install)
     psyco.bind(Transaction._remove)
     psyco.bind(Transaction._updown)
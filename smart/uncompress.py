@@ -19,6 +19,7 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
+import struct
 import os
 
 from smart.const import BLOCKSIZE
@@ -38,10 +39,10 @@ class Uncompressor(object):
                 return handler
     getHandler = classmethod(getHandler)
 
-    def uncompress(self, localpath):
+    def uncompress(self, localpath, digests=None):
         for handler in self._handlers:
             if handler.query(localpath):
-                return handler.uncompress(localpath)
+                return handler.uncompress(localpath, digests=digests)
         else:
             raise Error, _("Unknown compressed file: %s") % localpath
 
@@ -53,9 +54,120 @@ class UncompressorHandler(object):
     def getTargetPath(self, localpath):
         return None
 
-    def uncompress(self, localpath):
+    def uncompress(self, localpath, digests=None):
+        # If given, digests must be fed with the uncompressed data.
         raise Error, _("Unsupported file type")
 
+    def getDecompressor(self):
+        # Return an object uncompressing data as it's given to its
+        # decompress() method, and raising Error from flush() if the
+        # data wasn't complete. Formats which can't be uncompressed
+        # that way return None.
+        return None
+
+class StreamDecompressor(object):
+    """Wrap a decompressor object from the bz2 or lzma modules."""
+
+    def __init__(self, decompressor):
+        self._decompressor = decompressor
+
+    def _isDone(self):
+        return self._decompressor.eof
+
+    def decompress(self, data):
+        if not data:
+            return ""
+        if self._isDone():
+            raise Error, _("Unexpected data after the compressed stream")
+        try:
+            data = self._decompressor.decompress(data)
+        except (IOError, EOFError), e:
+            raise Error, unicode(e)
+        if self._decompressor.unused_data:
+            raise Error, _("Unexpected data after the compressed stream")
+        return data
+
+    def flush(self):
+        if not self._isDone():
+            raise Error, _("Compressed data is incomplete")
+        return ""
+
+class BZ2StreamDecompressor(StreamDecompressor):
+
+    def _isDone(self):
+        # Older versions of the bz2 module have no eof attribute, but
+        # refuse any data once the stream ended.
+        try:
+            self._decompressor.decompress("")
+        except EOFError:
+            return True
+        return False
+
+class GZipDecompressor(object):
+    """Uncompress a gzip stream incrementally, checking its trailer."""
+
+    def __init__(self):
+        self._header = ""
+        self._decompressor = None
+        self._crc = 0
+        self._size = 0
+
+    def _skipHeader(self):
+        # Return how long the header is, or None if it's incomplete.
+        header = self._header
+        if len(header) < 10:
+            return None
+        if header[:3] != "\037\213\010":
+            raise Error, _("Not a gzip file")
+        flags = ord(header[3])
+        pos = 10
+        if flags & 4:
+            if len(header) < pos+2:
+                return None
+            pos += 2+struct.unpack("<H", header[pos:pos+2])[0]
+        for flag in (8, 16):
+            if flags & flag:
+                pos = header.find("\0", pos)+1
+                if not pos:
+                    return None
+        if flags & 2:
+            pos += 2
+        if len(header) < pos:
+            return None
+        return pos
+
+    def decompress(self, data):
+        import zlib
+        if self._decompressor is None:
+            self._header += data
+            pos = self._skipHeader()
+            if pos is None:
+                return ""
+            data = self._header[pos:]
+            self._header = None
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            data = self._decompressor.decompress(data)
+        except zlib.error, e:
+            raise Error, unicode(e)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        if len(self._decompressor.unused_data) > 8:
+            # Multiple members aren't supported.
+            raise Error, _("Unexpected data after the compressed stream")
+        return data
+
+    def flush(self):
+        if self._decompressor is None:
+            raise Error, _("Compressed data is incomplete")
+        trailer = self._decompressor.unused_data
+        if len(trailer) != 8:
+            raise Error, _("Compressed data is incomplete")
+        crc, size = struct.unpack("<iI", trailer)
+        if crc != self._crc or size != self._size & 0xffffffffL:
+            raise Error, _("CRC check failed")
+        return ""
+
 class BZ2Handler(UncompressorHandler):
 
     def query(self, localpath):
@@ -65,7 +177,11 @@ class BZ2Handler(UncompressorHandler):
     def getTargetPath(self, localpath):
         return localpath[:-4]
 
-    def uncompress(self, localpath):
+    def getDecompressor(self):
+        import bz2
+        return BZ2StreamDecompressor(bz2.BZ2Decompressor())
+
+    def uncompress(self, localpath, digests=None):
         import bz2
         try:
             input = bz2.BZ2File(localpath)
@@ -73,6 +189,8 @@ class BZ2Handler(UncompressorHandler):
             data = input.read(BLOCKSIZE)
             while data:
                 output.write(data)
+                if digests:
+                    digests.update(data)
                 data = input.read(BLOCKSIZE)
         except (IOError, OSError), e:
             raise Error, "%s: %s" % (localpath, e)
@@ -81,6 +199,17 @@ class BZ2Handler(UncompressorHandler):
 
 Uncompressor.addHandler(BZ2Handler)
 
+def getLZMADecompressor():
+    try:
+        import lzma
+    except ImportError:
+        return None
+    decompressor = lzma.LZMADecompressor()
+    if not hasattr(decompressor, "eof"):
+        # Older lzma bindings can't tell when the stream ended.
+        return None
+    return StreamDecompressor(decompressor)
+
 class LZMAHandler(UncompressorHandler):
 
     def query(self, localpath):
@@ -91,7 +220,10 @@ class LZMAHandler(UncompressorHandler):
         if localpath.endswith(".lzma"):
             return localpath[:-5]
 
-    def uncompress(self, localpath):
+    def getDecompressor(self):
+        return getLZMADecompressor()
+
+    def uncompress(self, localpath, digests=None):
         try:
             import lzma
         except ImportError, e:
@@ -107,6 +239,8 @@ class LZMAHandler(UncompressorHandler):
             data = input.read(BLOCKSIZE)
             while data:
                 output.write(data)
+                if digests:
+                    digests.update(data)
                 data = input.read(BLOCKSIZE)
         except (IOError, OSError), e:
             raise Error, "%s: %s" % (localpath, e)
@@ -126,7 +260,10 @@ class XZHandler(UncompressorHandler):
         if localpath.endswith(".xz"):
             return localpath[:-3]
 
-    def uncompress(self, localpath):
+    def getDecompressor(self):
+        return getLZMADecompressor()
+
+    def uncompress(self, localpath, digests=None):
         import lzma
         try:
             input = lzma.LZMAFile(localpath)
@@ -134,6 +271,8 @@ class XZHandler(UncompressorHandler):
             data = input.read(BLOCKSIZE)
             while data:
                 output.write(data)
+                if digests:
+                    digests.update(data)
                 data = input.read(BLOCKSIZE)
         except (IOError, OSError), e:
             raise Error, "%s: %s" % (localpath, e)
@@ -151,7 +290,10 @@ class GZipHandler(UncompressorHandler):
     def getTargetPath(self, localpath):
         return localpath[:-3]
 
-    def uncompress(self, localpath):
+    def getDecompressor(self):
+        return GZipDecompressor()
+
+    def uncompress(self, localpath, digests=None):
         import gzip
         try:
             input = gzip.GzipFile(localpath)
@@ -159,6 +301,8 @@ class GZipHandler(UncompressorHandler):
             data = input.read(BLOCKSIZE)
             while data:
                 output.write(data)
+                if digests:
+                    digests.update(data)
                 data = input.read(BLOCKSIZE)
         except (IOError, OSError), e:
             raise Error, "%s: %s" % (localpath, e)
@@ -188,7 +332,7 @@ class ZipHandler(UncompressorHandler):
             raise Error, "%s: %s" % (localpath, e)
         return None
 
-    def uncompress(self, localpath, name=None):
+    def uncompress(self, localpath, name=None, digests=None):
         import zipfile
         try:
             zip = zipfile.ZipFile(localpath, 'r')
@@ -198,6 +342,8 @@ class ZipHandler(UncompressorHandler):
             output = open(self.getTargetPath(localpath), "w")
             data = zip.read(name)
             output.write(data)
+            if digests:
+                digests.update(data)
             zip.close()
         except (IOError, OSError), e:
             raise Error, "%s: %s" % (localpath, e)
@@ -224,7 +370,7 @@ class SevenZipHandler(UncompressorHandler):
             raise Error, "%s: %s" % (localpath, e)
         return None
 
-    def uncompress(self, localpath, name=None):
+    def uncompress(self, localpath, name=None, digests=None):
         import py7zlib
         try:
             zip = py7zlib.Archive7z(open(localpath, 'r'))
@@ -235,6 +381,8 @@ class SevenZipHandler(UncompressorHandler):
             input = zip.getmember(name)
             data = input.read()
             output.write(data)
+            if digests:
+                digests.update(data)
         except (IOError, OSError), e:
             raise Error, "%s: %s" % (localpath, e)
 
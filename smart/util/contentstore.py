@@ -0,0 +1,157 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+import shutil
+import thread
+import fcntl
+import errno
+import os
+
+# The FICLONE ioctl of Linux, which makes dest share the extents of
+# source on filesystems supporting it.
+FICLONE = 0x40049409
+
+def cloneFile(source, dest):
+    """
+    Make dest have the contents of source, as a hard link when
+    possible, otherwise as a reflink clone, and as a copy at last.
+    """
+    try:
+        os.link(source, dest)
+        return
+    except OSError:
+        pass
+    sourcefile = open(source)
+    try:
+        destfile = open(dest, "w")
+        try:
+            try:
+                fcntl.ioctl(destfile.fileno(), FICLONE, sourcefile.fileno())
+            except (IOError, OSError):
+                shutil.copyfileobj(sourcefile, destfile)
+        finally:
+            destfile.close()
+    finally:
+        sourcefile.close()
+
+class ContentStore(object):
+    """
+    Files kept by their contents, so that the same file fetched from
+    different URLs or channels is stored only once.
+
+    Keys are digests, as returned by getKey(). Using a stored file
+    or adding it marks it as recently used, and evict() removes the
+    least recently used files first.
+    """
+
+    def __init__(self, dir):
+        self._dir = dir
+
+    def getDir(self):
+        return self._dir
+
+    def getKey(kind, digest):
+        return "%s-%s" % (kind, digest)
+    getKey = staticmethod(getKey)
+
+    def getPath(self, key):
+        return os.path.join(self._dir, key)
+
+    def has(self, key):
+        return os.path.isfile(self.getPath(key))
+
+    def get(self, key, path):
+        """Put the file stored with key at path, if there's one."""
+        storepath = self.getPath(key)
+        try:
+            os.utime(storepath, None)
+        except OSError:
+            return False
+        tmppath = self._getTempPath(path)
+        try:
+            cloneFile(storepath, tmppath)
+            os.rename(tmppath, path)
+        except (IOError, OSError):
+            if os.path.isfile(tmppath):
+                os.unlink(tmppath)
+            return False
+        return True
+
+    def add(self, key, path):
+        """Store the file at path with key, unless it's there already."""
+        storepath = self.getPath(key)
+        try:
+            os.utime(storepath, None)
+            return
+        except OSError:
+            pass
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+        tmppath = self._getTempPath(storepath)
+        try:
+            cloneFile(path, tmppath)
+            os.rename(tmppath, storepath)
+            os.utime(storepath, None)
+        except (IOError, OSError):
+            if os.path.isfile(tmppath):
+                os.unlink(tmppath)
+
+    def _getTempPath(self, path):
+        return "%s.%d.%d.tmp" % (path, os.getpid(), thread.get_ident())
+
+    def _getEntries(self):
+        entries = []
+        try:
+            names = os.listdir(self._dir)
+        except OSError:
+            return entries
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self._dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def getSize(self):
+        return sum([size for mtime, size, path in self._getEntries()])
+
+    def evict(self, maxsize):
+        """
+        Remove the least recently used files until the ones left
+        take at most maxsize bytes, and return the removed paths.
+        """
+        entries = self._getEntries()
+        entries.sort()
+        total = sum([size for mtime, size, path in entries])
+        removed = []
+        for mtime, size, path in entries:
+            if total <= maxsize:
+                break
+            try:
+                os.unlink(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    continue
+            total -= size
+            removed.append(path)
+        return removed
+
+# vim:ts=4:sw=4:et
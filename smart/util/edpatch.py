@@ -0,0 +1,75 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart import Error, _
+import re
+
+COMMAND = re.compile(r"^(\d+)?(?:,(\d+))?([acd])$")
+
+def applyEdPatch(lines, patch):
+    """
+    Apply to the list of lines the ed script read from the patch
+    iterable, as written by diff --ed. Besides the a, c and d commands,
+    the s/.// command is understood, since diff uses it to insert lines
+    containing a single dot.
+    """
+    patch = iter(patch)
+    current = 0
+    for command in patch:
+        command = command.rstrip("\n")
+        if not command or command == "w":
+            continue
+        if command == "s/.//":
+            if not 0 < current <= len(lines):
+                raise Error, _("Invalid ed patch: substitution out of range")
+            lines[current-1] = lines[current-1][1:]
+            continue
+        m = COMMAND.match(command)
+        if not m:
+            raise Error, _("Invalid ed patch command: %s") % command
+        first, last, action = m.groups()
+        if first is None:
+            first = current
+        else:
+            first = int(first)
+        if last is None:
+            last = first
+        else:
+            last = int(last)
+        if first > last or last > len(lines):
+            raise Error, _("Invalid ed patch: %s is out of range") % command
+        text = []
+        if action != "d":
+            for line in patch:
+                if line.rstrip("\n") == ".":
+                    break
+                text.append(line)
+            else:
+                raise Error, _("Invalid ed patch: unterminated text")
+        if action == "a":
+            lines[first:first] = text
+            current = first+len(text)
+        else:
+            if first == 0:
+                raise Error, _("Invalid ed patch: %s is out of range") \
+                             % command
+            lines[first-1:last] = text
+            current = first-1+len(text)
+            if action == "d" and current < len(lines):
+                current += 1
+
+# vim:ts=4:sw=4:et
@@ -0,0 +1,146 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+import cPickle
+import thread
+import os
+
+METAFILE = ".metadata"
+
+class FileMetadata(object):
+    """
+    Metadata about the files in a directory, such as the digests they
+    were verified with and the ETag and Last-Modified headers they were
+    served with.
+
+    Entries are dictionaries, and are only returned while the file
+    keeps the size, inode and times it had when they were recorded,
+    so that whoever changes the file doesn't have to care about them.
+    """
+
+    def __init__(self, dir):
+        self._path = os.path.join(dir, METAFILE)
+        self._entries = None
+        self._changed = False
+        self._lock = thread.allocate_lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                file = open(self._path)
+                try:
+                    self._entries = cPickle.load(file)
+                finally:
+                    file.close()
+                if type(self._entries) is not dict:
+                    raise ValueError
+            except (IOError, OSError, EOFError, ValueError,
+                    cPickle.UnpicklingError, AttributeError, IndexError):
+                self._entries = {}
+        return self._entries
+
+    def _getKey(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_ino, st.st_mtime, st.st_ctime)
+
+    def get(self, path):
+        """Return the entry for path, or None if it's outdated."""
+        key = self._getKey(path)
+        self._lock.acquire()
+        try:
+            entry = self._load().get(os.path.basename(path))
+            if entry and key and entry["key"] == key:
+                return entry.copy()
+            return None
+        finally:
+            self._lock.release()
+
+    def update(self, path, **data):
+        """
+        Add data to the entry for path, replacing it if it's outdated.
+        Digests are merged with the ones already in the entry.
+        """
+        key = self._getKey(path)
+        if not key:
+            return
+        name = os.path.basename(path)
+        self._lock.acquire()
+        try:
+            entries = self._load()
+            entry = entries.get(name)
+            if not entry or entry["key"] != key:
+                entry = entries[name] = {"key": key, "digests": {}}
+            digests = data.pop("digests", None)
+            if digests:
+                entry["digests"].update(digests)
+            entry.update(data)
+            self._changed = True
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """Write entries down, forgetting the ones of removed files."""
+        self._lock.acquire()
+        try:
+            if not self._changed:
+                return
+            self._changed = False
+            dir = os.path.dirname(self._path)
+            for name in self._entries.keys():
+                if not os.path.isfile(os.path.join(dir, name)):
+                    del self._entries[name]
+            try:
+                file = open(self._path+".new", "w")
+                try:
+                    cPickle.dump(self._entries, file, 2)
+                finally:
+                    file.close()
+                os.rename(self._path+".new", self._path)
+            except (IOError, OSError):
+                pass
+        finally:
+            self._lock.release()
+
+_registry = {}
+_registrylock = thread.allocate_lock()
+
+def getFileMetadata(dir):
+    """Return the FileMetadata shared by everyone using dir."""
+    dir = os.path.realpath(dir)
+    _registrylock.acquire()
+    try:
+        metadata = _registry.get(dir)
+        if metadata is None:
+            metadata = _registry[dir] = FileMetadata(dir)
+        return metadata
+    finally:
+        _registrylock.release()
+
+def saveFileMetadata():
+    """Save the changes made to any FileMetadata."""
+    _registrylock.acquire()
+    try:
+        metadata = _registry.values()
+    finally:
+        _registrylock.release()
+    for entry in metadata:
+        entry.save()
+
+# vim:ts=4:sw=4:et
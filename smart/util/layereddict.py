@@ -0,0 +1,353 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+import weakref
+
+# Copies of copies are chained. Once a chain gets this deep, the
+# next copy is flattened instead, so that lookups stay cheap.
+MAXDEPTH = 16
+
+_MISSING = object()
+
+_dictget = dict.get
+_dictcontains = dict.__contains__
+_dictsetitem = dict.__setitem__
+
+class LayeredDict(dict):
+    """
+    Dictionary with cheap copies.
+
+    The copy() method returns a layer, which stores only the changes
+    made to it and looks everything else up in the dictionary it was
+    copied from. When a dictionary is changed while layers copied
+    from it are still alive, the previous values are pushed down into
+    them, so every copy keeps seeing what it had when it was taken.
+
+    Layers must be read through their methods. Functions working on
+    the dict internals, such as dict(layer), only see the changes.
+    """
+
+    _layer = False
+    _parent = None
+    _removed = ()
+    _depth = 0
+    _flat = None
+    _children = None
+
+    def copy(self):
+        return self._copy(self._layerclass)
+
+    def _copy(self, cls):
+        layer = cls.__new__(cls)
+        layer._removed = {}
+        layer._flat = None
+        layer._children = None
+        if self._depth < MAXDEPTH:
+            layer._parent = self
+            layer._depth = self._depth+1
+            children = self._children
+            if children is None:
+                children = self._children = {}
+            key = id(layer)
+            children[key] = weakref.ref(layer,
+                                        lambda ref: children.pop(key, None))
+        else:
+            layer._parent = None
+            layer._depth = 0
+            dict.update(layer, self._view())
+        return layer
+
+    def _view(self):
+        return self
+
+    def _isPlain(self):
+        # Plain dictionaries may be changed through the dict methods
+        # directly, since nobody needs to know about their changes.
+        return not (self._layer or self._children)
+
+    def _push(self, key):
+        value = self.get(key, _MISSING)
+        for ref in self._children.values():
+            layer = ref()
+            if (layer is not None and not _dictcontains(layer, key) and
+                key not in layer._removed):
+                if value is _MISSING:
+                    layer._removed[key] = True
+                else:
+                    _dictsetitem(layer, key, value)
+
+    def getDelta(self, ancestor):
+        """
+        Return a (changed, removed) pair of dictionaries with the
+        changes made since this dictionary was copied from ancestor,
+        or None if it doesn't descend from ancestor.
+        """
+        layers = []
+        layer = self
+        while layer is not ancestor:
+            if layer is None or layer._parent is None:
+                return None
+            layers.append(layer)
+            layer = layer._parent
+        changed = {}
+        removed = {}
+        for layer in reversed(layers):
+            for key in layer._removed:
+                if key in changed:
+                    del changed[key]
+                removed[key] = True
+            for key, value in dict.iteritems(layer):
+                changed[key] = value
+                if key in removed:
+                    del removed[key]
+        return changed, removed
+
+    def __setitem__(self, key, value):
+        if self._children:
+            self._push(key)
+        _dictsetitem(self, key, value)
+
+    def __delitem__(self, key):
+        if self._children:
+            self._push(key)
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        if self._children:
+            for key in self.keys():
+                self._push(key)
+        dict.clear(self)
+
+    def update(self, other):
+        if isinstance(other, LayeredDict) and other._parent is not None:
+            delta = other.getDelta(self)
+            if delta:
+                for key, value in delta[0].iteritems():
+                    self[key] = value
+                return
+        if isinstance(other, dict):
+            if self._isPlain() and not isinstance(other, DictLayer):
+                dict.update(self, other)
+                return
+            other = other.iteritems()
+        for key, value in other:
+            self[key] = value
+
+    def assign(self, other):
+        """Make the contents of this dictionary equal to other's."""
+        if other is self:
+            return
+        if isinstance(other, LayeredDict) and other._parent is not None:
+            delta = other.getDelta(self)
+            if delta:
+                changed, removed = delta
+                for key in removed:
+                    if key in self:
+                        del self[key]
+                for key, value in changed.iteritems():
+                    self[key] = value
+                return
+        if isinstance(other, LayeredDict):
+            other = other._view()
+        if self._isPlain():
+            dict.clear(self)
+            dict.update(self, other)
+            return
+        for key in self.keys():
+            if key not in other:
+                del self[key]
+        for key, value in other.iteritems():
+            if self.get(key, _MISSING) is not value:
+                self[key] = value
+
+    def pop(self, key, *default):
+        if self._isPlain():
+            return dict.pop(self, key, *default)
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        del self[key]
+        return value
+
+    def popitem(self):
+        for key in self._view():
+            break
+        else:
+            raise KeyError("popitem(): dictionary is empty")
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
+
+class DictLayer(LayeredDict):
+    """Copy of a LayeredDict. See LayeredDict for details."""
+
+    _layer = True
+
+    def _view(self):
+        flat = self._flat
+        if flat is None:
+            layers = []
+            layer = self
+            while True:
+                if layer._flat is not None:
+                    flat = layer._flat.copy()
+                    break
+                if not layer._layer:
+                    flat = dict.copy(layer)
+                    break
+                layers.append(layer)
+                layer = layer._parent
+                if layer is None:
+                    flat = {}
+                    break
+            for layer in reversed(layers):
+                for key in layer._removed:
+                    if key in flat:
+                        del flat[key]
+                flat.update(dict.iteritems(layer))
+            self._setFlat(flat)
+        return flat
+
+    def _setFlat(self, flat):
+        # Once the flat view exists it is kept up to date, so lookups
+        # may go straight to it.
+        self._flat = flat
+        self.get = flat.get
+
+    def get(self, key, default=None):
+        layer = self
+        while layer is not None:
+            flat = layer._flat
+            if flat is not None:
+                return flat.get(key, default)
+            value = _dictget(layer, key, _MISSING)
+            if value is not _MISSING:
+                return value
+            if key in layer._removed:
+                return default
+            layer = layer._parent
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._view())
+
+    def __iter__(self):
+        return iter(self._view())
+
+    def iterkeys(self):
+        return self._view().iterkeys()
+
+    def itervalues(self):
+        return self._view().itervalues()
+
+    def iteritems(self):
+        return self._view().iteritems()
+
+    def keys(self):
+        return self._view().keys()
+
+    def values(self):
+        return self._view().values()
+
+    def items(self):
+        return self._view().items()
+
+    def __repr__(self):
+        return repr(self._view())
+
+    def __eq__(self, other):
+        return self._view() == _getView(other)
+
+    def __ne__(self, other):
+        return self._view() != _getView(other)
+
+    def __lt__(self, other):
+        return self._view() < _getView(other)
+
+    def __le__(self, other):
+        return self._view() <= _getView(other)
+
+    def __gt__(self, other):
+        return self._view() > _getView(other)
+
+    def __ge__(self, other):
+        return self._view() >= _getView(other)
+
+    def __setitem__(self, key, value):
+        if self._children:
+            self._push(key)
+        _dictsetitem(self, key, value)
+        removed = self._removed
+        if key in removed:
+            del removed[key]
+        flat = self._flat
+        if flat is not None:
+            flat[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if self._children:
+            self._push(key)
+        if _dictcontains(self, key):
+            dict.__delitem__(self, key)
+        if self._parent is not None:
+            self._removed[key] = True
+        flat = self._flat
+        if flat is not None:
+            del flat[key]
+
+    def clear(self):
+        if self._parent is not None:
+            # Keys removed before must stay removed, or values pushed
+            # down by the parent later would show up again.
+            removed = dict(self._removed)
+            removed.update(dict.fromkeys(self._view(), True))
+        else:
+            removed = {}
+        if self._children:
+            for key in self.keys():
+                self._push(key)
+        dict.clear(self)
+        self._removed = removed
+        self._setFlat({})
+
+def _getView(obj):
+    if isinstance(obj, LayeredDict):
+        return obj._view()
+    return obj
+
+LayeredDict._layerclass = DictLayer
+
+# vim:ts=4:sw=4:et
@@ -0,0 +1,177 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart import Error, _
+import struct
+import array
+import mmap
+import sys
+import os
+
+# Path index file format. The file starts with a fixed header made of
+# the magic string, the format version, and an (offset, count) pair
+# for each of the sections listed below, in that order. Integers are
+# little-endian, and paths are sorted, so that the file may be mapped
+# in memory and searched without loading it.
+#
+#   DIGEST    - raw digest of the data the index was built from
+#               (count is its size in bytes)
+#   KEYS      - count+1 uint32 offsets of each key into KEYDATA
+#   KEYDATA   - raw key data (count is its size in bytes)
+#   PATHS     - count+1 uint32 offsets of each path into PATHDATA
+#   PATHDATA  - raw path data (count is its size in bytes)
+#   OWNERS    - count+1 uint32 offsets of each path's keys into KEYLIST
+#   KEYLIST   - uint32 key indexes referenced by OWNERS
+#
+PATHINDEXMAGIC = "SMARTPI\0"
+PATHINDEXVERSION = 1
+
+PI_DIGEST   = 0
+PI_KEYS     = 1
+PI_KEYDATA  = 2
+PI_PATHS    = 3
+PI_PATHDATA = 4
+PI_OWNERS   = 5
+PI_KEYLIST  = 6
+PI_SECTIONS = 7
+
+PI_HEADER = "<8sI"+"II"*PI_SECTIONS
+PI_HEADERSIZE = struct.calcsize(PI_HEADER)
+
+def _packArray(lst):
+    data = array.array("I", lst)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tostring()
+
+def _packStrings(strings):
+    offsets = [0]
+    for string in strings:
+        offsets.append(offsets[-1]+len(string))
+    return _packArray(offsets), "".join(strings)
+
+def writePathIndex(filename, digest, paths):
+    """
+    Write an index of paths, a dictionary mapping each path to a list
+    of keys, such as the ids of the packages owning it. The digest
+    identifies the data the index was built from.
+    """
+    keys = {}
+    keylist = []
+    for owners in paths.itervalues():
+        for key in owners:
+            if key not in keys:
+                keys[key] = len(keylist)
+                keylist.append(key)
+    sortedpaths = paths.keys()
+    sortedpaths.sort()
+    owners = [0]
+    ownerlist = []
+    for path in sortedpaths:
+        ownerlist.extend([keys[x] for x in paths[path]])
+        owners.append(len(ownerlist))
+    keyoffsets, keydata = _packStrings(keylist)
+    pathoffsets, pathdata = _packStrings(sortedpaths)
+    sections = [(digest, len(digest)),
+                (keyoffsets, len(keylist)),
+                (keydata, len(keydata)),
+                (pathoffsets, len(sortedpaths)),
+                (pathdata, len(pathdata)),
+                (_packArray(owners), len(sortedpaths)),
+                (_packArray(ownerlist), len(ownerlist))]
+    header = [PATHINDEXMAGIC, PATHINDEXVERSION]
+    offset = PI_HEADERSIZE
+    for data, count in sections:
+        header.extend((offset, count))
+        offset += len(data)
+    file = open(filename+".new", "w")
+    try:
+        file.write(struct.pack(PI_HEADER, *header))
+        for data, count in sections:
+            file.write(data)
+    finally:
+        file.close()
+    os.rename(filename+".new", filename)
+
+class PathIndex(object):
+    """Read an index written by writePathIndex()."""
+
+    def __init__(self, filename):
+        file = open(filename)
+        try:
+            try:
+                self._buffer = mmap.mmap(file.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                self._buffer = ""
+        finally:
+            file.close()
+        buffer = self._buffer
+        if (len(buffer) < PI_HEADERSIZE or
+            buffer[:8] != PATHINDEXMAGIC):
+            self.close()
+            raise Error, _("Invalid path index: %s") % filename
+        header = struct.unpack(PI_HEADER, buffer[:PI_HEADERSIZE])
+        if header[1] != PATHINDEXVERSION:
+            self.close()
+            raise Error, _("Unsupported path index version: %s") % filename
+        self._sections = [header[i:i+2] for i in range(2, len(header), 2)]
+        offset, count = self._sections[PI_DIGEST]
+        self._digest = buffer[offset:offset+count]
+
+    def close(self):
+        if not isinstance(self._buffer, str):
+            self._buffer.close()
+        self._buffer = ""
+
+    def getDigest(self):
+        return self._digest
+
+    def __len__(self):
+        return self._sections[PI_PATHS][1]
+
+    def _getOffsets(self, section, index):
+        offset = self._sections[section][0]+index*4
+        return struct.unpack("<II", self._buffer[offset:offset+8])
+
+    def _getString(self, section, datasection, index):
+        start, end = self._getOffsets(section, index)
+        offset = self._sections[datasection][0]
+        return self._buffer[offset+start:offset+end]
+
+    def get(self, path):
+        """Return the keys path was indexed with, or an empty list."""
+        lo = 0
+        hi = len(self)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._getString(PI_PATHS, PI_PATHDATA, mid) < path:
+                lo = mid+1
+            else:
+                hi = mid
+        if (lo == len(self) or
+            self._getString(PI_PATHS, PI_PATHDATA, lo) != path):
+            return []
+        start, end = self._getOffsets(PI_OWNERS, lo)
+        offset = self._sections[PI_KEYLIST][0]
+        data = array.array("I")
+        data.fromstring(self._buffer[offset+start*4:offset+end*4])
+        if sys.byteorder == "big":
+            data.byteswap()
+        return [self._getString(PI_KEYS, PI_KEYDATA, x) for x in data]
+
+# vim:ts=4:sw=4:et
@@ -0,0 +1,289 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+import cPickle
+import array
+import sys
+import os
+import re
+
+TOKENINDEXVERSION = 2
+
+_wordre = re.compile(r"\w+", re.UNICODE)
+_wildcardre = re.compile(r"\[!?\]?[^]]*\]|[*?]")
+_globre = re.compile(r"[*?]")
+
+def getWords(text):
+    """Return the lowercase words in text."""
+    if type(text) is not unicode:
+        text = text.decode("utf-8", "replace")
+    return _wordre.findall(text.lower())
+
+def getGlobWords(pattern):
+    """
+    Return the words a text must contain, either whole or as part of
+    longer words, for the glob pattern to be found in it.
+    """
+    words = []
+    for piece in _wildcardre.split(pattern):
+        words.extend(getWords(piece))
+    return words
+
+def _unpackArray(data):
+    lst = array.array("I")
+    lst.fromstring(data)
+    if sys.byteorder == "big":
+        lst.byteswap()
+    return lst
+
+def _packArray(lst):
+    data = array.array("I", lst)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tostring()
+
+class TokenIndex(object):
+    """
+    Inverted index from the words of texts to the keys they were
+    added with. Each key may be added with several texts, such as
+    the summary and the description of a package, and each of them
+    is indexed as a separate field.
+    """
+
+    def __init__(self, keys=None, fields=None):
+        self._keys = keys or []
+        self._fields = fields or []
+
+    def add(self, key, *texts):
+        index = len(self._keys)
+        self._keys.append(key)
+        fields = self._fields
+        while len(fields) < len(texts):
+            fields.append({})
+        for words, text in zip(fields, texts):
+            if not text:
+                continue
+            for word in getWords(text):
+                lst = words.get(word)
+                if lst is None:
+                    words[word] = [index]
+                elif lst[-1] != index:
+                    lst.append(index)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self, words, field=0):
+        """
+        Return the keys added with a text in the given field which
+        has all the given words, either whole or as part of longer
+        words.
+        """
+        if not words:
+            return self._keys[:]
+        if field >= len(self._fields):
+            return []
+        fieldwords = self._fields[field]
+        found = None
+        for word in words:
+            indexes = {}
+            for indexword, lst in fieldwords.iteritems():
+                if word in indexword:
+                    if type(lst) is str:
+                        lst = fieldwords[indexword] = _unpackArray(lst)
+                    indexes.update(dict.fromkeys(lst))
+            if found is None:
+                found = indexes
+            else:
+                for index in found.keys():
+                    if index not in indexes:
+                        del found[index]
+            if not found:
+                return []
+        keys = self._keys
+        return [keys[x] for x in sorted(found)]
+
+    def __getstate__(self):
+        return self._keys, [_packTable(x) for x in self._fields]
+
+    def __setstate__(self, state):
+        self._keys, self._fields = state
+
+class TrigramIndex(object):
+    """
+    Index from the trigrams of strings, such as paths and URLs, to the
+    keys they were added with. Each key may be added with several
+    lists of strings, and each of them is indexed as a separate field.
+    A field given as None isn't known, and the key is always returned
+    when searching in it.
+    """
+
+    def __init__(self, keys=None, fields=None):
+        self._keys = keys or []
+        # (trigrams, unindexed keys, longest string) for each field.
+        self._fields = fields or []
+
+    def add(self, key, *fields):
+        index = len(self._keys)
+        self._keys.append(key)
+        while len(self._fields) < len(fields):
+            self._fields.append(({}, [], 0))
+        for i, strings in enumerate(fields):
+            trigrams, unindexed, maxlen = self._fields[i]
+            if strings is None:
+                unindexed.append(index)
+                continue
+            found = {}
+            dirs = {}
+            for s in strings:
+                s = s.lower()
+                if len(s) > maxlen:
+                    maxlen = len(s)
+                # Paths share most of their directories, so these
+                # are split out to be looked at just once.
+                pos = s.rfind("/")+1
+                dir = s[:pos]
+                if dir not in dirs:
+                    dirs[dir] = True
+                    _getTrigrams(dir, found)
+                _getTrigrams(s[max(pos-2, 0):], found)
+            for trigram in found:
+                lst = trigrams.get(trigram)
+                if lst is None:
+                    trigrams[trigram] = [index]
+                else:
+                    lst.append(index)
+            self._fields[i] = (trigrams, unindexed, maxlen)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self, pattern, cutoff, field=0):
+        """
+        Return the keys added with a string in the given field that
+        globdistance() may consider within cutoff of the pattern, or
+        None if the pattern is too loose for the index to tell.
+        """
+        if cutoff is None or field >= len(self._fields):
+            return None
+        trigrams, unindexed, maxlen = self._fields[field]
+        pattern = pattern.lower().lstrip("*")
+        wanted = []
+        for piece in _globre.split(pattern):
+            wanted.extend([piece[i:i+3] for i in range(len(piece)-2)])
+        if cutoff and type(cutoff) is float:
+            # Same allowance as globdistance(), for the longest string.
+            maxl = max(len(pattern), maxlen)
+            distance = max(int(maxl-cutoff*maxl), 0)
+        else:
+            distance = cutoff
+        # Each edit changes at most three trigrams of the pattern, so
+        # a close enough string has all of the others.
+        needed = len(wanted)-3*distance
+        if needed <= 0:
+            return None
+        counts = {}
+        for trigram in wanted:
+            lst = trigrams.get(trigram)
+            if lst is None:
+                continue
+            if type(lst) is str:
+                lst = trigrams[trigram] = _unpackArray(lst)
+            for index in lst:
+                counts[index] = counts.get(index, 0)+1
+        found = [x for x in counts if counts[x] >= needed]
+        found.extend(unindexed)
+        keys = self._keys
+        return [keys[x] for x in sorted(found)]
+
+    def __getstate__(self):
+        return self._keys, [(_packTable(trigrams), _packArray(unindexed),
+                             maxlen)
+                            for trigrams, unindexed, maxlen in self._fields]
+
+    def __setstate__(self, state):
+        self._keys, fields = state
+        self._fields = [(trigrams, list(_unpackArray(unindexed)), maxlen)
+                        for trigrams, unindexed, maxlen in fields]
+
+def _getTrigrams(s, found):
+    for i in range(len(s)-2):
+        found[s[i:i+3]] = True
+
+def _packTable(table):
+    packed = {}
+    for key, lst in table.iteritems():
+        if type(lst) is not str:
+            lst = _packArray(lst)
+        packed[key] = lst
+    return packed
+
+def writeTokenIndex(filename, index, digest):
+    """
+    Write index down, recording the digest of what it was built from.
+    The index may also be a tuple of indexes.
+    """
+    file = open(filename+".new", "w")
+    try:
+        cPickle.dump((TOKENINDEXVERSION, digest), file, 2)
+        cPickle.dump(index, file, 2)
+    finally:
+        file.close()
+    os.rename(filename+".new", filename)
+
+def _readHeader(file):
+    try:
+        version, digest = cPickle.load(file)
+    except (EOFError, ValueError, TypeError, AttributeError, IndexError,
+            ImportError, cPickle.UnpicklingError):
+        return None
+    if version != TOKENINDEXVERSION:
+        return None
+    return digest
+
+def getTokenIndexDigest(filename):
+    """Return the digest filename was written with, or None."""
+    try:
+        file = open(filename)
+    except IOError:
+        return None
+    try:
+        return _readHeader(file)
+    finally:
+        file.close()
+
+def readTokenIndex(filename, digest):
+    """
+    Return the index in filename, or None if it's missing or wasn't
+    written with the given digest.
+    """
+    try:
+        file = open(filename)
+    except IOError:
+        return None
+    try:
+        if _readHeader(file) != digest:
+            return None
+        try:
+            return cPickle.load(file)
+        except (EOFError, ValueError, TypeError, AttributeError,
+                IndexError, ImportError, cPickle.UnpicklingError):
+            return None
+    finally:
+        file.close()
+
+# vim:ts=4:sw=4:et
@@ -0,0 +1,93 @@
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+import traceback
+import threading
+import sys
+
+class WorkerPool(object):
+    """
+    Run tasks in at most a given number of threads.
+
+    Threads are started as tasks arrive, and are reused while there
+    are tasks waiting. If a callback is given, it's called from the
+    worker thread after each task, even if the task failed.
+    """
+
+    def __init__(self, size, callback=None):
+        self._size = max(size, 1)
+        self._callback = callback
+        self._tasks = []
+        self._threads = 0
+        self._idle = 0
+        self._stopped = False
+        self._cond = threading.Condition(threading.Lock())
+
+    def submit(self, func, *args):
+        self._cond.acquire()
+        try:
+            self._tasks.append((func, args))
+            self._stopped = False
+            if self._idle:
+                self._cond.notify()
+            if (len(self._tasks) > self._idle and
+                self._threads < self._size):
+                self._threads += 1
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """Let threads exit once the waiting tasks are done."""
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _work(self):
+        cond = self._cond
+        cond.acquire()
+        try:
+            while True:
+                while not self._tasks:
+                    if self._stopped:
+                        self._threads -= 1
+                        return
+                    self._idle += 1
+                    cond.wait()
+                    self._idle -= 1
+                func, args = self._tasks.pop(0)
+                cond.release()
+                try:
+                    try:
+                        func(*args)
+                    except:
+                        sys.stderr.write("Unhandled exception in %r:\n"
+                                         % func)
+                        traceback.print_exc()
+                finally:
+                    if self._callback:
+                        self._callback()
+                    cond.acquire()
+        finally:
+            cond.release()
+
+# vim:ts=4:sw=4:et
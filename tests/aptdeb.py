@@ -1,5 +1,7 @@
 from StringIO import StringIO
+from hashlib import md5, sha1
 import shutil
+import gzip
 import sys
 import os
 
@@ -361,6 +363,64 @@ class AptDebChannelTest(MockerTestCase):
         else:
             self.fail("Fetch worked with a bad signature! :-(")
 
+    def make_pdiff_repository(self, patch):
+        repo_dir = self.makeDir()
+        shutil.copytree(TESTDATADIR + "/aptdeb", repo_dir + "/aptdeb")
+        dists_dir = os.path.join(repo_dir, "aptdeb/dists")
+        binary_dir = os.path.join(dists_dir, "component/binary-i386")
+        new = gzip.open(os.path.join(binary_dir, "Packages.gz")).read()
+        lines = new.splitlines(True)
+        old = "".join(lines[:21])
+        if patch is None:
+            patch = "21a\n%s.\n" % "".join(lines[21:])
+        os.mkdir(os.path.join(binary_dir, "Packages.diff"))
+        file = gzip.open(os.path.join(binary_dir,
+                                      "Packages.diff/2008-09-03-2231.29.gz"),
+                         "w")
+        file.write(patch)
+        file.close()
+        index = ("SHA1-Current: %s %d\n"
+                 "SHA1-History:\n %s %d 2008-09-03-2231.29\n"
+                 "SHA1-Patches:\n %s %d 2008-09-03-2231.29\n" %
+                 (sha1(new).hexdigest(), len(new),
+                  sha1(old).hexdigest(), len(old),
+                  sha1(patch).hexdigest(), len(patch)))
+        open(os.path.join(binary_dir, "Packages.diff/Index"), "w").write(index)
+        release = open(os.path.join(dists_dir, "Release")).read()
+        release = release.replace("SHA1:\n", "".join(
+            [" %s %d component/binary-i386/%s\n" %
+             (md5(data).hexdigest(), len(data), name)
+             for name, data in [("Packages", new),
+                                ("Packages.diff/Index", index)]]) +
+            "SHA1:\n")
+        open(os.path.join(dists_dir, "Release"), "w").write(release)
+        # What was fetched last time.
+        open(os.path.join(self.download_dir, "Packages"), "w").write(old)
+        return repo_dir
+
+    def test_fetch_with_pdiff(self):
+        repo_dir = self.make_pdiff_repository(None)
+        # Make sure the patch is used.
+        os.unlink(os.path.join(repo_dir, "aptdeb/dists/component/"
+                                         "binary-i386/Packages.gz"))
+        channel = createChannel("alias",
+                                {"type": "apt-deb",
+                                 "baseurl": "file://%s/aptdeb" % repo_dir,
+                                 "distribution": "./",
+                                 "components": "component"})
+        self.check_channel(channel)
+        self.assertEquals(channel.getLoaders()[0]._filename,
+                          os.path.join(self.download_dir, "Packages"))
+
+    def test_fetch_with_broken_pdiff(self):
+        repo_dir = self.make_pdiff_repository("1d\n")
+        channel = createChannel("alias",
+                                {"type": "apt-deb",
+                                 "baseurl": "file://%s/aptdeb" % repo_dir,
+                                 "distribution": "./",
+                                 "components": "component"})
+        self.check_channel(channel)
+
     def test_fetch_with_component_missing_in_release_file(self):
         iface_mock = self.mocker.patch(iface.object)
         iface_mock.warning("Component 'non-existent' is not in Release file "
@@ -0,0 +1,271 @@
+from StringIO import StringIO
+import tempfile
+import unittest
+import random
+import os
+
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.backends.deb.base import DebDepends
+from smart.cache import Cache, StateVersionError, ProvidesIndex
+from smart.cache import dumpCacheFile, loadCacheFile
+from smart import Error
+
+
+SECTION = """\
+Package: %s
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %s
+Depends: libc6 (>= 2.3), foo | bar (>= 1)
+Provides: virtual
+Conflicts: old-%s
+Description: Summary line
+ Full description.
+"""
+
+
+class FakeLoader(DebTagLoader):
+
+    def __init__(self, sections=[]):
+        super(FakeLoader, self).__init__()
+        self.fake_sections = sections
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self.fake_sections):
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+
+def summarize(cache):
+    result = []
+    for pkg in cache.getPackages():
+        result.append((str(pkg), pkg.installed, pkg.priority,
+                       [str(x) for x in pkg.provides],
+                       [str(x) for x in pkg.requires],
+                       [str(x) for x in pkg.conflicts],
+                       sorted([(cache._loaders.index(loader), info)
+                               for loader, info in pkg.loaders.items()])))
+    for rel in cache.getProvides()+cache.getRequires()+cache.getConflicts():
+        result.append((str(rel), [str(x) for x in rel.packages]))
+    result.sort()
+    return result
+
+
+class CacheFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.installed = FakeLoader([SECTION % ("pkg%d" % i, "1.0", i)
+                                     for i in range(10)])
+        self.installed.setInstalled(True)
+        self.available = FakeLoader([SECTION % ("pkg%d" % i, "1.1", i)
+                                     for i in range(10)])
+        self.cache.addLoader(self.installed)
+        self.cache.addLoader(self.available)
+        self.cache.load()
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        if os.path.isfile(self.path):
+            os.unlink(self.path)
+
+    def dump(self, state):
+        file = open(self.path, "w")
+        dumpCacheFile(file, self.cache, state)
+        file.close()
+
+    def load(self):
+        file = open(self.path)
+        try:
+            return loadCacheFile(file)
+        finally:
+            file.close()
+
+    def test_round_trip(self):
+        self.dump(("state",))
+        cache, state = self.load()
+        self.assertEquals(state, ("state",))
+        self.assertEquals(summarize(cache), summarize(self.cache))
+
+    def test_loaders_are_relinked(self):
+        self.dump({"loader": self.installed})
+        cache, state = self.load()
+        loader = cache._loaders[0]
+        self.assertTrue(state["loader"] is loader)
+        self.assertTrue(loader.getCache() is cache)
+        self.assertTrue(loader.getInstalled())
+        for pkg in cache.getPackages():
+            for loader in pkg.loaders:
+                self.assertTrue(loader in cache._loaders)
+
+    def test_reload(self):
+        self.dump(None)
+        cache, state = self.load()
+        cache.reset()
+        cache.load()
+        self.assertEquals(summarize(cache), summarize(self.cache))
+
+    def test_bad_magic(self):
+        file = open(self.path, "w")
+        file.write("\0"*4096)
+        file.close()
+        self.assertRaises(StateVersionError, self.load)
+
+    def test_truncated(self):
+        self.dump(None)
+        data = open(self.path).read()
+        file = open(self.path, "w")
+        file.write(data[:len(data)//2])
+        file.close()
+        self.assertRaises(Error, self.load)
+
+
+class CacheNameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.loader = FakeLoader([SECTION % ("pkg%d" % i, "1.0", i)
+                                  for i in range(5)])
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+
+    def test_get_by_name(self):
+        packages = self.cache.getPackages("pkg1")
+        self.assertEquals([str(pkg) for pkg in packages], ["pkg1_1.0"])
+        self.assertEquals(len(self.cache.getProvides("virtual")), 1)
+        self.assertEquals(len(self.cache.getRequires("libc6")), 1)
+        self.assertEquals(len(self.cache.getConflicts("old-3")), 1)
+        self.assertEquals(self.cache.getPackages("missing"), [])
+
+    def test_get_without_name(self):
+        self.assertTrue(self.cache.getPackages() is self.cache._packages)
+        self.assertEquals(len(self.cache.getPackages("")), 5)
+
+    def test_result_is_a_copy(self):
+        self.cache.getPackages("pkg1").append(None)
+        self.assertEquals(len(self.cache.getPackages("pkg1")), 1)
+
+    def test_reset_and_reload(self):
+        self.assertEquals(len(self.cache.getPackages("pkg1")), 1)
+        self.cache.reset()
+        self.assertEquals(self.cache.getPackages("pkg1"), [])
+        self.loader.fake_sections.append(SECTION % ("pkg1", "1.1", 1))
+        self.loader.reset()
+        self.cache.load()
+        self.assertEquals(len(self.cache.getPackages("pkg1")), 2)
+
+    def test_remove_loader(self):
+        self.assertEquals(len(self.cache.getPackages("pkg1")), 1)
+        self.cache.removeLoader(self.loader)
+        self.cache.load()
+        self.assertEquals(self.cache.getPackages("pkg1"), [])
+
+    def test_lookups_while_building(self):
+        lookups = []
+        class LookingLoader(FakeLoader):
+            def getSections(self, prog):
+                for section in FakeLoader.getSections(self, prog):
+                    cache = self.getCache()
+                    lookups.append((len(cache.getPackages("pkg1")),
+                                    len(cache.getProvides("virtual"))))
+                    yield section
+        cache = Cache()
+        cache.addLoader(LookingLoader([SECTION % ("pkg0", "1.0", 0),
+                                       SECTION % ("pkg1", "1.0", 1),
+                                       SECTION % ("pkg1", "1.1", 1)]))
+        cache.load()
+        self.assertEquals(lookups, [(0, 0), (0, 1), (1, 1)])
+        self.assertEquals(len(cache.getPackages("pkg1")), 2)
+
+
+LINKSECTION = """\
+Package: %s
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %s
+Depends: %s
+Provides: %s
+Conflicts: %s
+Description: Summary line
+ Full description.
+"""
+
+
+def link(dep, prv):
+    # Or-dependencies naming the same provide twice are linked to it
+    # twice, as they've always been.
+    if dep.matches(prv):
+        return dep.getMatchNames().count(prv.name)
+    return 0
+
+
+class LinkDepsTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(0)
+        versions = ["%d.%d-%d" % (rnd.randint(0, 3), rnd.randint(0, 9),
+                                  rnd.randint(1, 2)) for i in range(60)]
+        versions.append("1:0.1-1")
+        versions = sorted(set(versions))
+        def relation():
+            name = rnd.choice(["lib", "lib", "lib", "virtual", "lib1"])
+            op = rnd.choice(["", "<<", "<=", "=", ">=", ">>"])
+            if not op:
+                return name
+            return "%s (%s %s)" % (name, op, rnd.choice(versions))
+        def relations(alternatives=3):
+            result = []
+            for i in range(rnd.randint(1, 3)):
+                result.append(" | ".join([relation() for j in
+                              range(rnd.randint(1, alternatives))]))
+            return ", ".join(result)
+        sections = []
+        for version in versions:
+            sections.append(LINKSECTION % ("lib", version, relations(),
+                                           "virtual", relations(1)))
+        for i in range(5):
+            sections.append(LINKSECTION % ("user%d" % i, "1.0", relations(),
+                                           "lib", relations(1)))
+        self.cache = Cache()
+        self.cache.addLoader(FakeLoader(sections))
+        self.cache.load()
+
+    def test_link_results(self):
+        provides = self.cache.getProvides()
+        self.assertTrue(len(self.cache.getProvides("lib")) > 20)
+        for deps, attr in [(self.cache.getRequires(), "requiredby"),
+                           (self.cache.getConflicts(), "conflictedby")]:
+            for dep in deps:
+                expected = [prv for prv in provides
+                            for i in range(link(dep, prv))]
+                self.assertEquals(dep.providedby or [], expected)
+            for prv in provides:
+                expected = [dep for dep in deps
+                            for i in range(link(dep, prv))]
+                self.assertEquals(getattr(prv, attr) or [], expected)
+
+    def test_index_candidates(self):
+        provides = self.cache.getProvides()
+        index = ProvidesIndex(provides)
+        deps = self.cache.getRequires()+self.cache.getConflicts()
+        for dep in deps:
+            expected = [prv for prv in provides
+                        for i in range(link(dep, prv))]
+            candidates = index.getCandidates(dep)
+            self.assertEquals([prv for prv in candidates
+                               if dep.matches(prv)], expected)
+
+    def test_index_prunes_versioned(self):
+        bucket = self.cache.getProvides("lib")
+        index = ProvidesIndex(self.cache.getProvides())
+        for prv in bucket:
+            if prv.version:
+                dep = DebDepends("lib", "=", prv.version)
+                candidates = index.getCandidates(dep)
+                self.assertTrue(prv in candidates)
+                self.assertTrue(len(candidates) < len(bucket))
@@ -0,0 +1,195 @@
+import threading
+import unittest
+import tempfile
+import shutil
+
+from smart.backends.deb.base import DebPackage
+from smart.transaction import ChangeSet
+from smart.channel import PackageChannel
+from smart.fetcher import FetcherCancelled
+from smart.const import INSTALL, REMOVE, NEVER
+from smart.cache import Cache
+from smart import Error, sysconf, iface
+
+from tests.transaction import make_cache
+from tests import ctrl
+
+
+class PipelinedCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = make_cache(6, lambda i: min(i+1, 5))
+        self.changeset = ChangeSet(self.cache)
+        for pkg in self.cache.getPackages():
+            if pkg.installed:
+                self.changeset[pkg] = REMOVE
+            elif pkg.version == "1.2":
+                self.changeset[pkg] = INSTALL
+        self.events = []
+        self.fail_fetch = None
+
+        self.cond = threading.Condition()
+
+        test = self
+        class FakePackageManager(object):
+            def commit(self, changeset, pkgpaths):
+                for pkg in changeset:
+                    if changeset[pkg] is INSTALL:
+                        assert pkg in pkgpaths
+                names = sorted(map(str, changeset))
+                test.cond.acquire()
+                test.events.append(("commit", names))
+                # Wait for the next step to start downloading.
+                steps = len(test.steps)
+                for i in range(50):
+                    fetches = [x for x in test.events if x[0] == "fetch"]
+                    commits = [x for x in test.events if x[0] == "commit"]
+                    if len(fetches) >= min(len(commits)+1, steps):
+                        break
+                    test.cond.wait(0.1)
+                test.events.append(("committed", names))
+                test.cond.release()
+
+        self.steps = ctrl.splitChangeSet(self.changeset)
+        self.old_packagemanager = DebPackage.packagemanager
+        DebPackage.packagemanager = FakePackageManager
+        self.old_cache = ctrl._cache
+        ctrl._cache = self.cache
+        ctrl.fetchPackages = self.fetchPackages
+
+    def tearDown(self):
+        DebPackage.packagemanager = self.old_packagemanager
+        ctrl._cache = self.old_cache
+        del ctrl.fetchPackages
+        sysconf.remove("commit-pipelined")
+
+    def fetchPackages(self, packages, caching=None, targetdir=None,
+                      channels=False, fetcher=None, progress=None):
+        names = sorted(map(str, packages))
+        self.cond.acquire()
+        self.events.append(("fetch", names))
+        self.cond.notify()
+        self.cond.release()
+        if names == self.fail_fetch:
+            raise Error, "Failed to download"
+        pkgpaths = dict.fromkeys(packages, [])
+        pkgchannels = {}
+        for pkg in packages:
+            pkgchannels[pkg] = pkg.loaders.keys()[0].getChannel()
+        return pkgpaths, pkgchannels
+
+    def getInstalls(self):
+        return [sorted([str(pkg) for pkg in cs if cs[pkg] is INSTALL])
+                for cs in self.steps]
+
+    def test_split_changeset(self):
+        self.assertTrue(len(self.steps) > 1)
+        done = ChangeSet(self.cache)
+        for cs in self.steps:
+            for pkg in cs:
+                self.assertFalse(pkg in done)
+            done.update(cs)
+        self.assertEquals(done, self.changeset)
+
+    def test_commit_pipelined(self):
+        sysconf.set("commit-pipelined", True)
+        self.assertTrue(ctrl.commitChangeSet(self.changeset, confirm=False))
+        installs = self.getInstalls()
+        commits = [sorted(map(str, cs)) for cs in self.steps]
+        self.assertEquals(self.events[0], ("fetch", installs[0]))
+        self.assertEquals([x for x in self.events if x[0] == "commit"],
+                          [("commit", x) for x in commits])
+        # Each step starts downloading while the one before it is
+        # still being committed.
+        for i in range(1, len(self.steps)):
+            self.assertTrue(self.events.index(("fetch", installs[i])) <
+                            self.events.index(("committed", commits[i-1])))
+
+    def test_commit_pipelined_fetch_failure(self):
+        self.fail_fetch = self.getInstalls()[1]
+        self.assertRaises(Error, ctrl.commitChangeSetPipelined,
+                          self.changeset, confirm=False)
+        commits = [x for x in self.events if x[0] == "commit"]
+        self.assertEquals(commits,
+                          [("commit", sorted(map(str, self.steps[0])))])
+
+
+class ReloadChannelsConcurrentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = sysconf.get("data-dir")
+        self.tmp_dir = tempfile.mkdtemp()
+        sysconf.set("data-dir", self.tmp_dir, soft=True)
+        self.old_cache = ctrl._cache
+        ctrl._cache = Cache()
+        self.cond = threading.Condition()
+        self.started = []
+
+    def tearDown(self):
+        ctrl._cache = self.old_cache
+        sysconf.set("data-dir", self.data_dir, soft=True)
+        sysconf.remove("channel-fetch-workers")
+        shutil.rmtree(self.tmp_dir)
+
+    def make_channel(self, alias):
+        test = self
+        class WaitingChannel(PackageChannel):
+            def getFetchSteps(self):
+                return 1
+            def fetch(self, fetcher, progress):
+                # Wait like a download would, until it's cancelled.
+                test.cond.acquire()
+                test.started.append(self)
+                test.cond.notifyAll()
+                for i in range(100):
+                    if fetcher.wasCancelled():
+                        break
+                    test.cond.wait(0.1)
+                test.cond.release()
+                if fetcher.wasCancelled():
+                    raise FetcherCancelled, "Cancelled"
+                return True
+        return WaitingChannel("deb-dir", alias)
+
+    def test_cancel_while_fetching_concurrently(self):
+        sysconf.set("channel-fetch-workers", 2)
+        channels = [self.make_channel("alias%d" % i) for i in range(3)]
+        def cancel():
+            self.cond.acquire()
+            for i in range(100):
+                if len(self.started) >= 2:
+                    break
+                self.cond.wait(0.1)
+            self.cond.release()
+            ctrl.getFetcher().cancel()
+        thread = threading.Thread(target=cancel)
+        thread.start()
+        self.assertFalse(ctrl.reloadChannels(channels, caching=NEVER))
+        thread.join()
+        # The third channel was waiting for a worker, so it's skipped.
+        self.assertEquals(sorted([x.getAlias() for x in self.started]),
+                          ["alias0", "alias1"])
+
+    def test_messages_are_shown_from_main_thread(self):
+        sysconf.set("channel-fetch-workers", 2)
+        shown = []
+        def warning(msg):
+            shown.append((msg, threading.currentThread()))
+        class WarningChannel(PackageChannel):
+            def getFetchSteps(self):
+                return 1
+            def fetch(self, fetcher, progress):
+                iface.warning("warning from %s" % self.getAlias())
+                return True
+        channels = [WarningChannel("deb-dir", "alias%d" % i)
+                    for i in range(3)]
+        iface.object.warning = warning
+        try:
+            self.assertTrue(ctrl.reloadChannels(channels, caching=NEVER))
+        finally:
+            del iface.object.warning
+        self.assertEquals(sorted([x for x, y in shown]),
+                          ["warning from alias0", "warning from alias1",
+                           "warning from alias2"])
+        for msg, thread in shown:
+            self.assertTrue(thread is threading.currentThread())
@@ -1,3 +1,4 @@
+import random
 import sys
 
 from tests.mocker import MockerTestCase
@@ -5,7 +6,7 @@ from tests.mocker import MockerTestCase
 import smart.backends.deb._base
 
 from smart.backends.deb.base import getArchitecture
-from smart.backends.deb.debver import splitrelease
+from smart.backends.deb.debver import splitrelease, vercmp, verkey, checkdep
 
 
 class GetArchitectureTest(MockerTestCase):
@@ -65,3 +66,41 @@ class DebVerSplitTest(MockerTestCase):
         self.assertEquals(version, "1.0")
         self.assertEquals(release, "1_0ubuntu0.10.04")
 
+
+class DebVerKeyTest(MockerTestCase):
+
+    def test_known_order(self):
+        versions = ["~~", "~", "~a", "0", "0.9", "1.0~rc1", "1.0", "1.0-1",
+                    "1.0-1.1", "1.0-2", "1.0a", "1.0+b1", "1.0.1", "1.10",
+                    "2", "1:0.1", "1:0.1-1"]
+        for i in range(len(versions)):
+            for j in range(len(versions)):
+                self.assertEquals(vercmp(versions[i], versions[j]),
+                                  cmp(i, j))
+                self.assertEquals(cmp(verkey(versions[i]),
+                                      verkey(versions[j])), cmp(i, j))
+
+    def test_equal_versions(self):
+        for v1, v2 in [("1.0", "1.00"), ("1.0", "1."), ("1:1.0", "1:1.00"),
+                       ("1.01", "1.1")]:
+            self.assertEquals(vercmp(v1, v2), 0)
+            self.assertEquals(verkey(v1), verkey(v2))
+
+    def test_key_matches_vercmp(self):
+        rnd = random.Random(0)
+        versions = ["".join([rnd.choice("0019a.~+-:")
+                             for i in range(rnd.randint(1, 8))])
+                    for i in range(200)]
+        versions = [x for x in versions if x[0] != "-"]
+        for v1 in versions:
+            for v2 in versions:
+                rc = vercmp(v1, v2)
+                self.assertEquals(cmp(verkey(v1), verkey(v2)), rc)
+                self.assertEquals(checkdep(v1, "<=", v2), rc <= 0)
+
+    def test_big_numbers(self):
+        self.assertEquals(vercmp("1.%s" % ("9"*30), "1.1%s" % ("0"*30)), -1)
+        self.assertEquals(vercmp("1.%s" % ("9"*30), "1.0%s" % ("9"*30)), 0)
+
+    def test_key_is_cached(self):
+        self.assertTrue(verkey("1.2.3-4") is verkey("1.2.3-4"))
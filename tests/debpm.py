@@ -7,6 +7,7 @@ from smart.backends.deb.base import \
     DebPackage, DebProvides, DebNameProvides, DebPreRequires, DebRequires, \
     DebOrRequires, DebUpgrades, DebConflicts, DebBreaks
 from smart.backends.deb.pm import DebPackageManager, DebSorter, UNPACK, CONFIG
+from smart.backends.deb.pm import joinLayers
 from smart.channel import createChannel
 from smart.sysconfig import SysConfig
 from smart.interface import Interface
@@ -236,3 +237,32 @@ class DebSorterTest(unittest.TestCase):
         self.assertEquals(sorted,
                           [(a_2, UNPACK), (a_1, REMOVE), (b_1, UNPACK),
                            (b_1, CONFIG), (a_2, CONFIG)])
+
+        layers = sorter.getLayers()
+
+        self.assertEquals(layers,
+                          [[(a_2, UNPACK)], [(a_1, REMOVE)], [(b_1, UNPACK)],
+                           [(b_1, CONFIG)], [(a_2, CONFIG)]])
+
+
+class JoinLayersTest(unittest.TestCase):
+
+    def test_group_by_operation(self):
+        layers = [[("a", UNPACK), ("b", REMOVE), ("c", UNPACK)]]
+        self.assertEquals(joinLayers(layers),
+                          [("a", UNPACK), ("c", UNPACK), ("b", REMOVE)])
+
+    def test_continue_previous_operation(self):
+        layers = [[("a", UNPACK), ("b", REMOVE)],
+                  [("c", CONFIG), ("d", REMOVE)],
+                  [("e", CONFIG), ("f", UNPACK)]]
+        self.assertEquals(joinLayers(layers),
+                          [("a", UNPACK), ("b", REMOVE), ("d", REMOVE),
+                           ("c", CONFIG), ("e", CONFIG), ("f", UNPACK)])
+
+    def test_single_operation(self):
+        layers = [[("a", CONFIG)], [("b", CONFIG), ("c", REMOVE)],
+                  [("d", UNPACK)]]
+        self.assertEquals(joinLayers(layers),
+                          [("a", CONFIG), ("b", CONFIG), ("c", REMOVE),
+                           ("d", UNPACK)])
@@ -1,4 +1,6 @@
+from StringIO import StringIO
 import BaseHTTPServer
+import gzip
 import threading
 import unittest
 import socket
@@ -8,8 +10,9 @@ import os
 
 from smart.progress import Progress
 from smart.interface import Interface
-from smart.fetcher import Fetcher
-from smart.const import VERSION, SUCCEEDED, FAILED
+from smart.fetcher import Fetcher, FetcherCancelled
+from smart.util.contentstore import ContentStore
+from smart.const import VERSION, SUCCEEDED, FAILED, NEVER
 from smart import fetcher, sysconf, iface
 
 from tests.mocker import MockerTestCase
@@ -18,6 +21,10 @@ from tests.mocker import MockerTestCase
 PORT = 43543
 URL = "http://127.0.0.1:%d/filename.pkg" % PORT
 
+# Digests of "Hello!".
+MD5 = "952d2c56d0485958336747bcdd98590d"
+SHA256 = "334d016f755cd6dc58c53a86e183882f8ec14f52fb05345887c8a5edd42c87b7"
+
 
 class HTTPServer(BaseHTTPServer.HTTPServer):
 
@@ -45,7 +52,8 @@ class FetcherTest(MockerTestCase):
         # See above.
         signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
-    def start_server(self, handler, hide_errors=False):
+    def start_server(self, handler, hide_errors=False,
+                     protocol_version="HTTP/1.0", requests=1):
         startup_lock = threading.Lock()
         startup_lock.acquire()
         def server():
@@ -54,6 +62,7 @@ class FetcherTest(MockerTestCase):
                     return handler(self)
                 def log_message(self, format, *args):
                     pass
+            Handler.protocol_version = protocol_version
             while True:
                 try:
                     httpd = HTTPServer(("127.0.0.1", PORT), Handler)
@@ -64,7 +73,8 @@ class FetcherTest(MockerTestCase):
                     time.sleep(1)
             startup_lock.release()
             httpd.hide_errors = hide_errors
-            httpd.handle_request()
+            for i in range(requests):
+                httpd.handle_request()
 
         self.server_thread = threading.Thread(target=server)
         self.server_thread.start()
@@ -102,6 +112,224 @@ class FetcherTest(MockerTestCase):
                 del os.environ["http_proxy"]
         self.assertTrue("Pragma: no-cache\r\n" not in headers)
 
+    def test_keep_alive(self):
+        sysconf.set("max-active-downloads", 1, soft=True)
+        self.addCleanup(sysconf.remove, "max-active-downloads", soft=True)
+        clients = []
+        def handler(request):
+            clients.append(request.client_address)
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.end_headers()
+            request.wfile.write("Hello!")
+        # The server handles a single connection, so both files must
+        # be fetched through it.
+        self.start_server(handler, protocol_version="HTTP/1.1")
+        self.fetcher.enqueue(URL)
+        self.fetcher.enqueue(URL + "2")
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        for item in self.fetcher.getItems():
+            self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(len(clients), 2)
+        self.assertEquals(clients[0], clients[1])
+
+    def test_fork_shares_download_slots(self):
+        forked = self.fetcher.fork()
+        self.assertTrue(forked.getMirrorSystem() is
+                        self.fetcher.getMirrorSystem())
+        self.assertEquals(forked.getLocalPathPrefix(), self.local_path + "/")
+        self.fetcher._slots.join(self.fetcher, 1)
+        self.assertTrue(forked.changeActiveDownloads(1))
+        self.assertFalse(self.fetcher.changeActiveDownloads(1))
+        self.assertEquals(self.fetcher.getActiveDownloads(), 1)
+        self.assertTrue(forked.changeActiveDownloads(-1))
+        self.assertTrue(self.fetcher.changeActiveDownloads(1))
+
+    def test_forks_run_concurrently(self):
+        def handler(request):
+            request.send_response(200)
+            request.end_headers()
+            request.wfile.write("Hello!")
+        self.start_server(handler, requests=2)
+        forks = [self.fetcher.fork(), self.fetcher.fork()]
+        threads = []
+        for i, forked in enumerate(forks):
+            forked.enqueue(URL + str(i))
+            thread = threading.Thread(target=forked.run,
+                                      kwargs={"progress": Progress()})
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.wait_for_server()
+        for i, forked in enumerate(forks):
+            item = forked.getItem(URL + str(i))
+            self.assertEquals(item.getStatus(), SUCCEEDED)
+            self.assertEquals(open(item.getTargetPath()).read(), "Hello!")
+
+    def test_cancel_stops_forks(self):
+        started = threading.Event()
+        release = threading.Event()
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", "12")
+            request.end_headers()
+            request.wfile.write("Hello!")
+            request.wfile.flush()
+            started.set()
+            release.wait(10)
+        self.start_server(handler, hide_errors=True)
+        forked = self.fetcher.fork()
+        forked.enqueue(URL)
+        errors = []
+        def run():
+            try:
+                forked.run(progress=Progress())
+            except FetcherCancelled, e:
+                errors.append(e)
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            started.wait(10)
+            self.fetcher.cancel()
+            thread.join(10)
+            self.assertFalse(thread.isAlive())
+            self.assertEquals(len(errors), 1)
+            self.assertTrue(forked.wasCancelled())
+        finally:
+            release.set()
+            thread.join()
+            self.wait_for_server()
+
+    def test_digests_while_downloading(self):
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.end_headers()
+            request.wfile.write("Hello!")
+        self.start_server(handler)
+        item = self.fetcher.enqueue(URL, md5=MD5, sha256=SHA256)
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        path = item.getTargetPath()
+        self.assertEquals(item.getDigests(path),
+                          {"md5": MD5, "sha256": SHA256})
+        # Digests are ignored once the file doesn't match them.
+        file = open(path, "a")
+        file.write("!")
+        file.close()
+        self.assertEquals(item.getDigests(path), None)
+        self.assertFalse(self.fetcher.validate(item, path))
+
+    def test_invalid_digest(self):
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.end_headers()
+            request.wfile.write("Hello?")
+        self.start_server(handler)
+        item = self.fetcher.enqueue(URL, md5=MD5)
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), FAILED)
+        self.assertTrue(item.getFailedReason().startswith("Invalid MD5"))
+
+    def test_etag_revalidation(self):
+        self.fetcher.setLocalPathPrefix(None)
+        self.fetcher.setLocalDir(self.local_path)
+        headers = []
+        def handler(request):
+            headers.append(request.headers)
+            if request.headers.get("if-none-match") == '"1"':
+                request.send_response(304)
+                request.end_headers()
+                return
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.send_header("ETag", '"1"')
+            request.send_header("Last-Modified",
+                                "Sat, 01 Jan 2011 00:00:00 GMT")
+            request.end_headers()
+            request.wfile.write("Hello!")
+        self.start_server(handler, requests=2)
+        self.fetcher.enqueue(URL, md5=MD5)
+        self.fetcher.run(progress=Progress())
+        # The second run must trust the recorded digests.
+        def getFileDigest(path, kind):
+            raise AssertionError("%s was hashed" % path)
+        self.addCleanup(setattr, fetcher, "getFileDigest",
+                        fetcher.getFileDigest)
+        fetcher.getFileDigest = getFileDigest
+        self.fetcher.reset()
+        self.fetcher.setCaching(NEVER)
+        item = self.fetcher.enqueue(URL, md5=MD5)
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(headers[1].get("if-none-match"), '"1"')
+        self.assertEquals(headers[1].get("if-modified-since"),
+                          "Sat, 01 Jan 2011 00:00:00 GMT")
+        path = item.getTargetPath()
+        self.assertEquals(self.fetcher.getFileMetadata(path)["digests"],
+                          {"md5": MD5})
+        # Once the file changes, it has to be read again.
+        file = open(path, "w")
+        file.write("Hello?")
+        file.close()
+        self.assertEquals(self.fetcher.getFileMetadata(path), {})
+
+    def test_store(self):
+        store = ContentStore(self.makeDir())
+        self.fetcher.setStore(store)
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", "6")
+            request.end_headers()
+            request.wfile.write("Hello!")
+        self.start_server(handler)
+        self.fetcher.enqueue(URL, md5=MD5)
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        self.assertTrue(store.has(store.getKey("md5", MD5)))
+        # The same contents at another URL come from the store.
+        self.fetcher.reset()
+        item = self.fetcher.enqueue(URL + "2", md5=MD5)
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(open(item.getTargetPath()).read(), "Hello!")
+
+    def fetch_gzip(self, body):
+        sysconf.set("stream-uncompress", True, soft=True)
+        self.addCleanup(sysconf.remove, "stream-uncompress", soft=True)
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+        self.start_server(handler)
+        url = URL + ".gz"
+        item = self.fetcher.enqueue(url, uncomp=True, uncomp_md5=MD5)
+        self.fetcher.run(progress=Progress())
+        return item
+
+    def test_stream_uncompress(self):
+        file = StringIO()
+        gzip.GzipFile("filename.pkg", "w", 9, file).write("Hello!")
+        item = self.fetch_gzip(file.getvalue())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        path = item.getTargetPath()
+        self.assertEquals(item.getUncompressedPath(), path)
+        self.assertEquals(open(path).read(), "Hello!")
+        self.assertEquals(item.getDigests(path, uncomp=True), {"md5": MD5})
+        self.assertFalse(os.path.exists(path+".part"))
+
+    def test_stream_uncompress_broken(self):
+        item = self.fetch_gzip("Hello!")
+        self.assertEquals(item.getStatus(), FAILED)
+        self.assertEquals(item.getUncompressedPath(), None)
+        path = self.fetcher.getLocalPath(item)[:-3]
+        self.assertFalse(os.path.exists(path+".part"))
+
     def test_401_handling(self):
         headers = []
         def handler(request):
@@ -0,0 +1,165 @@
+import unittest
+import random
+
+from smart.reachability import Reachability
+from smart.transaction import ChangeSet
+from smart.const import INSTALL, REMOVE
+from smart.cache import Cache
+from smart import pkgconf
+
+from tests.transaction import FakeLoader, make_cache
+
+
+SECTION = """\
+Package: pkg%d
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %s
+Depends: %s
+Recommends: %s
+Description: Summary line
+ Full description.
+"""
+
+
+def make_random_cache(total, seed):
+    rnd = random.Random(seed)
+    cache = Cache()
+    for version in ["1.0", "1.1"]:
+        sections = []
+        for i in range(total):
+            deps = ["pkg%d" % rnd.randrange(total)
+                    for j in range(rnd.randrange(3))]
+            deps.append("pkg%d (>= %s)" % (rnd.randrange(total), version))
+            recommends = "pkg%d" % rnd.randrange(total)
+            sections.append(SECTION % (i, version, " | ".join(deps),
+                                       recommends))
+        loader = FakeLoader(sections)
+        loader.setInstalled(version == "1.0")
+        cache.addLoader(loader)
+    cache.load()
+    return cache
+
+
+def old_mark_and_sweep(cache, changeset):
+    # The walk markAndSweep() did before the graph was kept around.
+    auto = pkgconf.getFlagMatcher("auto")
+    marked = {}
+    for pkg in cache.getPackages():
+        if (pkg.installed and not auto.matches(pkg) and
+            changeset.get(pkg) != REMOVE):
+            marked[pkg] = True
+    queue = marked.keys()
+    while queue:
+        pkg = queue.pop(0)
+        for req in pkg.requires + pkg.recommends:
+            for prv in req.providedby:
+                for prvpkg in prv.packages:
+                    if (prvpkg.installed and
+                        prvpkg not in marked and
+                        prvpkg not in changeset):
+                        marked[prvpkg] = True
+                        queue.append(prvpkg)
+    return [pkg for pkg in cache.getPackages()
+            if pkg.installed and pkg not in marked]
+
+
+def old_leaves(cache):
+    leaves = []
+    for pkg in cache.getPackages():
+        if not pkg.installed:
+            continue
+        leaf = True
+        for prv in pkg.provides:
+            for req in prv.requiredby:
+                for reqpkg in req.packages:
+                    if reqpkg.installed:
+                        leaf = False
+        if leaf:
+            leaves.append(pkg)
+    return leaves
+
+
+class ReachabilityTest(unittest.TestCase):
+
+    def setUp(self):
+        # pkg0 -> pkg1 -> ... -> pkg5, with pkg5 requiring itself.
+        self.cache = make_cache(6, lambda i: min(i+1, 5))
+        self.installed = dict([(pkg.name, pkg)
+                               for pkg in self.cache.getPackages()
+                               if pkg.installed])
+        self.reachability = Reachability(self.cache)
+
+    def tearDown(self):
+        pkgconf.clearFlag("auto")
+
+    def names(self, pkgs):
+        return sorted([pkg.name for pkg in pkgs])
+
+    def test_only_installed(self):
+        self.assertEquals(self.names(self.reachability.getPackages()),
+                          self.names(self.installed.values()))
+
+    def test_leaves(self):
+        self.assertEquals(self.names(self.reachability.getLeaves()),
+                          ["pkg0"])
+        self.assertTrue(self.reachability.isLeaf(self.installed["pkg0"]))
+        self.assertFalse(self.reachability.isLeaf(self.installed["pkg5"]))
+
+    def test_required_by(self):
+        pkg5 = self.installed["pkg5"]
+        self.assertEquals(self.names(self.reachability.getRequiredBy(pkg5)),
+                          ["pkg4", "pkg5"])
+
+    def test_sweep_keeps_dependencies(self):
+        for i in range(1, 6):
+            pkgconf.setFlag("auto", "pkg%d" % i)
+        self.assertEquals(self.reachability.sweep(), [])
+        self.assertEquals(self.reachability.getOrphans(), [])
+
+    def test_orphans(self):
+        for i in range(6):
+            pkgconf.setFlag("auto", "pkg%d" % i)
+        self.assertEquals(self.names(self.reachability.getOrphans()),
+                          self.names(self.installed.values()))
+
+    def test_orphans_follow_auto_flag(self):
+        pkgconf.setFlag("auto", "pkg0")
+        self.assertEquals(self.names(self.reachability.getOrphans()),
+                          ["pkg0"])
+        pkgconf.clearFlag("auto", "pkg0")
+        self.assertEquals(self.reachability.getOrphans(), [])
+
+    def test_removal_impact(self):
+        for i in range(3, 6):
+            pkgconf.setFlag("auto", "pkg%d" % i)
+        impact = self.reachability.getRemovalImpact([self.installed["pkg2"]])
+        self.assertEquals(self.names(impact), ["pkg3", "pkg4", "pkg5"])
+        impact = self.reachability.getRemovalImpact([self.installed["pkg0"]])
+        self.assertEquals(impact, [])
+
+    def test_stale_after_load(self):
+        self.assertTrue(self.reachability.isCurrent(self.cache))
+        self.assertFalse(self.reachability.isCurrent(Cache()))
+        self.cache.load()
+        self.assertFalse(self.reachability.isCurrent(self.cache))
+
+    def test_matches_old_walk(self):
+        for seed in range(5):
+            cache = make_random_cache(40, seed)
+            rnd = random.Random(seed)
+            pkgconf.clearFlag("auto")
+            for i in range(40):
+                if rnd.random() < 0.9:
+                    pkgconf.setFlag("auto", "pkg%d" % i)
+            reachability = Reachability(cache)
+            self.assertEquals(reachability.getLeaves(), old_leaves(cache))
+            changeset = ChangeSet(cache)
+            self.assertEquals(reachability.sweep(changeset),
+                              old_mark_and_sweep(cache, changeset))
+            for pkg in rnd.sample(cache.getPackages(), 10):
+                changeset[pkg] = rnd.choice([INSTALL, REMOVE])
+                self.assertEquals(reachability.sweep(changeset),
+                                  old_mark_and_sweep(cache, changeset))
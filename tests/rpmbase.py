@@ -6,7 +6,10 @@ from mocker import MockerTestCase
 
 from smart.backends.rpm.base import RPMPackage, Package, Requires, Provides, \
                                     getTS, collapse_libc_requires
+from smart.backends.rpm.base import RPMProvides, RPMRequires
 from smart.backends.rpm.rpmver import checkver, splitarch, splitrelease
+from smart.backends.rpm.rpmver import vercmp, verkey, vercmpkeys
+from smart.cache import ProvidesIndex
 from smart import sysconf
 
 
@@ -126,3 +129,51 @@ class RPMVerSplitTest(MockerTestCase):
         self.assertEquals(version, "1.0")
         self.assertEquals(release, "1")
 
+class RPMVerKeyTest(MockerTestCase):
+
+    def test_known_order(self):
+        versions = ["0.9", "1.0", "1.0a", "1.0.1", "1.1", "1.10", "2",
+                    "1:0.1"]
+        for i in range(len(versions)):
+            for j in range(len(versions)):
+                self.assertEquals(vercmp(versions[i], versions[j]),
+                                  cmp(i, j))
+                self.assertEquals(vercmpkeys(verkey(versions[i]),
+                                             verkey(versions[j])),
+                                  cmp(i, j))
+
+    def test_release(self):
+        self.assertEquals(vercmp("1.0-1", "1.0-2"), -1)
+        self.assertEquals(vercmp("1.0-10", "1.0-9"), 1)
+        self.assertEquals(vercmp("1.0", "1.0-2"), 0)
+        self.assertEquals(vercmp("1.0-2", "1.0"), 0)
+        self.assertEquals(verkey("1.0")[2], None)
+
+    def test_trailing_separator(self):
+        self.assertEquals(verkey("1.0."), None)
+        self.assertEquals(verkey("1.0-1."), None)
+        self.assertEquals(vercmp("1.0.", "1.0"), 1)
+
+    def test_key_is_cached(self):
+        self.assertTrue(verkey("1.2.3-4") is verkey("1.2.3-4"))
+
+
+class ProvidesIndexTest(MockerTestCase):
+
+    def test_keeps_unsortable_versions(self):
+        # rpm doesn't order versions ending in a separator, or without
+        # alphanumeric segments, consistently with the others.
+        versions = ["1.0", "2.0", "2.5", "3", "3.0", "3.0-1", "3.1",
+                    "3.", "3..", "0:3..", "3.a", "..", ".", "4.0-1",
+                    "1:1.0", "1:3.."]
+        provides = [RPMProvides("foo", version) for version in versions]
+        index = ProvidesIndex(provides)
+        for version in versions:
+            for relation in ["<", "<=", "=", ">=", ">"]:
+                dep = RPMRequires("foo", relation, version)
+                expected = [prv for prv in provides if dep.matches(prv)]
+                candidates = index.getCandidates(dep)
+                self.assertEquals([prv for prv in candidates
+                                   if dep.matches(prv)], expected)
+        dep = RPMRequires("foo", "=", "0:3..")
+        self.assertTrue(provides[9] in index.getCandidates(dep))
@@ -1,6 +1,56 @@
+from StringIO import StringIO
+import os
+
 from mocker import MockerTestCase
 
-from smart.searcher import Searcher
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.searcher import Searcher, updateSearchIndex, getSearchIndexPath
+from smart.channel import PackageChannel, createChannel
+from smart.cache import Cache, Loader
+from smart.const import NEVER
+from smart import sysconf
+
+from tests import ctrl, TESTDATADIR
+
+
+SECTION = """\
+Package: %s
+Priority: optional
+Section: %s
+Architecture: all
+Version: 1.0
+Description: %s
+ %s
+"""
+
+
+class FakeLoader(DebTagLoader):
+
+    def __init__(self, sections):
+        super(FakeLoader, self).__init__()
+        self.fake_sections = sections
+        self.fake_read = []
+        self.fake_paths = []
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self.fake_sections):
+            self.fake_read.append(offset)
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+    def getDict(self, pkg):
+        offset = pkg.loaders[self]
+        self.fake_read.append(offset)
+        tf = TagFile(StringIO(self.fake_sections[offset]))
+        tf.advanceSection()
+        return tf.copy()
+
+    def getPaths(self, info):
+        name = info.getPackage().name
+        self.fake_paths.append(name)
+        return {"/usr/bin/%s" % name: "f",
+                "/usr/share/doc/%s/README" % name: "f"}
 
 
 class SearcherTest(MockerTestCase):
@@ -8,3 +58,165 @@ class SearcherTest(MockerTestCase):
     def test_group(self):
         searcher = Searcher()
         searcher.addGroup("foo")
+
+
+class SearchIndexTest(MockerTestCase):
+
+    def setUp(self):
+        self.data_dir = sysconf.get("data-dir")
+        sysconf.set("data-dir", self.makeDir(), soft=True)
+        os.mkdir(os.path.join(sysconf.get("data-dir"), "channels"))
+        self.loader = FakeLoader([
+            SECTION % ("apache", "web", "Web server", "Serves pages."),
+            SECTION % ("postfix", "mail", "Mail server", "Sends mail."),
+            SECTION % ("wget", "web", "Retrieves files", "From the web."),
+            SECTION % ("vim", "editors", "Text editor", "Edits text."),
+            SECTION % ("bc", "math", "Calculator", "Does math.")])
+        self.channel = PackageChannel("deb-dir", "alias")
+        self.channel._digest = "digest"
+        self.channel._loaders.append(self.loader)
+        self.loader.setChannel(self.channel)
+        self.cache = Cache()
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+
+    def tearDown(self):
+        sysconf.set("data-dir", self.data_dir, soft=True)
+
+    def search(self, **kwargs):
+        searcher = Searcher()
+        for kind, pattern in kwargs.items():
+            getattr(searcher, "add"+kind.capitalize())(pattern)
+        del self.loader.fake_read[:]
+        self.cache.search(searcher)
+        return sorted([pkg.name for ratio, pkg in searcher.getResults()])
+
+    def test_index_path(self):
+        path, digest = getSearchIndexPath(self.loader)
+        self.assertEquals(path, os.path.join(sysconf.get("data-dir"),
+                                             "channels", "alias%%search0"))
+        self.assertEquals(digest, "digest")
+        self.channel._digest = object()
+        self.assertEquals(getSearchIndexPath(self.loader), (None, None))
+
+    def test_search_without_index(self):
+        self.assertEquals(self.search(summary="*server*"),
+                          ["apache", "postfix"])
+        self.assertEquals(self.loader.fake_read, [0, 1, 2, 3, 4])
+
+    def test_search_with_index(self):
+        updateSearchIndex(self.loader)
+        self.assertEquals(self.search(summary="*server*"),
+                          ["apache", "postfix"])
+        self.assertEquals(self.loader.fake_read, [0, 1])
+        self.assertEquals(self.search(description="*web*"), ["wget"])
+        self.assertEquals(self.loader.fake_read, [2])
+        self.assertEquals(self.search(group="web"), ["apache", "wget"])
+        self.assertEquals(self.loader.fake_read, [0, 2])
+        self.assertEquals(self.search(summary="*erver*"),
+                          ["apache", "postfix"])
+        self.assertEquals(self.search(summary="*nothing*"), [])
+        self.assertEquals(self.loader.fake_read, [])
+
+    def generic_search(self, **kwargs):
+        searcher = Searcher()
+        for kind, pattern in kwargs.items():
+            getattr(searcher, "add"+kind.capitalize())(*pattern)
+        del self.loader.fake_paths[:]
+        Loader.search(self.loader, searcher)
+        return sorted([(pkg.name, ratio) for ratio, pkg in
+                       searcher.getResults()])
+
+    def test_generic_search_with_index(self):
+        texts = [(pkg.name, texts, urls, sorted(paths))
+                 for pkg, texts, urls, paths in
+                 Loader.getSearchTexts(self.loader)]
+        self.assertEquals(texts[0], ("apache", ("web", "Web server",
+                                                "Serves pages."), [],
+                                     ["/usr/bin/apache",
+                                      "/usr/share/doc/apache/README"]))
+        updateSearchIndex(self.loader)
+        searcher = Searcher()
+        searcher.addSummary("*server*")
+        del self.loader.fake_read[:]
+        Loader.search(self.loader, searcher)
+        self.assertEquals(sorted([pkg.name for ratio, pkg in
+                                  searcher.getResults()]),
+                          ["apache", "postfix"])
+        self.assertEquals(sorted(set(self.loader.fake_read)), [0, 1])
+
+    def test_generic_path_search_with_index(self):
+        patterns = [("/usr/bin/wget", 1.0), ("/USR/BIN/WGET", 1.0),
+                    ("*bin/wget", 1.0), ("*/doc/?im/*", 1.0),
+                    ("/usr/bin/wgot", 0.9), ("/usr/bin/wgot", 0.99),
+                    ("/usr/bin/w?et", 1), ("*apache*", 1.0),
+                    ("/usr/lib/nothing", 1.0), ("/usr/bin/vi", 0.7),
+                    ("*bi", 1.0), ("*", 1.0)]
+        expected = [self.generic_search(path=x) for x in patterns]
+        loader = self.loader
+        loader.getSearchTexts = lambda: Loader.getSearchTexts(loader)
+        updateSearchIndex(self.loader)
+        self.assertEquals([self.generic_search(path=x) for x in patterns],
+                          expected)
+        self.assertEquals(expected[0], [("wget", 1.0)])
+        self.assertEquals(self.generic_search(path=patterns[0]),
+                          [("wget", 1.0)])
+        self.assertEquals(self.loader.fake_paths, ["wget"])
+        self.generic_search(path=("/usr/lib/nothing", 1.0))
+        self.assertEquals(self.loader.fake_paths, [])
+        self.generic_search(path=("*bi", 1.0))
+        self.assertEquals(len(self.loader.fake_paths), 5)
+
+    def test_path_candidates_unindexed(self):
+        updateSearchIndex(self.loader)
+        searcher = Searcher()
+        searcher.addPath("/usr/bin/wget")
+        self.assertEquals(len(searcher.getCandidates(self.loader)), 5)
+
+    def test_search_with_wildcards_only(self):
+        updateSearchIndex(self.loader)
+        self.assertEquals(len(self.search(summary="*")), 5)
+        self.assertEquals(self.loader.fake_read, [0, 1, 2, 3, 4])
+
+    def test_search_with_outdated_index(self):
+        updateSearchIndex(self.loader)
+        self.channel._digest = "other"
+        self.assertEquals(self.search(summary="*server*"),
+                          ["apache", "postfix"])
+        self.assertEquals(self.loader.fake_read, [0, 1, 2, 3, 4])
+
+    def test_search_index_disabled(self):
+        updateSearchIndex(self.loader)
+        sysconf.set("search-index", False)
+        try:
+            self.assertEquals(self.search(summary="*server*"),
+                              ["apache", "postfix"])
+        finally:
+            sysconf.remove("search-index")
+        self.assertEquals(self.loader.fake_read, [0, 1, 2, 3, 4])
+
+
+class ReloadChannelsSearchIndexTest(MockerTestCase):
+
+    def setUp(self):
+        self.data_dir = sysconf.get("data-dir")
+        sysconf.set("data-dir", self.makeDir(), soft=True)
+        self.old_cache = ctrl._cache
+        self.old_channels = ctrl._channels
+        ctrl._cache = Cache()
+        ctrl._channels = {}
+
+    def tearDown(self):
+        ctrl._cache = self.old_cache
+        ctrl._channels = self.old_channels
+        sysconf.set("data-dir", self.data_dir, soft=True)
+
+    def test_reload_channels_indexes_loaders(self):
+        channel = createChannel("alias", {"type": "deb-dir",
+                                          "path": "/%s/deb" % TESTDATADIR})
+        ctrl._channels["alias"] = channel
+        self.assertTrue(ctrl.reloadChannels([channel], caching=NEVER))
+        loaders = ctrl.getCache().getLoaders()
+        self.assertEquals(loaders, channel.getLoaders())
+        path, digest = getSearchIndexPath(loaders[0])
+        self.assertTrue(os.path.isfile(path))
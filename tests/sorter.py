@@ -1,7 +1,9 @@
 import unittest
+import random
 import sys
 
 from smart.sorter import ElementSorter, DisableError
+from smart.sorter import MAXIMUM_SCORED_RELATIONS
 
 
 if sys.version_info < (2, 4):
@@ -239,3 +241,84 @@ class ElementSorterTest(unittest.TestCase):
             sorter.addSuccessor(i+1, i)
         sorter.addSuccessor(0, 5)
         self.assertEquals(sorter.getSorted(), [0, 1, 2, 3, 4, 5])
+
+    def test_getLoops_with_big_loop(self):
+        sorter = self.sorter
+        for i in range(2000):
+            sorter.addSuccessor(i, (i+1)%2000)
+        sorter.addSuccessor(0, 2000)
+        loops = sorter.getLoops()
+        self.assertEquals(len(loops), 1)
+        self.assertEquals(loops[0][0], set(range(2000)))
+        self.assertEquals(len(loops[0][1]), 2000)
+
+    def test_countRelationsInLoop(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 1)
+        sorter.addSuccessor(1, 0, priority=1)
+        sorter.addSuccessor(1, 2)
+        sorter.addSuccessor(2, 1)
+        relations = set(sorter._priorities)
+        self.assertEquals(sorter.countRelationsInLoop([0, 1, 2], relations),
+                          4)
+        self.assertEquals(sorter.countRelationsInLoop([0, 1, 2], relations,
+                                                      0), 2)
+        relations.remove((2, 1))
+        self.assertEquals(sorter.countRelationsInLoop([0, 1, 2], relations),
+                          2)
+        self.assertTrue(sorter.hasLoop([0], relations))
+        self.assertFalse(sorter.hasLoop([2], relations))
+
+    def test_loop_with_itself(self):
+        self.sorter.addSuccessor(0, 0)
+        self.sorter.addSuccessor(0, 1)
+        self.assertEquals(self.sorter.getSorted(), [0, 1])
+
+    def test_big_loop_breaking(self):
+        sorter = self.sorter
+        for i in range(1000):
+            sorter.addSuccessor(i, (i+1)%1000, int(i == 500))
+        self.assertEquals(sorter.getSorted(),
+                          range(501, 1000)+range(501))
+
+    def test_big_loop_breaking_keeps_priorities(self):
+        rnd = random.Random(0)
+        sorter = self.sorter
+        for i in range(300):
+            sorter.addSuccessor(i, (i+1)%300, 1)
+            for j in range(2):
+                sorter.addSuccessor(i, rnd.randrange(300),
+                                    rnd.randrange(3))
+        self.assertTrue(len(sorter.getLoops()[0][1]) >
+                        MAXIMUM_SCORED_RELATIONS)
+        result = sorter.getSorted()
+        position = dict([(elem, i) for i, elem in enumerate(result)])
+        for relation, priority in sorter._priorities.items():
+            pred, succ = relation
+            if relation not in sorter._disabled:
+                self.assertTrue(position[pred] < position[succ])
+            elif pred != succ:
+                # It was only disabled because it would close a loop
+                # with relations of the same or higher priority.
+                elements, relations = sorter.getPathData(
+                    succ, pred, maximum_priority=priority)
+                self.assertTrue(elements, relation)
+
+    def test_getLayers(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 1)
+        sorter.addSuccessor(0, 2)
+        sorter.addSuccessor(1, 3)
+        sorter.addSuccessor(2, 3)
+        sorter.addSuccessor(4, 3)
+        sorter.addElement(5)
+        layers = [sorted(layer) for layer in sorter.getLayers()]
+        self.assertEquals(layers, [[0, 4, 5], [1, 2], [3]])
+
+    def test_getLayers_with_loop(self):
+        sorter = self.sorter
+        sorter.addSuccessor(0, 1, priority=1)
+        sorter.addSuccessor(1, 2)
+        sorter.addSuccessor(2, 0)
+        sorter.addSuccessor(2, 3)
+        self.assertEquals(sorter.getLayers(), [[1], [2], [0, 3]])
@@ -0,0 +1,122 @@
+import unittest
+
+from smart.backends.deb.base import DebPackage
+from smart.sysconfig import SysConfig, FrozenDict, freeze
+from smart.pkgconfig import PkgConfig
+from smart import Error
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = SysConfig()
+        self.config.set("map", {"a": [1, 2], "b": {"c": 3}})
+
+    def test_snapshot_equals_get(self):
+        snapshot = self.config.getSnapshot("map")
+        self.assertTrue(isinstance(snapshot, FrozenDict))
+        self.assertEquals(snapshot, {"a": (1, 2), "b": {"c": 3}})
+        self.assertTrue(isinstance(snapshot["b"], FrozenDict))
+        self.assertEquals(self.config.getSnapshot("map.b.c"), 3)
+
+    def test_snapshot_is_shared(self):
+        self.assertTrue(self.config.getSnapshot("map") is
+                        self.config.getSnapshot(("map",)))
+
+    def test_snapshot_is_read_only(self):
+        snapshot = self.config.getSnapshot("map")
+        self.assertRaises(Error, snapshot.__setitem__, "d", 4)
+        self.assertRaises(Error, snapshot["b"].pop, "c")
+        self.assertRaises(Error, snapshot.update, {})
+        self.assertEquals(self.config.get("map.b"), {"c": 3})
+
+    def test_default(self):
+        self.assertEquals(self.config.getSnapshot("missing"), None)
+        self.assertEquals(self.config.getSnapshot("missing", ()), ())
+        self.assertEquals(self.config.getSnapshot("map.x", 1), 1)
+
+    def test_changes_invalidate(self):
+        snapshot = self.config.getSnapshot("map")
+        for change in [lambda: self.config.set("map.b.c", 4),
+                       lambda: self.config.add("map.a", 3),
+                       lambda: self.config.remove("map.a", 1),
+                       lambda: self.config.set("other", 1, soft=True),
+                       lambda: self.config.set("map.d", 1, weak=True)]:
+            generation = self.config.getGeneration()
+            change()
+            self.assertTrue(self.config.getGeneration() > generation)
+            new = self.config.getSnapshot("map")
+            self.assertFalse(new is snapshot)
+            self.assertEquals(new, freeze(self.config.get("map")))
+            snapshot = new
+
+    def test_map_priority(self):
+        self.config.set("map", {"a": 1}, soft=True)
+        self.config.set("map.b.c", 5, weak=True)
+        self.assertEquals(self.config.getSnapshot("map"), {"a": 1})
+        self.assertEquals(self.config.getSnapshot("map.b.c"), 3)
+        self.assertEquals(self.config.getSnapshot("map", weak=True),
+                          {"b": {"c": 5}})
+
+
+class PkgConfigSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pkgconf = PkgConfig(SysConfig())
+        self.pkg = DebPackage("name", "1.0")
+
+    def test_flag_changes_are_seen(self):
+        self.assertFalse(self.pkgconf.testFlag("lock", self.pkg))
+        self.pkgconf.setFlag("lock", "name", "=", "1.0")
+        self.assertTrue(self.pkgconf.testFlag("lock", self.pkg))
+        self.assertEquals(self.pkgconf.filterByFlag("lock", [self.pkg]),
+                          [self.pkg])
+        self.pkgconf.clearFlag("lock", "name")
+        self.assertFalse(self.pkgconf.testFlag("lock", self.pkg))
+        self.assertEquals(self.pkgconf.filterByFlag("lock", [self.pkg]), [])
+
+
+class FlagMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = SysConfig()
+        self.pkgconf = PkgConfig(self.config)
+        self.pkgs = [DebPackage("name", "1.0"), DebPackage("name", "2.0"),
+                     DebPackage("other", "1.0")]
+
+    def test_versioned(self):
+        self.pkgconf.setFlag("lock", "name", ">=", "2.0")
+        matcher = self.pkgconf.getFlagMatcher("lock")
+        self.assertEquals([matcher.matches(x) for x in self.pkgs],
+                          [False, True, False])
+        self.assertEquals(matcher.filter(self.pkgs), [self.pkgs[1]])
+
+    def test_unversioned(self):
+        self.pkgconf.setFlag("lock", "name", ">=", "2.0")
+        self.pkgconf.setFlag("lock", "name")
+        matcher = self.pkgconf.getFlagMatcher("lock")
+        self.assertEquals(matcher.filter(self.pkgs), self.pkgs[:2])
+
+    def test_shared_until_changed(self):
+        matcher = self.pkgconf.getFlagMatcher("lock")
+        self.assertTrue(self.pkgconf.getFlagMatcher("lock") is matcher)
+        self.assertEquals(matcher.filter(self.pkgs), [])
+        self.pkgconf.setFlag("lock", "other")
+        matcher = self.pkgconf.getFlagMatcher("lock")
+        self.assertEquals(matcher.filter(self.pkgs), [self.pkgs[2]])
+
+    def test_soft_names_come_first(self):
+        self.pkgconf.setFlag("lock", "name", "=", "1.0")
+        self.pkgconf.setFlag("lock", "other")
+        self.config.set(("package-flags", "lock", "name"), [("=", "2.0")],
+                        soft=True)
+        self.assertEquals(self.pkgconf.filterByFlag("lock", self.pkgs),
+                          self.pkgs[1:])
+
+    def test_set_flag_targets(self):
+        self.pkgconf.setFlagTargets("new", {"name": [("=", "1.0")],
+                                            "other": [("=", "1.0")]})
+        self.assertEquals(self.pkgconf.filterByFlag("new", self.pkgs),
+                          [self.pkgs[0], self.pkgs[2]])
+        self.assertEquals(self.config.get(("package-flags", "new", "name")),
+                          [("=", "1.0")])
@@ -0,0 +1,258 @@
+from StringIO import StringIO
+import unittest
+import random
+
+from smart.backends.deb.loader import DebTagLoader, TagFile
+from smart.transaction import ChangeSet, Transaction, _TrialChangeSet
+from smart.transaction import Policy, PolicyInstall, PolicyRemove
+from smart.transaction import PolicyUpgrade, UPGRADE
+from smart.channel import PackageChannel
+from smart.const import INSTALL, REMOVE
+from smart.util.layereddict import LayeredDict
+from smart.cache import Cache
+from smart import Error, sysconf, iface
+
+
+SECTION = """\
+Package: pkg%d
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %s
+Depends: pkg%d (>= 1.0)
+Description: Summary line
+ Full description.
+"""
+
+RELATIONS_SECTION = """\
+Package: %s
+Status: install ok installed
+Priority: optional
+Section: admin
+Architecture: all
+Version: %s
+%s
+Description: Summary line
+ Full description.
+"""
+
+
+class FakeLoader(DebTagLoader):
+
+    def __init__(self, sections):
+        super(FakeLoader, self).__init__()
+        self.fake_sections = sections
+        self.setChannel(PackageChannel("deb-dir", "fake"))
+
+    def getSections(self, prog):
+        for offset, section in enumerate(self.fake_sections):
+            tf = TagFile(StringIO(section))
+            tf.advanceSection()
+            yield tf, offset
+
+
+def make_cache(total, deps):
+    cache = Cache()
+    for version in ["1.0", "1.1", "1.2"]:
+        loader = FakeLoader([SECTION % (i, version, deps(i))
+                             for i in range(total)])
+        loader.setInstalled(version == "1.0")
+        cache.addLoader(loader)
+    cache.load()
+    return cache
+
+
+def make_relations_cache(installed, available):
+    cache = Cache()
+    for sections, isinstalled in [(installed, True), (available, False)]:
+        loader = FakeLoader([RELATIONS_SECTION % x for x in sections])
+        loader.setInstalled(isinstalled)
+        cache.addLoader(loader)
+    cache.load()
+    return cache
+
+
+class PolicyWeightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = make_cache(10, lambda i: (i+1)%10)
+
+    def tearDown(self):
+        sysconf.remove("check-policy-weights")
+
+    def check_policy(self, policycls):
+        policy = Transaction(self.cache, policycls)._policy
+        policy.runStarting()
+        try:
+            pkgs = self.cache.getPackages()
+            rnd = random.Random(0)
+            changeset = ChangeSet(self.cache)
+            changeset.trackWeight(policy)
+            states = [ChangeSet(self.cache, changeset)]
+            for i in range(500):
+                action = rnd.random()
+                pkg = rnd.choice(pkgs)
+                if action < 0.4:
+                    changeset[pkg] = rnd.choice([INSTALL, REMOVE])
+                elif action < 0.6:
+                    if pkg in changeset:
+                        del changeset[pkg]
+                elif action < 0.7:
+                    changeset = changeset.copy()
+                elif action < 0.8:
+                    states.append(ChangeSet(self.cache, changeset))
+                elif action < 0.9:
+                    changeset.setState(rnd.choice(states))
+                else:
+                    copy = changeset.copy()
+                    copy[pkg] = rnd.choice([INSTALL, REMOVE])
+                    changeset.setState(copy)
+                self.assertAlmostEquals(policy.getWeight(changeset),
+                                        policy.computeWeight(changeset))
+            changeset.clear()
+            self.assertEquals(policy.getWeight(changeset), 0)
+        finally:
+            policy.runFinished()
+
+    def test_policy_install(self):
+        self.check_policy(PolicyInstall)
+
+    def test_policy_remove(self):
+        self.check_policy(PolicyRemove)
+
+    def test_policy_upgrade(self):
+        self.check_policy(PolicyUpgrade)
+
+    def test_untracked_changeset(self):
+        policy = Transaction(self.cache, PolicyRemove)._policy
+        changeset = ChangeSet(self.cache)
+        for pkg in self.cache.getPackages():
+            changeset[pkg] = REMOVE
+        self.assertEquals(policy.getWeight(changeset), 30)
+
+    def test_check_mismatch(self):
+        sysconf.set("check-policy-weights", True)
+        policy = Transaction(self.cache, PolicyRemove)._policy
+        policy.runStarting()
+        try:
+            changeset = ChangeSet(self.cache)
+            changeset.trackWeight(policy)
+            changeset[self.cache.getPackages()[0]] = REMOVE
+            self.assertEquals(policy.getWeight(changeset), 1)
+            changeset._weight = 2
+            self.assertRaises(Error, policy.getWeight, changeset)
+        finally:
+            policy.runFinished()
+
+
+class SolverWorkersTest(unittest.TestCase):
+
+    def tearDown(self):
+        sysconf.remove("solver-workers")
+
+    def upgrade(self, cache, workers):
+        sysconf.set("solver-workers", workers)
+        trans = Transaction(cache, PolicyUpgrade)
+        for pkg in cache.getPackages():
+            if pkg.installed:
+                trans.enqueue(pkg, UPGRADE)
+        trans.run()
+        return trans.getChangeSet()
+
+    def check_upgrade(self, cache):
+        serial = self.upgrade(cache, 1)
+        parallel = self.upgrade(cache, 3)
+        self.assertEquals(parallel.items(), serial.items())
+        self.assertEquals(len(serial), 2*len(cache.getPackages())/3)
+
+    def test_independent_upgrades(self):
+        self.check_upgrade(make_cache(30, lambda i: i))
+
+    def test_dependent_upgrades(self):
+        self.check_upgrade(make_cache(30, lambda i: (i+1)%30))
+
+    def test_upgrade_reading_earlier_changes(self):
+        # Upgrading a replaces c, and b's upgrade only works with the
+        # old c. b's trial sees c while trying its alternatives in
+        # copies of its changeset, so it must not be replayed once
+        # a's upgrade is chosen.
+        cache = make_relations_cache(
+            [("a", "1.0", ""), ("b", "1.0", ""), ("c", "1.0", "")],
+            [("a", "1.1", "Conflicts: c (<< 1.1)"),
+             ("b", "1.1", "Depends: d | e"),
+             ("c", "1.1", ""),
+             ("d", "1.0", "Depends: c (<< 1.1)"),
+             ("e", "1.0", "Depends: c (<< 1.1)")])
+        serial = self.upgrade(cache, 1)
+        parallel = self.upgrade(cache, 3)
+        self.assertEquals(sorted(parallel.items()), sorted(serial.items()))
+        self.assertEquals(sorted([str(pkg) for pkg in serial]),
+                          ["a_1.0", "a_1.1", "c_1.0", "c_1.1"])
+
+    def test_worker_failure_is_reported(self):
+        cache = make_cache(30, lambda i: (i+1)%30)
+        serial = self.upgrade(cache, 1)
+        messages = []
+        def makeTrials(*args):
+            raise ValueError("broken worker")
+        old_make_trials = Transaction._makeTrials
+        Transaction._makeTrials = makeTrials
+        iface.debug = messages.append
+        try:
+            parallel = self.upgrade(cache, 3)
+        finally:
+            Transaction._makeTrials = old_make_trials
+            del iface.debug
+        self.assertEquals(parallel.items(), serial.items())
+        failures = [x for x in messages if "broken worker" in x]
+        self.assertEquals(len(failures), 3)
+
+
+class TrialChangeSetTest(unittest.TestCase):
+
+    def test_copies_record_reads(self):
+        cache = make_cache(3, lambda i: i)
+        pkg1, pkg2, pkg3 = cache.getPackages()[:3]
+        changeset = ChangeSet(cache)
+        changeset[pkg1] = INSTALL
+        cs = changeset._copy(_TrialChangeSet)
+        cs._reads = reads = {}
+        cs._log = log = []
+        copy = cs.copy().copy()
+        self.assertTrue(isinstance(copy, _TrialChangeSet))
+        copy[pkg2] = REMOVE
+        self.assertEquals(log, [])
+        self.assertTrue(pkg1 in copy)
+        self.assertEquals(reads, {pkg1: True})
+        # Building the flat view records everything, but later
+        # lookups must still go through get().
+        copy.keys()
+        reads.clear()
+        self.assertEquals(copy.get(pkg3), None)
+        self.assertEquals(reads, {pkg3: True})
+
+    def test_replay_applies_requested_changes(self):
+        cache = make_cache(3, lambda i: i)
+        packages = dict([(str(pkg), pkg) for pkg in cache.getPackages()])
+        trans = Transaction(cache, PolicyUpgrade)
+        trans.getPolicy().runStarting()
+        try:
+            changeset = ChangeSet(cache)
+            pkg0 = packages["pkg0_1.1"]
+            changeset[pkg0] = INSTALL
+            changeset[packages["pkg0_1.0"]] = REMOVE
+            changeset.setRequested(pkg0, True)
+            locked = LayeredDict()
+            pkg1 = packages["pkg1_1.1"]
+            trial = trans._makeTrials([pkg1], changeset, locked, 0)[pkg1]
+            # An earlier trial, accepted before this one is replayed,
+            # takes back the requested package.
+            changeset.set(pkg0, REMOVE)
+            self.assertTrue(trial.isValid({pkg0: True}))
+            cs, lk = trial.replay(changeset, locked)
+        finally:
+            trans.getPolicy().runFinished()
+        self.assertEquals(cs.get(pkg1), INSTALL)
+        self.assertFalse(pkg0 in cs)
+        self.assertFalse(cs.getRequested(pkg0))
@@ -2,6 +2,8 @@ import unittest
 import os
 
 from smart.uncompress import Uncompressor
+from smart.fetcher import DigestSet, getFileDigest
+from smart import Error
 
 from tests import TESTDATADIR
 
@@ -29,6 +31,38 @@ class UncompressorTest(unittest.TestCase):
     def test_gzip(self):
         self.uncompress_file("%s/uncompress/test.gz" % TESTDATADIR)
 
+    def test_gzip_digests(self):
+        digests = DigestSet(["md5", "sha"])
+        Uncompressor().uncompress("%s/uncompress/test.gz" % TESTDATADIR,
+                                  digests=digests)
+        orig = "%s/uncompress/test.txt" % TESTDATADIR
+        self.assertEquals(digests.size, os.path.getsize(orig))
+        self.assertEquals(digests.getHexDigests(),
+                          {"md5": getFileDigest(orig, "md5"),
+                           "sha": getFileDigest(orig, "sha")})
+
+    def stream_file(self, file, step):
+        handler = Uncompressor().getHandler(file)
+        decompressor = handler.getDecompressor()
+        data = open(file).read()
+        output = []
+        for i in range(0, len(data), step):
+            output.append(decompressor.decompress(data[i:i+step]))
+        output.append(decompressor.flush())
+        orig = "%s/uncompress/test.txt" % TESTDATADIR
+        self.assertEquals("".join(output), open(orig).read())
+        decompressor = handler.getDecompressor()
+        decompressor.decompress(data[:-1])
+        self.assertRaises(Error, decompressor.flush)
+
+    def test_gzip_stream(self):
+        for step in (1, 7, 4096):
+            self.stream_file("%s/uncompress/test.gz" % TESTDATADIR, step)
+
+    def test_bzip2_stream(self):
+        for step in (1, 7, 4096):
+            self.stream_file("%s/uncompress/test.bz2" % TESTDATADIR, step)
+
     def test_bzip2(self):
         self.uncompress_file("%s/uncompress/test.bz2" % TESTDATADIR)
 
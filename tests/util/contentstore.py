@@ -0,0 +1,65 @@
+import os
+
+from smart.util.contentstore import ContentStore, cloneFile
+
+from tests.mocker import MockerTestCase
+
+
+class ContentStoreTest(MockerTestCase):
+
+    def setUp(self):
+        self.dir = self.makeDir()
+        self.store = ContentStore(os.path.join(self.dir, "store"))
+
+    def add(self, key, content, mtime):
+        path = self.makeFile(content)
+        self.store.add(key, path)
+        os.utime(self.store.getPath(key), (mtime, mtime))
+
+    def test_get_key(self):
+        self.assertEquals(ContentStore.getKey("sha256", "abc"),
+                          "sha256-abc")
+
+    def test_add_and_get(self):
+        path = self.makeFile("Hello!")
+        self.assertFalse(self.store.has("md5-a"))
+        self.store.add("md5-a", path)
+        self.assertTrue(self.store.has("md5-a"))
+        os.unlink(path)
+        target = os.path.join(self.dir, "target")
+        self.assertTrue(self.store.get("md5-a", target))
+        self.assertEquals(open(target).read(), "Hello!")
+        self.assertFalse(self.store.get("md5-b", target + "2"))
+        self.assertFalse(os.path.exists(target + "2"))
+        self.assertEquals(sorted(os.listdir(self.dir)), ["store", "target"])
+
+    def test_add_existing_keeps_file(self):
+        self.add("md5-a", "Hello!", 1)
+        self.store.add("md5-a", self.makeFile("Other"))
+        self.assertEquals(open(self.store.getPath("md5-a")).read(),
+                          "Hello!")
+        self.assertTrue(os.path.getmtime(self.store.getPath("md5-a")) > 1)
+
+    def test_evict_least_recently_used(self):
+        self.add("md5-a", "a"*10, 1)
+        self.add("md5-b", "b"*10, 2)
+        self.add("md5-c", "c"*10, 3)
+        self.assertEquals(self.store.getSize(), 30)
+        # Using a file makes it the most recently used one.
+        self.store.get("md5-a", os.path.join(self.dir, "target"))
+        removed = self.store.evict(15)
+        self.assertEquals(removed, [self.store.getPath("md5-b"),
+                                    self.store.getPath("md5-c")])
+        self.assertTrue(self.store.has("md5-a"))
+        self.assertEquals(self.store.evict(10), [])
+        self.assertEquals(len(self.store.evict(0)), 1)
+        self.assertEquals(self.store.getSize(), 0)
+
+    def test_evict_missing_dir(self):
+        self.assertEquals(self.store.evict(0), [])
+
+    def test_clone_file(self):
+        source = self.makeFile("Hello!")
+        dest = os.path.join(self.dir, "dest")
+        cloneFile(source, dest)
+        self.assertEquals(open(dest).read(), "Hello!")
@@ -0,0 +1,69 @@
+import unittest
+
+from smart.util.edpatch import applyEdPatch
+from smart import Error
+
+
+OLD = """\
+Package: name1
+Version: 1
+
+Package: name2
+Version: 1
+
+Package: name3
+"""
+
+NEW = """\
+Package: name1
+Version: 1
+
+Package: name2
+Version: 2
+.
+
+Package: name3
+
+Package: name4
+"""
+
+# Written by diff --ed.
+PATCH = """\
+7a
+
+Package: name4
+.
+5c
+Version: 2
+..
+.
+s/.//
+"""
+
+
+class ApplyEdPatchTest(unittest.TestCase):
+
+    def apply(self, old, patch):
+        lines = old.splitlines(True)
+        applyEdPatch(lines, patch.splitlines(True))
+        return "".join(lines)
+
+    def test_diff_output(self):
+        self.assertEquals(self.apply(OLD, PATCH), NEW)
+
+    def test_delete(self):
+        self.assertEquals(self.apply(OLD, "2,3d\n1d\n"), "Package: name2\n"
+                          "Version: 1\n\nPackage: name3\n")
+
+    def test_append_at_start(self):
+        self.assertEquals(self.apply("b\n", "0a\na\n.\n"), "a\nb\n")
+
+    def test_out_of_range(self):
+        self.assertRaises(Error, self.apply, OLD, "9d\n")
+        self.assertRaises(Error, self.apply, OLD, "0c\nx\n.\n")
+
+    def test_invalid_command(self):
+        self.assertRaises(Error, self.apply, OLD, "1,2m\n")
+
+    def test_unterminated_text(self):
+        self.assertRaises(Error, self.apply, OLD, "1a\nx\n")
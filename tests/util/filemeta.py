@@ -0,0 +1,51 @@
+import os
+
+from smart.util.filemeta import FileMetadata, getFileMetadata, METAFILE
+
+from tests.mocker import MockerTestCase
+
+
+class FileMetadataTest(MockerTestCase):
+
+    def setUp(self):
+        self.dir = self.makeDir()
+        self.path = self.makeFile("Hello!", dirname=self.dir)
+
+    def test_update(self):
+        metadata = FileMetadata(self.dir)
+        self.assertEquals(metadata.get(self.path), None)
+        metadata.update(self.path, etag="1", digests={"md5": "a"})
+        metadata.update(self.path, digests={"sha": "b"})
+        entry = metadata.get(self.path)
+        self.assertEquals(entry["etag"], "1")
+        self.assertEquals(entry["digests"], {"md5": "a", "sha": "b"})
+
+    def test_outdated_entry(self):
+        metadata = FileMetadata(self.dir)
+        metadata.update(self.path, etag="1")
+        os.utime(self.path, (0, 0))
+        self.assertEquals(metadata.get(self.path), None)
+        metadata.update(self.path, digests={"md5": "a"})
+        self.assertEquals(metadata.get(self.path).get("etag"), None)
+
+    def test_save(self):
+        metadata = FileMetadata(self.dir)
+        metadata.update(self.path, etag="1")
+        removed = self.makeFile("", dirname=self.dir)
+        metadata.update(removed, etag="2")
+        os.unlink(removed)
+        metadata.save()
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, METAFILE)))
+        metadata = FileMetadata(self.dir)
+        self.assertEquals(metadata.get(self.path)["etag"], "1")
+        self.assertEquals(metadata._load().keys(),
+                          [os.path.basename(self.path)])
+
+    def test_broken_file(self):
+        self.makeFile("broken", dirname=self.dir, basename=METAFILE)
+        metadata = FileMetadata(self.dir)
+        self.assertEquals(metadata.get(self.path), None)
+
+    def test_shared(self):
+        self.assertTrue(getFileMetadata(self.dir) is
+                        getFileMetadata(self.dir + "/"))
@@ -0,0 +1,142 @@
+import unittest
+
+from smart.util.layereddict import LayeredDict, DictLayer, MAXDEPTH
+
+
+class LayeredDictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = LayeredDict({1: "a", 2: "b", 3: "c"})
+
+    def test_copy_is_layer(self):
+        layer = self.root.copy()
+        self.assertTrue(isinstance(layer, DictLayer))
+        self.assertEquals(dict.items(layer), [])
+        self.assertEquals(layer, {1: "a", 2: "b", 3: "c"})
+
+    def test_layer_reads(self):
+        layer = self.root.copy()
+        layer[4] = "d"
+        del layer[1]
+        self.assertEquals(layer.get(1), None)
+        self.assertEquals(layer.get(2), "b")
+        self.assertEquals(layer[4], "d")
+        self.assertTrue(4 in layer)
+        self.assertFalse(1 in layer)
+        self.assertRaises(KeyError, layer.__getitem__, 1)
+        self.assertEquals(len(layer), 3)
+        self.assertEquals(sorted(layer), [2, 3, 4])
+        self.assertEquals(sorted(layer.items()),
+                          [(2, "b"), (3, "c"), (4, "d")])
+        self.assertEquals(self.root, {1: "a", 2: "b", 3: "c"})
+
+    def test_delete_missing(self):
+        layer = self.root.copy()
+        self.assertRaises(KeyError, layer.__delitem__, 5)
+        del layer[1]
+        self.assertRaises(KeyError, layer.__delitem__, 1)
+
+    def test_nested_layers(self):
+        layer1 = self.root.copy()
+        layer1[4] = "d"
+        layer2 = layer1.copy()
+        del layer2[2]
+        layer2[1] = "x"
+        self.assertEquals(layer2, {1: "x", 3: "c", 4: "d"})
+        self.assertEquals(layer1, {1: "a", 2: "b", 3: "c", 4: "d"})
+
+    def test_parent_changes_are_not_seen(self):
+        layer = self.root.copy()
+        layer[1] = "x"
+        self.root[2] = "y"
+        self.root[5] = "z"
+        del self.root[3]
+        self.assertEquals(layer, {1: "x", 2: "b", 3: "c"})
+        self.root.clear()
+        self.assertEquals(layer, {1: "x", 2: "b", 3: "c"})
+
+    def test_parent_changes_after_iteration(self):
+        layer = self.root.copy()
+        self.assertEquals(len(layer), 3)
+        self.root[5] = "z"
+        self.assertEquals(layer.get(5), None)
+        self.assertEquals(len(layer), 3)
+
+    def test_update_from_layer(self):
+        layer = self.root.copy()
+        layer[1] = "x"
+        layer[4] = "d"
+        del layer[2]
+        self.root.update(layer)
+        self.assertEquals(self.root, {1: "x", 2: "b", 3: "c", 4: "d"})
+
+    def test_assign_from_layer(self):
+        layer = self.root.copy()
+        layer[1] = "x"
+        del layer[2]
+        self.root.assign(layer)
+        self.assertEquals(self.root, {1: "x", 3: "c"})
+        self.assertEquals(layer, {1: "x", 3: "c"})
+
+    def test_assign_from_unrelated(self):
+        layer = self.root.copy()
+        other = LayeredDict({7: "g"})
+        layer.assign(other)
+        self.assertEquals(layer, {7: "g"})
+        self.root.assign({8: "h"})
+        self.assertEquals(self.root, {8: "h"})
+        self.assertEquals(layer, {7: "g"})
+
+    def test_sibling_keeps_contents_after_assign(self):
+        layer1 = self.root.copy()
+        layer2 = self.root.copy()
+        layer1[1] = "x"
+        layer2[2] = "y"
+        self.root.assign(layer1)
+        self.assertEquals(layer2, {1: "a", 2: "y", 3: "c"})
+
+    def test_clear_layer(self):
+        layer = self.root.copy()
+        layer.clear()
+        self.assertEquals(layer, {})
+        self.assertEquals(layer.get(1), None)
+        layer[1] = "x"
+        self.assertEquals(layer, {1: "x"})
+
+    def test_clear_layer_keeps_removals(self):
+        layer = self.root.copy()
+        self.root[4] = "d"
+        layer.clear()
+        self.root[4] = "e"
+        self.assertEquals(layer, {})
+        self.root.update(layer)
+        self.assertEquals(self.root[4], "e")
+
+    def test_pop_and_setdefault(self):
+        layer = self.root.copy()
+        self.assertEquals(layer.pop(1), "a")
+        self.assertEquals(layer.pop(1, None), None)
+        self.assertRaises(KeyError, layer.pop, 1)
+        self.assertEquals(layer.setdefault(2, "x"), "b")
+        self.assertEquals(layer.setdefault(5, "x"), "x")
+        self.assertEquals(layer, {2: "b", 3: "c", 5: "x"})
+
+    def test_maximum_depth(self):
+        layer = self.root
+        for i in range(MAXDEPTH+1):
+            layer = layer.copy()
+            layer[i+10] = i
+        self.assertTrue(layer._depth < MAXDEPTH)
+        self.assertEquals(len(layer), MAXDEPTH+4)
+
+    def test_comparison(self):
+        layer1 = self.root.copy()
+        layer2 = self.root.copy()
+        self.assertEquals(layer1, layer2)
+        self.assertEquals(layer1, self.root)
+        layer2[4] = "d"
+        self.assertNotEquals(layer1, layer2)
+        self.assertEquals(cmp(dict(layer1.items()), dict(layer2.items())),
+                          cmp(layer1, layer2))
+        self.assertTrue(layer1 < layer2)
+        self.assertTrue(self.root < layer2)
@@ -0,0 +1,63 @@
+import os
+
+from smart.util.pathindex import PathIndex, writePathIndex
+from smart import Error
+
+from tests.mocker import MockerTestCase
+
+
+class PathIndexTest(MockerTestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(self.makeDir(), "index")
+
+    def test_get(self):
+        writePathIndex(self.filename, "digest",
+                       {"/usr/bin/b": ["pkg1", "pkg2"],
+                        "/usr/bin/a": ["pkg2"],
+                        "/etc/c": ["pkg3"]})
+        index = PathIndex(self.filename)
+        self.assertEquals(index.getDigest(), "digest")
+        self.assertEquals(len(index), 3)
+        self.assertEquals(index.get("/usr/bin/a"), ["pkg2"])
+        self.assertEquals(index.get("/usr/bin/b"), ["pkg1", "pkg2"])
+        self.assertEquals(index.get("/etc/c"), ["pkg3"])
+        self.assertEquals(index.get("/etc"), [])
+        self.assertEquals(index.get("/usr/bin/c"), [])
+        self.assertEquals(index.get("/"), [])
+        index.close()
+
+    def test_many_paths(self):
+        paths = {}
+        for i in range(1000):
+            paths["/dir%d/file%d" % (i%7, i)] = ["pkg%d" % (i%13)]
+        writePathIndex(self.filename, "", paths)
+        index = PathIndex(self.filename)
+        for path, keys in paths.items():
+            self.assertEquals(index.get(path), keys)
+        self.assertEquals(index.get("/dir0/file1"), [])
+        index.close()
+
+    def test_empty(self):
+        writePathIndex(self.filename, "digest", {})
+        index = PathIndex(self.filename)
+        self.assertEquals(len(index), 0)
+        self.assertEquals(index.get("/bin/sh"), [])
+        index.close()
+
+    def test_replace(self):
+        writePathIndex(self.filename, "digest1", {"/a": ["pkg1"]})
+        writePathIndex(self.filename, "digest2", {"/a": ["pkg2"]})
+        self.assertFalse(os.path.exists(self.filename+".new"))
+        index = PathIndex(self.filename)
+        self.assertEquals(index.getDigest(), "digest2")
+        self.assertEquals(index.get("/a"), ["pkg2"])
+        index.close()
+
+    def test_invalid(self):
+        self.makeFile("", path=self.filename)
+        self.assertRaises(Error, PathIndex, self.filename)
+        self.makeFile("Not an index, but long enough to hold a header.",
+                      path=self.filename)
+        self.assertRaises(Error, PathIndex, self.filename)
+        self.assertRaises(IOError, PathIndex, self.filename+"-missing")
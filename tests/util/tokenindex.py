@@ -0,0 +1,116 @@
+import os
+
+from smart.util.tokenindex import TokenIndex, getWords, getGlobWords
+from smart.util.tokenindex import TrigramIndex
+from smart.util.tokenindex import readTokenIndex, writeTokenIndex
+from smart.util.tokenindex import getTokenIndexDigest
+
+from smart.util.strtools import globdistance
+
+from tests.mocker import MockerTestCase
+
+
+class TokenIndexTest(MockerTestCase):
+
+    def setUp(self):
+        self.index = TokenIndex()
+        self.index.add("a", "Web server", "Serves web pages.")
+        self.index.add("b", "Mail server", None)
+        self.index.add("c", "Cobweb remover", "")
+
+    def test_get_words(self):
+        self.assertEquals(getWords("A web-server, 2.0"),
+                          ["a", "web", "server", "2", "0"])
+        self.assertEquals(getWords("Caf\xc3\xa9"), [u"caf\xe9"])
+
+    def test_get_glob_words(self):
+        self.assertEquals(getGlobWords("*web serv?r*"),
+                          ["web", "serv", "r"])
+        self.assertEquals(getGlobWords("x[a-z]y"), ["x", "y"])
+        self.assertEquals(getGlobWords("*"), [])
+
+    def test_search(self):
+        self.assertEquals(self.index.search(["web"]), ["a", "c"])
+        self.assertEquals(self.index.search(["server"]), ["a", "b"])
+        self.assertEquals(self.index.search(["web", "serv"]), ["a"])
+        self.assertEquals(self.index.search(["pages"]), [])
+        self.assertEquals(self.index.search(["pages"], 1), ["a"])
+        self.assertEquals(self.index.search(["web"], 1), ["a"])
+        self.assertEquals(self.index.search(["web"], 2), [])
+        self.assertEquals(self.index.search(["nothing"]), [])
+        self.assertEquals(self.index.search([]), ["a", "b", "c"])
+
+    def test_write_and_read(self):
+        filename = os.path.join(self.makeDir(), "index")
+        writeTokenIndex(filename, self.index, "digest")
+        self.assertEquals(getTokenIndexDigest(filename), "digest")
+        self.assertEquals(readTokenIndex(filename, "other"), None)
+        index = readTokenIndex(filename, "digest")
+        self.assertEquals(len(index), 3)
+        self.assertEquals(index.search(["web"]), ["a", "c"])
+        self.assertEquals(index.search(["web", "serv"]), ["a"])
+        self.assertEquals(index.search(["pages"], 1), ["a"])
+
+    def test_read_broken(self):
+        filename = self.makeFile("broken")
+        self.assertEquals(getTokenIndexDigest(filename), None)
+        self.assertEquals(readTokenIndex(filename, "digest"), None)
+        self.assertEquals(readTokenIndex(filename+"-missing", "digest"),
+                          None)
+
+
+class TrigramIndexTest(MockerTestCase):
+
+    def setUp(self):
+        self.paths = {"a": ["/usr/bin/wget", "/usr/share/doc/wget/README"],
+                      "b": ["/usr/sbin/postfix", "/etc/postfix/main.cf"],
+                      "c": [], "d": None}
+        self.index = TrigramIndex()
+        for key in sorted(self.paths):
+            self.index.add(key, ["http://example.com/"+key],
+                           self.paths[key])
+
+    def test_search(self):
+        self.assertEquals(self.index.search("/usr/bin/wget", 1.0, 1),
+                          ["a", "d"])
+        self.assertEquals(self.index.search("*/POSTFIX/*", 1.0, 1),
+                          ["b", "d"])
+        self.assertEquals(self.index.search("/usr/?bin/post*", 1.0, 1),
+                          ["b", "d"])
+        self.assertEquals(self.index.search("*/nothing", 1.0, 1), ["d"])
+        self.assertEquals(self.index.search("*.com/b", 1.0, 0), ["b"])
+        self.assertEquals(self.index.search("*.com/b", 1.0, 2), None)
+        self.assertEquals(self.index.search("*bi", 1.0, 1), None)
+        self.assertEquals(self.index.search("/usr/bin/wget", None, 1),
+                          None)
+
+    def test_search_with_distance(self):
+        self.assertEquals(self.index.search("/usr/bin/wgot", 1, 1),
+                          ["a", "d"])
+        self.assertEquals(self.index.search("/usr/bin/wgot", 0, 1), ["d"])
+        self.assertEquals(self.index.search("/usr/bin/wgot", 0.5, 1),
+                          None)
+
+    def test_search_finds_all_matches(self):
+        patterns = ["/usr/bin/wget", "/usr/bin/wgot", "*wget*",
+                    "/usr/sbin/postfax", "*/main.c?", "/etc/postfix",
+                    "/usr/share/doc/wget/READ", "*doc/wget*"]
+        for pattern in patterns:
+            for cutoff in [1.0, 0.95, 0.9, 0.8, 0, 1, 2]:
+                found = self.index.search(pattern, cutoff, 1)
+                for key, paths in self.paths.items():
+                    for path in paths or ():
+                        if (globdistance(pattern, path, cutoff, True)[1]
+                            and found is not None):
+                            self.assertTrue(key in found,
+                                            (pattern, cutoff, key))
+
+    def test_write_and_read(self):
+        filename = os.path.join(self.makeDir(), "index")
+        writeTokenIndex(filename, (TokenIndex(), self.index), "digest")
+        tokens, index = readTokenIndex(filename, "digest")
+        self.assertEquals(len(index), 4)
+        self.assertEquals(index.search("/usr/bin/wget", 1.0, 1),
+                          ["a", "d"])
+        self.assertEquals(index.search("/usr/bin/wgot", 1, 1), ["a", "d"])
+        self.assertEquals(index.search("*.com/b", 1.0, 0), ["b"])
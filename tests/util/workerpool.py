@@ -0,0 +1,61 @@
+from StringIO import StringIO
+import threading
+import unittest
+import sys
+
+from smart.util.workerpool import WorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_runs_all_tasks(self):
+        done = []
+        finished = threading.Semaphore(0)
+        pool = WorkerPool(3, finished.release)
+        for i in range(20):
+            pool.submit(done.append, i)
+        for i in range(20):
+            finished.acquire()
+        pool.stop()
+        self.assertEquals(sorted(done), range(20))
+
+    def test_bounded_threads(self):
+        lock = threading.Lock()
+        running = [0, 0]
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        finished = threading.Semaphore(0)
+        def task():
+            lock.acquire()
+            running[0] += 1
+            running[1] = max(running)
+            lock.release()
+            started.release()
+            release.wait()
+            lock.acquire()
+            running[0] -= 1
+            lock.release()
+        pool = WorkerPool(2, finished.release)
+        for i in range(6):
+            pool.submit(task)
+        started.acquire()
+        started.acquire()
+        release.set()
+        for i in range(6):
+            finished.acquire()
+        pool.stop()
+        self.assertEquals(running, [0, 2])
+
+    def test_failing_task_calls_back(self):
+        finished = threading.Semaphore(0)
+        pool = WorkerPool(1, finished.release)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            pool.submit(lambda: 1/0)
+            finished.acquire()
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        pool.stop()
+        self.assertTrue("ZeroDivisionError" in output)
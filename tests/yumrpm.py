@@ -33,6 +33,7 @@ class YumRpmChannelTest(MockerTestCase):
 
     def tearDown(self):
         sysconf.remove("log-level")
+        sysconf.remove("rpm-md-sqlite")
  
     def check_channel(self, channel):
         self.assertEquals(channel.fetch(self.fetcher, self.progress), True)
@@ -62,6 +63,76 @@ class YumRpmChannelTest(MockerTestCase):
                                  "baseurl": "file://%s/yumrpm" % TESTDATADIR})
         self.check_channel(channel)
 
+    def get_packages(self, usedb, useindex=True, breakfilelists=False):
+        from smart.backends.rpm.metadata import RPMMetaDataDBLoader
+        sysconf.set("rpm-md-sqlite", usedb)
+        channel = createChannel("alias",
+                                {"type": "rpm-md",
+                                 "baseurl": "file://%s/yumrpm" % TESTDATADIR})
+        self.assertEquals(channel.fetch(self.fetcher, self.progress), True)
+        loader = channel.getLoaders()[0]
+        self.assertEquals(isinstance(loader, RPMMetaDataDBLoader), usedb)
+        if not useindex:
+            loader.setFileIndex(None, None)
+        if breakfilelists:
+            open(loader._filelistsname, "w").write("<broken")
+
+        # Ask for files which no package requires as well.
+        loadFileProvides = loader.loadFileProvides
+        def load_file_provides(fndict):
+            fndict = fndict.copy()
+            fndict["/tmp/file1"] = fndict["/tmp/file3"] = True
+            loadFileProvides(fndict)
+        loader.loadFileProvides = load_file_provides
+
+        cache = Cache()
+        cache.addLoader(loader)
+        saved = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            cache.load()
+        finally:
+            sys.stdout = saved
+
+        result = []
+        for pkg in sorted(cache.getPackages()):
+            info = loader.getInfo(pkg)
+            result.append((pkg.name, pkg.version, pkg.loaders[loader],
+                           info.getURLs(), info.getSource(),
+                           sorted([str(x) for x in pkg.provides]),
+                           sorted([str(x) for x in pkg.requires]),
+                           sorted([str(x) for x in pkg.recommends]),
+                           sorted([str(x) for x in pkg.upgrades]),
+                           sorted([str(x) for x in pkg.conflicts])))
+        return result
+
+    def test_fetch_sqlite_by_default(self):
+        from smart.backends.rpm.metadata import RPMMetaDataDBLoader
+        channel = createChannel("alias",
+                                {"type": "rpm-md",
+                                 "baseurl": "file://%s/yumrpm" % TESTDATADIR})
+        self.assertEquals(channel.fetch(self.fetcher, self.progress), True)
+        loaders = channel.getLoaders()
+        self.assertEquals(len(loaders), 1)
+        self.assertTrue(isinstance(loaders[0], RPMMetaDataDBLoader))
+
+    def test_fetch_sqlite_matches_xml(self):
+        xml = self.get_packages(False)
+        db = self.get_packages(True)
+        self.assertEquals(db, xml)
+        self.assertTrue("/tmp/file1" in db[0][5])
+        self.assertFalse("/tmp/file1" in db[1][5])
+
+    def test_fetch_indexes_filelists(self):
+        xml = self.get_packages(False, useindex=False)
+        self.assertEquals(self.get_packages(False), xml)
+        index = [x for x in os.listdir(self.download_dir)
+                 if x.endswith("filelists.xml.idx")]
+        self.assertEquals(len(index), 1)
+
+        # The index must be enough for finding the provided files.
+        self.assertEquals(self.get_packages(False, breakfilelists=True), xml)
+
     def test_fetch_with_broken_mirrorlist(self):
         def fail_open(filename, mode='r', bufsize=-1):
              raise IOError("emulating a broken mirrorlist...")